@@ -0,0 +1,24 @@
+"""add timeline keyset indexes
+
+Revision ID: 0004_timeline_indexes
+Revises: 0003_document_ingestion_metadata
+Create Date: 2026-10-17 09:00:00.000000
+
+"""
+from alembic import op
+
+
+revision = "0004_timeline_indexes"
+down_revision = "0003_document_ingestion_metadata"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("ix_medicalrecord_timeline", "medicalrecord", ["patient_id", "date", "id"], unique=False)
+    op.create_index("ix_medicaldocument_timeline", "medicaldocument", ["patient_id", "document_date", "id"], unique=False)
+
+
+def downgrade():
+    op.drop_index("ix_medicaldocument_timeline", table_name="medicaldocument")
+    op.drop_index("ix_medicalrecord_timeline", table_name="medicalrecord")
@@ -0,0 +1,76 @@
+"""link derived rows to their source document
+
+Revision ID: 0005_source_document_links
+Revises: 0004_timeline_indexes
+Create Date: 2026-10-17 11:00:00.000000
+
+"""
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0005_source_document_links"
+down_revision = "0004_timeline_indexes"
+branch_labels = None
+depends_on = None
+
+LINKED_TABLES = ("medicalrecord", "labobservation", "wearabledata")
+
+
+def _document_id_from_flags(flags):
+    try:
+        parsed = json.loads(flags) if flags else []
+    except ValueError:
+        return None
+    for flag in parsed:
+        if isinstance(flag, str) and flag.startswith("document:"):
+            try:
+                return int(flag.split(":", 1)[1])
+            except ValueError:
+                continue
+    return None
+
+
+def upgrade():
+    for table in LINKED_TABLES:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.add_column(sa.Column("source_document_id", sa.Integer(), nullable=True))
+            batch_op.create_foreign_key(
+                f"fk_{table}_source_document_id_medicaldocument",
+                "medicaldocument",
+                ["source_document_id"],
+                ["id"],
+            )
+            batch_op.create_index(f"ix_{table}_source_document_id", ["source_document_id"], unique=False)
+
+    # Only timeline records carried the flag-encoded "document:<id>" link.
+    bind = op.get_bind()
+    medicalrecord = sa.table(
+        "medicalrecord",
+        sa.column("id", sa.Integer()),
+        sa.column("flags", sa.String()),
+        sa.column("source_document_id", sa.Integer()),
+    )
+    medicaldocument = sa.table("medicaldocument", sa.column("id", sa.Integer()))
+    known_documents = {row.id for row in bind.execute(sa.select(medicaldocument.c.id))}
+    rows = bind.execute(
+        sa.select(medicalrecord.c.id, medicalrecord.c.flags).where(medicalrecord.c.flags.like("%document:%"))
+    ).fetchall()
+    for row in rows:
+        document_id = _document_id_from_flags(row.flags)
+        if document_id in known_documents:
+            bind.execute(
+                medicalrecord.update()
+                .where(medicalrecord.c.id == row.id)
+                .values(source_document_id=document_id)
+            )
+
+
+def downgrade():
+    for table in reversed(LINKED_TABLES):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_index(f"ix_{table}_source_document_id")
+            batch_op.drop_constraint(f"fk_{table}_source_document_id_medicaldocument", type_="foreignkey")
+            batch_op.drop_column("source_document_id")
@@ -0,0 +1,29 @@
+"""add dashboard snapshot cache table
+
+Revision ID: 0006_dashboard_snapshots
+Revises: 0005_source_document_links
+Create Date: 2026-10-17 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0006_dashboard_snapshots"
+down_revision = "0005_source_document_links"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "dashboardsnapshot",
+        sa.Column("patient_id", sa.String(), primary_key=True, nullable=False),
+        sa.Column("version", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("payload", sa.Text(), nullable=True),
+        sa.Column("computed_at", sa.TIMESTAMP(), nullable=True),
+    )
+
+
+def downgrade():
+    op.drop_table("dashboardsnapshot")
@@ -0,0 +1,45 @@
+"""add document ingestion job queue
+
+Revision ID: 0007_ingestion_jobs
+Revises: 0006_dashboard_snapshots
+Create Date: 2026-10-17 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0007_ingestion_jobs"
+down_revision = "0006_dashboard_snapshots"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "ingestionjob",
+        sa.Column("id", sa.Integer(), primary_key=True, nullable=False),
+        sa.Column("patient_id", sa.String(), nullable=False),
+        sa.Column("document_id", sa.Integer(), sa.ForeignKey("medicaldocument.id"), nullable=False),
+        sa.Column("status", sa.String(), nullable=False, server_default="queued"),
+        sa.Column("supplied_text", sa.Text(), nullable=True),
+        sa.Column("attempts", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("max_attempts", sa.Integer(), nullable=False, server_default="3"),
+        sa.Column("last_error", sa.String(), nullable=True),
+        sa.Column("extracted_text_length", sa.Integer(), nullable=True),
+        sa.Column("locked_by", sa.String(), nullable=True),
+        sa.Column("available_at", sa.TIMESTAMP(), nullable=False),
+        sa.Column("started_at", sa.TIMESTAMP(), nullable=True),
+        sa.Column("finished_at", sa.TIMESTAMP(), nullable=True),
+        sa.Column("created_at", sa.TIMESTAMP(), nullable=False),
+    )
+    op.create_index(op.f("ix_ingestionjob_patient_id"), "ingestionjob", ["patient_id"], unique=False)
+    op.create_index(op.f("ix_ingestionjob_document_id"), "ingestionjob", ["document_id"], unique=False)
+    op.create_index(op.f("ix_ingestionjob_status"), "ingestionjob", ["status"], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f("ix_ingestionjob_status"), table_name="ingestionjob")
+    op.drop_index(op.f("ix_ingestionjob_document_id"), table_name="ingestionjob")
+    op.drop_index(op.f("ix_ingestionjob_patient_id"), table_name="ingestionjob")
+    op.drop_table("ingestionjob")
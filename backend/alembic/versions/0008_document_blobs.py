@@ -0,0 +1,53 @@
+"""add content-addressed document blob store
+
+Revision ID: 0008_document_blobs
+Revises: 0007_ingestion_jobs
+Create Date: 2026-10-17 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0008_document_blobs"
+down_revision = "0007_ingestion_jobs"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "documentblob",
+        sa.Column("id", sa.Integer(), primary_key=True, nullable=False),
+        sa.Column("content_hash", sa.String(), nullable=False),
+        sa.Column("byte_size", sa.Integer(), nullable=False),
+        sa.Column("encrypted_blob", sa.Text(), nullable=False),
+        sa.Column("ref_count", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("extracted_text", sa.Text(), nullable=True),
+        sa.Column("ocr_status", sa.String(), nullable=True),
+        sa.Column("created_at", sa.TIMESTAMP(), nullable=False),
+    )
+    op.create_index(op.f("ix_documentblob_content_hash"), "documentblob", ["content_hash"], unique=True)
+
+    # Existing documents keep their inline payload; only new uploads are deduplicated.
+    with op.batch_alter_table("medicaldocument") as batch_op:
+        batch_op.add_column(sa.Column("blob_id", sa.Integer(), nullable=True))
+        batch_op.create_foreign_key("fk_medicaldocument_blob_id_documentblob", "documentblob", ["blob_id"], ["id"])
+        batch_op.create_index("ix_medicaldocument_blob_id", ["blob_id"], unique=False)
+        batch_op.alter_column("encrypted_blob", existing_type=sa.Text(), nullable=True)
+
+
+def downgrade():
+    # Inline the shared payloads again before the column becomes required.
+    op.execute(
+        "UPDATE medicaldocument SET encrypted_blob = "
+        "(SELECT documentblob.encrypted_blob FROM documentblob WHERE documentblob.id = medicaldocument.blob_id) "
+        "WHERE blob_id IS NOT NULL"
+    )
+    with op.batch_alter_table("medicaldocument") as batch_op:
+        batch_op.alter_column("encrypted_blob", existing_type=sa.Text(), nullable=False)
+        batch_op.drop_index("ix_medicaldocument_blob_id")
+        batch_op.drop_constraint("fk_medicaldocument_blob_id_documentblob", type_="foreignkey")
+        batch_op.drop_column("blob_id")
+    op.drop_index(op.f("ix_documentblob_content_hash"), table_name="documentblob")
+    op.drop_table("documentblob")
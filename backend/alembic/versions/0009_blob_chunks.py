@@ -0,0 +1,41 @@
+"""store document blobs as encrypted chunks in a pluggable backend
+
+Revision ID: 0009_blob_chunks
+Revises: 0008_document_blobs
+Create Date: 2026-10-17 17:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0009_blob_chunks"
+down_revision = "0008_document_blobs"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "blobchunk",
+        sa.Column("blob_key", sa.String(), nullable=False),
+        sa.Column("chunk_index", sa.Integer(), nullable=False),
+        sa.Column("data", sa.LargeBinary(), nullable=False),
+        sa.PrimaryKeyConstraint("blob_key", "chunk_index"),
+    )
+    # Inline payloads stay readable; scripts/migrate_document_blobs.py moves them into chunks.
+    with op.batch_alter_table("documentblob") as batch_op:
+        batch_op.add_column(sa.Column("storage_backend", sa.String(), nullable=True))
+        batch_op.add_column(sa.Column("chunk_size", sa.Integer(), nullable=False, server_default="0"))
+        batch_op.add_column(sa.Column("chunk_count", sa.Integer(), nullable=False, server_default="0"))
+        batch_op.alter_column("encrypted_blob", existing_type=sa.Text(), nullable=True)
+
+
+def downgrade():
+    # Chunked blobs have no inline payload, so this only succeeds before any upload used chunks.
+    with op.batch_alter_table("documentblob") as batch_op:
+        batch_op.alter_column("encrypted_blob", existing_type=sa.Text(), nullable=False)
+        batch_op.drop_column("chunk_count")
+        batch_op.drop_column("chunk_size")
+        batch_op.drop_column("storage_backend")
+    op.drop_table("blobchunk")
@@ -0,0 +1,31 @@
+"""envelope-encrypt document blobs with per-blob data keys
+
+Revision ID: 0010_blob_envelope_encryption
+Revises: 0009_blob_chunks
+Create Date: 2026-10-17 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0010_blob_envelope_encryption"
+down_revision = "0009_blob_chunks"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("documentblob") as batch_op:
+        batch_op.add_column(sa.Column("storage_key", sa.String(), nullable=True))
+        batch_op.add_column(sa.Column("wrapped_data_key", sa.String(), nullable=True))
+        batch_op.add_column(sa.Column("nonce_prefix", sa.String(), nullable=True))
+    # Chunked blobs were previously stored under their content hash.
+    op.execute("UPDATE documentblob SET storage_key = content_hash WHERE storage_backend IS NOT NULL")
+
+
+def downgrade():
+    with op.batch_alter_table("documentblob") as batch_op:
+        batch_op.drop_column("nonce_prefix")
+        batch_op.drop_column("wrapped_data_key")
+        batch_op.drop_column("storage_key")
@@ -0,0 +1,31 @@
+"""track resumable encryption key rotation
+
+Revision ID: 0011_key_rotation_progress
+Revises: 0010_blob_envelope_encryption
+Create Date: 2026-10-17 19:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0011_key_rotation_progress"
+down_revision = "0010_blob_envelope_encryption"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "keyrotationprogress",
+        sa.Column("table_name", sa.String(), primary_key=True, nullable=False),
+        sa.Column("key_fingerprint", sa.String(), nullable=False),
+        sa.Column("last_id", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("rows_rotated", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("started_at", sa.TIMESTAMP(), nullable=False),
+        sa.Column("finished_at", sa.TIMESTAMP(), nullable=True),
+    )
+
+
+def downgrade():
+    op.drop_table("keyrotationprogress")
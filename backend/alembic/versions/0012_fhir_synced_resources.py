@@ -0,0 +1,35 @@
+"""track synced FHIR resources for incremental sync
+
+Revision ID: 0012_fhir_synced_resources
+Revises: 0011_key_rotation_progress
+Create Date: 2026-10-17 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0012_fhir_synced_resources"
+down_revision = "0011_key_rotation_progress"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "fhirsyncedresource",
+        sa.Column("id", sa.Integer(), primary_key=True, nullable=False),
+        sa.Column("connection_id", sa.Integer(), sa.ForeignKey("fhirconnection.id"), nullable=False),
+        sa.Column("resource_type", sa.String(), nullable=False),
+        sa.Column("resource_id", sa.String(), nullable=False),
+        sa.Column("version_id", sa.String(), nullable=True),
+        sa.Column("last_updated", sa.String(), nullable=True),
+        sa.Column("lab_observation_id", sa.Integer(), sa.ForeignKey("labobservation.id"), nullable=True),
+        sa.Column("medical_record_id", sa.Integer(), sa.ForeignKey("medicalrecord.id"), nullable=True),
+        sa.Column("synced_at", sa.TIMESTAMP(), nullable=False),
+        sa.UniqueConstraint("connection_id", "resource_type", "resource_id"),
+    )
+
+
+def downgrade():
+    op.drop_table("fhirsyncedresource")
@@ -0,0 +1,33 @@
+"""schedule background FHIR syncs and record their outcome
+
+Revision ID: 0013_fhir_sync_schedule
+Revises: 0012_fhir_synced_resources
+Create Date: 2026-10-17 21:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0013_fhir_sync_schedule"
+down_revision = "0012_fhir_synced_resources"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("fhirconnection") as batch_op:
+        batch_op.add_column(sa.Column("next_sync_at", sa.TIMESTAMP(), nullable=True))
+        batch_op.add_column(sa.Column("last_sync_duration_ms", sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column("last_sync_error", sa.String(), nullable=True))
+        batch_op.add_column(sa.Column("sync_failures", sa.Integer(), nullable=False, server_default="0"))
+    op.create_index(op.f("ix_fhirconnection_next_sync_at"), "fhirconnection", ["next_sync_at"], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f("ix_fhirconnection_next_sync_at"), table_name="fhirconnection")
+    with op.batch_alter_table("fhirconnection") as batch_op:
+        batch_op.drop_column("sync_failures")
+        batch_op.drop_column("last_sync_error")
+        batch_op.drop_column("last_sync_duration_ms")
+        batch_op.drop_column("next_sync_at")
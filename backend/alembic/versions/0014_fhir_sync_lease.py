@@ -0,0 +1,25 @@
+"""lease FHIR connections for manual as well as scheduled syncs
+
+Revision ID: 0014_fhir_sync_lease
+Revises: 0013_fhir_sync_schedule
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0014_fhir_sync_lease"
+down_revision = "0013_fhir_sync_schedule"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("fhirconnection") as batch_op:
+        batch_op.add_column(sa.Column("sync_leased_until", sa.TIMESTAMP(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table("fhirconnection") as batch_op:
+        batch_op.drop_column("sync_leased_until")
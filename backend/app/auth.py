@@ -1,14 +1,17 @@
+import hmac
 import os
 import re
 from datetime import datetime, timedelta, timezone
 from typing import Optional
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, Header, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from sqlmodel import Session, select
-from .db import get_session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from .auth_cache import cached_claims, load_user, load_user_async, remember_claims
+from .db import get_async_session, get_session
 from .models import User
+from . import password_hashing
 
 # --- JWT Secret enforcement ---
 # In production (Vercel), JWT_SECRET must be explicitly set.
@@ -27,16 +30,70 @@ else:
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 240  # 4 hours
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Shared secret for the internal metrics endpoints (connection pools, hashing queue).
+# Unset, those endpoints are not served at all.
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 
 
+def _hashing_busy() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Too many sign-in attempts in progress. Please retry shortly.",
+        headers={"Retry-After": "1"},
+    )
+
+
+def require_metrics_token(x_metrics_token: Optional[str] = Header(default=None)) -> None:
+    """Allow a request only if its ``X-Metrics-Token`` header matches ``METRICS_TOKEN``."""
+    if not METRICS_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if not x_metrics_token or not hmac.compare_digest(x_metrics_token.encode(), METRICS_TOKEN.encode()):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid metrics token")
+
+
 def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+    try:
+        return password_hashing.hash_password(password)
+    except password_hashing.PasswordHashingBusy:
+        raise _hashing_busy()
 
 
 def verify_password(plain: str, hashed: str) -> bool:
-    return pwd_context.verify(plain, hashed)
+    try:
+        return password_hashing.verify_password(plain, hashed)
+    except password_hashing.PasswordHashingBusy:
+        raise _hashing_busy()
+
+
+def verify_and_update_password(plain: str, hashed: str) -> tuple[bool, Optional[str]]:
+    """Verify ``plain``; on success also return a new hash when ``hashed`` uses an outdated bcrypt cost."""
+    try:
+        return password_hashing.verify_and_update(plain, hashed)
+    except password_hashing.PasswordHashingBusy:
+        raise _hashing_busy()
+
+
+async def hash_password_async(password: str) -> str:
+    try:
+        return await password_hashing.hash_password_async(password)
+    except password_hashing.PasswordHashingBusy:
+        raise _hashing_busy()
+
+
+async def verify_password_async(plain: str, hashed: str) -> bool:
+    try:
+        return await password_hashing.verify_password_async(plain, hashed)
+    except password_hashing.PasswordHashingBusy:
+        raise _hashing_busy()
+
+
+async def verify_and_update_password_async(plain: str, hashed: str) -> tuple[bool, Optional[str]]:
+    try:
+        return await password_hashing.verify_and_update_async(plain, hashed)
+    except password_hashing.PasswordHashingBusy:
+        raise _hashing_busy()
 
 
 def validate_password(password: str) -> list[str]:
@@ -85,26 +142,65 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
-def get_current_user(
-    token: str = Depends(oauth2_scheme),
-    session: Session = Depends(get_session),
-) -> User:
-    credentials_exception = HTTPException(
+def token_claims(token: str) -> Optional[dict]:
+    """Claims of a valid access token, or None if it is invalid or expired."""
+    payload = cached_claims(token)
+    if payload is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except JWTError:
+            return None
+        remember_claims(token, payload)
+    return payload
+
+
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Invalid authentication credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-
-    user = session.exec(select(User).where(User.email == email)).first()
+
+
+def get_current_user(
+    token: str = Depends(oauth2_scheme),
+    session: Session = Depends(get_session),
+) -> User:
+    payload = token_claims(token)
+    if payload is None:
+        raise _credentials_exception()
+
+    user_id = payload.get("uid")
+    if isinstance(user_id, int):
+        user = load_user(session, user_id)
+    elif payload.get("sub"):
+        # Tokens issued before they carried the user id.
+        user = session.exec(select(User).where(User.email == payload["sub"])).first()
+    else:
+        user = None
+    if user is None:
+        raise _credentials_exception()
+    return user
+
+
+async def get_current_user_async(
+    token: str = Depends(oauth2_scheme),
+    session: AsyncSession = Depends(get_async_session),
+) -> User:
+    """``get_current_user`` for async handlers, loading the user through the async session."""
+    payload = token_claims(token)
+    if payload is None:
+        raise _credentials_exception()
+
+    user_id = payload.get("uid")
+    if isinstance(user_id, int):
+        user = await load_user_async(session, user_id)
+    elif payload.get("sub"):
+        user = (await session.exec(select(User).where(User.email == payload["sub"]))).first()
+    else:
+        user = None
     if user is None:
-        raise credentials_exception
+        raise _credentials_exception()
     return user
 
 
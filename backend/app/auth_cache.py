@@ -0,0 +1,136 @@
+"""
+Caches for the authentication path every API request goes through.
+
+- Verified tokens: the claims of a token whose signature and expiry were
+  checked are kept (up to ``AUTH_TOKEN_CACHE_MAX_ENTRIES``) until the token
+  expires or ``AUTH_TOKEN_CACHE_TTL_SECONDS`` pass, so repeat requests skip the
+  HMAC verification and JSON decoding.
+- Users: the column values of each ``User`` row are kept per user id for
+  ``AUTH_USER_CACHE_TTL_SECONDS``. A hit is merged into the request's session
+  without a query, so handlers can still modify and commit the user as usual.
+
+Any update or delete of a User row (settings, password or role changes)
+drops that user's entry, both when it is flushed and again once it is
+committed. The caches are per process, so another worker may serve a user's
+old row for up to the user TTL.
+"""
+from __future__ import annotations
+
+from collections import OrderedDict
+import os
+import threading
+import time
+from typing import Any, Hashable
+
+from sqlalchemy import event
+from sqlalchemy.orm import make_transient_to_detached, object_session
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.models import User
+
+AUTH_TOKEN_CACHE_TTL_SECONDS = float(os.environ.get("AUTH_TOKEN_CACHE_TTL_SECONDS", "300"))
+AUTH_TOKEN_CACHE_MAX_ENTRIES = int(os.environ.get("AUTH_TOKEN_CACHE_MAX_ENTRIES", "4096"))
+AUTH_USER_CACHE_TTL_SECONDS = float(os.environ.get("AUTH_USER_CACHE_TTL_SECONDS", "60"))
+AUTH_USER_CACHE_MAX_ENTRIES = int(os.environ.get("AUTH_USER_CACHE_MAX_ENTRIES", "4096"))
+
+
+class _TTLCache:
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Any | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl_seconds: float | None = None) -> None:
+        ttl = self.ttl_seconds if ttl_seconds is None else min(ttl_seconds, self.ttl_seconds)
+        if ttl <= 0 or self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+_tokens = _TTLCache(AUTH_TOKEN_CACHE_MAX_ENTRIES, AUTH_TOKEN_CACHE_TTL_SECONDS)
+_users = _TTLCache(AUTH_USER_CACHE_MAX_ENTRIES, AUTH_USER_CACHE_TTL_SECONDS)
+
+
+def cached_claims(token: str) -> dict | None:
+    """Claims of a token verified earlier, or None. Callers must not modify them."""
+    return _tokens.get(token)
+
+
+def remember_claims(token: str, claims: dict) -> None:
+    """Cache the claims of a freshly verified token, no longer than the token is valid."""
+    expires_in = claims["exp"] - time.time() if "exp" in claims else None
+    _tokens.set(token, claims, expires_in)
+
+
+def load_user(session: Session, user_id: int) -> User | None:
+    values = _users.get(user_id)
+    if values is None:
+        user = session.get(User, user_id)
+        if user is not None:
+            _users.set(user_id, user.model_dump())
+        return user
+    cached = User(**values)
+    make_transient_to_detached(cached)
+    # load=False attaches the cached row (or returns the session's own copy) without a SELECT.
+    return session.merge(cached, load=False)
+
+
+async def load_user_async(session: AsyncSession, user_id: int) -> User | None:
+    values = _users.get(user_id)
+    if values is None:
+        user = await session.get(User, user_id)
+        if user is not None:
+            _users.set(user_id, user.model_dump())
+        return user
+    cached = User(**values)
+    make_transient_to_detached(cached)
+    return await session.merge(cached, load=False)
+
+
+def invalidate_user(user_id: int | None) -> None:
+    if user_id is not None:
+        _users.pop(user_id)
+
+
+def clear_auth_cache() -> None:
+    _tokens.clear()
+    _users.clear()
+
+
+def _drop_changed_user(_mapper, _connection, user: User) -> None:
+    user_id = user.id
+    invalidate_user(user_id)
+    session = object_session(user)
+    if session is not None:
+        # A request that reads the row before the commit lands would cache the old values again.
+        event.listen(session, "after_commit", lambda _session: invalidate_user(user_id), once=True)
+
+
+event.listen(User, "after_update", _drop_changed_user)
+event.listen(User, "after_delete", _drop_changed_user)
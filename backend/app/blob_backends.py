@@ -0,0 +1,159 @@
+"""
+Storage backends for document blob chunks.
+
+A blob is stored as ``chunk_count`` encrypted chunks under one key. Backends
+only move opaque bytes; chunking and encryption happen in ``app.blob_store``.
+
+- ``database`` (default): chunks in the ``blobchunk`` table, so SQLite and
+  Postgres deploys need no extra infrastructure.
+- ``filesystem``: one file per chunk under ``BLOB_STORE_PATH``.
+- ``s3``: one object per chunk in any S3-compatible bucket (AWS, MinIO, R2).
+  Needs ``boto3``, which is only imported when this backend is selected.
+
+Each ``DocumentBlob`` records the backend that wrote it, so changing
+``BLOB_STORE_BACKEND`` only affects new uploads.
+"""
+from __future__ import annotations
+
+import os
+from pathlib import Path
+from typing import Any
+
+from sqlalchemy import delete
+from sqlmodel import Session
+
+from app.models import BlobChunk
+
+BLOB_STORE_BACKEND = os.environ.get("BLOB_STORE_BACKEND", "database").strip().lower()
+BLOB_CHUNK_BYTES = int(os.environ.get("BLOB_CHUNK_BYTES", str(256 * 1024)))
+BLOB_STORE_PATH = os.environ.get("BLOB_STORE_PATH", "/tmp/medbridge-blobs" if os.environ.get("VERCEL") else "./blobs")
+BLOB_STORE_S3_BUCKET = os.environ.get("BLOB_STORE_S3_BUCKET", "")
+BLOB_STORE_S3_PREFIX = os.environ.get("BLOB_STORE_S3_PREFIX", "documents/")
+BLOB_STORE_S3_ENDPOINT = os.environ.get("BLOB_STORE_S3_ENDPOINT") or None
+
+
+class BlobBackend:
+    name = ""
+
+    def put_chunk(self, session: Session, key: str, index: int, data: bytes) -> None:
+        raise NotImplementedError
+
+    def get_chunk(self, session: Session, key: str, index: int) -> bytes:
+        raise NotImplementedError
+
+    def replace_chunk(self, session: Session, key: str, index: int, data: bytes) -> None:
+        self.put_chunk(session, key, index, data)
+
+    def delete_blob(self, session: Session, key: str, chunk_count: int) -> None:
+        raise NotImplementedError
+
+
+class DatabaseBlobBackend(BlobBackend):
+    """Chunks live in the app database and commit with the caller's transaction."""
+
+    name = "database"
+
+    def put_chunk(self, session: Session, key: str, index: int, data: bytes) -> None:
+        session.add(BlobChunk(blob_key=key, chunk_index=index, data=data))
+
+    def replace_chunk(self, session: Session, key: str, index: int, data: bytes) -> None:
+        session.merge(BlobChunk(blob_key=key, chunk_index=index, data=data))
+
+    def get_chunk(self, session: Session, key: str, index: int) -> bytes:
+        chunk = session.get(BlobChunk, (key, index))
+        if chunk is None:
+            raise FileNotFoundError(f"Missing chunk {index} of blob {key}")
+        data = chunk.data
+        session.expunge(chunk)
+        return data
+
+    def delete_blob(self, session: Session, key: str, chunk_count: int) -> None:
+        session.execute(delete(BlobChunk).where(BlobChunk.blob_key == key))
+
+
+class FilesystemBlobBackend(BlobBackend):
+    name = "filesystem"
+
+    def __init__(self, root: str | Path):
+        self.root = Path(root)
+
+    def _path(self, key: str, index: int) -> Path:
+        return self.root / key[:2] / key / f"{index:06d}"
+
+    def put_chunk(self, session: Session, key: str, index: int, data: bytes) -> None:
+        path = self._path(key, index)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write then rename so a crashed upload never leaves a torn chunk behind.
+        partial = path.with_suffix(".partial")
+        partial.write_bytes(data)
+        os.replace(partial, path)
+
+    def get_chunk(self, session: Session, key: str, index: int) -> bytes:
+        return self._path(key, index).read_bytes()
+
+    def delete_blob(self, session: Session, key: str, chunk_count: int) -> None:
+        for index in range(chunk_count):
+            self._path(key, index).unlink(missing_ok=True)
+        try:
+            self._path(key, 0).parent.rmdir()
+        except OSError:
+            pass
+
+
+class S3BlobBackend(BlobBackend):
+    """Works with any client exposing boto3's ``put_object``/``get_object``/``delete_object``."""
+
+    name = "s3"
+
+    def __init__(self, client: Any, bucket: str, prefix: str = ""):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def _key(self, key: str, index: int) -> str:
+        return f"{self.prefix}{key}/{index:06d}"
+
+    def put_chunk(self, session: Session, key: str, index: int, data: bytes) -> None:
+        self.client.put_object(Bucket=self.bucket, Key=self._key(key, index), Body=data)
+
+    def get_chunk(self, session: Session, key: str, index: int) -> bytes:
+        return self.client.get_object(Bucket=self.bucket, Key=self._key(key, index))["Body"].read()
+
+    def delete_blob(self, session: Session, key: str, chunk_count: int) -> None:
+        for index in range(chunk_count):
+            self.client.delete_object(Bucket=self.bucket, Key=self._key(key, index))
+
+
+def _s3_backend_from_env() -> S3BlobBackend:
+    if not BLOB_STORE_S3_BUCKET:
+        raise RuntimeError("BLOB_STORE_S3_BUCKET must be set when BLOB_STORE_BACKEND=s3.")
+    try:
+        import boto3
+    except ImportError as exc:
+        raise RuntimeError("BLOB_STORE_BACKEND=s3 requires the boto3 package.") from exc
+    client = boto3.client("s3", endpoint_url=BLOB_STORE_S3_ENDPOINT)
+    return S3BlobBackend(client, BLOB_STORE_S3_BUCKET, BLOB_STORE_S3_PREFIX)
+
+
+_backends: dict[str, BlobBackend] = {}
+
+
+def register_blob_backend(backend: BlobBackend) -> None:
+    _backends[backend.name] = backend
+
+
+def get_blob_backend(name: str | None = None) -> BlobBackend:
+    name = name or BLOB_STORE_BACKEND
+    backend = _backends.get(name)
+    if backend is not None:
+        return backend
+    if name == "database":
+        backend = DatabaseBlobBackend()
+    elif name == "filesystem":
+        backend = FilesystemBlobBackend(BLOB_STORE_PATH)
+    elif name == "s3":
+        backend = _s3_backend_from_env()
+    else:
+        raise RuntimeError(f"Unknown BLOB_STORE_BACKEND: {name}")
+    register_blob_backend(backend)
+    return backend
@@ -0,0 +1,333 @@
+"""
+Content-addressed store for uploaded document payloads.
+
+Blobs are keyed by an HMAC-SHA256 of the patient id and the plaintext, so a
+patient re-uploading the same portal PDF stores the ciphertext once and bumps
+a reference count instead. Blobs are never shared between patients: a
+cross-patient match would let one patient confirm that another holds a given
+document. The HMAC key (``BLOB_HASH_KEY``) is separate from ``ENCRYPTION_KEY``
+so rotating the encryption key leaves content hashes unchanged. The blob also
+caches the text the first extraction produced, which lets duplicate uploads
+skip extraction entirely.
+
+Payloads are split into ``BLOB_CHUNK_BYTES`` plaintext segments, sealed with
+the blob's own AES-GCM data key (see ``app.encryption``) and written to a
+pluggable backend (see ``app.blob_backends``). Uploads are encrypted as they
+are read and downloads decrypted as they are streamed, so neither holds more
+than a couple of segments in memory, and ``MedicalDocument`` rows stay small.
+"""
+from __future__ import annotations
+
+import hashlib
+import hmac
+import os
+from typing import Iterator
+import uuid
+
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+
+from app.blob_backends import BLOB_CHUNK_BYTES, get_blob_backend
+from app.encryption import (
+    NONCE_PREFIX_BYTES,
+    SegmentCipher,
+    decrypt_bytes,
+    decrypt_chunk,
+    decrypt_field,
+    encrypt_field,
+    new_data_key,
+    unwrap_data_key,
+)
+from app.models import DocumentBlob, MedicalDocument
+
+# Where PHI is encrypted (or in production), BLOB_HASH_KEY must be set explicitly.
+# Locally, fall back to a dev-only default.
+_hash_key_env = os.environ.get("BLOB_HASH_KEY")
+if _hash_key_env:
+    _hash_key = _hash_key_env.encode()
+elif os.environ.get("ENCRYPTION_KEY") or os.environ.get("VERCEL"):
+    raise RuntimeError(
+        "BLOB_HASH_KEY environment variable must be set alongside ENCRYPTION_KEY. "
+        "Refusing to hash document contents with a default key."
+    )
+else:
+    _hash_key = b"medbridge-dev-blob-hash-key"
+
+
+class EmptyUpload(ValueError):
+    pass
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+def _content_hasher(patient_id: str):
+    hasher = hmac.new(_hash_key, digestmod=hashlib.sha256)
+    hasher.update(f"{patient_id}\0".encode())
+    return hasher
+
+
+def content_hash(patient_id: str, payload: bytes) -> str:
+    hasher = _content_hasher(patient_id)
+    hasher.update(payload)
+    return hasher.hexdigest()
+
+
+def _find_blob(session: Session, digest: str) -> DocumentBlob | None:
+    return session.exec(select(DocumentBlob).where(DocumentBlob.content_hash == digest)).first()
+
+
+class BlobWriter:
+    """Hash, encrypt and store a payload segment by segment as it is read.
+
+    Segments go to a fresh random storage key; ``finish_document_blob`` then
+    either registers them as a new blob or discards them in favour of an
+    existing blob with the same content hash. At most two segments are held
+    in memory, because the last one must be sealed with the final flag.
+    """
+
+    def __init__(self, session: Session, patient_id: str, backend_name: str | None = None):
+        self.session = session
+        self.backend = get_blob_backend(backend_name)
+        self.storage_key = uuid.uuid4().hex
+        self.segment_size = max(BLOB_CHUNK_BYTES, 1)
+        self.byte_size = 0
+        self.chunk_count = 0
+        self.nonce_prefix = os.urandom(NONCE_PREFIX_BYTES)
+        self._hash = _content_hasher(patient_id)
+        self._buffer = bytearray()
+        data_key = new_data_key()
+        self.wrapped_data_key = data_key[1] if data_key else None
+        self._cipher = SegmentCipher(data_key[0], self.nonce_prefix, self.storage_key.encode()) if data_key else None
+
+    def _put(self, segment: bytes, final: bool) -> None:
+        if self._cipher:
+            segment = self._cipher.encrypt(self.chunk_count, segment, final)
+        self.backend.put_chunk(self.session, self.storage_key, self.chunk_count, segment)
+        self.chunk_count += 1
+
+    def write(self, data: bytes) -> None:
+        self._hash.update(data)
+        self.byte_size += len(data)
+        self._buffer += data
+        # Keep one full segment back so the last segment can be flagged final.
+        while len(self._buffer) > self.segment_size:
+            self._put(bytes(self._buffer[:self.segment_size]), final=False)
+            del self._buffer[:self.segment_size]
+
+    def close(self) -> str:
+        """Flush the final segment and return the content hash."""
+        self._put(bytes(self._buffer), final=True)
+        self._buffer.clear()
+        return self._hash.hexdigest()
+
+    def abort(self) -> None:
+        self.backend.delete_blob(self.session, self.storage_key, self.chunk_count)
+
+
+def _add_reference(session: Session, blob: DocumentBlob) -> None:
+    session.execute(
+        update(DocumentBlob)
+        .where(DocumentBlob.id == blob.id)
+        .values(ref_count=DocumentBlob.ref_count + 1)
+        .execution_options(synchronize_session=False)
+    )
+    session.refresh(blob)
+
+
+def finish_document_blob(session: Session, writer: BlobWriter) -> tuple[DocumentBlob, bool]:
+    """Return ``(blob, created)`` holding one new reference to the written payload. Does not commit."""
+    digest = writer.close()
+    blob = _find_blob(session, digest)
+    if blob is None:
+        try:
+            with session.begin_nested():
+                blob = DocumentBlob(
+                    content_hash=digest,
+                    byte_size=writer.byte_size,
+                    storage_backend=writer.backend.name,
+                    storage_key=writer.storage_key,
+                    chunk_size=writer.segment_size,
+                    chunk_count=writer.chunk_count,
+                    wrapped_data_key=writer.wrapped_data_key,
+                    nonce_prefix=writer.nonce_prefix.hex(),
+                    ref_count=1,
+                )
+                session.add(blob)
+            return blob, True
+        except IntegrityError:
+            # A concurrent upload of the same bytes inserted it first.
+            blob = _find_blob(session, digest)
+            if blob is None:
+                raise
+
+    writer.abort()
+    _add_reference(session, blob)
+    return blob, False
+
+
+async def store_upload_blob(
+    session: Session, patient_id: str, upload, max_bytes: int
+) -> tuple[DocumentBlob, bool]:
+    """Store an ``UploadFile`` without buffering it: one pass hashes it, and a
+    second encrypts and writes it only if the content is not already stored.
+    Does not commit.
+    """
+    segment_size = max(BLOB_CHUNK_BYTES, 1)
+    hasher = _content_hasher(patient_id)
+    size = 0
+    while segment := await upload.read(segment_size):
+        size += len(segment)
+        if size > max_bytes:
+            raise UploadTooLarge(f"Upload exceeds {max_bytes} bytes.")
+        hasher.update(segment)
+    if not size:
+        raise EmptyUpload("Uploaded file is empty.")
+
+    blob = _find_blob(session, hasher.hexdigest())
+    if blob is not None:
+        _add_reference(session, blob)
+        return blob, False
+
+    await upload.seek(0)
+    writer = BlobWriter(session, patient_id)
+    try:
+        while segment := await upload.read(segment_size):
+            writer.write(segment)
+    except BaseException:
+        writer.abort()
+        raise
+    return finish_document_blob(session, writer)
+
+
+def store_document_blob(session: Session, patient_id: str, payload: bytes) -> tuple[DocumentBlob, bool]:
+    """Return ``(blob, created)`` holding one new reference to ``payload``. Does not commit."""
+    # Skip the write entirely when the patient already stored these bytes.
+    blob = _find_blob(session, content_hash(patient_id, payload))
+    if blob is not None:
+        _add_reference(session, blob)
+        return blob, False
+    writer = BlobWriter(session, patient_id)
+    writer.write(payload)
+    return finish_document_blob(session, writer)
+
+
+def release_document_blob(session: Session, blob_id: int) -> None:
+    """Drop one reference and delete the blob once nothing points at it. Does not commit."""
+    session.execute(
+        update(DocumentBlob)
+        .where(DocumentBlob.id == blob_id)
+        .values(ref_count=DocumentBlob.ref_count - 1)
+        .execution_options(synchronize_session=False)
+    )
+    blob = session.get(DocumentBlob, blob_id)
+    if blob is not None:
+        session.refresh(blob)
+        if blob.ref_count <= 0:
+            if blob.storage_backend:
+                get_blob_backend(blob.storage_backend).delete_blob(session, blob.storage_key, blob.chunk_count)
+            session.delete(blob)
+
+
+def iter_blob_chunks(session: Session, blob: DocumentBlob) -> Iterator[bytes]:
+    """Yield the decrypted payload one chunk at a time."""
+    if not blob.storage_backend:
+        yield decrypt_bytes(blob.encrypted_blob or "")
+        return
+    backend = get_blob_backend(blob.storage_backend)
+    cipher = None
+    if blob.wrapped_data_key:
+        cipher = SegmentCipher(
+            unwrap_data_key(blob.wrapped_data_key), bytes.fromhex(blob.nonce_prefix), blob.storage_key.encode()
+        )
+    for index in range(blob.chunk_count):
+        chunk = backend.get_chunk(session, blob.storage_key, index)
+        if cipher:
+            yield cipher.decrypt(index, chunk, final=index == blob.chunk_count - 1)
+        else:
+            # Chunks written before envelope encryption are single Fernet tokens.
+            yield decrypt_chunk(chunk)
+
+
+def iter_document_payload(session: Session, document: MedicalDocument) -> Iterator[bytes]:
+    if document.blob_id is None:
+        yield decrypt_bytes(document.encrypted_blob or "")
+        return
+    blob = session.get(DocumentBlob, document.blob_id)
+    if blob is not None:
+        yield from iter_blob_chunks(session, blob)
+
+
+def document_payload_size(session: Session, document: MedicalDocument) -> int | None:
+    if document.blob_id is None:
+        return None
+    blob = session.get(DocumentBlob, document.blob_id)
+    return blob.byte_size if blob else None
+
+
+def load_document_payload(session: Session, document: MedicalDocument) -> bytes:
+    return b"".join(iter_document_payload(session, document))
+
+
+def cached_extraction(session: Session, document: MedicalDocument) -> tuple[str, str] | None:
+    """Return ``(text, ocr_status)`` from an earlier extraction of the same bytes."""
+    if document.blob_id is None:
+        return None
+    blob = session.get(DocumentBlob, document.blob_id)
+    if blob is None or not blob.extracted_text or not blob.ocr_status:
+        return None
+    return decrypt_field(blob.extracted_text), blob.ocr_status
+
+
+def remember_extraction(session: Session, document: MedicalDocument, text: str, ocr_status: str) -> None:
+    if document.blob_id is None or not text:
+        return
+    blob = session.get(DocumentBlob, document.blob_id)
+    if blob is not None and not blob.extracted_text:
+        blob.extracted_text = encrypt_field(text)
+        blob.ocr_status = ocr_status
+        session.add(blob)
+
+
+def migrate_legacy_payloads(session: Session, batch_size: int = 50) -> int:
+    """Move inline base64 payloads into chunked storage, one committed batch at a time.
+
+    Safe to stop and re-run: each pass only picks up rows that still carry an
+    inline ``encrypted_blob``. Returns the number of rows migrated.
+    """
+    migrated = 0
+    while True:
+        blobs = session.exec(
+            select(DocumentBlob).where(DocumentBlob.encrypted_blob.is_not(None)).limit(batch_size)
+        ).all()
+        for blob in blobs:
+            # The blob keeps its content hash; only the storage moves.
+            writer = BlobWriter(session, patient_id="")
+            writer.write(decrypt_bytes(blob.encrypted_blob))
+            writer.close()
+            blob.storage_backend = writer.backend.name
+            blob.storage_key = writer.storage_key
+            blob.chunk_size = writer.segment_size
+            blob.chunk_count = writer.chunk_count
+            blob.wrapped_data_key = writer.wrapped_data_key
+            blob.nonce_prefix = writer.nonce_prefix.hex()
+            blob.encrypted_blob = None
+            session.add(blob)
+
+        documents = session.exec(
+            select(MedicalDocument)
+            .where(MedicalDocument.encrypted_blob.is_not(None), MedicalDocument.blob_id.is_(None))
+            .limit(batch_size)
+        ).all()
+        for document in documents:
+            blob, _created = store_document_blob(session, document.patient_id, decrypt_bytes(document.encrypted_blob))
+            document.blob_id = blob.id
+            document.encrypted_blob = None
+            session.add(document)
+
+        if not blobs and not documents:
+            return migrated
+        session.commit()
+        migrated += len(blobs) + len(documents)
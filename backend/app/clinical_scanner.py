@@ -0,0 +1,205 @@
+"""
+One-pass scanner for the clinical facts MedBridge extracts without a model.
+
+Labs, medications, blood pressure, heart rate and weight used to be found with
+five separate regexes, each run over the whole document, once for extraction
+artifacts and again for the local review draft. Here the keywords that can
+start any finding are compiled into a single trie-shaped regex, so the
+engine tries one branch per character instead of every keyword at every
+position. One pass over an ASCII-lowercased copy of the text finds all the
+keywords, and the full pattern for that kind of finding is then matched only
+at the keyword's position. Findings are the same as running each pattern with
+``finditer``/``search`` on its own.
+
+Lab names, synonyms and units come from the lab catalog (``app.lab_catalog``),
+so a test added to the catalog table is recognised without touching the
+patterns here.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+import re
+import string
+
+from app.lab_catalog import get_lab_catalog
+
+_LAB_CATALOG = get_lab_catalog()
+# Units the line pattern has always accepted, then every unit in the catalog.
+_LAB_UNITS = tuple(dict.fromkeys(("%", "mg/dL", "mIU/L", "mmol/L", *_LAB_CATALOG.units)))
+
+KEYWORDS = {
+    "lab": tuple(_LAB_CATALOG.names),
+    "medication": ("metformin", "lisinopril", "atorvastatin", "levothyroxine", "albuterol", "sertraline"),
+    "blood_pressure": ("bp", "blood pressure"),
+    "heart_rate": ("pulse", "heart rate", "hr"),
+    "weight": ("weight",),
+}
+
+
+def _trie_regex(words) -> str:
+    """Compile words into a regex shaped like their prefix trie.
+
+    A space in a keyword also matches a hyphen, as in "hs-CRP" or "HDL-C".
+    """
+    trie: dict = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node: dict) -> str:
+        branches = [
+            ("[ -]" if char == " " else re.escape(char)) + build(child)
+            for char, child in sorted(node.items())
+            if char
+        ]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+        return f"(?:{body})?" if "" in node else body
+
+    return build(trie)
+
+
+def _unit_alternation() -> str:
+    # Longest first, so "mg/dL" wins over a bare "mg".
+    return "|".join(re.escape(unit) for unit in sorted(_LAB_UNITS, key=len, reverse=True))
+
+
+def _alternation(kind: str) -> str:
+    return "|".join(re.escape(keyword) for keyword in KEYWORDS[kind])
+
+
+MEDICATION_PATTERN = re.compile(
+    rf"(?i)\b({_alternation('medication')})\b[:\- ]*(\d+(?:\.\d+)?\s*(?:mg|mcg|puffs))?(?:.*?(daily|nightly|as needed|twice daily|once daily))?"
+)
+# A number followed by one of these is a dose ("Calcium 600 mg twice daily",
+# "Vitamin D 2000 IU"), not a lab result.
+DOSE_WORDS = (
+    "mg", "mcg", "ug", "µg", "μg", "g", "gm", "grams?", "iu", "units?", "ml", "meq",
+    "tablets?", "tabs?", "capsules?", "caps?", "pills?", "puffs?", "drops?", "sprays?",
+    "daily", "nightly", "once", "twice", "bid", "tid", "qid", "qd", "qhs", "prn",
+)
+LAB_LINE_PATTERN = re.compile(
+    rf"(?i)\b({_trie_regex(KEYWORDS['lab'])})\b"
+    # The number is never cut short, so "600 mg" can't match as "60".
+    rf"[^0-9]{{0,20}}(\d+(?:\.\d+)?)(?!\d|\.\d)"
+    # A catalog unit, else no dose, keeping any other unit ("mmol/mol") as written.
+    rf"(?:\s*({_unit_alternation()})(?![A-Za-z])"
+    rf"|(?!\s*(?:{'|'.join(DOSE_WORDS)})(?:/(?:day|d|dose|kg)\b|(?![A-Za-z0-9/])))"
+    r"(?:\s*([A-Za-z%µμ][A-Za-z0-9%µμ*.]*/[A-Za-z0-9.]+))?)"
+    r"(?:[^A-Za-z0-9]{0,12}(high|low|normal))?"
+)
+BP_PATTERN = re.compile(rf"(?i)\b(?:{_alternation('blood_pressure')})\b[^0-9]{{0,10}}(\d{{2,3}}/\d{{2,3}})")
+HEART_RATE_PATTERN = re.compile(rf"(?i)\b(?:{_alternation('heart_rate')})\b[^0-9]{{0,10}}(\d{{2,3}})")
+WEIGHT_PATTERN = re.compile(rf"(?i)\b(?:{_alternation('weight')})\b[^0-9]{{0,10}}(\d{{2,3}}(?:\.\d+)?)\s*(lb|lbs|kg)?")
+
+_VITAL_PATTERNS = {
+    "blood_pressure": BP_PATTERN,
+    "heart_rate": HEART_RATE_PATTERN,
+    "weight": WEIGHT_PATTERN,
+}
+_KEYWORD_KINDS = {keyword: kind for kind, keywords in KEYWORDS.items() for keyword in keywords}
+_ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+
+# Where one keyword is a prefix of another ("glucose", "glucose fasting") the
+# trie prefers the longer, as the lab pattern does. Every full pattern starts
+# at a word boundary; checking it here as well keeps short lab abbreviations
+# ("alt", "ast") from firing inside ordinary words.
+TRIGGER_PATTERN = re.compile(rf"\b{_trie_regex(_KEYWORD_KINDS)}")
+
+
+@dataclass(frozen=True)
+class LabFinding:
+    test_name: str
+    value_text: str  # the number as written, e.g. "5.80"
+    value: float
+    unit: str | None
+    loinc: str | None
+    ref_range: str | None
+    status: str | None  # as written in the document, else derived from ref_range
+
+
+@dataclass(frozen=True)
+class MedicationFinding:
+    name: str
+    dose: str
+    frequency: str
+
+
+@dataclass(frozen=True)
+class VitalFinding:
+    metric: str
+    value: str
+    unit: str | None
+
+
+@dataclass(frozen=True)
+class ClinicalFindings:
+    labs: tuple[LabFinding, ...] = ()
+    medications: tuple[MedicationFinding, ...] = ()  # de-duplicated, in document order
+    vitals: tuple[VitalFinding, ...] = ()  # first blood pressure, heart rate and weight, in that order
+
+
+def _lab_finding(match: re.Match) -> LabFinding:
+    test = _LAB_CATALOG.lookup(match.group(1))
+    value = float(match.group(2))
+    other_unit = match.group(4)
+    status = (match.group(5) or "").lower()
+    # The catalog's range only applies in the catalog's unit, assumed when none is written.
+    if not status and not other_unit and test and test.reference:
+        status = test.reference.status(value)
+    return LabFinding(
+        test_name=test.name if test else match.group(1).title(),
+        value_text=match.group(2),
+        value=value,
+        unit=match.group(3) or other_unit or (test.unit if test else None),
+        loinc=test.loinc if test else None,
+        ref_range=test.ref_range if test else None,
+        status=status or None,
+    )
+
+
+def _vital_finding(metric: str, match: re.Match) -> VitalFinding:
+    if metric == "heart_rate":
+        return VitalFinding(metric, match.group(1), "bpm")
+    if metric == "weight":
+        return VitalFinding(metric, match.group(1), (match.group(2) or "lb").lower())
+    return VitalFinding(metric, match.group(1), None)
+
+
+def scan_clinical_text(text: str) -> ClinicalFindings:
+    labs: list[LabFinding] = []
+    medications: dict[MedicationFinding, None] = {}
+    vitals: dict[str, VitalFinding] = {}
+    # Where each repeating pattern may match next; like finditer, a kind's
+    # matches never overlap each other, though different kinds may overlap.
+    lab_resume = medication_resume = 0
+
+    # Translating only A-Z keeps every offset valid in the original text.
+    for trigger in TRIGGER_PATTERN.finditer(text.translate(_ASCII_LOWER)):
+        kind = _KEYWORD_KINDS[trigger.group().replace("-", " ")]
+        start = trigger.start()
+        if kind == "lab":
+            if start >= lab_resume and (match := LAB_LINE_PATTERN.match(text, start)):
+                labs.append(_lab_finding(match))
+                lab_resume = match.end()
+        elif kind == "medication":
+            if start >= medication_resume and (match := MEDICATION_PATTERN.match(text, start)):
+                finding = MedicationFinding(
+                    name=match.group(1).title(),
+                    dose=(match.group(2) or "").strip(),
+                    frequency=(match.group(3) or "").strip(),
+                )
+                medications.setdefault(finding)
+                medication_resume = match.end()
+        elif kind not in vitals and (match := _VITAL_PATTERNS[kind].match(text, start)):
+            vitals[kind] = _vital_finding(kind, match)
+
+    return ClinicalFindings(
+        labs=tuple(labs),
+        medications=tuple(medications),
+        vitals=tuple(vitals[metric] for metric in _VITAL_PATTERNS if metric in vitals),
+    )
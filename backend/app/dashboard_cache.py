@@ -0,0 +1,149 @@
+"""
+Per-patient dashboard snapshot cache.
+
+Snapshots are keyed by (patient_id, version). Every write that can change the
+dashboard calls ``invalidate_dashboard`` which bumps the patient's version, so
+stale snapshots are simply never looked up again and age out of the LRU.
+
+Two tiers:
+- an in-process LRU with a TTL (always on), and
+- an optional database tier (``DASHBOARD_CACHE_BACKEND=database``) that keeps
+  the version counter and last snapshot in the app database so several
+  uvicorn workers share invalidations.
+"""
+from __future__ import annotations
+
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+import copy
+import json
+import os
+import threading
+import time
+from typing import Any
+
+from sqlalchemy import event, update
+from sqlmodel import Session
+
+from app.models import DashboardSnapshot
+
+
+DASHBOARD_CACHE_BACKEND = os.environ.get("DASHBOARD_CACHE_BACKEND", "memory").strip().lower()
+DASHBOARD_CACHE_TTL_SECONDS = float(os.environ.get("DASHBOARD_CACHE_TTL_SECONDS", "300"))
+DASHBOARD_CACHE_MAX_ENTRIES = int(os.environ.get("DASHBOARD_CACHE_MAX_ENTRIES", "512"))
+
+
+class _SnapshotLRU:
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[tuple[str, int], tuple[float, dict]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple[str, int]) -> dict | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, snapshot = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return snapshot
+
+    def set(self, key: tuple[str, int], snapshot: dict) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, snapshot)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+_lru = _SnapshotLRU(DASHBOARD_CACHE_MAX_ENTRIES, DASHBOARD_CACHE_TTL_SECONDS)
+_local_versions: dict[str, int] = {}
+_versions_lock = threading.Lock()
+
+
+def _uses_database_tier() -> bool:
+    return DASHBOARD_CACHE_BACKEND == "database"
+
+
+def _bump_local_version(patient_id: str) -> None:
+    with _versions_lock:
+        _local_versions[patient_id] = _local_versions.get(patient_id, 0) + 1
+
+
+def _current_version(session: Session, patient_id: str) -> tuple[int, DashboardSnapshot | None]:
+    if _uses_database_tier():
+        row = session.get(DashboardSnapshot, patient_id)
+        return (row.version if row else 0), row
+    with _versions_lock:
+        return _local_versions.get(patient_id, 0), None
+
+
+def get_snapshot(session: Session, patient_id: str) -> tuple[int, dict | None]:
+    """Return ``(version, snapshot)``; ``snapshot`` is None on a miss.
+
+    Callers must treat the returned snapshot as read-only.
+    """
+    version, row = _current_version(session, patient_id)
+    snapshot = _lru.get((patient_id, version))
+    if snapshot is not None:
+        return version, snapshot
+
+    if row is not None and row.payload and row.computed_at:
+        computed_at = row.computed_at if row.computed_at.tzinfo else row.computed_at.replace(tzinfo=timezone.utc)
+        if datetime.now(timezone.utc) - computed_at <= timedelta(seconds=DASHBOARD_CACHE_TTL_SECONDS):
+            snapshot = json.loads(row.payload)
+            _lru.set((patient_id, version), snapshot)
+            return version, snapshot
+    return version, None
+
+
+def store_snapshot(session: Session, patient_id: str, version: int, snapshot: dict[str, Any]) -> None:
+    """Cache a freshly computed snapshot under the version it was computed for.
+
+    The database tier only accepts the write if no invalidation happened in the
+    meantime; the caller is responsible for committing the session.
+    """
+    _lru.set((patient_id, version), copy.deepcopy(snapshot))
+    if not _uses_database_tier():
+        return
+    payload = json.dumps(snapshot)
+    computed_at = datetime.now(timezone.utc)
+    if version == 0 and session.get(DashboardSnapshot, patient_id) is None:
+        session.add(DashboardSnapshot(patient_id=patient_id, version=0, payload=payload, computed_at=computed_at))
+        return
+    session.execute(
+        update(DashboardSnapshot)
+        .where(DashboardSnapshot.patient_id == patient_id, DashboardSnapshot.version == version)
+        .values(payload=payload, computed_at=computed_at)
+    )
+
+
+def invalidate_dashboard(session: Session, patient_id: str) -> None:
+    """Mark the patient's dashboard stale as part of the caller's transaction."""
+    _bump_local_version(patient_id)
+    # Bump again once the write is visible so a concurrent read that cached
+    # pre-commit data under the intermediate version is never served.
+    event.listen(session, "after_commit", lambda _session: _bump_local_version(patient_id), once=True)
+    if not _uses_database_tier():
+        return
+    result = session.execute(
+        update(DashboardSnapshot)
+        .where(DashboardSnapshot.patient_id == patient_id)
+        .values(version=DashboardSnapshot.version + 1, payload=None, computed_at=None)
+    )
+    if not result.rowcount:
+        session.add(DashboardSnapshot(patient_id=patient_id, version=1))
+
+
+def clear_dashboard_cache() -> None:
+    _lru.clear()
+    with _versions_lock:
+        _local_versions.clear()
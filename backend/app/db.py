@@ -1,14 +1,47 @@
 import os
+from sqlalchemy.ext.asyncio import create_async_engine
 from sqlmodel import create_engine, Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.db_config import configure_engine, engine_options, pool_stats
 
 # Vercel serverless: writable path is /tmp
 _default_db = "sqlite:////tmp/medbridge.db" if os.environ.get("VERCEL") else "sqlite:///./medbridge.db"
 DATABASE_URL = os.environ.get("DATABASE_URL", _default_db)
 
-connect_args = {"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
-engine = create_engine(DATABASE_URL, echo=False, connect_args=connect_args)
+engine = create_engine(DATABASE_URL, **engine_options(DATABASE_URL))
+configure_engine(engine, DATABASE_URL)
+
+
+def async_database_url(url: str) -> str:
+    """The same database through an async driver: aiosqlite for SQLite, asyncpg for Postgres."""
+    scheme, separator, rest = url.partition("://")
+    driver = {
+        "sqlite": "sqlite+aiosqlite",
+        "postgres": "postgresql+asyncpg",
+        "postgresql": "postgresql+asyncpg",
+        "postgresql+psycopg2": "postgresql+asyncpg",
+    }.get(scheme, scheme)
+    return f"{driver}{separator}{rest}"
+
+
+# Async handlers share the database with the sync engine; set ASYNC_DATABASE_URL
+# when the async driver needs different options (asyncpg rejects libpq's ?sslmode=, for example).
+ASYNC_DATABASE_URL = os.environ.get("ASYNC_DATABASE_URL") or async_database_url(DATABASE_URL)
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **engine_options(ASYNC_DATABASE_URL, is_async=True))
+configure_engine(async_engine, ASYNC_DATABASE_URL)
 
 
 def get_session():
     with Session(engine) as session:
         yield session
+
+
+async def get_async_session():
+    # Attributes stay loaded after commit; an async session can't lazily reload them.
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        yield session
+
+
+def database_pool_stats() -> dict:
+    return {"sync": pool_stats(engine), "async": pool_stats(async_engine)}
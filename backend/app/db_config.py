@@ -0,0 +1,161 @@
+"""
+Connection settings and pool metrics for the sync and async database engines.
+
+SQLite connections are opened with:
+
+- ``journal_mode=WAL``, so readers keep working while a writer (an upload
+  storing a multi-megabyte blob, say) holds the write lock;
+- ``synchronous=NORMAL``, which in WAL mode only fsyncs at checkpoints;
+- ``busy_timeout`` (``DB_SQLITE_BUSY_TIMEOUT_MS``), so a second writer waits
+  for the lock instead of failing with "database is locked";
+- ``mmap_size`` (``DB_SQLITE_MMAP_SIZE``) and ``cache_size``
+  (``DB_SQLITE_CACHE_SIZE_KB``) for the page cache.
+
+Connections are pooled with ``DB_POOL_SIZE`` persistent connections plus up to
+``DB_MAX_OVERFLOW`` extra ones; a checkout waits at most ``DB_POOL_TIMEOUT``
+seconds for a free connection. Postgres connections are also recycled after
+``DB_POOL_RECYCLE_SECONDS`` and checked with a ping before use
+(``DB_POOL_PRE_PING``) so connections dropped by the server or a proxy are
+replaced instead of failing a request.
+
+``pool_stats`` reports how long checkouts wait for a connection. Waits that
+approach the pool timeout mean the pool is smaller than the number of
+requests and workers competing for it.
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from typing import Any
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE_SECONDS = int(os.environ.get("DB_POOL_RECYCLE_SECONDS", "1800"))
+DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "1").lower() not in {"0", "false", "no"}
+
+DB_SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("DB_SQLITE_BUSY_TIMEOUT_MS", "5000"))
+DB_SQLITE_MMAP_SIZE = int(os.environ.get("DB_SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+DB_SQLITE_CACHE_SIZE_KB = int(os.environ.get("DB_SQLITE_CACHE_SIZE_KB", str(64 * 1024)))
+
+
+class _CheckoutStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def record(self, wait_seconds: float) -> None:
+        with self.lock:
+            self.checkouts += 1
+            self.wait_seconds_total += wait_seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, wait_seconds)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            checkouts = self.checkouts
+            return {
+                "checkouts": checkouts,
+                "timeouts": self.timeouts,
+                "avg_wait_ms": round(self.wait_seconds_total / checkouts * 1000, 2) if checkouts else 0.0,
+                "max_wait_ms": round(self.wait_seconds_max * 1000, 2),
+            }
+
+
+class _TimedCheckout:
+    """Pool mixin that records how long each ``connect()`` waits, including opening new connections."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkout_stats = _CheckoutStats()
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            with self.checkout_stats.lock:
+                self.checkout_stats.timeouts += 1
+            raise
+        self.checkout_stats.record(time.perf_counter() - started)
+        return connection
+
+
+class TimedQueuePool(_TimedCheckout, QueuePool):
+    pass
+
+
+class TimedAsyncAdaptedQueuePool(_TimedCheckout, AsyncAdaptedQueuePool):
+    pass
+
+
+def is_sqlite(url: str) -> bool:
+    return url.startswith("sqlite")
+
+
+def _is_sqlite_memory(url: str) -> bool:
+    _, _, path = url.partition("://")
+    return path in {"", "/", "/:memory:"} or "mode=memory" in path
+
+
+def engine_options(url: str, *, is_async: bool = False) -> dict[str, Any]:
+    """Keyword arguments for ``create_engine``/``create_async_engine`` for ``url``."""
+    options: dict[str, Any] = {"echo": False}
+    if is_sqlite(url):
+        options["connect_args"] = {"check_same_thread": False}
+        if _is_sqlite_memory(url):
+            # Each pooled connection would get its own empty database; keep SQLAlchemy's default pool.
+            return options
+    else:
+        options["pool_recycle"] = DB_POOL_RECYCLE_SECONDS
+        options["pool_pre_ping"] = DB_POOL_PRE_PING
+    options.update(
+        poolclass=TimedAsyncAdaptedQueuePool if is_async else TimedQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+    )
+    return options
+
+
+def apply_sqlite_pragmas(dbapi_connection, _connection_record=None) -> None:
+    """``connect`` listener that sets the per-connection SQLite pragmas."""
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={DB_SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA mmap_size={DB_SQLITE_MMAP_SIZE}")
+        # A negative cache_size is in KiB rather than pages.
+        cursor.execute(f"PRAGMA cache_size=-{DB_SQLITE_CACHE_SIZE_KB}")
+    finally:
+        cursor.close()
+
+
+def configure_engine(engine, url: str) -> None:
+    """Install the SQLite pragmas on ``engine`` (sync or async)."""
+    if is_sqlite(url):
+        event.listen(getattr(engine, "sync_engine", engine), "connect", apply_sqlite_pragmas)
+
+
+def pool_stats(engine) -> dict:
+    """Pool occupancy and checkout wait times for ``engine``."""
+    pool = engine.pool
+    stats: dict[str, Any] = {"pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update(
+            size=pool.size(),
+            checked_out=pool.checkedout(),
+            idle=pool.checkedin(),
+            overflow=max(pool.overflow(), 0),
+        )
+    checkout_stats = getattr(pool, "checkout_stats", None)
+    if checkout_stats is not None:
+        stats.update(checkout_stats.snapshot())
+    return stats
@@ -10,17 +10,12 @@ from urllib import error as urllib_error
 from urllib import request as urllib_request
 
 from pydantic import BaseModel, Field, ValidationError
-from sqlmodel import Session
-
-from app.document_extraction import (
-    BP_PATTERN,
-    HEART_RATE_PATTERN,
-    LAB_CATALOG,
-    LAB_LINE_PATTERN,
-    MEDICATION_PATTERN,
-    WEIGHT_PATTERN,
-    ExtractionArtifact,
-)
+from sqlalchemy import func
+from sqlmodel import Session, select
+
+from app.clinical_scanner import ClinicalFindings, scan_clinical_text
+from app.document_extraction import ExtractionArtifact
+from app.lab_catalog import lookup_lab
 from app.models import AuditLog, DocumentReviewItem, LabObservation, MedicalDocument, MedicalRecord, User, WearableData
 
 
@@ -88,15 +83,6 @@ def _compact_text(value: str) -> str:
     return " ".join(value.split())
 
 
-def _safe_float(value: str | None) -> float | None:
-    if not value:
-        return None
-    try:
-        return float(value)
-    except (TypeError, ValueError):
-        return None
-
-
 def _clip_text(value: str, limit: int = MAX_SUPPLEMENTAL_TEXT_CHARS) -> str:
     compacted = value.strip()
     if len(compacted) <= limit:
@@ -121,96 +107,43 @@ def _quality_flags_for_document(document: MedicalDocument, text: str) -> list[st
     return flags
 
 
-def _parse_local_labs(text: str) -> list[ReviewLab]:
+def _local_labs(findings: ClinicalFindings) -> list[ReviewLab]:
     labs: list[ReviewLab] = []
     seen: set[tuple[str, str]] = set()
-    for match in LAB_LINE_PATTERN.finditer(text):
-        label = match.group(1).lower()
-        numeric_value = _safe_float(match.group(2))
-        unit = match.group(3)
-        explicit_status = (match.group(4) or "").lower()
-        meta = LAB_CATALOG.get(label, LAB_CATALOG.get(label.replace("fasting ", ""), {}))
-        if not unit:
-            unit = meta.get("unit")
-
-        status = explicit_status or "unknown"
-        if status == "unknown" and numeric_value is not None:
-            ref_range = meta.get("ref_range")
-            if ref_range and ref_range.startswith("<"):
-                cutoff = _safe_float(ref_range[1:])
-                if cutoff is not None:
-                    status = "high" if numeric_value >= cutoff else "normal"
-            elif ref_range and "-" in ref_range:
-                lower, upper = ref_range.split("-", 1)
-                low = _safe_float(lower)
-                high = _safe_float(upper)
-                if low is not None and high is not None:
-                    if numeric_value < low:
-                        status = "low"
-                    elif numeric_value > high:
-                        status = "high"
-                    else:
-                        status = "normal"
-
-        key = (match.group(1).title(), match.group(2))
+    for lab in findings.labs:
+        key = (lab.test_name, lab.value_text)
         if key in seen:
             continue
         seen.add(key)
         labs.append(
             ReviewLab(
-                test_name=match.group(1).title(),
-                value_text=f"{match.group(2)} {unit or ''}".strip(),
-                numeric_value=numeric_value,
-                unit=unit,
-                reference_range=meta.get("ref_range"),
-                status=status if status in {"high", "low", "normal", "abnormal"} else "unknown",
+                test_name=lab.test_name,
+                value_text=f"{lab.value_text} {lab.unit or ''}".strip(),
+                numeric_value=lab.value,
+                unit=lab.unit,
+                reference_range=lab.ref_range,
+                status=lab.status if lab.status in {"high", "low", "normal", "abnormal"} else "unknown",
             )
         )
     return labs
 
 
-def _parse_local_medications(text: str) -> list[ReviewMedication]:
-    medications: list[ReviewMedication] = []
-    seen: set[tuple[str, str, str]] = set()
-    for match in MEDICATION_PATTERN.finditer(text):
-        medication = ReviewMedication(
-            name=match.group(1).title(),
-            dose=(match.group(2) or "").strip() or None,
-            frequency=(match.group(3) or "").strip() or None,
-            status="active",
-        )
-        key = (medication.name, medication.dose or "", medication.frequency or "")
-        if key in seen:
-            continue
-        seen.add(key)
-        medications.append(medication)
-    return medications
-
-
-def _parse_local_vitals(text: str) -> list[ReviewVital]:
-    vitals: list[ReviewVital] = []
-    bp_match = BP_PATTERN.search(text)
-    hr_match = HEART_RATE_PATTERN.search(text)
-    weight_match = WEIGHT_PATTERN.search(text)
-    if bp_match:
-        vitals.append(ReviewVital(metric="blood_pressure", value=bp_match.group(1)))
-    if hr_match:
-        vitals.append(ReviewVital(metric="heart_rate", value=hr_match.group(1), unit="bpm"))
-    if weight_match:
-        vitals.append(
-            ReviewVital(
-                metric="weight",
-                value=weight_match.group(1),
-                unit=(weight_match.group(2) or "lb").lower(),
-            )
-        )
-    return vitals
+def _local_medications(findings: ClinicalFindings) -> list[ReviewMedication]:
+    return [
+        ReviewMedication(name=med.name, dose=med.dose or None, frequency=med.frequency or None, status="active")
+        for med in findings.medications
+    ]
+
+
+def _local_vitals(findings: ClinicalFindings) -> list[ReviewVital]:
+    return [ReviewVital(metric=vital.metric, value=vital.value, unit=vital.unit) for vital in findings.vitals]
 
 
 def build_local_review_draft(document: MedicalDocument, text: str, reason: str | None = None) -> ClinicalDocumentReviewDraft:
-    labs = _parse_local_labs(text)
-    medications = _parse_local_medications(text)
-    vitals = _parse_local_vitals(text)
+    findings = scan_clinical_text(text)
+    labs = _local_labs(findings)
+    medications = _local_medications(findings)
+    vitals = _local_vitals(findings)
     quality_flags = _quality_flags_for_document(document, text)
     if reason:
         quality_flags.append(reason)
@@ -437,6 +370,7 @@ def build_artifacts_from_review(document: MedicalDocument, draft: ClinicalDocume
         artifact.medical_records.append(
             MedicalRecord(
                 patient_id=document.patient_id,
+                source_document_id=document.id,
                 record_type="lab",
                 title=lab.test_name,
                 description=" · ".join(part for part in description_parts if part),
@@ -447,16 +381,16 @@ def build_artifacts_from_review(document: MedicalDocument, draft: ClinicalDocume
             )
         )
         if lab.numeric_value is not None:
-            lab_key = lab.test_name.lower()
-            catalog_meta = LAB_CATALOG.get(lab_key, LAB_CATALOG.get(lab_key.replace("fasting ", ""), {}))
+            catalog_test = lookup_lab(lab.test_name)
             artifact.lab_observations.append(
                 LabObservation(
                     patient_id=document.patient_id,
+                    source_document_id=document.id,
                     test_name=lab.test_name,
-                    loinc=catalog_meta.get("loinc"),
+                    loinc=catalog_test.loinc if catalog_test else None,
                     value=lab.numeric_value,
                     unit=lab.unit,
-                    ref_range=lab.reference_range or catalog_meta.get("ref_range"),
+                    ref_range=lab.reference_range or (catalog_test.ref_range if catalog_test else None),
                     status=None if lab.status == "unknown" else lab.status,
                     source=source_label,
                     timestamp=datetime.now(timezone.utc),
@@ -468,6 +402,7 @@ def build_artifacts_from_review(document: MedicalDocument, draft: ClinicalDocume
         artifact.medical_records.append(
             MedicalRecord(
                 patient_id=document.patient_id,
+                source_document_id=document.id,
                 record_type="medication",
                 title=medication.name,
                 description=" · ".join(bit for bit in medication_bits if bit) or "Imported from reviewed document",
@@ -483,6 +418,7 @@ def build_artifacts_from_review(document: MedicalDocument, draft: ClinicalDocume
         artifact.wearable_data.append(
             WearableData(
                 patient_id=document.patient_id,
+                source_document_id=document.id,
                 metric=vital.metric,
                 value=wearable_value,
                 trend="stable",
@@ -497,6 +433,7 @@ def build_artifacts_from_review(document: MedicalDocument, draft: ClinicalDocume
         artifact.medical_records.append(
             MedicalRecord(
                 patient_id=document.patient_id,
+                source_document_id=document.id,
                 record_type=_document_timeline_type(document.record_type),
                 title=document.title,
                 description=description or "Reviewed document imported into MedBridge",
@@ -540,3 +477,18 @@ def persist_review_approval(
         )
     )
     return count
+
+
+def derived_record_counts(session: Session, patient_id: str, document_ids: list[int]) -> dict[int, int]:
+    """Count timeline records imported from each document with one grouped query."""
+    if not document_ids:
+        return {}
+    rows = session.exec(
+        select(MedicalRecord.source_document_id, func.count(MedicalRecord.id))
+        .where(
+            MedicalRecord.patient_id == patient_id,
+            MedicalRecord.source_document_id.in_(document_ids),
+        )
+        .group_by(MedicalRecord.source_document_id)
+    ).all()
+    return {document_id: count for document_id, count in rows}
@@ -2,38 +2,14 @@ from __future__ import annotations
 
 from dataclasses import dataclass, field
 from datetime import datetime, timezone
-import io
 import json
-import re
 from typing import Any
 
-from pypdf import PdfReader
 from sqlmodel import Session
 
+from app.clinical_scanner import ClinicalFindings, scan_clinical_text
 from app.models import AuditLog, LabObservation, MedicalDocument, MedicalRecord, User, WearableData
-
-
-LAB_CATALOG = {
-    "hemoglobin a1c": {"loinc": "4548-4", "unit": "%", "ref_range": "4.0-5.6"},
-    "a1c": {"loinc": "4548-4", "unit": "%", "ref_range": "4.0-5.6"},
-    "glucose": {"loinc": "2345-7", "unit": "mg/dL", "ref_range": "70-100"},
-    "fasting glucose": {"loinc": "1558-6", "unit": "mg/dL", "ref_range": "70-100"},
-    "total cholesterol": {"loinc": "2093-3", "unit": "mg/dL", "ref_range": "<200"},
-    "cholesterol": {"loinc": "2093-3", "unit": "mg/dL", "ref_range": "<200"},
-    "creatinine": {"loinc": "2160-0", "unit": "mg/dL", "ref_range": "0.6-1.3"},
-    "tsh": {"loinc": "3016-3", "unit": "mIU/L", "ref_range": "0.4-4.5"},
-}
-
-MEDICATION_PATTERN = re.compile(
-    r"(?i)(metformin|lisinopril|atorvastatin|levothyroxine|albuterol|sertraline)\b[:\- ]*(\d+(?:\.\d+)?\s*(?:mg|mcg|puffs))?(?:.*?(daily|nightly|as needed|twice daily|once daily))?"
-)
-LAB_LINE_PATTERN = re.compile(
-    r"(?i)(hemoglobin a1c|a1c|fasting glucose|glucose|total cholesterol|cholesterol|creatinine|tsh)"
-    r"[^0-9]{0,20}(\d+(?:\.\d+)?)\s*(%|mg/dL|mIU/L|mmol/L)?(?:[^A-Za-z0-9]{0,12}(high|low|normal))?"
-)
-BP_PATTERN = re.compile(r"(?i)\b(?:bp|blood pressure)\b[^0-9]{0,10}(\d{2,3}/\d{2,3})")
-HEART_RATE_PATTERN = re.compile(r"(?i)\b(?:pulse|heart rate|hr)\b[^0-9]{0,10}(\d{2,3})")
-WEIGHT_PATTERN = re.compile(r"(?i)\bweight\b[^0-9]{0,10}(\d{2,3}(?:\.\d+)?)\s*(lb|lbs|kg)?")
+from app.pdf_text import extract_pdf_text
 
 
 @dataclass
@@ -46,13 +22,7 @@ class ExtractionArtifact:
 
 def extract_text_from_pdf_bytes(payload: bytes) -> str:
     try:
-        reader = PdfReader(io.BytesIO(payload))
-        parts: list[str] = []
-        for page in reader.pages:
-            page_text = page.extract_text() or ""
-            if page_text.strip():
-                parts.append(page_text)
-        return "\n".join(parts).strip()
+        return extract_pdf_text(payload).text
     except Exception:
         return ""
 
@@ -69,133 +39,62 @@ def _collect_section(lines: list[str], keys: tuple[str, ...]) -> str | None:
     return None
 
 
-def _parse_labs(text: str, patient_id: str, source: str) -> list[LabObservation]:
-    matches = []
-    for match in LAB_LINE_PATTERN.finditer(text):
-        label = match.group(1).lower()
-        value = float(match.group(2))
-        unit = match.group(3)
-        status = (match.group(4) or "").lower() or None
-        meta = LAB_CATALOG.get(label, LAB_CATALOG.get(label.replace("fasting ", ""), {}))
-        if not unit:
-            unit = meta.get("unit")
-
-        if not status:
-            ref = meta.get("ref_range", "")
-            if ref and ref.startswith("<"):
-                try:
-                    status = "high" if value >= float(ref[1:]) else "normal"
-                except ValueError:
-                    status = "normal"
-            elif ref and "-" in ref:
-                low, high = ref.split("-", 1)
-                try:
-                    if value < float(low):
-                        status = "low"
-                    elif value > float(high):
-                        status = "high"
-                    else:
-                        status = "normal"
-                except ValueError:
-                    status = "normal"
-
-        matches.append(
-            LabObservation(
-                patient_id=patient_id,
-                test_name=match.group(1).title(),
-                loinc=meta.get("loinc"),
-                value=value,
-                unit=unit,
-                ref_range=meta.get("ref_range"),
-                status=status,
-                source=source,
-                timestamp=datetime.now(timezone.utc),
-            )
-        )
-    return matches
-
-
-def _parse_medications(text: str) -> list[dict[str, str]]:
-    medications: list[dict[str, str]] = []
-    for match in MEDICATION_PATTERN.finditer(text):
-        name = match.group(1).title()
-        dose = (match.group(2) or "").strip()
-        frequency = (match.group(3) or "").strip()
-        medications.append(
-            {
-                "name": name,
-                "dose": dose,
-                "frequency": frequency,
-            }
-        )
-    deduped: list[dict[str, str]] = []
-    seen = set()
-    for med in medications:
-        key = (med["name"], med["dose"], med["frequency"])
-        if key not in seen:
-            seen.add(key)
-            deduped.append(med)
-    return deduped
-
-
-def _parse_wearables(text: str, patient_id: str, source: str) -> list[WearableData]:
-    vitals: list[WearableData] = []
-    bp_match = BP_PATTERN.search(text)
-    hr_match = HEART_RATE_PATTERN.search(text)
-    weight_match = WEIGHT_PATTERN.search(text)
-
-    if bp_match:
-        vitals.append(
-            WearableData(
-                patient_id=patient_id,
-                metric="blood_pressure",
-                value=bp_match.group(1),
-                trend="stable",
-                period="Imported document",
-                source=source,
-            )
-        )
-    if hr_match:
-        vitals.append(
-            WearableData(
-                patient_id=patient_id,
-                metric="heart_rate",
-                value=hr_match.group(1),
-                trend="stable",
-                period="Imported document",
-                source=source,
-            )
+def _lab_observations(findings: ClinicalFindings, patient_id: str, source: str) -> list[LabObservation]:
+    return [
+        LabObservation(
+            patient_id=patient_id,
+            test_name=lab.test_name,
+            loinc=lab.loinc,
+            value=lab.value,
+            unit=lab.unit,
+            ref_range=lab.ref_range,
+            status=lab.status,
+            source=source,
+            timestamp=datetime.now(timezone.utc),
         )
-    if weight_match:
-        unit = (weight_match.group(2) or "lb").lower()
-        vitals.append(
-            WearableData(
-                patient_id=patient_id,
-                metric="weight",
-                value=f"{weight_match.group(1)} {unit}",
-                trend="stable",
-                period="Imported document",
-                source=source,
-            )
+        for lab in findings.labs
+    ]
+
+
+def _medications(findings: ClinicalFindings) -> list[dict[str, str]]:
+    return [
+        {"name": med.name, "dose": med.dose, "frequency": med.frequency}
+        for med in findings.medications
+    ]
+
+
+def _wearables(findings: ClinicalFindings, patient_id: str, source: str) -> list[WearableData]:
+    return [
+        WearableData(
+            patient_id=patient_id,
+            metric=vital.metric,
+            value=f"{vital.value} {vital.unit}" if vital.metric == "weight" else vital.value,
+            trend="stable",
+            period="Imported document",
+            source=source,
         )
-    return vitals
+        for vital in findings.vitals
+    ]
 
 
 def build_extraction_artifacts(document: MedicalDocument, text: str, source_label: str) -> ExtractionArtifact:
     artifact = ExtractionArtifact()
     lines = [line.strip() for line in text.splitlines() if line.strip()]
     link_flags = json.dumps(["Extracted from uploaded document", f"document:{document.id}"])
+    findings = scan_clinical_text(text)
 
     if document.record_type in {"lab_result", "pathology_report"}:
-        labs = _parse_labs(text, document.patient_id, source_label)
+        labs = _lab_observations(findings, document.patient_id, source_label)
         artifact.lab_observations.extend(labs)
         for lab in labs:
+            lab.source_document_id = document.id
             description = f"{lab.value} {lab.unit or ''}".strip()
             if lab.ref_range:
                 description += f" · Ref {lab.ref_range}"
             artifact.medical_records.append(
                 MedicalRecord(
                     patient_id=document.patient_id,
+                    source_document_id=document.id,
                     record_type="lab",
                     title=lab.test_name,
                     description=description,
@@ -211,13 +110,14 @@ def build_extraction_artifacts(document: MedicalDocument, text: str, source_labe
             artifact.summary.append(f"{len(labs)} lab results extracted")
 
     if document.record_type == "medication_list":
-        medications = _parse_medications(text)
+        medications = _medications(findings)
         for med in medications:
             dose_fragment = med["dose"] or "dose not found"
             frequency_fragment = med["frequency"] or "frequency not found"
             artifact.medical_records.append(
                 MedicalRecord(
                     patient_id=document.patient_id,
+                    source_document_id=document.id,
                     record_type="medication",
                     title=med["name"],
                     description=f"{dose_fragment} · {frequency_fragment}",
@@ -231,7 +131,9 @@ def build_extraction_artifacts(document: MedicalDocument, text: str, source_labe
             artifact.summary.append(f"{len(medications)} medications extracted")
 
     if document.record_type in {"wearable_report", "vitals_sheet"}:
-        wearable_rows = _parse_wearables(text, document.patient_id, source_label)
+        wearable_rows = _wearables(findings, document.patient_id, source_label)
+        for wearable in wearable_rows:
+            wearable.source_document_id = document.id
         artifact.wearable_data.extend(wearable_rows)
         if wearable_rows:
             artifact.summary.append(f"{len(wearable_rows)} vitals extracted")
@@ -271,6 +173,7 @@ def build_extraction_artifacts(document: MedicalDocument, text: str, source_labe
         artifact.medical_records.append(
             MedicalRecord(
                 patient_id=document.patient_id,
+                source_document_id=document.id,
                 record_type=timeline_type,
                 title=document.title,
                 description=summary_text,
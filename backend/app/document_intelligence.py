@@ -1,8 +1,9 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-import re
-from typing import Iterable
+from typing import Iterable, Sequence
+
+from app.hint_matcher import HintMatcher, hint_tokens
 
 
 DOCUMENT_TYPE_LABELS = {
@@ -243,10 +244,42 @@ SOURCE_SYSTEMS: tuple[SourceSystemProfile, ...] = (
     ),
 )
 
+# Vendor names that identify the source system when they appear anywhere in a
+# document's text. Earlier entries win when several appear.
+SOURCE_SYSTEM_HINTS = {
+    "epic (mychart)": "epic_mychart",
+    "epic mychart": "epic_mychart",
+    "mychart": "epic_mychart",
+    "oracle health": "oracle_cerner",
+    "cerner": "oracle_cerner",
+    "meditech": "meditech",
+    "athenahealth": "athenahealth",
+    "athenaone": "athenahealth",
+    "eclinicalworks": "eclinicalworks",
+    "e clinical works": "eclinicalworks",
+    "nextgen": "nextgen_healthcare",
+    "tebra": "tebra",
+    "kareo": "tebra",
+    "patientpop": "tebra",
+    "practice fusion": "practice_fusion",
+    "greenway": "greenway_intergy",
+    "intergy": "greenway_intergy",
+    "advancedmd": "advancedmd",
+    "allscripts": "allscripts_veradigm",
+    "veradigm": "allscripts_veradigm",
+    "drchrono": "drchrono",
+    "curemd": "curemd",
+    "praxis": "praxis_emr",
+    "nextech": "nextech",
+    "simplepractice": "behavioral_health",
+    "therapynotes": "behavioral_health",
+    "va health": "va_health",
+    "my healthevet": "va_health",
+}
+
+
 def _normalize_free_text(value: str) -> str:
-    lowered = value.strip().lower()
-    cleaned = re.sub(r"[^a-z0-9]+", " ", lowered)
-    return " ".join(cleaned.split())
+    return " ".join(hint_tokens(value))
 
 
 ALIAS_LOOKUP = {}
@@ -259,12 +292,33 @@ for profile in SOURCE_SYSTEMS:
 SLUG_LOOKUP = {profile.slug: profile for profile in SOURCE_SYSTEMS}
 
 
+@dataclass(frozen=True)
+class SourceHint:
+    slug: str
+    priority: int  # position in SOURCE_SYSTEM_HINTS; the earliest hint found wins
+
+
+SOURCE_HINT_MATCHER: HintMatcher[SourceHint] = HintMatcher(
+    [(hint, SourceHint(slug, priority)) for priority, (hint, slug) in enumerate(SOURCE_SYSTEM_HINTS.items())]
+)
+
+
+def source_system_from_tokens(tokens: Sequence[str]) -> str | None:
+    """Return the vendor named in a document's tokens, if any."""
+    best: SourceHint | None = None
+    for match in SOURCE_HINT_MATCHER.iter_matches(tokens):
+        hint = match.value
+        if best is None or hint.priority < best.priority:
+            best = hint
+    return best.slug if best else None
+
+
 def normalize_source_system(value: str) -> str:
     normalized = _normalize_free_text(value)
     profile = ALIAS_LOOKUP.get(normalized)
     if profile:
         return profile.slug
-    return normalized.replace("/", " ").replace("-", " ").replace(" ", "_") or "generic_scanned_record"
+    return normalized.replace(" ", "_") or "generic_scanned_record"
 
 
 def profile_for_source_system(value: str) -> SourceSystemProfile:
@@ -1,116 +1,308 @@
+"""
+Naive Bayes document profile classifier.
+
+The trainer writes two artifacts side by side:
+
+- ``document_profile_model.bin``: the runtime format. A small JSON header is
+  followed by, per label model, a sorted table of 64-bit token hashes and a
+  float32 log-probability matrix with one row per hash. The file is
+  memory-mapped and the arrays are NumPy views over the mapping, so loading
+  costs a header parse, and uvicorn workers share the pages.
+- ``document_profile_model.json``: the raw token counts, kept as a debug
+  export and as a fallback when no binary artifact exists.
+
+Scoring a batch hashes every token once, finds them all with one
+``searchsorted`` and sums the matching rows per document. The loaded model is
+memoized and reloaded only when the artifact's mtime changes, e.g. after
+retraining.
+"""
 from __future__ import annotations
 
+from dataclasses import dataclass
+from functools import lru_cache
+import hashlib
 import json
+import logging
 import math
-import re
+import mmap
+import os
 from pathlib import Path
-from typing import Any
+import re
+import struct
+import threading
+from typing import Any, Sequence
+
+import numpy as np
+
+from app.document_intelligence import source_system_from_tokens
 
+logger = logging.getLogger(__name__)
 
 MODEL_PATH = Path(__file__).resolve().parents[1] / "generated" / "document_profile_model.json"
+MODEL_MAGIC = b"MBPM"
+MODEL_FORMAT_VERSION = 1
+# magic, format version, reserved, header length; the JSON header follows.
+_PREAMBLE = struct.Struct("<4sHHQ")
+_ARRAY_ALIGNMENT = 64
+LABEL_MODEL_NAMES = ("source_system_model", "record_type_model")
 TOKEN_RE = re.compile(r"[a-z0-9]+")
-SOURCE_SYSTEM_HINTS = {
-    "epic (mychart)": "epic_mychart",
-    "epic mychart": "epic_mychart",
-    "mychart": "epic_mychart",
-    "oracle health": "oracle_cerner",
-    "cerner": "oracle_cerner",
-    "meditech": "meditech",
-    "athenahealth": "athenahealth",
-    "athenaone": "athenahealth",
-    "eclinicalworks": "eclinicalworks",
-    "e clinical works": "eclinicalworks",
-    "nextgen": "nextgen_healthcare",
-    "tebra": "tebra",
-    "kareo": "tebra",
-    "patientpop": "tebra",
-    "practice fusion": "practice_fusion",
-    "greenway": "greenway_intergy",
-    "intergy": "greenway_intergy",
-    "advancedmd": "advancedmd",
-    "allscripts": "allscripts_veradigm",
-    "veradigm": "allscripts_veradigm",
-    "drchrono": "drchrono",
-    "curemd": "curemd",
-    "praxis": "praxis_emr",
-    "nextech": "nextech",
-    "simplepractice": "behavioral_health",
-    "therapynotes": "behavioral_health",
-    "va health": "va_health",
-    "my healthevet": "va_health",
-}
 
 
 def _tokenize(text: str) -> list[str]:
     return TOKEN_RE.findall(text.lower())
 
 
-def _load_model() -> dict[str, Any] | None:
-    if not MODEL_PATH.exists():
+@lru_cache(maxsize=65536)
+def token_hash(token: str) -> int:
+    """Stable 64-bit token hash; Python's ``hash`` is salted per process."""
+    return int.from_bytes(hashlib.blake2b(token.encode(), digest_size=8).digest(), "little")
+
+
+@dataclass(frozen=True)
+class CompiledLabelModel:
+    labels: tuple[str, ...]
+    token_hashes: np.ndarray  # (vocabulary,) uint64, sorted; row i of log_probs belongs to token_hashes[i]
+    log_probs: np.ndarray  # (vocabulary, labels) float32: log P(token | label), Laplace-smoothed
+    unseen_log_probs: np.ndarray  # (labels,): log P(token | label) for out-of-vocabulary tokens
+    priors: np.ndarray  # (labels,)
+
+    @classmethod
+    def from_bundle(cls, bundle: dict[str, Any]) -> "CompiledLabelModel":
+        labels = tuple(bundle["labels"])
+        token_counts = bundle["token_counts"]
+        vocabulary: dict[str, int] = {}
+        for label in labels:
+            for token in token_counts.get(label, {}):
+                vocabulary.setdefault(token, len(vocabulary))
+
+        hashes = np.fromiter((token_hash(token) for token in vocabulary), dtype=np.uint64, count=len(vocabulary))
+        order = np.argsort(hashes)
+        hashes = hashes[order]
+        if len(hashes) > 1 and not np.all(hashes[1:] != hashes[:-1]):
+            raise ValueError("Token hash collision in the profile model vocabulary.")
+        rows = np.empty(len(vocabulary), dtype=np.int64)
+        rows[order] = np.arange(len(vocabulary))
+
+        counts = np.zeros((len(vocabulary), len(labels)), dtype=np.float64)
+        for column, label in enumerate(labels):
+            for token, count in token_counts.get(label, {}).items():
+                counts[rows[vocabulary[token]], column] = count
+
+        vocab_size = max(bundle.get("vocab_size", 1), 1)
+        denominators = np.array(
+            [bundle["total_tokens"].get(label, 0) + vocab_size for label in labels], dtype=np.float64
+        )
+        return cls(
+            labels=labels,
+            token_hashes=hashes,
+            log_probs=(np.log(counts + 1.0) - np.log(denominators)).astype(np.float32),
+            unseen_log_probs=-np.log(denominators),
+            priors=np.array([float(bundle["priors"].get(label, -20.0)) for label in labels], dtype=np.float64),
+        )
+
+    def score_batch(self, token_lists: Sequence[list[str]]) -> np.ndarray:
+        """Return a (documents, labels) matrix of unnormalized log posteriors."""
+        scores = np.tile(self.priors, (len(token_lists), 1))
+        if not self.labels or not token_lists:
+            return scores
+        lengths = np.fromiter((len(tokens) for tokens in token_lists), dtype=np.int64, count=len(token_lists))
+        total = int(lengths.sum())
+        if not total:
+            return scores
+
+        hashes = np.fromiter(
+            (token_hash(token) for tokens in token_lists for token in tokens), dtype=np.uint64, count=total
+        )
+        documents = np.repeat(np.arange(len(token_lists)), lengths)
+        if len(self.token_hashes):
+            rows = np.minimum(np.searchsorted(self.token_hashes, hashes), len(self.token_hashes) - 1)
+            known = self.token_hashes[rows] == hashes
+        else:
+            rows = np.zeros(total, dtype=np.int64)
+            known = np.zeros(total, dtype=bool)
+
+        unseen = np.bincount(documents[~known], minlength=len(token_lists))
+        scores += unseen[:, None] * self.unseen_log_probs
+        if known.any():
+            # Known tokens stay grouped by document, so reduceat sums each
+            # document's rows in one pass; documents without any are skipped.
+            present, starts = np.unique(documents[known], return_index=True)
+            scores[present] += np.add.reduceat(self.log_probs[rows[known]], starts, axis=0, dtype=np.float64)
+        return scores
+
+    def predict_batch(self, token_lists: Sequence[list[str]]) -> list[dict[str, Any]]:
+        if not self.labels:
+            return [{"label": None, "confidence": 0.0} for _ in token_lists]
+        scores = self.score_batch(token_lists)
+        top = scores.argmax(axis=1)
+        max_scores = scores[np.arange(len(token_lists)), top]
+        denominators = np.exp(scores - max_scores[:, None]).sum(axis=1)
+        return [
+            {"label": self.labels[index], "confidence": round(float(1.0 / denominator), 4) if denominator else 0.0}
+            for index, denominator in zip(top, denominators)
+        ]
+
+
+@dataclass(frozen=True)
+class ProfileModel:
+    summary: dict[str, Any] | None
+    source_system_model: CompiledLabelModel
+    record_type_model: CompiledLabelModel
+
+
+def compile_model(payload: dict[str, Any]) -> ProfileModel:
+    """Compile the trainer's JSON payload (raw token counts) into a ProfileModel."""
+    return ProfileModel(
+        summary=payload.get("summary"),
+        source_system_model=CompiledLabelModel.from_bundle(payload["source_system_model"]),
+        record_type_model=CompiledLabelModel.from_bundle(payload["record_type_model"]),
+    )
+
+
+def binary_model_path(json_path: Path) -> Path:
+    return json_path.with_suffix(".bin")
+
+
+def _align(offset: int) -> int:
+    return -(-offset // _ARRAY_ALIGNMENT) * _ARRAY_ALIGNMENT
+
+
+def write_binary_model(path: Path, model: ProfileModel) -> None:
+    """Write ``model`` in the memory-mappable format.
+
+    The file is written next to ``path`` and renamed over it, so processes
+    that still map the previous artifact keep a valid view of it.
+    """
+    arrays: list[np.ndarray] = []
+    models: dict[str, Any] = {}
+    offset = 0  # relative to the start of the (aligned) data section
+    for name in LABEL_MODEL_NAMES:
+        label_model: CompiledLabelModel = getattr(model, name)
+        specs = {}
+        for field_name, dtype in (
+            ("token_hashes", "<u8"),
+            ("log_probs", "<f4"),
+            ("unseen_log_probs", "<f8"),
+            ("priors", "<f8"),
+        ):
+            array = np.ascontiguousarray(getattr(label_model, field_name), dtype=dtype)
+            specs[field_name] = {"dtype": dtype, "shape": list(array.shape), "offset": offset}
+            arrays.append(array)
+            offset = _align(offset + array.nbytes)
+        models[name] = {"labels": list(label_model.labels), "arrays": specs}
+
+    header = json.dumps({"summary": model.summary, "models": models}, separators=(",", ":")).encode()
+    data_start = _align(_PREAMBLE.size + len(header))
+    partial = path.with_suffix(path.suffix + ".partial")
+    with partial.open("wb") as handle:
+        handle.write(_PREAMBLE.pack(MODEL_MAGIC, MODEL_FORMAT_VERSION, 0, len(header)))
+        handle.write(header)
+        for array, spec in zip(arrays, (spec for entry in models.values() for spec in entry["arrays"].values())):
+            handle.seek(data_start + spec["offset"])
+            handle.write(array.tobytes())
+        handle.truncate(data_start + offset)
+    os.replace(partial, path)
+
+
+def read_binary_model(path: Path) -> ProfileModel:
+    """Map a binary artifact; the returned arrays are read-only views over the file."""
+    with path.open("rb") as handle:
+        buffer = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, _reserved, header_length = _PREAMBLE.unpack_from(buffer, 0)
+    if magic != MODEL_MAGIC:
+        raise ValueError(f"{path} is not a profile model artifact.")
+    if version != MODEL_FORMAT_VERSION:
+        raise ValueError(f"{path} has format version {version}; expected {MODEL_FORMAT_VERSION}.")
+    header = json.loads(buffer[_PREAMBLE.size:_PREAMBLE.size + header_length])
+    data_start = _align(_PREAMBLE.size + header_length)
+
+    label_models = {}
+    for name in LABEL_MODEL_NAMES:
+        entry = header["models"][name]
+        views = {
+            field_name: np.frombuffer(
+                buffer, dtype=spec["dtype"], count=math.prod(spec["shape"]), offset=data_start + spec["offset"]
+            ).reshape(spec["shape"])
+            for field_name, spec in entry["arrays"].items()
+        }
+        label_models[name] = CompiledLabelModel(labels=tuple(entry["labels"]), **views)
+    return ProfileModel(summary=header.get("summary"), **label_models)
+
+
+_cache_lock = threading.Lock()
+_cached: tuple[Path, int, ProfileModel] | None = None
+
+
+def _current_artifact() -> tuple[Path, int] | None:
+    for path in (binary_model_path(MODEL_PATH), MODEL_PATH):
+        try:
+            return path, path.stat().st_mtime_ns
+        except FileNotFoundError:
+            continue
+    return None
+
+
+def _read_artifact(path: Path) -> ProfileModel:
+    if path.suffix == ".bin":
+        try:
+            return read_binary_model(path)
+        except (OSError, ValueError, KeyError, struct.error):
+            if not MODEL_PATH.exists():
+                raise
+            logger.warning("Unreadable profile model %s; falling back to %s", path, MODEL_PATH.name, exc_info=True)
+    return compile_model(json.loads(MODEL_PATH.read_text()))
+
+
+def _load_model() -> ProfileModel | None:
+    """Return the model, preferring the binary artifact and reloading only when it changed on disk."""
+    global _cached
+    artifact = _current_artifact()
+    if artifact is None:
         return None
-    return json.loads(MODEL_PATH.read_text())
+    cached = _cached
+    if cached and cached[:2] == artifact:
+        return cached[2]
+
+    with _cache_lock:
+        if _cached and _cached[:2] == artifact:
+            return _cached[2]
+        model = _read_artifact(artifact[0])
+        _cached = (*artifact, model)
+        return model
 
 
 def model_summary() -> dict[str, Any] | None:
-    payload = _load_model()
-    if not payload:
+    model = _load_model()
+    if not model:
         return None
-    return payload.get("summary")
-
-
-def _predict_label(bundle: dict[str, Any], text: str) -> dict[str, Any]:
-    tokens = _tokenize(text)
-    labels = bundle["labels"]
-    if not labels:
-        return {"label": None, "confidence": 0.0}
-
-    vocab_size = max(bundle.get("vocab_size", 1), 1)
-    token_counts = bundle["token_counts"]
-    total_tokens = bundle["total_tokens"]
-    priors = bundle["priors"]
-
-    scores: dict[str, float] = {}
-    for label in labels:
-        score = float(priors.get(label, -20.0))
-        denominator = float(total_tokens.get(label, 0) + vocab_size)
-        label_token_counts = token_counts.get(label, {})
-        for token in tokens:
-            score += math.log((label_token_counts.get(token, 0) + 1) / denominator)
-        scores[label] = score
-
-    top_label = max(scores, key=scores.get)
-    max_score = scores[top_label]
-    denominator = sum(math.exp(score - max_score) for score in scores.values())
-    confidence = 1.0 / denominator if denominator else 0.0
-    return {
-        "label": top_label,
-        "confidence": round(confidence, 4),
-    }
-
-
-def _forced_source_label(text: str) -> str | None:
-    normalized = " ".join(text.lower().split())
-    for hint, label in SOURCE_SYSTEM_HINTS.items():
-        if hint in normalized:
-            return label
-    return None
+    return model.summary
 
 
-def classify_text(text: str) -> dict[str, Any] | None:
-    payload = _load_model()
-    if not payload:
+def classify_texts(texts: Sequence[str]) -> list[dict[str, Any]] | None:
+    """Classify many documents at once; returns None if no model has been trained."""
+    model = _load_model()
+    if not model:
         return None
 
-    source_prediction = _predict_label(payload["source_system_model"], text)
-    forced_source = _forced_source_label(text)
-    if forced_source:
-        source_prediction = {
-            "label": forced_source,
-            "confidence": max(source_prediction.get("confidence", 0.0), 0.995),
-        }
-    record_prediction = _predict_label(payload["record_type_model"], text)
-    return {
-        "source_system": source_prediction,
-        "record_type": record_prediction,
-        "model_summary": payload.get("summary"),
-    }
+    token_lists = [_tokenize(text) for text in texts]
+    source_predictions = model.source_system_model.predict_batch(token_lists)
+    record_predictions = model.record_type_model.predict_batch(token_lists)
+    results = []
+    for tokens, source_prediction, record_prediction in zip(token_lists, source_predictions, record_predictions):
+        forced_source = source_system_from_tokens(tokens)
+        if forced_source:
+            source_prediction = {
+                "label": forced_source,
+                "confidence": max(source_prediction.get("confidence", 0.0), 0.995),
+            }
+        results.append({
+            "source_system": source_prediction,
+            "record_type": record_prediction,
+            "model_summary": model.summary,
+        })
+    return results
+
+
+def classify_text(text: str) -> dict[str, Any] | None:
+    results = classify_texts([text])
+    return results[0] if results else None
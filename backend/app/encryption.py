@@ -2,18 +2,97 @@
 Field-level encryption for PHI using Fernet symmetric encryption.
 Uses ENCRYPTION_KEY env var (must be a valid Fernet key).
 Generate one with: python -c "from cryptography.fernet import Fernet; print(Fernet.generate_key().decode())"
+
+To rotate, move the old key into ENCRYPTION_PREVIOUS_KEYS (comma-separated,
+newest first) and set a new ENCRYPTION_KEY. Values encrypted under any key in
+the ring still decrypt; ``app.key_rotation`` re-encrypts them in the background.
+
+Document payloads use envelope encryption instead: each blob gets its own
+AES-256-GCM data key, wrapped (Fernet-encrypted) by ENCRYPTION_KEY, and the
+payload is sealed in fixed-size segments so it can be encrypted and decrypted
+as a stream. Segment nonces are ``prefix || index || final-flag`` so segments
+cannot be reordered, dropped, or truncated without failing authentication.
 """
 import os
 import base64
-from cryptography.fernet import Fernet
+import hashlib
+from functools import lru_cache
+import struct
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 
 _key = os.environ.get("ENCRYPTION_KEY")
+_previous_keys = os.environ.get("ENCRYPTION_PREVIOUS_KEYS", "")
+
+
+def _as_bytes(key: str | bytes) -> bytes:
+    return key.encode() if isinstance(key, str) else key
+
+
+@lru_cache(maxsize=4)
+def _build_keys(primary: str | bytes | None, previous: str) -> tuple[Fernet, ...]:
+    if not primary:
+        return ()
+    keys = [Fernet(_as_bytes(primary))]
+    keys.extend(Fernet(_as_bytes(old.strip())) for old in previous.split(",") if old.strip())
+    return tuple(keys)
+
+
+@lru_cache(maxsize=4)
+def _build_keyring(primary: str | bytes | None, previous: str) -> MultiFernet | None:
+    keys = _build_keys(primary, previous)
+    return MultiFernet(list(keys)) if keys else None
+
+
+def _get_fernet() -> MultiFernet | None:
+    """The cached keyring: encrypts with ENCRYPTION_KEY, decrypts with any configured key."""
+    return _build_keyring(_key, _previous_keys)
+
+
+def _primary_fernet() -> Fernet | None:
+    keys = _build_keys(_key, _previous_keys)
+    return keys[0] if keys else None
+
+
+def _decrypt_with_ring(token: bytes) -> tuple[int, Fernet, bytes] | None:
+    """Try each key once, primary first; returns ``(index, key, plaintext)`` for the one that decrypts ``token``."""
+    for index, key in enumerate(_build_keys(_key, _previous_keys)):
+        try:
+            return index, key, key.decrypt(token)
+        except InvalidToken:
+            continue
+    return None  # not a token at all (e.g. written before a key was configured)
+
+
+def primary_key_fingerprint() -> str | None:
+    return hashlib.sha256(_as_bytes(_key)).hexdigest()[:16] if _key else None
+
+
+def rotation_pending() -> bool:
+    return bool(_key and _previous_keys.strip())
+
+
+def needs_rotation(token: str | bytes) -> bool:
+    """True if ``token`` was encrypted under a previous key rather than the primary one."""
+    decrypted = _decrypt_with_ring(_as_bytes(token)) if token else None
+    return decrypted is not None and decrypted[0] > 0
+
 
+def rotated_token(token: str) -> str | None:
+    """``token`` re-encrypted under the primary key, keeping its timestamp; None if it
+    already is, or is not a token at all.
+    """
+    decrypted = _decrypt_with_ring(token.encode()) if token else None
+    if decrypted is None or decrypted[0] == 0:
+        return None
+    _index, key, plaintext = decrypted
+    return _primary_fernet().encrypt_at_time(plaintext, key.extract_timestamp(token.encode())).decode()
 
-def _get_fernet() -> Fernet | None:
-    if _key:
-        return Fernet(_key.encode() if isinstance(_key, str) else _key)
-    return None
+
+def rotated_chunk(value: bytes) -> bytes | None:
+    """``rotated_token`` for chunks stored as raw Fernet tokens."""
+    rotated = rotated_token(base64.urlsafe_b64encode(value).decode())
+    return base64.urlsafe_b64decode(rotated) if rotated is not None else None
 
 
 def encrypt_field(value: str) -> str:
@@ -45,3 +124,53 @@ def decrypt_bytes(value: str) -> bytes:
     """Decrypt a text-safe payload back into binary data."""
     decoded = decrypt_field(value)
     return base64.b64decode(decoded.encode()) if decoded else b""
+
+
+def decrypt_chunk(value: bytes) -> bytes:
+    """Decrypt a chunk stored as a raw Fernet token (blobs written before envelope encryption).
+    Returns original if not encrypted or no key."""
+    f = _get_fernet()
+    if f and value:
+        try:
+            return f.decrypt(base64.urlsafe_b64encode(value))
+        except Exception:
+            return value
+    return value
+
+
+DATA_KEY_BYTES = 32
+NONCE_PREFIX_BYTES = 7
+
+
+def new_data_key() -> tuple[bytes, str] | None:
+    """Return ``(data_key, wrapped_data_key)``, or None if no master key is configured."""
+    f = _get_fernet()
+    if not f:
+        return None
+    data_key = AESGCM.generate_key(bit_length=DATA_KEY_BYTES * 8)
+    return data_key, f.encrypt(data_key).decode()
+
+
+def unwrap_data_key(wrapped: str) -> bytes:
+    f = _get_fernet()
+    if not f:
+        raise RuntimeError("ENCRYPTION_KEY is required to decrypt this document.")
+    return f.decrypt(wrapped.encode())
+
+
+class SegmentCipher:
+    """AES-GCM over a sequence of segments sharing one data key."""
+
+    def __init__(self, data_key: bytes, nonce_prefix: bytes, associated_data: bytes = b""):
+        self._aead = AESGCM(data_key)
+        self.nonce_prefix = nonce_prefix
+        self.associated_data = associated_data
+
+    def _nonce(self, index: int, final: bool) -> bytes:
+        return self.nonce_prefix + struct.pack(">IB", index, 1 if final else 0)
+
+    def encrypt(self, index: int, segment: bytes, final: bool) -> bytes:
+        return self._aead.encrypt(self._nonce(index, final), segment, self.associated_data)
+
+    def decrypt(self, index: int, segment: bytes, final: bool) -> bytes:
+        return self._aead.decrypt(self._nonce(index, final), segment, self.associated_data)
@@ -0,0 +1,251 @@
+"""
+Bulk import through the FHIR Bulk Data ``$export`` operation.
+
+Onboarding a practice through the REST sync means one sync per patient. A
+bulk import asks the server for every Patient, Observation and
+MedicationRequest of a Group (or of all patients) in one export instead:
+
+1. the kick-off request (``Prefer: respond-async``) returns 202 and a status
+   URL in ``Content-Location``;
+2. the status URL answers 202 until the export is ready, honouring
+   ``Retry-After``, and then returns a manifest with one or more NDJSON files
+   per resource type;
+3. each file is streamed and parsed one line at a time, so memory use depends
+   on ``FHIR_BULK_BATCH_SIZE`` rather than on the size of the export. Rows are
+   written with the REST sync's mappers and upserts and committed per batch.
+
+Resources are matched to local patients through the active FHIR connections
+to the same server; resources of patients without a connection are skipped.
+Each of those connections is leased (see ``app.fhir_scheduler``) for the whole
+import, so neither a scheduled nor a manual sync writes the same rows
+concurrently. Connections already leased by a running sync are left out and
+reported as ``busy``; their patients' resources are skipped.
+"""
+from __future__ import annotations
+
+import asyncio
+from collections import Counter, defaultdict
+from datetime import datetime
+import json
+import logging
+import os
+import time
+from typing import Iterable
+
+import httpx
+from sqlmodel import Session, select
+
+from app.dashboard_cache import invalidate_dashboard
+from app.fhir_client import FHIRClient, FHIRError, same_origin
+from app.fhir_scheduler import FHIR_SYNC_LEASE_SECONDS, lease_connection, release_connection
+from app.fhir_sync import RESOURCE_MAPPERS, SyncTarget, store_resources
+from app.models import FHIRConnection
+
+logger = logging.getLogger(__name__)
+
+FHIR_BULK_BATCH_SIZE = int(os.environ.get("FHIR_BULK_BATCH_SIZE", "1000"))
+# Status polling interval when the server sends no usable Retry-After, and the cap on it when it does.
+FHIR_BULK_POLL_SECONDS = float(os.environ.get("FHIR_BULK_POLL_SECONDS", "5"))
+FHIR_BULK_MAX_POLL_SECONDS = float(os.environ.get("FHIR_BULK_MAX_POLL_SECONDS", "120"))
+FHIR_BULK_TIMEOUT_SECONDS = float(os.environ.get("FHIR_BULK_TIMEOUT_SECONDS", "21600"))
+
+BULK_RESOURCE_TYPES = tuple(RESOURCE_MAPPERS)
+
+
+def patient_targets(session: Session, fhir_base_url: str) -> dict[str, SyncTarget]:
+    """Map remote patient ids to the local patients connected to ``fhir_base_url``."""
+    base = fhir_base_url.rstrip("/")
+    connections = session.exec(
+        select(FHIRConnection).where(
+            FHIRConnection.fhir_base_url.in_((base, f"{base}/")),
+            FHIRConnection.status == "active",
+            FHIRConnection.patient_fhir_id.is_not(None),
+        )
+    ).all()
+    return {
+        connection.patient_fhir_id: SyncTarget(
+            patient_id=connection.patient_id, ehr_name=connection.ehr_name, connection_id=connection.id
+        )
+        for connection in connections
+    }
+
+
+def resource_patient_id(resource: dict) -> str | None:
+    if resource.get("resourceType") == "Patient":
+        return resource.get("id")
+    reference = (resource.get("subject") or resource.get("patient") or {}).get("reference") or ""
+    kind, _, patient_id = reference.rpartition("/")
+    return patient_id if patient_id and kind.endswith("Patient") else None
+
+
+async def kick_off_export(
+    client: FHIRClient,
+    group_id: str | None = None,
+    types: Iterable[str] = BULK_RESOURCE_TYPES,
+    since: datetime | None = None,
+) -> str:
+    """Start an export and return its status URL."""
+    params = {"_type": ",".join(types)}
+    if since is not None:
+        params["_since"] = since.isoformat()
+    response = await client.request(
+        "GET",
+        f"Group/{group_id}/$export" if group_id else "Patient/$export",
+        params=params,
+        headers={"Accept": "application/fhir+json", "Prefer": "respond-async"},
+    )
+    status_url = response.headers.get("Content-Location")
+    if response.status_code != 202 or not status_url:
+        raise FHIRError(f"Bulk export was not accepted (HTTP {response.status_code})", response.status_code)
+    status_url = str(response.url.join(status_url))
+    if not same_origin(status_url, client.base_url):
+        raise FHIRError("Bulk export status URL points to another server")
+    return status_url
+
+
+def _retry_after(response: httpx.Response) -> float:
+    try:
+        seconds = float(response.headers.get("Retry-After", ""))
+    except ValueError:
+        seconds = FHIR_BULK_POLL_SECONDS  # missing, or the HTTP-date form
+    return min(max(seconds, 0.0), FHIR_BULK_MAX_POLL_SECONDS)
+
+
+async def wait_for_manifest(client: FHIRClient, status_url: str) -> dict:
+    deadline = time.monotonic() + FHIR_BULK_TIMEOUT_SECONDS
+    while True:
+        response = await client.request("GET", status_url, headers={"Accept": "application/json"})
+        if response.status_code == 200:
+            try:
+                return response.json()
+            except ValueError as exc:
+                raise FHIRError("Bulk export manifest is not JSON") from exc
+        if response.status_code != 202:
+            raise FHIRError(f"Unexpected bulk export status response (HTTP {response.status_code})", response.status_code)
+        if time.monotonic() >= deadline:
+            raise FHIRError("Bulk export did not finish in time")
+        logger.info("Bulk export in progress: %s", response.headers.get("X-Progress", "no progress reported"))
+        await asyncio.sleep(_retry_after(response))
+
+
+def _store_bulk_batch(session: Session, resource_type: str, batch: list[tuple[SyncTarget, dict]]) -> Counter:
+    by_target: dict[SyncTarget, list[tuple[str, dict]]] = defaultdict(list)
+    for target, resource in batch:
+        by_target[target].append((resource_type, resource))
+    counts: Counter = Counter()
+    for target, items in by_target.items():
+        counts += store_resources(session, target, items)
+    session.commit()
+    return counts
+
+
+async def ingest_ndjson(
+    client: FHIRClient,
+    url: str,
+    resource_type: str,
+    targets: dict[str, SyncTarget],
+    session: Session,
+    authenticated: bool = True,
+) -> Counter:
+    """Stream one NDJSON output file into the database, ``FHIR_BULK_BATCH_SIZE`` resources at a time."""
+    counts: Counter = Counter()
+    batch: list[tuple[SyncTarget, dict]] = []
+    async for line in client.stream_lines(url, authenticated=authenticated):
+        if not line.strip():
+            continue
+        try:
+            resource = json.loads(line)
+        except ValueError:
+            counts["malformed"] += 1
+            continue
+        target = targets.get(resource_patient_id(resource)) if resource.get("resourceType") == resource_type else None
+        if target is None:
+            counts["skipped"] += 1
+            continue
+        batch.append((target, resource))
+        if len(batch) >= FHIR_BULK_BATCH_SIZE:
+            counts.update(await asyncio.to_thread(_store_bulk_batch, session, resource_type, batch))
+            batch = []
+    if batch:
+        counts.update(await asyncio.to_thread(_store_bulk_batch, session, resource_type, batch))
+    return counts
+
+
+async def run_bulk_import(
+    session: Session,
+    fhir_base_url: str,
+    access_token: str,
+    *,
+    group_id: str | None = None,
+    since: datetime | None = None,
+    transport: httpx.AsyncBaseTransport | None = None,
+) -> dict:
+    """Export, download and store everything for the patients connected to ``fhir_base_url``."""
+    connected = patient_targets(session, fhir_base_url)
+    if not connected:
+        raise FHIRError("No active FHIR connections to this server to import into")
+    # Long enough to wait out the export and then store it.
+    lease_seconds = FHIR_BULK_TIMEOUT_SECONDS + FHIR_SYNC_LEASE_SECONDS
+    targets = {
+        fhir_id: target
+        for fhir_id, target in connected.items()
+        if lease_connection(session, target.connection_id, lease_seconds)
+    }
+    busy = sorted(target.connection_id for fhir_id, target in connected.items() if fhir_id not in targets)
+    if busy:
+        logger.info("Bulk import skips FHIR connections with a sync in progress: %s", busy)
+    try:
+        if not targets:
+            raise FHIRError("Every FHIR connection to this server is already being synced")
+        summary = await _import_export(session, fhir_base_url, access_token, targets, group_id, since, transport)
+    finally:
+        for target in targets.values():
+            release_connection(session, target.connection_id)
+    return summary | {"busy": busy}
+
+
+async def _import_export(
+    session: Session,
+    fhir_base_url: str,
+    access_token: str,
+    targets: dict[str, SyncTarget],
+    group_id: str | None,
+    since: datetime | None,
+    transport: httpx.AsyncBaseTransport | None,
+) -> dict:
+    async with FHIRClient(fhir_base_url, access_token, transport=transport) as client:
+        status_url = await kick_off_export(client, group_id, since=since)
+        manifest = await wait_for_manifest(client, status_url)
+        authenticated = bool(manifest.get("requiresAccessToken", True))
+        counts: Counter = Counter()
+        failed: list[str] = []
+        for output in manifest.get("output") or []:
+            resource_type, url = output.get("type"), output.get("url")
+            if resource_type not in RESOURCE_MAPPERS or not url:
+                continue
+            try:
+                counts += await ingest_ndjson(client, url, resource_type, targets, session, authenticated)
+            except FHIRError as exc:
+                logger.warning("Bulk export file %s failed: %s", url, exc)
+                session.rollback()
+                failed.append(url)
+        try:
+            # Lets the server clean up the export files.
+            await client.request("DELETE", status_url)
+        except FHIRError as exc:
+            logger.info("Could not delete bulk export %s: %s", status_url, exc)
+
+    for patient_id in {target.patient_id for target in targets.values()}:
+        invalidate_dashboard(session, patient_id)
+    session.commit()
+    return {
+        "patients": counts["Patient"],
+        "observations": counts["observations"],
+        "medications": counts["MedicationRequest"],
+        "records": counts["records"],
+        "unchanged": counts["unchanged"],
+        "skipped": counts["skipped"],
+        "malformed": counts["malformed"],
+        "errors": len(manifest.get("error") or []),
+        "failed": failed,
+    }
@@ -0,0 +1,217 @@
+"""
+Async FHIR REST client with pooled keep-alive connections.
+
+One ``FHIRClient`` wraps an ``httpx.AsyncClient``, so every request to a
+server reuses a pooled connection instead of paying a new TCP/TLS handshake.
+At most ``FHIR_MAX_CONNECTIONS`` requests are in flight per client, however
+many resource types are being fetched at once.
+
+Searches follow the Bundle's ``next`` link page by page. Next links are only
+followed on the server's own origin, so the bearer token is never sent
+elsewhere. A next link on another origin (including ``http`` for an ``https``
+server), a link that repeats, or paging past ``FHIR_MAX_PAGES`` ends the
+search with ``FHIRError``: the results are incomplete, so the caller must not
+treat them as a finished sync.
+
+The SMART endpoints of the supported EHRs and the refresh-token grant live
+here too, so the request handlers and the background sync share them.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+from typing import Any, AsyncIterator
+from urllib.parse import urlsplit
+
+import httpx
+
+FHIR_MAX_CONNECTIONS = int(os.environ.get("FHIR_MAX_CONNECTIONS", "8"))
+FHIR_PAGE_SIZE = int(os.environ.get("FHIR_PAGE_SIZE", "100"))
+FHIR_TIMEOUT_SECONDS = float(os.environ.get("FHIR_TIMEOUT_SECONDS", "30"))
+# Guards against servers whose paging never ends.
+FHIR_MAX_PAGES = int(os.environ.get("FHIR_MAX_PAGES", "1000"))
+
+SMART_CLIENT_ID = os.environ.get("SMART_CLIENT_ID", "medbridge-local-dev")
+
+EHR_CONFIGS = {
+    "epic": {
+        "authorize_url": "https://fhir.epic.com/interconnect-fhir-oauth/oauth2/authorize",
+        "token_url": "https://fhir.epic.com/interconnect-fhir-oauth/oauth2/token",
+        "fhir_base": "https://fhir.epic.com/interconnect-fhir-oauth/api/FHIR/R4",
+        "scopes": "openid fhirUser patient/*.read launch/patient",
+    },
+    "cerner": {
+        "authorize_url": "https://authorization.cerner.com/tenants/ec2458f2-1e24-41c8-b71b-0e701af7583d/protocols/oauth2/profiles/smart-v1/personas/patient/authorize",
+        "token_url": "https://authorization.cerner.com/tenants/ec2458f2-1e24-41c8-b71b-0e701af7583d/protocols/oauth2/profiles/smart-v1/token",
+        "fhir_base": "https://fhir-open.cerner.com/r4/ec2458f2-1e24-41c8-b71b-0e701af7583d",
+        "scopes": "openid fhirUser patient/*.read launch/patient",
+    },
+}
+
+_transport: httpx.AsyncBaseTransport | None = None
+
+
+class FHIRError(Exception):
+    def __init__(self, message: str, status_code: int | None = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def set_fhir_transport(transport: httpx.AsyncBaseTransport | None) -> None:
+    """Route every new client through ``transport``, e.g. a mock FHIR server in tests."""
+    global _transport
+    _transport = transport
+
+
+def ehr_config(ehr: str, fhir_url: str | None = None) -> dict | None:
+    """Endpoints for a known EHR, or derived from the base URL of a generic FHIR server."""
+    if ehr in EHR_CONFIGS:
+        return EHR_CONFIGS[ehr]
+    if ehr == "generic" and fhir_url:
+        # The caller is expected to provide a conformant server.
+        base = fhir_url.rstrip("/")
+        return {
+            "authorize_url": f"{base}/auth/authorize",
+            "token_url": f"{base}/auth/token",
+            "fhir_base": base,
+            "scopes": "openid fhirUser patient/*.read launch/patient",
+        }
+    return None
+
+
+async def refresh_access_token(
+    token_url: str,
+    refresh_token: str,
+    transport: httpx.AsyncBaseTransport | None = None,
+) -> dict:
+    """Trade a refresh token for a new token response (``access_token``, ``expires_in``, ...)."""
+    async with httpx.AsyncClient(timeout=FHIR_TIMEOUT_SECONDS, transport=transport or _transport) as client:
+        try:
+            response = await client.post(
+                token_url,
+                data={"grant_type": "refresh_token", "refresh_token": refresh_token, "client_id": SMART_CLIENT_ID},
+                headers={"Accept": "application/json"},
+            )
+        except httpx.HTTPError as exc:
+            raise FHIRError(f"Could not reach token endpoint: {exc}") from exc
+    if response.status_code >= 400:
+        raise FHIRError(f"Token refresh failed ({response.status_code}): {response.text[:200]}", response.status_code)
+    try:
+        payload = response.json()
+    except ValueError as exc:
+        raise FHIRError("Token endpoint returned a non-JSON response") from exc
+    if not payload.get("access_token"):
+        raise FHIRError("No access_token in token response")
+    return payload
+
+
+def next_link(bundle: dict) -> str | None:
+    for link in bundle.get("link") or []:
+        if link.get("relation") == "next" and link.get("url"):
+            return link["url"]
+    return None
+
+
+def same_origin(url: str, other: str) -> bool:
+    first, second = urlsplit(url), urlsplit(other)
+    return (first.scheme, first.netloc) == (second.scheme, second.netloc)
+
+
+class FHIRClient:
+    def __init__(
+        self,
+        base_url: str,
+        access_token: str,
+        *,
+        max_connections: int = FHIR_MAX_CONNECTIONS,
+        transport: httpx.AsyncBaseTransport | None = None,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self._slots = asyncio.Semaphore(max(max_connections, 1))
+        self._client = httpx.AsyncClient(
+            base_url=f"{self.base_url}/",
+            headers={"Authorization": f"Bearer {access_token}", "Accept": "application/fhir+json"},
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=FHIR_TIMEOUT_SECONDS,
+            transport=transport or _transport,
+        )
+
+    async def __aenter__(self) -> FHIRClient:
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+    async def request(self, method: str, url: str, **kwargs: Any) -> httpx.Response:
+        async with self._slots:
+            try:
+                response = await self._client.request(method, url, **kwargs)
+            except httpx.HTTPError as exc:
+                raise FHIRError(f"Could not reach FHIR server: {exc}") from exc
+        if response.status_code >= 400:
+            raise FHIRError(f"FHIR server returned {response.status_code}: {response.reason_phrase}", response.status_code)
+        return response
+
+    async def stream_lines(self, url: str, *, authenticated: bool = True) -> AsyncIterator[str]:
+        """Yield the lines of a (possibly huge) response body without buffering it whole.
+
+        The bearer token is only sent with ``authenticated`` to the server's own origin.
+        """
+        request = self._client.build_request("GET", url, headers={"Accept": "application/fhir+ndjson"})
+        if not authenticated or not same_origin(str(request.url), self.base_url):
+            del request.headers["Authorization"]
+        async with self._slots:
+            try:
+                response = await self._client.send(request, stream=True)
+            except httpx.HTTPError as exc:
+                raise FHIRError(f"Could not download {url}: {exc}") from exc
+            try:
+                if response.status_code >= 400:
+                    raise FHIRError(
+                        f"FHIR server returned {response.status_code}: {response.reason_phrase}", response.status_code
+                    )
+                async for line in response.aiter_lines():
+                    yield line
+            except httpx.HTTPError as exc:
+                raise FHIRError(f"Download of {url} was interrupted: {exc}") from exc
+            finally:
+                await response.aclose()
+
+    async def get_json(self, url: str, params: dict[str, Any] | None = None) -> dict:
+        response = await self.request("GET", url, params=params)
+        try:
+            return response.json()
+        except ValueError as exc:
+            raise FHIRError("FHIR server returned a non-JSON response") from exc
+
+    async def read(self, resource_type: str, resource_id: str) -> dict:
+        return await self.get_json(f"{resource_type}/{resource_id}")
+
+    async def search_pages(self, resource_type: str, params: dict[str, Any]) -> AsyncIterator[list[dict]]:
+        """Yield the ``resource_type`` resources of each search page, following ``next`` links.
+
+        Raises ``FHIRError`` if paging has to stop before the last page.
+        """
+        url: str | None = resource_type
+        query: dict[str, Any] | None = {**params, "_count": FHIR_PAGE_SIZE}
+        seen: set[str] = set()
+        for _page in range(FHIR_MAX_PAGES):
+            bundle = await self.get_json(url, query)
+            yield [
+                entry["resource"]
+                for entry in bundle.get("entry") or []
+                if (entry.get("resource") or {}).get("resourceType") == resource_type
+            ]
+            url, query = next_link(bundle), None
+            if not url:
+                return
+            if not same_origin(url, self.base_url):
+                link = urlsplit(url)
+                raise FHIRError(f"{resource_type} search has a next link on another origin ({link.scheme}://{link.netloc})")
+            if url in seen:
+                raise FHIRError(f"{resource_type} search repeats a next link")
+            seen.add(url)
+        raise FHIRError(f"{resource_type} search has more than FHIR_MAX_PAGES ({FHIR_MAX_PAGES}) pages")
@@ -0,0 +1,309 @@
+"""
+Background sync of every active FHIR connection.
+
+A small pool of worker threads claims connections that are due: active, past
+their ``next_sync_at`` and not synced within the last
+``FHIR_SYNC_INTERVAL_SECONDS``. The claim is a conditional UPDATE that sets
+``sync_leased_until``, as with the ingestion queue, so several uvicorn
+workers can share the schedule and a connection whose worker died is picked
+up again once the lease runs out. Manual syncs take the same lease
+(``lease_connection``), so a connection is never synced twice at once.
+
+Access tokens that expire within ``FHIR_TOKEN_REFRESH_MARGIN_SECONDS`` are
+refreshed with the stored refresh token before the sync; a connection whose
+token can't be refreshed is marked ``expired`` and left for the patient to
+reconnect. Syncs to each EHR are paced by a token bucket
+(``FHIR_SYNC_RATE_LIMITS``), and every connection is rescheduled with up to
+``FHIR_SYNC_JITTER_SECONDS`` of random jitter so connections made together
+drift apart instead of hitting the EHR at the same moment each interval.
+Failed syncs back off exponentially, capped at the interval.
+
+Each sync records its duration, the last error and the number of consecutive
+failures on the connection.
+"""
+from __future__ import annotations
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+import logging
+import os
+import random
+import threading
+import time
+from typing import Callable
+
+import httpx
+from sqlalchemy import and_, or_, update
+from sqlmodel import Session, select
+
+from app.db import engine
+from app.encryption import decrypt_field, encrypt_field
+from app.fhir_client import FHIRError, ehr_config, refresh_access_token
+from app.fhir_sync import as_utc, sync_fhir_connection_async
+from app.models import FHIRConnection
+
+logger = logging.getLogger(__name__)
+
+FHIR_SYNC_WORKERS = int(os.environ.get("FHIR_SYNC_WORKERS", "0" if os.environ.get("VERCEL") else "2"))
+# 0 turns scheduled syncs off; connections are then only synced on request.
+FHIR_SYNC_INTERVAL_SECONDS = float(os.environ.get("FHIR_SYNC_INTERVAL_SECONDS", "3600"))
+FHIR_SYNC_JITTER_SECONDS = float(os.environ.get("FHIR_SYNC_JITTER_SECONDS", "300"))
+FHIR_SYNC_POLL_SECONDS = float(os.environ.get("FHIR_SYNC_POLL_SECONDS", "30"))
+FHIR_SYNC_RETRY_BASE_SECONDS = float(os.environ.get("FHIR_SYNC_RETRY_BASE_SECONDS", "60"))
+# A claimed connection is not handed to another worker for this long.
+FHIR_SYNC_LEASE_SECONDS = float(os.environ.get("FHIR_SYNC_LEASE_SECONDS", "900"))
+FHIR_TOKEN_REFRESH_MARGIN_SECONDS = float(os.environ.get("FHIR_TOKEN_REFRESH_MARGIN_SECONDS", "300"))
+# Syncs per minute to each EHR, e.g. "epic=30,cerner=20"; others get the default.
+FHIR_SYNC_RATE_LIMITS = os.environ.get("FHIR_SYNC_RATE_LIMITS", "")
+FHIR_SYNC_DEFAULT_RATE_PER_MINUTE = float(os.environ.get("FHIR_SYNC_DEFAULT_RATE_PER_MINUTE", "60"))
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def parse_rate_limits(spec: str) -> dict[str, float]:
+    rates: dict[str, float] = {}
+    for item in spec.split(","):
+        ehr, _, rate = item.partition("=")
+        if ehr.strip() and rate.strip():
+            rates[ehr.strip().lower()] = float(rate)
+    return rates
+
+
+class EHRRateLimiter:
+    """One token bucket per EHR, shared by the sync workers of a process.
+
+    ``reserve`` takes the next slot and returns how long to wait before using
+    it, so each EHR sees at most ``rate`` syncs per minute, evenly spaced.
+    A rate of 0 or less means unlimited.
+    """
+
+    def __init__(self, rates: dict[str, float], default_rate: float, clock: Callable[[], float] = time.monotonic):
+        self.rates = rates
+        self.default_rate = default_rate
+        self._clock = clock
+        self._buckets: dict[str, tuple[float, float]] = {}  # ehr -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    def reserve(self, ehr: str) -> float:
+        per_second = self.rates.get(ehr, self.default_rate) / 60
+        if per_second <= 0:
+            return 0.0
+        with self._lock:
+            now = self._clock()
+            tokens, updated_at = self._buckets.get(ehr, (1.0, now))
+            tokens = min(1.0, tokens + (now - updated_at) * per_second) - 1
+            self._buckets[ehr] = (tokens, now)
+        return max(0.0, -tokens / per_second)
+
+
+def _unleased(now: datetime):
+    return or_(FHIRConnection.sync_leased_until.is_(None), FHIRConnection.sync_leased_until <= now)
+
+
+def _due(now: datetime):
+    synced_before = now - timedelta(seconds=FHIR_SYNC_INTERVAL_SECONDS)
+    return and_(
+        FHIRConnection.status == "active",
+        or_(FHIRConnection.next_sync_at.is_(None), FHIRConnection.next_sync_at <= now),
+        or_(FHIRConnection.last_synced_at.is_(None), FHIRConnection.last_synced_at <= synced_before),
+        _unleased(now),
+    )
+
+
+def _lease(
+    session: Session, connection_id: int, condition, now: datetime, seconds: float = FHIR_SYNC_LEASE_SECONDS
+) -> bool:
+    result = session.execute(
+        update(FHIRConnection)
+        .where(FHIRConnection.id == connection_id, condition)
+        .values(sync_leased_until=now + timedelta(seconds=seconds))
+        .execution_options(synchronize_session=False)
+    )
+    session.commit()
+    return result.rowcount == 1
+
+
+def lease_connection(session: Session, connection_id: int, seconds: float = FHIR_SYNC_LEASE_SECONDS) -> bool:
+    """Reserve a connection for a manual sync or bulk import; False if another sync holds it."""
+    now = _now()
+    return _lease(session, connection_id, _unleased(now), now, seconds)
+
+
+def release_connection(session: Session, connection_id: int) -> None:
+    session.execute(
+        update(FHIRConnection)
+        .where(FHIRConnection.id == connection_id)
+        .values(sync_leased_until=None)
+        .execution_options(synchronize_session=False)
+    )
+    session.commit()
+
+
+def claim_due_connection(session: Session) -> FHIRConnection | None:
+    now = _now()
+    candidate_ids = session.exec(
+        select(FHIRConnection.id)
+        .where(_due(now))
+        .order_by(FHIRConnection.next_sync_at, FHIRConnection.id)
+        .limit(5)
+    ).all()
+    for connection_id in candidate_ids:
+        if _lease(session, connection_id, _due(now), now):
+            return session.get(FHIRConnection, connection_id)
+    return None
+
+
+async def ensure_fresh_token(
+    session: Session,
+    connection: FHIRConnection,
+    transport: httpx.AsyncBaseTransport | None = None,
+) -> str | None:
+    """Refresh the access token if it expires soon. Returns an error, or None when the token is usable."""
+    expires_at = as_utc(connection.token_expires_at)
+    if expires_at is None or expires_at - _now() > timedelta(seconds=FHIR_TOKEN_REFRESH_MARGIN_SECONDS):
+        return None
+    config = ehr_config(connection.ehr_name, connection.fhir_base_url)
+    if not connection.refresh_token or config is None:
+        connection.status = "expired"
+        session.add(connection)
+        session.commit()
+        return "Access token expired and cannot be refreshed"
+    try:
+        token = await refresh_access_token(config["token_url"], decrypt_field(connection.refresh_token), transport)
+    except FHIRError as exc:
+        if exc.status_code in (400, 401):
+            # invalid_grant: the refresh token was revoked or has itself expired.
+            connection.status = "expired"
+            session.add(connection)
+            session.commit()
+        return str(exc)
+    connection.access_token = encrypt_field(token["access_token"])
+    if token.get("refresh_token"):
+        connection.refresh_token = encrypt_field(token["refresh_token"])
+    connection.token_expires_at = _now() + timedelta(seconds=int(token.get("expires_in", 3600)))
+    session.add(connection)
+    session.commit()
+    return None
+
+
+async def _sync(session: Session, connection: FHIRConnection, transport: httpx.AsyncBaseTransport | None) -> str | None:
+    if error := await ensure_fresh_token(session, connection, transport):
+        return error
+    synced = await sync_fhir_connection_async(connection, connection.patient_id, session, transport)
+    if synced["failed"]:
+        return f"Could not fetch {', '.join(synced['failed'])}"
+    return None
+
+
+def _record_outcome(session: Session, connection_id: int, duration_ms: int, error: str | None) -> None:
+    connection = session.get(FHIRConnection, connection_id)
+    if connection is None:
+        return
+    connection.last_sync_duration_ms = duration_ms
+    connection.last_sync_error = error[:500] if error else None
+    if error:
+        connection.sync_failures += 1
+        delay = min(FHIR_SYNC_INTERVAL_SECONDS, FHIR_SYNC_RETRY_BASE_SECONDS * 2 ** (connection.sync_failures - 1))
+    else:
+        connection.sync_failures = 0
+        delay = FHIR_SYNC_INTERVAL_SECONDS
+    connection.next_sync_at = _now() + timedelta(seconds=delay + random.uniform(0, FHIR_SYNC_JITTER_SECONDS))
+    connection.sync_leased_until = None
+    session.add(connection)
+    session.commit()
+
+
+def run_scheduled_sync(
+    session: Session,
+    connection: FHIRConnection,
+    transport: httpx.AsyncBaseTransport | None = None,
+) -> bool:
+    """Sync one claimed connection and reschedule it. Returns True when the sync succeeded."""
+    connection_id = connection.id
+    started = time.perf_counter()
+    try:
+        error = asyncio.run(_sync(session, connection, transport))
+    except Exception as exc:
+        logger.exception("Scheduled sync of FHIR connection %s failed", connection_id)
+        session.rollback()
+        error = f"{type(exc).__name__}: {exc}"
+    _record_outcome(session, connection_id, round((time.perf_counter() - started) * 1000), error)
+    if error:
+        logger.warning("FHIR connection %s sync failed: %s", connection_id, error)
+    return error is None
+
+
+def run_due_syncs(
+    session: Session,
+    limit: int | None = None,
+    transport: httpx.AsyncBaseTransport | None = None,
+) -> int:
+    """Sync due connections inline, without rate limiting; returns how many were attempted."""
+    attempted = 0
+    while limit is None or attempted < limit:
+        connection = claim_due_connection(session)
+        if connection is None:
+            break
+        run_scheduled_sync(session, connection, transport)
+        attempted += 1
+    return attempted
+
+
+class FHIRSyncScheduler:
+    def __init__(
+        self,
+        workers: int,
+        poll_interval: float,
+        limiter: EHRRateLimiter,
+        session_factory: Callable[[], Session] | None = None,
+    ):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.limiter = limiter
+        self.session_factory = session_factory or (lambda: Session(engine))
+        self._threads: list[threading.Thread] = []
+        self._stop = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return any(thread.is_alive() for thread in self._threads)
+
+    def start(self) -> None:
+        if self.running or self.workers <= 0 or FHIR_SYNC_INTERVAL_SECONDS <= 0:
+            return
+        self._stop.clear()
+        self._threads = [
+            threading.Thread(target=self._run, name=f"fhir-sync-{index}", daemon=True)
+            for index in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                with self.session_factory() as session:
+                    connection = claim_due_connection(session)
+                    # An unused claim simply lapses with its lease, so stopping mid-wait is safe.
+                    if connection is not None and not self._stop.wait(self.limiter.reserve(connection.ehr_name)):
+                        run_scheduled_sync(session, connection)
+            except Exception:
+                logger.exception("FHIR sync worker crashed while polling")
+                connection = None
+            if connection is None:
+                self._stop.wait(self.poll_interval)
+
+
+fhir_sync_scheduler = FHIRSyncScheduler(
+    FHIR_SYNC_WORKERS,
+    FHIR_SYNC_POLL_SECONDS,
+    EHRRateLimiter(parse_rate_limits(FHIR_SYNC_RATE_LIMITS), FHIR_SYNC_DEFAULT_RATE_PER_MINUTE),
+)
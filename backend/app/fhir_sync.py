@@ -0,0 +1,362 @@
+"""
+Pull a patient's data from a connected FHIR server into local records.
+
+Patient, Observation and MedicationRequest are fetched concurrently over one
+pooled ``FHIRClient``, and each search follows its ``next`` links to the end.
+Pages pass through a bounded queue to a single writer that inserts rows in
+batches of ``FHIR_SYNC_BATCH_SIZE``; when the database falls behind, the
+fetchers wait on the queue instead of piling pages up in memory.
+
+Syncs are incremental. Every stored resource is recorded in
+``FHIRSyncedResource`` with its remote id and version, and searches after the
+first ask only for resources with ``_lastUpdated`` after the previous
+complete sync. A resource seen again updates its rows in place, or is skipped
+when its version has not changed, so repeated syncs write only the deltas.
+
+A resource type that fails to fetch does not stop the others; the sync
+stores whatever it fetched but keeps the old watermark, so the next sync
+asks for the same window again.
+"""
+from __future__ import annotations
+
+import asyncio
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+import logging
+import os
+from typing import Callable
+
+import httpx
+from sqlmodel import Session, SQLModel, select
+
+from app.dashboard_cache import invalidate_dashboard
+from app.encryption import decrypt_field
+from app.fhir_client import FHIRClient, FHIRError
+from app.models import FHIRConnection, FHIRSyncedResource, LabObservation, MedicalRecord
+
+logger = logging.getLogger(__name__)
+
+FHIR_SYNC_BATCH_SIZE = int(os.environ.get("FHIR_SYNC_BATCH_SIZE", "500"))
+FHIR_SYNC_QUEUE_PAGES = int(os.environ.get("FHIR_SYNC_QUEUE_PAGES", "8"))
+# Incremental searches reach back this far before the last sync, in case the
+# server's clock runs behind ours. Re-fetched resources are upserted, not duplicated.
+FHIR_SYNC_OVERLAP_SECONDS = int(os.environ.get("FHIR_SYNC_OVERLAP_SECONDS", "300"))
+
+SEARCH_RESOURCE_TYPES = ("Observation", "MedicationRequest")
+
+
+@dataclass(frozen=True)
+class SyncTarget:
+    patient_id: str  # local MedBridge patient id
+    ehr_name: str
+    connection_id: int | None = None
+
+    @property
+    def source(self) -> str:
+        return f"FHIR:{self.ehr_name}"
+
+    @property
+    def provider(self) -> str:
+        return self.ehr_name.capitalize()
+
+
+def _today() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+
+def _codeable_text(concept: dict | None, default: str = "Unknown") -> tuple[str, str | None]:
+    """Return ``(display text, first code)`` for a CodeableConcept."""
+    concept = concept or {}
+    codings = concept.get("coding") or [{}]
+    coding = codings[0] or {}
+    return coding.get("display") or concept.get("text") or default, coding.get("code")
+
+
+def patient_rows(resource: dict, target: SyncTarget) -> list[SQLModel]:
+    name_parts = (resource.get("name") or [{}])[0]
+    display_name = " ".join(name_parts.get("given", [])) + " " + name_parts.get("family", "")
+    return [
+        MedicalRecord(
+            patient_id=target.patient_id,
+            record_type="visit",
+            title=f"FHIR Patient record ({target.ehr_name})",
+            description=f"Patient: {display_name.strip()}. Birth date: {resource.get('birthDate', 'N/A')}.",
+            date=_today(),
+            source=target.provider,
+            provider=target.provider,
+        )
+    ]
+
+
+def observation_rows(resource: dict, target: SyncTarget) -> list[SQLModel]:
+    test_name, loinc = _codeable_text(resource.get("code"))
+    value_qty = resource.get("valueQuantity") or {}
+    value = value_qty.get("value")
+    unit = value_qty.get("unit", "")
+
+    ref_range = None
+    if ref_range_list := resource.get("referenceRange"):
+        low = (ref_range_list[0].get("low") or {}).get("value", "")
+        high = (ref_range_list[0].get("high") or {}).get("value", "")
+        if low or high:
+            ref_range = f"{low}-{high}"
+
+    effective = resource.get("effectiveDateTime") or datetime.now(timezone.utc).isoformat()
+    rows: list[SQLModel] = []
+    if value is not None:
+        rows.append(
+            LabObservation(
+                patient_id=target.patient_id,
+                test_name=test_name,
+                loinc=loinc,
+                value=float(value),
+                unit=unit,
+                ref_range=ref_range,
+                status="normal",
+                source=target.source,
+                timestamp=datetime.fromisoformat(effective.replace("Z", "+00:00")),
+            )
+        )
+    rows.append(
+        MedicalRecord(
+            patient_id=target.patient_id,
+            record_type="lab",
+            title=test_name,
+            description=f"{test_name}: {value} {unit}".strip(),
+            date=effective[:10],
+            source=target.source,
+            provider=target.provider,
+        )
+    )
+    return rows
+
+
+def medication_request_rows(resource: dict, target: SyncTarget) -> list[SQLModel]:
+    name, _code = _codeable_text(resource.get("medicationCodeableConcept"), default="Medication")
+    dosage = " ".join(filter(None, (item.get("text") for item in resource.get("dosageInstruction") or [])))
+    return [
+        MedicalRecord(
+            patient_id=target.patient_id,
+            record_type="medication",
+            title=name,
+            description=dosage or f"{name} ({resource.get('status', 'unknown')})",
+            date=(resource.get("authoredOn") or _today())[:10],
+            source=target.source,
+            provider=target.provider,
+        )
+    ]
+
+
+RESOURCE_MAPPERS: dict[str, Callable[[dict, SyncTarget], list[SQLModel]]] = {
+    "Patient": patient_rows,
+    "Observation": observation_rows,
+    "MedicationRequest": medication_request_rows,
+}
+
+
+def _replace_row(
+    session: Session, existing: SQLModel | None, row: SQLModel | None, orphans: list[SQLModel]
+) -> SQLModel | None:
+    """Copy ``row`` onto the stored ``existing`` row (or insert it), returning the row to link.
+
+    A stored row the resource no longer maps to goes into ``orphans``; it can only be
+    deleted once its link stops referencing it.
+    """
+    if row is None:
+        if existing is not None:
+            orphans.append(existing)
+        return None
+    if existing is None:
+        session.add(row)
+        return row
+    for field, value in row.model_dump(exclude={"id", "created_at"}).items():
+        setattr(existing, field, value)
+    session.add(existing)
+    return existing
+
+
+def store_resources(session: Session, target: SyncTarget, items: list[tuple[str, dict]]) -> Counter:
+    """Upsert a batch of resources by (connection, resource type, resource id). Does not commit."""
+    counts: Counter = Counter()
+    resource_ids = {resource["id"] for _type, resource in items if resource.get("id")}
+    links: dict[tuple[str, str], FHIRSyncedResource] = {}
+    if resource_ids:
+        for link in session.exec(
+            select(FHIRSyncedResource).where(
+                FHIRSyncedResource.connection_id == target.connection_id,
+                FHIRSyncedResource.resource_id.in_(resource_ids),
+            )
+        ).all():
+            links[(link.resource_type, link.resource_id)] = link
+    # Load the linked rows in two queries; session.get() below then hits the identity map.
+    for model, column in ((LabObservation, "lab_observation_id"), (MedicalRecord, "medical_record_id")):
+        row_ids = {getattr(link, column) for link in links.values()} - {None}
+        if row_ids:
+            session.exec(select(model).where(model.id.in_(row_ids))).all()
+
+    linked_rows = []
+    orphans: list[SQLModel] = []
+    seen: set[tuple[str, str]] = set()
+    for resource_type, resource in items:
+        key = (resource_type, resource.get("id"))
+        if key[1] and key in seen:
+            continue
+        seen.add(key)
+        meta = resource.get("meta") or {}
+        link = links.get(key)
+        if link is not None and link.version_id and link.version_id == meta.get("versionId"):
+            counts["unchanged"] += 1
+            continue
+
+        rows = RESOURCE_MAPPERS[resource_type](resource, target)
+        lab = next((row for row in rows if isinstance(row, LabObservation)), None)
+        record = next((row for row in rows if isinstance(row, MedicalRecord)), None)
+        counts[resource_type] += 1
+        counts["observations"] += lab is not None
+        counts["records"] += record is not None
+        if not key[1]:
+            session.add_all(rows)
+            continue
+        if link is None:
+            link = FHIRSyncedResource(connection_id=target.connection_id, resource_type=resource_type, resource_id=key[1])
+        existing_lab = session.get(LabObservation, link.lab_observation_id) if link.lab_observation_id else None
+        existing_record = session.get(MedicalRecord, link.medical_record_id) if link.medical_record_id else None
+        link.version_id = meta.get("versionId")
+        link.last_updated = meta.get("lastUpdated")
+        link.synced_at = datetime.now(timezone.utc)
+        linked_rows.append(
+            (
+                link,
+                _replace_row(session, existing_lab, lab, orphans),
+                _replace_row(session, existing_record, record, orphans),
+            )
+        )
+
+    session.flush()
+    for link, lab, record in linked_rows:
+        link.lab_observation_id = lab.id if lab is not None else None
+        link.medical_record_id = record.id if record is not None else None
+        session.add(link)
+    session.flush()
+    if orphans:
+        for row in orphans:
+            session.delete(row)
+        session.flush()
+    return counts
+
+
+async def _fetch_patient(client: FHIRClient, fhir_patient_id: str, queue: asyncio.Queue) -> None:
+    patient = await client.read("Patient", fhir_patient_id)
+    if patient.get("resourceType") == "Patient":
+        await queue.put(("Patient", [patient]))
+
+
+async def _fetch_search(
+    client: FHIRClient,
+    resource_type: str,
+    fhir_patient_id: str,
+    since: datetime | None,
+    queue: asyncio.Queue,
+) -> None:
+    params = {"patient": fhir_patient_id}
+    if since is not None:
+        params["_lastUpdated"] = f"gt{since.strftime('%Y-%m-%dT%H:%M:%SZ')}"
+    async for resources in client.search_pages(resource_type, params):
+        await queue.put((resource_type, resources))
+
+
+async def _guarded(resource_type: str, fetch) -> str | None:
+    """Run one fetcher; returns the resource type if it failed."""
+    try:
+        await fetch
+    except FHIRError as exc:
+        logger.warning("FHIR %s fetch failed: %s", resource_type, exc)
+        return resource_type
+    return None
+
+
+async def fetch_and_store(
+    client: FHIRClient,
+    fhir_patient_id: str,
+    target: SyncTarget,
+    session: Session,
+    since: datetime | None = None,
+) -> dict:
+    """Fetch every resource type concurrently and upsert the mapped rows. Does not commit.
+
+    With ``since``, searches only ask for resources updated after it.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max(FHIR_SYNC_QUEUE_PAGES, 1))
+    fetchers = [_guarded("Patient", _fetch_patient(client, fhir_patient_id, queue))]
+    fetchers += [
+        _guarded(resource_type, _fetch_search(client, resource_type, fhir_patient_id, since, queue))
+        for resource_type in SEARCH_RESOURCE_TYPES
+    ]
+
+    async def produce() -> list[str | None]:
+        try:
+            return await asyncio.gather(*fetchers)
+        finally:
+            await queue.put(None)
+
+    counts: Counter = Counter()
+    patient_fetched = False
+    producer = asyncio.create_task(produce())
+    batch: list[tuple[str, dict]] = []
+    try:
+        while (item := await queue.get()) is not None:
+            resource_type, resources = item
+            patient_fetched |= resource_type == "Patient"
+            batch.extend((resource_type, resource) for resource in resources)
+            if len(batch) >= FHIR_SYNC_BATCH_SIZE:
+                # Off the event loop, so fetching continues while the batch is written.
+                counts += await asyncio.to_thread(store_resources, session, target, batch)
+                batch = []
+        if batch:
+            counts += await asyncio.to_thread(store_resources, session, target, batch)
+        failed = [resource_type for resource_type in await producer if resource_type]
+    finally:
+        producer.cancel()
+    return {
+        "patient": patient_fetched,
+        "observations": counts["observations"],
+        "medications": counts["MedicationRequest"],
+        "records": counts["records"],
+        "unchanged": counts["unchanged"],
+        "failed": failed,
+    }
+
+
+def as_utc(value: datetime | None) -> datetime | None:
+    if value is None or value.tzinfo is not None:
+        return value
+    return value.replace(tzinfo=timezone.utc)  # SQLite drops the offset
+
+
+async def sync_fhir_connection_async(
+    connection: FHIRConnection,
+    patient_id: str,
+    session: Session,
+    transport: httpx.AsyncBaseTransport | None = None,
+) -> dict:
+    """Sync changes since the last complete sync and advance the watermark if nothing failed."""
+    started_at = datetime.now(timezone.utc)
+    since = as_utc(connection.last_synced_at)
+    if since is not None:
+        since -= timedelta(seconds=FHIR_SYNC_OVERLAP_SECONDS)
+    target = SyncTarget(patient_id=patient_id, ehr_name=connection.ehr_name, connection_id=connection.id)
+    async with FHIRClient(connection.fhir_base_url, decrypt_field(connection.access_token), transport=transport) as client:
+        synced = await fetch_and_store(client, connection.patient_fhir_id or "self", target, session, since)
+
+    if not synced["failed"]:
+        connection.last_synced_at = started_at
+        session.add(connection)
+    invalidate_dashboard(session, patient_id)
+    session.commit()
+    return synced
+
+
+def sync_fhir_connection(connection: FHIRConnection, patient_id: str, session: Session) -> dict:
+    """Blocking entry point for sync request handlers, which run outside the event loop."""
+    return asyncio.run(sync_fhir_connection_async(connection, patient_id, session))
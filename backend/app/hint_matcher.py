@@ -0,0 +1,95 @@
+"""
+Multi-pattern matcher for vendor and alias hints in free text.
+
+Patterns are word sequences ("epic mychart", "my healthevet"), compiled once
+into an Aho-Corasick automaton whose alphabet is tokens rather than
+characters. One pass over a token list reports every pattern occurrence,
+however many patterns there are. Matching on tokens also means hints only
+match whole words, so "va health" does not fire inside "nova health".
+
+Text is tokenized with the same ``[a-z0-9]+`` rule as the profile classifier,
+so callers that already hold the classifier's tokens can reuse them.
+"""
+from __future__ import annotations
+
+from collections import deque
+from dataclasses import dataclass
+import re
+from typing import Generic, Iterable, Iterator, Sequence, TypeVar
+
+T = TypeVar("T")
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def hint_tokens(text: str) -> list[str]:
+    return TOKEN_RE.findall(text.lower())
+
+
+@dataclass(frozen=True)
+class HintMatch(Generic[T]):
+    start: int  # token index of the first matched word
+    end: int  # token index one past the last matched word
+    value: T
+
+
+class HintMatcher(Generic[T]):
+    """Aho-Corasick automaton over word sequences, each carrying a value."""
+
+    def __init__(self, patterns: Iterable[tuple[str, T]]):
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        # (pattern length in tokens, value) for every pattern ending in a state,
+        # including those inherited through failure links.
+        self._outputs: list[list[tuple[int, T]]] = [[]]
+        for pattern, value in patterns:
+            self._add(hint_tokens(pattern), value)
+        self._link()
+
+    def _add(self, tokens: list[str], value: T) -> None:
+        if not tokens:
+            return
+        state = 0
+        for token in tokens:
+            next_state = self._goto[state].get(token)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._outputs.append([])
+                self._goto[state][token] = next_state
+            state = next_state
+        self._outputs[state].append((len(tokens), value))
+
+    def _link(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for token, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and token not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(token, 0) if state else 0
+                self._outputs[next_state] = self._outputs[next_state] + self._outputs[self._fail[next_state]]
+
+    def iter_matches(self, tokens: Sequence[str]) -> Iterator[HintMatch[T]]:
+        """Yield every pattern occurrence in ``tokens``, ordered by where it ends."""
+        goto, fail, outputs = self._goto, self._fail, self._outputs
+        root = goto[0]
+        # Most documents contain no hint at all; a C-level set check rules that out
+        # without stepping through the automaton.
+        if root.keys().isdisjoint(tokens):
+            return
+        state = 0
+        for index, token in enumerate(tokens):
+            if not state and token not in root:
+                continue
+            while state and token not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(token, 0)
+            for length, value in outputs[state]:
+                yield HintMatch(index + 1 - length, index + 1, value)
+
+    def find_all(self, text: str) -> list[HintMatch[T]]:
+        return list(self.iter_matches(hint_tokens(text)))
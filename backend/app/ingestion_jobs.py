@@ -0,0 +1,329 @@
+"""
+Durable document ingestion queue.
+
+Uploads only store the document and enqueue an ``IngestionJob`` row; text
+extraction and review-draft generation (which may wait on the OpenAI API for
+up to 90 seconds) run in a small pool of background worker threads that claim
+jobs from the database. Jobs are claimed with a conditional UPDATE so several
+uvicorn workers can share one queue, are retried with exponential backoff, and
+a job whose worker died is reclaimed once its lease expires. A worker only
+records an outcome while it still holds the job's lease: if the job was
+reclaimed in the meantime, its results are rolled back and the new run
+decides the outcome.
+
+When no worker pool is running (serverless deploys, tests, or
+``INGESTION_WORKERS=0``) the upload handler processes the job inline,
+retrying immediately up to the job's attempt limit.
+"""
+from __future__ import annotations
+
+from datetime import datetime, timedelta, timezone
+import logging
+import os
+import socket
+import threading
+from typing import Callable
+
+from sqlalchemy import and_, or_, update
+from sqlmodel import Session, select
+
+from app.blob_store import cached_extraction, load_document_payload, remember_extraction
+from app.dashboard_cache import invalidate_dashboard
+from app.db import engine
+from app.document_ai import build_review_draft, create_review_item
+from app.document_extraction import extract_document
+from app.encryption import decrypt_field, encrypt_field
+from app.models import DocumentReviewItem, IngestionJob, MedicalDocument
+
+logger = logging.getLogger(__name__)
+
+INGESTION_WORKERS = int(os.environ.get("INGESTION_WORKERS", "0" if os.environ.get("VERCEL") else "2"))
+INGESTION_POLL_SECONDS = float(os.environ.get("INGESTION_POLL_SECONDS", "2"))
+INGESTION_MAX_ATTEMPTS = int(os.environ.get("INGESTION_MAX_ATTEMPTS", "3"))
+INGESTION_RETRY_BASE_SECONDS = float(os.environ.get("INGESTION_RETRY_BASE_SECONDS", "5"))
+# A running job older than this is assumed to belong to a dead worker.
+INGESTION_LEASE_SECONDS = float(os.environ.get("INGESTION_LEASE_SECONDS", "600"))
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def run_document_ingestion(
+    session: Session,
+    document: MedicalDocument,
+    payload: bytes,
+    supplied_text: str | None,
+) -> tuple[DocumentReviewItem | None, int]:
+    """Extract text and queue a review draft for ``document``. Does not commit."""
+    cached = None if supplied_text else cached_extraction(session, document)
+    if cached:
+        extracted_content, ocr_status = cached
+        text_length = len(extracted_content)
+    else:
+        extracted_content, ocr_status, _extraction_status, text_length = extract_document(document, payload, supplied_text)
+        remember_extraction(session, document, extracted_content, ocr_status)
+    document.ocr_status = ocr_status
+    review_item: DocumentReviewItem | None = None
+    if document.content_type == "application/pdf" or supplied_text or extracted_content:
+        draft_build = build_review_draft(document, payload, supplied_text or extracted_content)
+        review_item = create_review_item(document, draft_build)
+        session.add(review_item)
+        document.extraction_status = "ready_for_review"
+    else:
+        document.extraction_status = "needs_review"
+    session.add(document)
+    return review_item, text_length
+
+
+def _clone_review_item(source: DocumentReviewItem, document: MedicalDocument) -> DocumentReviewItem:
+    return DocumentReviewItem(
+        patient_id=document.patient_id,
+        document_id=document.id,
+        extraction_engine=source.extraction_engine,
+        source_mode=source.source_mode,
+        model_name=source.model_name,
+        confidence=source.confidence,
+        summary=source.summary,
+        caution_flags=source.caution_flags,
+        structured_payload=source.structured_payload,
+        refusal_reason=source.refusal_reason,
+    )
+
+
+def reuse_cached_ingestion(
+    session: Session,
+    document: MedicalDocument,
+    supplied_text: str | None,
+) -> tuple[DocumentReviewItem, int] | None:
+    """Finish a duplicate upload from an earlier document's results, without extraction or drafting.
+
+    Drafts depend on the document metadata as well as its bytes, so only a draft
+    for the same patient, record type and source system is reused. Does not commit.
+    """
+    cached = cached_extraction(session, document)
+    if cached is None or (supplied_text and supplied_text != cached[0]):
+        return None
+    previous = session.exec(
+        select(DocumentReviewItem)
+        .join(MedicalDocument, MedicalDocument.id == DocumentReviewItem.document_id)
+        .where(
+            MedicalDocument.blob_id == document.blob_id,
+            MedicalDocument.id != document.id,
+            MedicalDocument.patient_id == document.patient_id,
+            MedicalDocument.record_type == document.record_type,
+            MedicalDocument.source_system == document.source_system,
+        )
+        .order_by(DocumentReviewItem.created_at.desc(), DocumentReviewItem.id.desc())
+        .limit(1)
+    ).first()
+    if previous is None:
+        return None
+
+    review_item = _clone_review_item(previous, document)
+    session.add(review_item)
+    document.ocr_status = cached[1]
+    document.extraction_status = "ready_for_review"
+    session.add(document)
+    return review_item, len(cached[0])
+
+
+def enqueue_document_ingestion(session: Session, document: MedicalDocument, supplied_text: str | None) -> IngestionJob:
+    """Add a queued job for ``document`` to the caller's transaction."""
+    document.ocr_status = "queued"
+    document.extraction_status = "queued"
+    job = IngestionJob(
+        patient_id=document.patient_id,
+        document_id=document.id,
+        supplied_text=encrypt_field(supplied_text) if supplied_text else None,
+        max_attempts=INGESTION_MAX_ATTEMPTS,
+    )
+    session.add(document)
+    session.add(job)
+    return job
+
+
+def _claimable(now: datetime):
+    stale_before = now - timedelta(seconds=INGESTION_LEASE_SECONDS)
+    return or_(
+        and_(IngestionJob.status == "queued", IngestionJob.available_at <= now),
+        and_(IngestionJob.status == "running", IngestionJob.started_at < stale_before),
+    )
+
+
+def claim_next_job(session: Session, worker_id: str) -> IngestionJob | None:
+    now = _now()
+    candidate_ids = session.exec(
+        select(IngestionJob.id)
+        .where(_claimable(now))
+        .order_by(IngestionJob.available_at, IngestionJob.id)
+        .limit(5)
+    ).all()
+    for job_id in candidate_ids:
+        result = session.execute(
+            update(IngestionJob)
+            .where(IngestionJob.id == job_id, _claimable(now))
+            .values(status="running", locked_by=worker_id, started_at=now, attempts=IngestionJob.attempts + 1)
+            .execution_options(synchronize_session=False)
+        )
+        session.commit()
+        if result.rowcount == 1:
+            return session.get(IngestionJob, job_id)
+    return None
+
+
+def _record_failure(session: Session, job: IngestionJob, reason: str) -> None:
+    job.last_error = reason[:500]
+    job.locked_by = None
+    if job.attempts >= job.max_attempts:
+        job.status = "failed"
+        job.finished_at = _now()
+        job.supplied_text = None
+        document = session.get(MedicalDocument, job.document_id)
+        if document:
+            document.extraction_status = "failed"
+            session.add(document)
+            invalidate_dashboard(session, document.patient_id)
+    else:
+        job.status = "queued"
+        job.available_at = _now() + timedelta(seconds=INGESTION_RETRY_BASE_SECONDS * (2 ** (job.attempts - 1)))
+    session.add(job)
+    session.commit()
+
+
+def _inline_worker_id() -> str:
+    return f"inline:{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+def process_ingestion_job(session: Session, job: IngestionJob) -> None:
+    """Run one claimed (or inline) job to completion, recording retries on failure."""
+    job_id = job.id
+    if job.status != "running":
+        job.status = "running"
+        job.locked_by = _inline_worker_id()
+        job.started_at = _now()
+        job.attempts += 1
+        session.add(job)
+        session.commit()
+    lease = job.locked_by
+
+    if job.attempts > job.max_attempts:
+        # Reclaimed after its worker died too many times; stop retrying.
+        _record_failure(session, job, job.last_error or "Worker lease expired repeatedly.")
+        return
+
+    document = session.get(MedicalDocument, job.document_id)
+    if document is None:
+        job.attempts = job.max_attempts
+        _record_failure(session, job, "Document no longer exists.")
+        return
+
+    try:
+        supplied_text = decrypt_field(job.supplied_text) if job.supplied_text else None
+        _review_item, text_length = run_document_ingestion(session, document, load_document_payload(session, document), supplied_text)
+        completed = session.execute(
+            update(IngestionJob)
+            .where(IngestionJob.id == job_id, IngestionJob.status == "running", IngestionJob.locked_by == lease)
+            .values(
+                status="succeeded",
+                extracted_text_length=text_length,
+                finished_at=_now(),
+                supplied_text=None,
+                last_error=None,
+                locked_by=None,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        if completed.rowcount != 1:
+            # The lease expired and another worker reclaimed the job; its run owns the outcome.
+            logger.warning("Ingestion job %s was reclaimed before %s finished it; discarding its results", job_id, lease)
+            session.rollback()
+            return
+        invalidate_dashboard(session, document.patient_id)
+        session.commit()
+    except Exception as exc:
+        logger.exception("Ingestion job %s failed on attempt %s", job_id, job.attempts)
+        session.rollback()
+        job = session.get(IngestionJob, job_id)
+        if job is not None and job.locked_by == lease:
+            _record_failure(session, job, f"{type(exc).__name__}: {exc}")
+
+
+def process_ingestion_job_inline(session: Session, job: IngestionJob) -> None:
+    """Run ``job`` in the caller's thread, retrying straight away until it succeeds or fails for good.
+
+    Without a worker pool nothing would ever claim a job requeued for later.
+    """
+    job_id = job.id
+    while job is not None and job.status in {"queued", "running"}:
+        process_ingestion_job(session, job)
+        job = session.get(IngestionJob, job_id)
+        if job is not None and job.status == "queued":
+            job.available_at = _now()
+
+
+def drain_ingestion_jobs(session: Session, worker_id: str, limit: int | None = None) -> int:
+    """Claim and process ready jobs until the queue is empty; returns the number processed."""
+    processed = 0
+    while limit is None or processed < limit:
+        job = claim_next_job(session, worker_id)
+        if job is None:
+            break
+        process_ingestion_job(session, job)
+        processed += 1
+    return processed
+
+
+class IngestionWorkerPool:
+    def __init__(self, workers: int, poll_interval: float, session_factory: Callable[[], Session] | None = None):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.session_factory = session_factory or (lambda: Session(engine))
+        self._threads: list[threading.Thread] = []
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return any(thread.is_alive() for thread in self._threads)
+
+    def start(self) -> None:
+        if self.running or self.workers <= 0:
+            return
+        self._stop.clear()
+        prefix = f"{socket.gethostname()}:{os.getpid()}"
+        self._threads = [
+            threading.Thread(target=self._run, args=(f"{prefix}:{index}",), name=f"ingestion-worker-{index}", daemon=True)
+            for index in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def _run(self, worker_id: str) -> None:
+        while not self._stop.is_set():
+            try:
+                with self.session_factory() as session:
+                    processed = drain_ingestion_jobs(session, worker_id)
+            except Exception:
+                logger.exception("Ingestion worker %s crashed while polling", worker_id)
+                processed = 0
+            if not processed:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+
+worker_pool = IngestionWorkerPool(INGESTION_WORKERS, INGESTION_POLL_SECONDS)
+
+
+def ingestion_workers_running() -> bool:
+    return worker_pool.running
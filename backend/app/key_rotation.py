@@ -0,0 +1,196 @@
+"""
+Background re-encryption after an ENCRYPTION_KEY rotation.
+
+Each table is walked in primary-key order, ``KEY_ROTATION_BATCH_SIZE`` rows per
+transaction. Progress is stored in ``KeyRotationProgress`` so the job resumes
+where it stopped after a restart, and starts over if the primary key changes
+again. Values already encrypted under the primary key are left alone, so
+re-running the job, or running it in several processes at once, is harmless.
+Rows are rewritten with a conditional UPDATE that only matches while the
+ciphertext read is still stored, so a value replaced concurrently (such as a
+FHIR token refreshed by the sync scheduler) is never put back.
+
+Envelope-encrypted document blobs only need their small wrapped data key
+re-encrypted; the payload segments themselves are untouched.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import datetime, timezone
+import logging
+import os
+import threading
+from typing import Callable
+
+from sqlalchemy import update
+from sqlmodel import Session, SQLModel, select
+
+from app.blob_backends import get_blob_backend
+from app.db import engine
+from app.encryption import primary_key_fingerprint, rotated_chunk, rotated_token, rotation_pending
+from app.models import DocumentBlob, FHIRConnection, IngestionJob, KeyRotationProgress, MedicalDocument
+
+logger = logging.getLogger(__name__)
+
+KEY_ROTATION_BATCH_SIZE = int(os.environ.get("KEY_ROTATION_BATCH_SIZE", "100"))
+# Pause between batches so rotation never competes with request traffic for long.
+KEY_ROTATION_PAUSE_SECONDS = float(os.environ.get("KEY_ROTATION_PAUSE_SECONDS", "0.5"))
+# Re-reads of a row that keeps changing underneath the rotation before it is skipped.
+KEY_ROTATION_ROW_ATTEMPTS = 3
+
+
+@dataclass(frozen=True)
+class RotationTarget:
+    model: type[SQLModel]
+    fields: tuple[str, ...]
+    rotate_extra: Callable[[Session, SQLModel], bool] | None = None
+
+    @property
+    def table_name(self) -> str:
+        return self.model.__tablename__
+
+
+def _rotate_fernet_chunks(session: Session, blob: DocumentBlob) -> bool:
+    # Blobs written before envelope encryption store each chunk as a Fernet token.
+    if not blob.storage_backend or blob.wrapped_data_key:
+        return False
+    backend = get_blob_backend(blob.storage_backend)
+    changed = False
+    for index in range(blob.chunk_count):
+        rotated = rotated_chunk(backend.get_chunk(session, blob.storage_key, index))
+        if rotated is not None:
+            backend.replace_chunk(session, blob.storage_key, index, rotated)
+            changed = True
+    return changed
+
+
+ROTATION_TARGETS = (
+    RotationTarget(MedicalDocument, ("encrypted_blob",)),
+    RotationTarget(DocumentBlob, ("wrapped_data_key", "extracted_text", "encrypted_blob"), _rotate_fernet_chunks),
+    RotationTarget(FHIRConnection, ("access_token", "refresh_token")),
+    RotationTarget(IngestionJob, ("supplied_text",)),
+)
+
+
+def _progress(session: Session, target: RotationTarget, fingerprint: str) -> KeyRotationProgress:
+    progress = session.get(KeyRotationProgress, target.table_name)
+    if progress is None:
+        progress = KeyRotationProgress(table_name=target.table_name, key_fingerprint=fingerprint)
+    elif progress.key_fingerprint != fingerprint:
+        # The primary key changed again; every row has to be checked anew.
+        progress.key_fingerprint = fingerprint
+        progress.last_id = 0
+        progress.rows_rotated = 0
+        progress.started_at = datetime.now(timezone.utc)
+        progress.finished_at = None
+    return progress
+
+
+def _replace_if_unchanged(
+    session: Session, model: type[SQLModel], row_id: int, rotated: dict[str, tuple[str, str]]
+) -> bool:
+    """Write the ``(stale, re-encrypted)`` values unless another writer (a token refresh,
+    say) replaced the stale ones since they were read.
+    """
+    result = session.execute(
+        update(model)
+        .where(model.id == row_id, *(getattr(model, name) == stale for name, (stale, _new) in rotated.items()))
+        .values({field_name: new for field_name, (_stale, new) in rotated.items()})
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+def _rotate_fields(session: Session, target: RotationTarget, row: SQLModel) -> bool:
+    for _attempt in range(KEY_ROTATION_ROW_ATTEMPTS):
+        rotated = {
+            field_name: (value, new)
+            for field_name in target.fields
+            if (value := getattr(row, field_name)) and (new := rotated_token(value)) is not None
+        }
+        if not rotated:
+            return False
+        if _replace_if_unchanged(session, target.model, row.id, rotated):
+            return True
+        # Another writer got there first; its values may still leave other fields to rotate.
+        session.refresh(row)
+    logger.warning("Gave up re-encrypting %s %s; it kept changing", target.table_name, row.id)
+    return False
+
+
+def rotate_batch(session: Session, target: RotationTarget, batch_size: int = KEY_ROTATION_BATCH_SIZE) -> bool:
+    """Re-encrypt the next batch of ``target``; returns False once the table is done."""
+    fingerprint = primary_key_fingerprint()
+    if fingerprint is None:
+        return False
+    progress = _progress(session, target, fingerprint)
+    if progress.finished_at is not None:
+        return False
+
+    rows = session.exec(
+        select(target.model).where(target.model.id > progress.last_id).order_by(target.model.id).limit(batch_size)
+    ).all()
+    for row in rows:
+        changed = _rotate_fields(session, target, row)
+        if target.rotate_extra and target.rotate_extra(session, row):
+            changed = True
+        if changed:
+            progress.rows_rotated += 1
+
+    if rows:
+        progress.last_id = rows[-1].id
+    if len(rows) < batch_size:
+        progress.finished_at = datetime.now(timezone.utc)
+    session.add(progress)
+    session.commit()
+    return progress.finished_at is None
+
+
+def rotate_encryption_keys(
+    session: Session,
+    batch_size: int = KEY_ROTATION_BATCH_SIZE,
+    stop: threading.Event | None = None,
+    pause_seconds: float = 0.0,
+) -> dict[str, int]:
+    """Run every target to completion (or until ``stop`` is set); returns rows rotated per table."""
+    for target in ROTATION_TARGETS:
+        while rotate_batch(session, target, batch_size):
+            if stop is not None and stop.wait(pause_seconds):
+                break
+        if stop is not None and stop.is_set():
+            break
+    return {
+        progress.table_name: progress.rows_rotated
+        for progress in session.exec(select(KeyRotationProgress)).all()
+    }
+
+
+class KeyRotationWorker:
+    def __init__(self, session_factory: Callable[[], Session] | None = None):
+        self.session_factory = session_factory or (lambda: Session(engine))
+        self._thread: threading.Thread | None = None
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        if not rotation_pending() or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="key-rotation", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self) -> None:
+        try:
+            with self.session_factory() as session:
+                rotated = rotate_encryption_keys(session, stop=self._stop, pause_seconds=KEY_ROTATION_PAUSE_SECONDS)
+            logger.info("Encryption key rotation progress: %s", rotated)
+        except Exception:
+            logger.exception("Encryption key rotation stopped; it will resume on the next start")
+
+
+key_rotation_worker = KeyRotationWorker()
@@ -0,0 +1,148 @@
+"""
+Lab terminology index: LOINC codes, names, synonyms, units and reference ranges.
+
+The catalog is a pre-built tab-separated table (``generated/lab_catalog.tsv``,
+or ``LAB_CATALOG_PATH``) with one row per test::
+
+    loinc  name  unit  ref_range  synonyms (pipe-separated)
+
+The shipped table covers the common chemistry, lipid, thyroid and blood count
+panels with curated reference ranges; ``scripts/build_lab_catalog.py`` extends
+it with thousands of ranked tests from the LOINC distribution.
+
+The table is read once per process. Every name and synonym is normalized to
+its lowercase words (``"Glucose (fasting)"`` -> ``"glucose fasting"``) and
+indexed in a dict, so looking up a test by any spelling is a single hash
+probe, and reference ranges are parsed into ``ReferenceRange`` objects at
+load time instead of on every observation. When two rows claim the same
+synonym, the earlier row wins, so curated rows go first.
+"""
+from __future__ import annotations
+
+import csv
+from dataclasses import dataclass
+from functools import lru_cache
+import os
+from pathlib import Path
+import re
+
+from app.hint_matcher import hint_tokens
+
+LAB_CATALOG_PATH = Path(
+    os.environ.get("LAB_CATALOG_PATH")
+    or Path(__file__).resolve().parents[1] / "generated" / "lab_catalog.tsv"
+)
+CATALOG_FIELDS = ("loinc", "name", "unit", "ref_range", "synonyms")
+
+_NUMBER = r"(-?\d+(?:\.\d+)?)"
+_BOUND_RE = re.compile(rf"^\s*(<=|>=|<|>|≤|≥)\s*{_NUMBER}")
+_INTERVAL_RE = re.compile(rf"^\s*{_NUMBER}\s*(?:-|–|to)\s*{_NUMBER}")
+
+
+@dataclass(frozen=True)
+class ReferenceRange:
+    text: str
+    low: float | None = None
+    high: float | None = None
+    low_inclusive: bool = True
+    high_inclusive: bool = True
+
+    def status(self, value: float) -> str:
+        if self.low is not None and (value < self.low or (value == self.low and not self.low_inclusive)):
+            return "low"
+        if self.high is not None and (value > self.high or (value == self.high and not self.high_inclusive)):
+            return "high"
+        return "normal"
+
+
+@lru_cache(maxsize=1024)
+def parse_reference_range(text: str | None) -> ReferenceRange | None:
+    """Parse ``"70-100"``, ``"<200"``, ``">=60"`` and the like; trailing units are ignored."""
+    if not text:
+        return None
+    if match := _INTERVAL_RE.match(text):
+        return ReferenceRange(text, low=float(match.group(1)), high=float(match.group(2)))
+    if match := _BOUND_RE.match(text):
+        operator, bound = match.group(1), float(match.group(2))
+        if operator in ("<", "<=", "≤"):
+            return ReferenceRange(text, high=bound, high_inclusive=operator != "<")
+        return ReferenceRange(text, low=bound, low_inclusive=operator != ">")
+    return None
+
+
+def reference_status(value: float, ref_range: str | None) -> str | None:
+    """``"low"``, ``"high"`` or ``"normal"``; None when the range is missing or unreadable."""
+    reference = parse_reference_range(ref_range)
+    return reference.status(value) if reference else None
+
+
+def normalize_lab_name(name: str) -> str:
+    return " ".join(hint_tokens(name))
+
+
+@dataclass(frozen=True)
+class LabTest:
+    loinc: str
+    name: str
+    unit: str | None
+    reference: ReferenceRange | None
+    synonyms: tuple[str, ...]  # normalized, including the name itself
+
+    @property
+    def ref_range(self) -> str | None:
+        return self.reference.text if self.reference else None
+
+
+class LabCatalog:
+    def __init__(self, tests: list[LabTest]):
+        self.tests = tuple(tests)
+        self._by_name: dict[str, LabTest] = {}
+        self._by_loinc: dict[str, LabTest] = {}
+        for test in self.tests:
+            self._by_loinc.setdefault(test.loinc, test)
+            for synonym in test.synonyms:
+                self._by_name.setdefault(synonym, test)
+
+    def __len__(self) -> int:
+        return len(self.tests)
+
+    @property
+    def names(self) -> list[str]:
+        """Every normalized name and synonym, in catalog order."""
+        return list(self._by_name)
+
+    @property
+    def units(self) -> list[str]:
+        return list(dict.fromkeys(test.unit for test in self.tests if test.unit))
+
+    def lookup(self, name: str | None) -> LabTest | None:
+        return self._by_name.get(normalize_lab_name(name)) if name else None
+
+    def by_loinc(self, code: str | None) -> LabTest | None:
+        return self._by_loinc.get(code) if code else None
+
+
+def _lab_test(row: dict[str, str]) -> LabTest:
+    names = [row["name"], *(row.get("synonyms") or "").split("|")]
+    return LabTest(
+        loinc=row["loinc"].strip(),
+        name=row["name"].strip(),
+        unit=(row.get("unit") or "").strip() or None,
+        reference=parse_reference_range((row.get("ref_range") or "").strip()),
+        synonyms=tuple(dict.fromkeys(filter(None, map(normalize_lab_name, names)))),
+    )
+
+
+def load_lab_catalog(path: str | Path) -> LabCatalog:
+    with open(path, newline="", encoding="utf-8") as handle:
+        rows = csv.DictReader(handle, delimiter="\t", quoting=csv.QUOTE_NONE)
+        return LabCatalog([_lab_test(row) for row in rows if row.get("loinc") and row.get("name")])
+
+
+@lru_cache(maxsize=1)
+def get_lab_catalog() -> LabCatalog:
+    return load_lab_catalog(LAB_CATALOG_PATH)
+
+
+def lookup_lab(name: str | None) -> LabTest | None:
+    return get_lab_catalog().lookup(name)
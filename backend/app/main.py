@@ -1,21 +1,15 @@
 import os
 import sys
 from contextlib import asynccontextmanager
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from slowapi import Limiter, _rate_limit_exceeded_handler
-from slowapi.util import get_remote_address
-from slowapi.errors import RateLimitExceeded
 from sqlmodel import SQLModel
 
-from .db import engine
+from .auth import require_metrics_token
+from .db import database_pool_stats, engine
+from .password_hashing import hashing_stats
 from .routers import auth, dashboard, records, providers, portals, notifications, settings, export_fhir, audit, smart_fhir
 
-# ---------------------------------------------------------------------------
-# Rate limiter (module-level so routers can access via request.app.state.limiter)
-# ---------------------------------------------------------------------------
-limiter = Limiter(key_func=get_remote_address)
-
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -23,7 +17,18 @@ async def lifespan(app: FastAPI):
     # Auto-seed demo data if DB is empty (works for both Vercel and local)
     from .seed import seed
     seed()
+    from .ingestion_jobs import worker_pool
+    from .key_rotation import key_rotation_worker
+    from .fhir_scheduler import fhir_sync_scheduler
+    worker_pool.start()
+    key_rotation_worker.start()
+    fhir_sync_scheduler.start()
     yield
+    fhir_sync_scheduler.stop()
+    key_rotation_worker.stop()
+    worker_pool.stop()
+    from .pdf_text import shutdown_pdf_pool
+    shutdown_pdf_pool()
 
 
 app = FastAPI(
@@ -33,10 +38,6 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
-# Attach rate limiter to app state and register its exception handler
-app.state.limiter = limiter
-app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
-
 ALLOWED_ORIGINS = os.environ.get(
     "CORS_ORIGINS",
     "http://localhost:3000,http://localhost:8000,https://frontend-eta-murex-20.vercel.app"
@@ -48,6 +49,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
     allow_headers=["Authorization", "Content-Type"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 app.include_router(auth.router)
@@ -67,6 +69,17 @@ def health():
     return {"status": "ok", "version": "0.2.0"}
 
 
+# Internal metrics, only for callers holding METRICS_TOKEN.
+@app.get("/api/health/password-hashing", dependencies=[Depends(require_metrics_token)], include_in_schema=False)
+def password_hashing_health():
+    return hashing_stats()
+
+
+@app.get("/api/health/database-pool", dependencies=[Depends(require_metrics_token)], include_in_schema=False)
+def database_pool_health():
+    return database_pool_stats()
+
+
 def run() -> None:
     try:
         import uvicorn
@@ -1,5 +1,6 @@
 from typing import Optional, List
 from datetime import datetime, timezone
+from sqlalchemy import Index, UniqueConstraint
 from sqlmodel import SQLModel, Field
 import json
 
@@ -36,10 +37,13 @@ class LabObservation(SQLModel, table=True):
     ref_range: Optional[str] = None
     status: Optional[str] = None  # normal, high, low
     source: Optional[str] = Field(default=None)
+    source_document_id: Optional[int] = Field(default=None, foreign_key="medicaldocument.id", index=True)
     timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 
 class MedicalRecord(SQLModel, table=True):
+    __table_args__ = (Index("ix_medicalrecord_timeline", "patient_id", "date", "id"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
     patient_id: str = Field(index=True)
     record_type: str  # lab, medication, imaging, visit, wearable
@@ -49,6 +53,7 @@ class MedicalRecord(SQLModel, table=True):
     source: str
     provider: str
     flags: str = Field(default="[]")  # JSON array of flag strings
+    source_document_id: Optional[int] = Field(default=None, foreign_key="medicaldocument.id", index=True)
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
     def get_flags(self) -> list:
@@ -56,6 +61,8 @@ class MedicalRecord(SQLModel, table=True):
 
 
 class MedicalDocument(SQLModel, table=True):
+    __table_args__ = (Index("ix_medicaldocument_timeline", "patient_id", "document_date", "id"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
     patient_id: str = Field(index=True)
     title: str
@@ -70,10 +77,36 @@ class MedicalDocument(SQLModel, table=True):
     extraction_profile: str = Field(default="generic_general_record")
     ocr_status: str = Field(default="pending")
     extraction_status: str = Field(default="pending")
-    encrypted_blob: str
+    blob_id: Optional[int] = Field(default=None, foreign_key="documentblob.id", index=True)
+    encrypted_blob: Optional[str] = None  # legacy inline payload; new uploads reference a DocumentBlob
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+class DocumentBlob(SQLModel, table=True):
+    """Content-addressed, reference-counted document payload shared by duplicate uploads."""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    content_hash: str = Field(index=True, unique=True)  # HMAC-SHA256 of the patient id and plaintext
+    byte_size: int
+    storage_backend: Optional[str] = None  # database, filesystem or s3; None for legacy inline blobs
+    storage_key: Optional[str] = None
+    chunk_size: int = Field(default=0)
+    chunk_count: int = Field(default=0)
+    wrapped_data_key: Optional[str] = None  # AES-GCM data key encrypted with ENCRYPTION_KEY
+    nonce_prefix: Optional[str] = None  # hex
+    encrypted_blob: Optional[str] = None  # legacy inline payload, moved into chunks by migrate_legacy_payloads
+    ref_count: int = Field(default=0)
+    extracted_text: Optional[str] = None  # encrypted; cached result of the first extraction
+    ocr_status: Optional[str] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 
+class BlobChunk(SQLModel, table=True):
+    """One encrypted chunk of a DocumentBlob stored by the database blob backend."""
+    blob_key: str = Field(primary_key=True)
+    chunk_index: int = Field(primary_key=True)
+    data: bytes
+
+
 class DocumentReviewItem(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     patient_id: str = Field(index=True)
@@ -106,6 +139,7 @@ class WearableData(SQLModel, table=True):
     trend: Optional[str] = None  # up, down, stable
     period: Optional[str] = None
     source: str = Field(default="Apple Watch")
+    source_document_id: Optional[int] = Field(default=None, foreign_key="medicaldocument.id", index=True)
     timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 
@@ -167,3 +201,57 @@ class FHIRConnection(SQLModel, table=True):
     status: str = Field(default="active")  # active, expired, revoked
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     last_synced_at: Optional[datetime] = None
+    next_sync_at: Optional[datetime] = Field(default=None, index=True)  # background sync due time
+    sync_leased_until: Optional[datetime] = None  # set while a scheduled or manual sync runs
+    last_sync_duration_ms: Optional[int] = None
+    last_sync_error: Optional[str] = None
+    sync_failures: int = Field(default=0)  # consecutive failed background syncs
+
+
+class FHIRSyncedResource(SQLModel, table=True):
+    """A remote FHIR resource already stored locally, so later syncs update it in place."""
+    __table_args__ = (UniqueConstraint("connection_id", "resource_type", "resource_id"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    connection_id: int = Field(foreign_key="fhirconnection.id")
+    resource_type: str
+    resource_id: str
+    version_id: Optional[str] = None  # meta.versionId; an unchanged version is not rewritten
+    last_updated: Optional[str] = None  # meta.lastUpdated as sent by the server
+    lab_observation_id: Optional[int] = Field(default=None, foreign_key="labobservation.id")
+    medical_record_id: Optional[int] = Field(default=None, foreign_key="medicalrecord.id")
+    synced_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+class DashboardSnapshot(SQLModel, table=True):
+    patient_id: str = Field(primary_key=True)
+    version: int = Field(default=0)  # bumped by every dashboard-affecting write
+    payload: Optional[str] = None  # JSON snapshot computed for `version`
+    computed_at: Optional[datetime] = None
+
+
+class IngestionJob(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    patient_id: str = Field(index=True)
+    document_id: int = Field(foreign_key="medicaldocument.id", index=True)
+    status: str = Field(default="queued", index=True)  # queued, running, succeeded, failed
+    supplied_text: Optional[str] = None  # encrypted browser OCR text, cleared once processed
+    attempts: int = Field(default=0)
+    max_attempts: int = Field(default=3)
+    last_error: Optional[str] = None
+    extracted_text_length: Optional[int] = None
+    locked_by: Optional[str] = None
+    available_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+class KeyRotationProgress(SQLModel, table=True):
+    """Resume point of the background re-encryption job, one row per table."""
+    table_name: str = Field(primary_key=True)
+    key_fingerprint: str  # primary key the table is being rotated to
+    last_id: int = Field(default=0)
+    rows_rotated: int = Field(default=0)
+    started_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    finished_at: Optional[datetime] = None
@@ -0,0 +1,148 @@
+"""
+Password hashing on a dedicated, bounded thread pool.
+
+bcrypt is deliberately slow: one hash at the default cost burns a couple of
+hundred milliseconds of CPU. Running it on the request threads lets a burst of
+logins occupy every core, so hashes and verifications run on a pool of
+``PASSWORD_HASH_WORKERS`` threads (bcrypt releases the GIL) and everything
+else keeps its share of the CPU. At most ``PASSWORD_HASH_MAX_QUEUE`` jobs may
+wait for a thread; beyond that callers get ``PasswordHashingBusy`` straight
+away instead of queueing for longer than a client would wait.
+
+The login, signup and password-change handlers are async and await the
+``*_async`` variants, so a queue of hashes holds no request threads either;
+the sync variants block their caller and are for scripts and seeding.
+
+The cost factor is ``PASSWORD_BCRYPT_ROUNDS``. Hashes made with any other
+cost count as outdated, and ``verify_and_update`` returns a replacement hash
+for them so logins migrate stored hashes whenever the setting changes.
+
+``hashing_stats`` reports the queue depth, jobs in progress and wait times.
+"""
+from __future__ import annotations
+
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor
+import os
+import threading
+import time
+from typing import Callable, TypeVar
+
+from passlib.context import CryptContext
+
+PASSWORD_BCRYPT_ROUNDS = int(os.environ.get("PASSWORD_BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", str(min(os.cpu_count() or 1, 4))))
+PASSWORD_HASH_MAX_QUEUE = int(os.environ.get("PASSWORD_HASH_MAX_QUEUE", "64"))
+
+T = TypeVar("T")
+
+
+def build_context(rounds: int) -> CryptContext:
+    # min == max == default, so needs_update() flags hashes of any other cost.
+    return CryptContext(
+        schemes=["bcrypt"],
+        deprecated="auto",
+        bcrypt__default_rounds=rounds,
+        bcrypt__min_rounds=rounds,
+        bcrypt__max_rounds=rounds,
+    )
+
+
+pwd_context = build_context(PASSWORD_BCRYPT_ROUNDS)
+
+
+class PasswordHashingBusy(Exception):
+    """The hashing queue is full."""
+
+
+class _Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.hash_seconds_total = 0.0
+
+
+_stats = _Stats()
+_executor = ThreadPoolExecutor(max_workers=max(PASSWORD_HASH_WORKERS, 1), thread_name_prefix="password-hash")
+
+
+def _submit(job: Callable[[], T]) -> Future[T]:
+    with _stats.lock:
+        if _stats.queued >= PASSWORD_HASH_MAX_QUEUE:
+            _stats.rejected += 1
+            raise PasswordHashingBusy("Too many password operations in progress")
+        _stats.queued += 1
+    submitted = time.perf_counter()
+
+    def timed() -> T:
+        started = time.perf_counter()
+        with _stats.lock:
+            _stats.queued -= 1
+            _stats.running += 1
+            _stats.wait_seconds_total += started - submitted
+            _stats.wait_seconds_max = max(_stats.wait_seconds_max, started - submitted)
+        try:
+            return job()
+        finally:
+            with _stats.lock:
+                _stats.running -= 1
+                _stats.completed += 1
+                _stats.hash_seconds_total += time.perf_counter() - started
+
+    return _executor.submit(timed)
+
+
+def _run(job: Callable[[], T]) -> T:
+    return _submit(job).result()
+
+
+async def _run_async(job: Callable[[], T]) -> T:
+    # Awaiting the future keeps the caller's request thread (or event loop) free while the job waits.
+    return await asyncio.wrap_future(_submit(job))
+
+
+def hash_password(password: str) -> str:
+    return _run(lambda: pwd_context.hash(password))
+
+
+def verify_password(plain: str, hashed: str) -> bool:
+    return _run(lambda: pwd_context.verify(plain, hashed))
+
+
+def verify_and_update(plain: str, hashed: str) -> tuple[bool, str | None]:
+    """Verify ``plain``; on success also return a new hash if ``hashed`` uses an outdated cost."""
+    return _run(lambda: pwd_context.verify_and_update(plain, hashed))
+
+
+async def hash_password_async(password: str) -> str:
+    return await _run_async(lambda: pwd_context.hash(password))
+
+
+async def verify_password_async(plain: str, hashed: str) -> bool:
+    return await _run_async(lambda: pwd_context.verify(plain, hashed))
+
+
+async def verify_and_update_async(plain: str, hashed: str) -> tuple[bool, str | None]:
+    return await _run_async(lambda: pwd_context.verify_and_update(plain, hashed))
+
+
+def hashing_stats() -> dict:
+    with _stats.lock:
+        completed = _stats.completed
+        return {
+            "workers": max(PASSWORD_HASH_WORKERS, 1),
+            "rounds": PASSWORD_BCRYPT_ROUNDS,
+            "queued": _stats.queued,
+            "running": _stats.running,
+            "max_queue": PASSWORD_HASH_MAX_QUEUE,
+            "completed": completed,
+            "rejected": _stats.rejected,
+            "avg_wait_ms": round(_stats.wait_seconds_total / completed * 1000, 1) if completed else 0.0,
+            "max_wait_ms": round(_stats.wait_seconds_max * 1000, 1),
+            "avg_hash_ms": round(_stats.hash_seconds_total / completed * 1000, 1) if completed else 0.0,
+        }
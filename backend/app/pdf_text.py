@@ -0,0 +1,306 @@
+"""
+PDF text extraction engine.
+
+Large PDFs are split into page ranges that are extracted in a shared process
+pool, so a 300-page lab packet uses every core instead of one request thread.
+The payload is copied into shared memory once per document, and each worker
+parses it once and keeps the reader for the document's remaining ranges, so
+tasks only carry a page range.
+
+Each document gets a wall-clock budget and a CPU budget; pages are yielded in
+order as soon as their range finishes, and each page carries its extraction
+time so slow scans show up in the logs. Workers check the budgets between
+pages. If the budget runs out while a range is still running (a single
+pathological page, say), the pool is retired and its processes are killed once
+no other document is reading from it; the next document gets a fresh pool.
+
+This module deliberately imports nothing from ``app`` so spawned pool workers
+start quickly.
+"""
+from __future__ import annotations
+
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+import io
+import logging
+import multiprocessing
+from multiprocessing import shared_memory
+import os
+import threading
+import time
+from typing import Iterator
+
+from pypdf import PdfReader
+
+logger = logging.getLogger(__name__)
+
+PDF_EXTRACT_WORKERS = int(
+    os.environ.get("PDF_EXTRACT_WORKERS", "0" if os.environ.get("VERCEL") else str(min(os.cpu_count() or 1, 4)))
+)
+# Documents shorter than this are extracted in the calling thread.
+PDF_EXTRACT_PARALLEL_MIN_PAGES = int(os.environ.get("PDF_EXTRACT_PARALLEL_MIN_PAGES", "16"))
+PDF_EXTRACT_PAGES_PER_TASK = int(os.environ.get("PDF_EXTRACT_PAGES_PER_TASK", "8"))
+PDF_EXTRACT_MAX_PAGES = int(os.environ.get("PDF_EXTRACT_MAX_PAGES", "300"))
+PDF_EXTRACT_TIMEOUT_SECONDS = float(os.environ.get("PDF_EXTRACT_TIMEOUT_SECONDS", "30"))
+PDF_EXTRACT_CPU_SECONDS = float(os.environ.get("PDF_EXTRACT_CPU_SECONDS", "60"))
+
+
+@dataclass(frozen=True)
+class PageText:
+    index: int
+    text: str
+    seconds: float
+
+
+@dataclass
+class PdfExtractionResult:
+    pages: list[PageText] = field(default_factory=list)
+    page_count: int = 0
+    truncated: bool = False
+    timed_out: bool = False
+    cpu_exhausted: bool = False
+    elapsed_seconds: float = 0.0
+
+    @property
+    def text(self) -> str:
+        return "\n".join(page.text for page in self.pages if page.text.strip()).strip()
+
+    @property
+    def slowest_page(self) -> PageText | None:
+        return max(self.pages, key=lambda page: page.seconds, default=None)
+
+
+@dataclass
+class _Budget:
+    deadline: float
+    cpu_seconds: float
+    cpu_used: float = 0.0
+    timed_out: bool = False
+    cpu_exhausted: bool = False
+
+    def exhausted(self) -> bool:
+        if time.monotonic() >= self.deadline:
+            self.timed_out = True
+        if self.cpu_used >= self.cpu_seconds:
+            self.cpu_exhausted = True
+        return self.timed_out or self.cpu_exhausted
+
+
+# Pool worker state: the shared-memory name and reader of the last document seen.
+_worker_document: tuple[str, PdfReader] | None = None
+
+
+def _worker_reader(name: str, size: int) -> PdfReader:
+    global _worker_document
+    if _worker_document is None or _worker_document[0] != name:
+        _worker_document = None  # drop the previous document before loading the next
+        segment = shared_memory.SharedMemory(name=name)
+        try:
+            payload = bytes(segment.buf[:size])
+        finally:
+            segment.close()
+        _worker_document = (name, PdfReader(io.BytesIO(payload)))
+    return _worker_document[1]
+
+
+def _extract_page_range(
+    name: str,
+    size: int,
+    start: int,
+    stop: int,
+    deadline_seconds: float,
+    cpu_seconds: float,
+) -> tuple[list[tuple[int, str, float]], float]:
+    """Extract pages ``[start, stop)`` of the document in shared memory ``name``;
+    returns ``(pages, cpu_seconds_used)``.
+
+    Runs in a pool worker. Budgets are checked between pages, so a single page
+    can overrun them by at most its own extraction time.
+    """
+    started_wall = time.monotonic()
+    started_cpu = time.process_time()
+    reader = _worker_reader(name, size)
+    pages: list[tuple[int, str, float]] = []
+    for index in range(start, stop):
+        if time.monotonic() - started_wall >= deadline_seconds or time.process_time() - started_cpu >= cpu_seconds:
+            break
+        page_started = time.perf_counter()
+        try:
+            text = reader.pages[index].extract_text() or ""
+        except Exception:
+            text = ""
+        pages.append((index, text, time.perf_counter() - page_started))
+    return pages, time.process_time() - started_cpu
+
+
+class _Pool:
+    """The shared executor and the number of documents currently extracting with it."""
+
+    def __init__(self):
+        # Spawn rather than fork: the API process runs ingestion threads.
+        self.executor = ProcessPoolExecutor(
+            max_workers=max(PDF_EXTRACT_WORKERS, 1),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        self.users = 0
+        self.retired = False
+
+    def kill(self) -> None:
+        # Cancelling a future can't stop a range that is already running, and
+        # ProcessPoolExecutor has no public way to stop its workers before 3.14.
+        for process in list((self.executor._processes or {}).values()):
+            process.kill()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+_pool: _Pool | None = None
+_pool_lock = threading.Lock()
+
+
+def _acquire_pool() -> _Pool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = _Pool()
+        _pool.users += 1
+        return _pool
+
+
+def _release_pool(pool: _Pool, recycle: bool = False) -> None:
+    """Drop one document's use of ``pool``; with ``recycle``, retire it and kill
+    its workers once no other document is using it.
+    """
+    global _pool
+    with _pool_lock:
+        pool.users -= 1
+        if recycle and not pool.retired:
+            pool.retired = True
+            if _pool is pool:
+                _pool = None
+        kill = pool.retired and pool.users == 0
+    if kill:
+        pool.kill()
+
+
+def shutdown_pdf_pool() -> None:
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+        if pool is not None:
+            pool.retired = True
+    if pool is not None:
+        pool.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _iter_serial(payload: bytes, page_count: int, budget: _Budget) -> Iterator[PageText]:
+    reader = PdfReader(io.BytesIO(payload))
+    for index in range(page_count):
+        if budget.exhausted():
+            return
+        cpu_started = time.process_time()
+        page_started = time.perf_counter()
+        try:
+            text = reader.pages[index].extract_text() or ""
+        except Exception:
+            text = ""
+        budget.cpu_used += time.process_time() - cpu_started
+        yield PageText(index, text, time.perf_counter() - page_started)
+
+
+def _iter_parallel(payload: bytes, page_count: int, budget: _Budget) -> Iterator[PageText]:
+    step = max(PDF_EXTRACT_PAGES_PER_TASK, 1)
+    ranges = [(start, min(start + step, page_count)) for start in range(0, page_count, step)]
+    # Each range gets an equal share of the CPU budget, and the whole wall budget.
+    cpu_share = budget.cpu_seconds / max(min(len(ranges), PDF_EXTRACT_WORKERS), 1)
+    segment = shared_memory.SharedMemory(create=True, size=max(len(payload), 1))
+    segment.buf[:len(payload)] = payload
+    pool = _acquire_pool()
+    pending: set[Future] = set()
+    try:
+        remaining = max(budget.deadline - time.monotonic(), 0.0)
+        futures: dict[Future, int] = {
+            pool.executor.submit(
+                _extract_page_range, segment.name, len(payload), start, stop, remaining, cpu_share
+            ): start
+            for start, stop in ranges
+        }
+        finished: dict[int, list[tuple[int, str, float]]] = {}
+        next_range = 0
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=max(budget.deadline - time.monotonic(), 0.0), return_when=FIRST_COMPLETED)
+            if not done:
+                budget.timed_out = True
+                break
+            for future in done:
+                pages, cpu_used = future.result()
+                budget.cpu_used += cpu_used
+                finished[futures[future]] = pages
+            # Stream ranges in page order as soon as the next one is available.
+            while next_range < len(ranges) and ranges[next_range][0] in finished:
+                start, stop = ranges[next_range]
+                pages = finished.pop(start)
+                for index, text, seconds in pages:
+                    yield PageText(index, text, seconds)
+                next_range += 1
+                if len(pages) < stop - start:
+                    budget.exhausted()
+                    return
+            if budget.exhausted():
+                break
+    finally:
+        for future in pending:
+            future.cancel()
+        # A range that could not be cancelled is still running in a worker.
+        _release_pool(pool, recycle=any(not future.cancelled() and not future.done() for future in pending))
+        segment.close()
+        segment.unlink()
+
+
+def iter_pdf_pages(payload: bytes, *, parallel: bool | None = None) -> Iterator[PageText]:
+    """Yield page text in order, stopping early when a budget runs out."""
+    yield from _iter_pdf_pages(payload, PdfExtractionResult(), parallel)
+
+
+def _iter_pdf_pages(payload: bytes, result: PdfExtractionResult, parallel: bool | None) -> Iterator[PageText]:
+    started = time.monotonic()
+    reader = PdfReader(io.BytesIO(payload))
+    result.page_count = len(reader.pages)
+    page_count = min(result.page_count, PDF_EXTRACT_MAX_PAGES)
+    result.truncated = page_count < result.page_count
+    budget = _Budget(deadline=started + PDF_EXTRACT_TIMEOUT_SECONDS, cpu_seconds=PDF_EXTRACT_CPU_SECONDS)
+    if parallel is None:
+        parallel = PDF_EXTRACT_WORKERS > 1 and page_count >= PDF_EXTRACT_PARALLEL_MIN_PAGES
+
+    pages = _iter_parallel(payload, page_count, budget) if parallel else _iter_serial(payload, page_count, budget)
+    try:
+        yield from pages
+    except BrokenProcessPool:
+        logger.exception("PDF extraction pool died; resetting it")
+        shutdown_pdf_pool()
+        raise
+    finally:
+        result.timed_out = budget.timed_out
+        result.cpu_exhausted = budget.cpu_exhausted
+        result.elapsed_seconds = time.monotonic() - started
+
+
+def extract_pdf_text(payload: bytes, *, parallel: bool | None = None) -> PdfExtractionResult:
+    result = PdfExtractionResult()
+    for page in _iter_pdf_pages(payload, result, parallel):
+        result.pages.append(page)
+
+    slowest = result.slowest_page
+    logger.info(
+        "Extracted %s/%s PDF pages in %.2fs (slowest page %s: %.2fs)%s%s%s",
+        len(result.pages),
+        result.page_count,
+        result.elapsed_seconds,
+        slowest.index + 1 if slowest else "-",
+        slowest.seconds if slowest else 0.0,
+        "; truncated" if result.truncated else "",
+        "; timed out" if result.timed_out else "",
+        "; CPU budget exhausted" if result.cpu_exhausted else "",
+    )
+    return result
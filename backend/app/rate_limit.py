@@ -0,0 +1,295 @@
+"""
+Token-bucket rate limiting shared by every route and worker.
+
+Each limited route names a budget such as ``upload=30/hour``: its buckets hold
+up to 30 tokens, refill at 30 per hour, and each request takes one, so a
+client can burst up to the budget and then continues at the refill rate.
+Requests are charged to one bucket per client IP and, when they carry a valid
+access token, to one per user id as well. Both must have a token left, so
+neither switching networks nor sharing one address gets around a budget. A
+request is charged to all of its buckets or to none: one spent bucket rejects
+it without draining the others.
+Defaults are in ``DEFAULT_BUDGETS``; ``RATE_LIMIT_BUDGETS`` overrides them.
+
+Buckets live in a pluggable store (``RATE_LIMIT_BACKEND``):
+
+- ``memory`` (default): per process.
+- ``sqlite``: a SQLite file at ``RATE_LIMIT_SQLITE_PATH`` that every worker on
+  the host shares; each request's check is one ``BEGIN IMMEDIATE`` transaction.
+- ``redis``: any Redis-compatible server at ``RATE_LIMIT_REDIS_URL``; each
+  request's check is one Lua script. Needs ``redis``, which is only imported
+  when this backend is selected.
+
+A store that can't be reached lets requests through rather than failing them.
+"""
+from __future__ import annotations
+
+from collections import OrderedDict
+from dataclasses import dataclass
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Iterable, Sequence
+
+from fastapi import HTTPException, Request, status
+
+from app.auth import token_claims
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "1").lower() not in {"0", "false", "no"}
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "memory").strip().lower()
+RATE_LIMIT_SQLITE_PATH = os.environ.get(
+    "RATE_LIMIT_SQLITE_PATH", "/tmp/medbridge-ratelimit.db" if os.environ.get("VERCEL") else "./ratelimit.db"
+)
+RATE_LIMIT_REDIS_URL = os.environ.get("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0")
+# Comma-separated overrides of DEFAULT_BUDGETS, e.g. "upload=50/hour,login=10/minute".
+RATE_LIMIT_BUDGETS = os.environ.get("RATE_LIMIT_BUDGETS", "")
+
+DEFAULT_BUDGETS = {
+    "login": "5/minute",
+    "signup": "10/hour",
+    "upload": "30/hour",
+    "fhir_sync": "10/hour",
+    "export": "20/hour",
+}
+
+PERIOD_SECONDS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+
+@dataclass(frozen=True)
+class Budget:
+    capacity: float
+    per_second: float
+
+    @classmethod
+    def parse(cls, spec: str) -> Budget:
+        """``"30/hour"`` -> a bucket of 30 tokens that refills at 30 per hour."""
+        count, _, period = spec.strip().partition("/")
+        seconds = PERIOD_SECONDS.get(period.strip().lower().rstrip("s"))
+        if not seconds or float(count) <= 0:
+            raise ValueError(f"Invalid rate limit budget: {spec!r}")
+        return cls(capacity=float(count), per_second=float(count) / seconds)
+
+
+def load_budgets(overrides: str = "") -> dict[str, Budget]:
+    specs = dict(DEFAULT_BUDGETS)
+    for item in overrides.split(","):
+        route, _, spec = item.partition("=")
+        if route.strip() and spec.strip():
+            specs[route.strip()] = spec
+    return {route: Budget.parse(spec) for route, spec in specs.items()}
+
+
+def refill_and_take(buckets: Sequence[tuple[float, float]], budget: Budget, now: float) -> tuple[list[float], float]:
+    """Refill each ``(tokens, updated_at)`` bucket and take a token from every one
+    only if all of them have one.
+
+    Returns the buckets' new token counts and how long to wait (0 if the tokens were taken).
+    """
+    tokens = [
+        min(budget.capacity, count + max(now - updated_at, 0.0) * budget.per_second) for count, updated_at in buckets
+    ]
+    wait = max(((1 - count) / budget.per_second for count in tokens if count < 1), default=0.0)
+    if wait:
+        return tokens, wait
+    return [count - 1 for count in tokens], 0.0
+
+
+class BucketStore:
+    name: str
+
+    def take(self, keys: Sequence[str], budget: Budget, now: float) -> float:
+        """Take a token from each of ``keys``' buckets if all have one; returns 0, or
+        the seconds until they all do.
+        """
+        raise NotImplementedError
+
+
+class MemoryBucketStore(BucketStore):
+    name = "memory"
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, keys: Sequence[str], budget: Budget, now: float) -> float:
+        with self._lock:
+            buckets = [self._buckets.pop(key, (budget.capacity, now)) for key in keys]
+            tokens, wait = refill_and_take(buckets, budget, now)
+            for key, count in zip(keys, tokens):
+                self._buckets[key] = (count, now)
+            # Forgetting the least recently used bucket only ever refills it early.
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+class SQLiteBucketStore(BucketStore):
+    name = "sqlite"
+    # Buckets untouched for this long are full again under any budget, so their rows can go.
+    idle_seconds = PERIOD_SECONDS["day"]
+    prune_every = 1000
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._takes = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limit_bucket "
+                "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._local.connection = connection
+        return connection
+
+    def take(self, keys: Sequence[str], budget: Budget, now: float) -> float:
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            buckets = [
+                connection.execute("SELECT tokens, updated_at FROM rate_limit_bucket WHERE key = ?", (key,)).fetchone()
+                or (budget.capacity, now)
+                for key in keys
+            ]
+            tokens, wait = refill_and_take(buckets, budget, now)
+            connection.executemany(
+                "INSERT INTO rate_limit_bucket (key, tokens, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at",
+                [(key, count, now) for key, count in zip(keys, tokens)],
+            )
+            self._takes += 1
+            if self._takes % self.prune_every == 0:
+                connection.execute("DELETE FROM rate_limit_bucket WHERE updated_at < ?", (now - self.idle_seconds,))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return wait
+
+
+_REDIS_TAKE = """
+local capacity, rate, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local tokens, wait = {}, 0
+for i, key in ipairs(KEYS) do
+  local bucket = redis.call('HMGET', key, 'tokens', 'updated_at')
+  local count = tonumber(bucket[1]) or capacity
+  local updated_at = tonumber(bucket[2]) or now
+  tokens[i] = math.min(capacity, count + math.max(now - updated_at, 0) * rate)
+  if tokens[i] < 1 then wait = math.max(wait, (1 - tokens[i]) / rate) end
+end
+for i, key in ipairs(KEYS) do
+  if wait == 0 then tokens[i] = tokens[i] - 1 end
+  redis.call('HSET', key, 'tokens', tokens[i], 'updated_at', now)
+  redis.call('EXPIRE', key, math.ceil(capacity / rate) + 1)
+end
+return tostring(wait)
+"""
+
+
+class RedisBucketStore(BucketStore):
+    """Works with any client exposing redis-py's ``register_script``."""
+
+    name = "redis"
+
+    def __init__(self, client: Any, prefix: str = "medbridge:ratelimit:"):
+        self.prefix = prefix
+        self._take = client.register_script(_REDIS_TAKE)
+
+    def take(self, keys: Sequence[str], budget: Budget, now: float) -> float:
+        # The script returns a string: Redis would truncate a Lua number to an integer.
+        return float(
+            self._take(keys=[self.prefix + key for key in keys], args=[budget.capacity, budget.per_second, now])
+        )
+
+
+def _redis_store_from_env() -> RedisBucketStore:
+    try:
+        import redis
+    except ImportError as exc:
+        raise RuntimeError("RATE_LIMIT_BACKEND=redis requires the redis package.") from exc
+    return RedisBucketStore(redis.Redis.from_url(RATE_LIMIT_REDIS_URL))
+
+
+def create_bucket_store(name: str) -> BucketStore:
+    if name == "memory":
+        return MemoryBucketStore()
+    if name == "sqlite":
+        return SQLiteBucketStore(RATE_LIMIT_SQLITE_PATH)
+    if name == "redis":
+        return _redis_store_from_env()
+    raise RuntimeError(f"Unknown RATE_LIMIT_BACKEND: {name}")
+
+
+class RateLimiter:
+    def __init__(self, budgets: dict[str, Budget], backend: str = "memory", enabled: bool = True):
+        self.budgets = budgets
+        self.backend = backend
+        self.enabled = enabled
+        self._store: BucketStore | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def store(self) -> BucketStore:
+        with self._lock:
+            if self._store is None:
+                self._store = create_bucket_store(self.backend)
+            return self._store
+
+    def use_store(self, store: BucketStore) -> None:
+        with self._lock:
+            self._store = store
+
+    def check(self, route: str, keys: Iterable[str]) -> float:
+        """Charge one request to every key's bucket for ``route`` if none is spent; returns 0, or seconds to wait."""
+        budget = self.budgets[route]
+        now = time.time()
+        try:
+            return self.store.take([f"{route}:{key}" for key in keys], budget, now)
+        except Exception:
+            logger.warning("Rate limit store %s failed; allowing the request", self.backend, exc_info=True)
+            return 0.0
+
+
+rate_limiter = RateLimiter(load_budgets(RATE_LIMIT_BUDGETS), RATE_LIMIT_BACKEND, RATE_LIMIT_ENABLED)
+
+
+def _request_user_id(request: Request) -> int | None:
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    claims = token_claims(token)
+    user_id = claims.get("uid") if claims else None
+    return user_id if isinstance(user_id, int) else None
+
+
+def rate_limit(route: str) -> Callable[[Request], None]:
+    """Dependency that charges a request to the ``route`` budget, answering 429 once it is spent."""
+    if route not in rate_limiter.budgets:
+        raise KeyError(f"No rate limit budget named {route!r}")
+
+    def check_rate_limit(request: Request) -> None:
+        if not rate_limiter.enabled:
+            return
+        keys = [f"ip:{request.client.host if request.client else 'unknown'}"]
+        if (user_id := _request_user_id(request)) is not None:
+            keys.append(f"user:{user_id}")
+        wait = rate_limiter.check(route, keys)
+        if wait > 0:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Rate limit exceeded. Please try again later.",
+                headers={"Retry-After": str(math.ceil(wait))},
+            )
+
+    return check_rate_limit
@@ -2,23 +2,24 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
 from pydantic import BaseModel
 from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from starlette.requests import Request
-from slowapi import Limiter
-from slowapi.util import get_remote_address
-from app.db import get_session
+from app.db import get_async_session, get_session
 from app.models import User, AuditLog
 from app.auth import (
-    hash_password,
+    hash_password_async,
     verify_password,
+    verify_password_async,
+    verify_and_update_password_async,
     validate_password,
     create_access_token,
     get_current_user,
+    get_current_user_async,
     generate_patient_id,
 )
+from app.rate_limit import rate_limit
 from app.seed import seed
 
-limiter = Limiter(key_func=get_remote_address)
-
 router = APIRouter(prefix="/api/auth", tags=["auth"])
 
 
@@ -57,7 +58,7 @@ DEMO_PASSWORD = "demo1234"
 
 
 def _build_auth_response(user: User) -> AuthResponse:
-    token = create_access_token({"sub": user.email})
+    token = create_access_token({"sub": user.email, "uid": user.id})
     return AuthResponse(
         access_token=token,
         user=UserResponse(
@@ -72,8 +73,8 @@ def _build_auth_response(user: User) -> AuthResponse:
     )
 
 
-@router.post("/signup", response_model=AuthResponse)
-def signup(req: SignupRequest, session: Session = Depends(get_session)):
+@router.post("/signup", response_model=AuthResponse, dependencies=[Depends(rate_limit("signup"))])
+async def signup(req: SignupRequest, session: AsyncSession = Depends(get_async_session)):
     # Validate password strength before creating user
     password_errors = validate_password(req.password)
     if password_errors:
@@ -82,7 +83,7 @@ def signup(req: SignupRequest, session: Session = Depends(get_session)):
             detail=password_errors,
         )
 
-    existing = session.exec(select(User).where(User.email == req.email)).first()
+    existing = (await session.exec(select(User).where(User.email == req.email))).first()
     if existing:
         raise HTTPException(status_code=400, detail="Email already registered")
 
@@ -92,22 +93,30 @@ def signup(req: SignupRequest, session: Session = Depends(get_session)):
         last_name=req.last_name,
         role=req.role,
         dob=req.dob,
-        hashed_password=hash_password(req.password),
+        hashed_password=await hash_password_async(req.password),
         patient_id=generate_patient_id(),
     )
     session.add(user)
-    session.commit()
-    session.refresh(user)
+    await session.commit()
+    await session.refresh(user)
 
     return _build_auth_response(user)
 
 
-@router.post("/login", response_model=AuthResponse)
-@limiter.limit("5/minute")
-def login(request: Request, form: OAuth2PasswordRequestForm = Depends(), session: Session = Depends(get_session)):
-    user = session.exec(select(User).where(User.email == form.username)).first()
-    if not user or not verify_password(form.password, user.hashed_password):
+@router.post("/login", response_model=AuthResponse, dependencies=[Depends(rate_limit("login"))])
+async def login(
+    request: Request,
+    form: OAuth2PasswordRequestForm = Depends(),
+    session: AsyncSession = Depends(get_async_session),
+):
+    user = (await session.exec(select(User).where(User.email == form.username))).first()
+    valid, new_hash = await verify_and_update_password_async(form.password, user.hashed_password) if user else (False, None)
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid email or password")
+    if new_hash:
+        # Stored with an outdated bcrypt cost; upgrade it now that we know the password.
+        user.hashed_password = new_hash
+        session.add(user)
 
     # Capture client IP for audit log
     client_ip = request.client.host if request.client else None
@@ -118,7 +127,7 @@ def login(request: Request, form: OAuth2PasswordRequestForm = Depends(), session
         icon="eye",
         ip_address=client_ip,
     ))
-    session.commit()
+    await session.commit()
 
     return _build_auth_response(user)
 
@@ -145,13 +154,13 @@ def demo_login(session: Session = Depends(get_session)):
 
 
 @router.post("/change-password")
-def change_password(
+async def change_password(
     body: ChangePasswordRequest,
-    user: User = Depends(get_current_user),
-    session: Session = Depends(get_session),
+    user: User = Depends(get_current_user_async),
+    session: AsyncSession = Depends(get_async_session),
 ):
     # Verify old password
-    if not verify_password(body.old_password, user.hashed_password):
+    if not await verify_password_async(body.old_password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Current password is incorrect.",
@@ -165,7 +174,7 @@ def change_password(
             detail=password_errors,
         )
 
-    user.hashed_password = hash_password(body.new_password)
+    user.hashed_password = await hash_password_async(body.new_password)
     session.add(user)
     session.add(AuditLog(
         patient_id=user.patient_id,
@@ -173,8 +182,7 @@ def change_password(
         performed_by="You",
         icon="eye",
     ))
-    session.commit()
-    session.refresh(user)
+    await session.commit()
     return {"status": "ok", "message": "Password changed successfully"}
 
 
@@ -11,7 +11,10 @@ from pydantic import BaseModel
 from sqlmodel import Session, select
 
 from app.auth import get_current_user
+from app.dashboard_cache import get_snapshot, invalidate_dashboard, store_snapshot
 from app.db import get_session
+from app.document_ai import derived_record_counts
+from app.lab_catalog import lookup_lab, reference_status
 from app.models import (
     AuditLog,
     DocumentReviewItem,
@@ -83,29 +86,6 @@ def _parse_blood_pressure(value: str | None) -> tuple[int | None, int | None]:
     return int(match.group(1)), int(match.group(2))
 
 
-def _derive_status(value: float, ref_range: str | None) -> str:
-    if not ref_range:
-        return "normal"
-    if ref_range.startswith("<"):
-        try:
-            return "high" if value >= float(ref_range[1:]) else "normal"
-        except ValueError:
-            return "normal"
-    if "-" in ref_range:
-        lower, upper = ref_range.split("-", 1)
-        try:
-            low = float(lower)
-            high = float(upper)
-        except ValueError:
-            return "normal"
-        if value < low:
-            return "low"
-        if value > high:
-            return "high"
-        return "normal"
-    return "normal"
-
-
 def _latest_lab_with_keywords(labs: list[LabObservation], keywords: tuple[str, ...]) -> LabObservation | None:
     matches = [lab for lab in labs if any(keyword in lab.test_name.lower() for keyword in keywords)]
     return max(matches, key=lambda lab: lab.timestamp) if matches else None
@@ -253,10 +233,8 @@ def _compute_health_axes(
     ]
 
 
-@router.get("/dashboard")
-def get_dashboard(user: User = Depends(get_current_user), session: Session = Depends(get_session)):
-    patient_id = user.patient_id
-
+def _build_dashboard_snapshot(session: Session, patient_id: str) -> dict:
+    """Everything on the dashboard that only changes when patient data is written."""
     portals = session.exec(
         select(PortalConnection).where(PortalConnection.patient_id == patient_id)
     ).all()
@@ -297,10 +275,6 @@ def get_dashboard(user: User = Depends(get_current_user), session: Session = Dep
     review_items = session.exec(
         select(DocumentReviewItem).where(DocumentReviewItem.patient_id == patient_id).order_by(DocumentReviewItem.created_at.desc())
     ).all()
-    audit_entries = session.exec(
-        select(AuditLog).where(AuditLog.patient_id == patient_id).order_by(AuditLog.created_at.desc()).limit(12)
-    ).all()
-
     latest_review_by_document = _review_item_map(review_items)
     record_counts = Counter(record.record_type for record in records)
     abnormal_labs = [lab for lab in all_labs if (lab.status or "").lower() in {"high", "low"}]
@@ -376,16 +350,7 @@ def get_dashboard(user: User = Depends(get_current_user), session: Session = Dep
         source_mix_counter["Uploaded documents"] += 1
     source_mix = [{"label": label, "count": count} for label, count in source_mix_counter.most_common()]
 
-    derived_record_counts: dict[int, int] = {}
-    for record in records:
-        flags = json.loads(record.flags) if record.flags else []
-        for flag in flags:
-            if isinstance(flag, str) and flag.startswith("document:"):
-                try:
-                    document_id = int(flag.split(":", 1)[1])
-                except ValueError:
-                    continue
-                derived_record_counts[document_id] = derived_record_counts.get(document_id, 0) + 1
+    derived_counts = derived_record_counts(session, patient_id, [document.id for document in documents[:4]])
 
     recent_documents = []
     for document in documents[:4]:
@@ -400,7 +365,7 @@ def get_dashboard(user: User = Depends(get_current_user), session: Session = Dep
                 "status": document.extraction_status,
                 "review_summary": review_item.summary if review_item else None,
                 "review_confidence": review_item.confidence if review_item else None,
-                "derived_records_count": derived_record_counts.get(document.id, 0),
+                "derived_records_count": derived_counts.get(document.id, 0),
             }
         )
 
@@ -431,11 +396,9 @@ def get_dashboard(user: User = Depends(get_current_user), session: Session = Dep
             }
         )
 
-    last_export = next((entry for entry in audit_entries if entry.action == "FHIR R4 data exported"), None)
     translation = {
         "exportable_resources": len(records) + len(all_labs) + len(documents),
         "supported_formats": ["FHIR R4 JSON"],
-        "last_exported_at": _relative_time(last_export.created_at) if last_export else None,
         "narrative": (
             "Every approved document extraction and typed lab can be translated into a portable FHIR bundle for the next portal or provider workflow."
         ),
@@ -450,6 +413,41 @@ def get_dashboard(user: User = Depends(get_current_user), session: Session = Dep
         "source_mix": source_mix,
     }
 
+    return {
+        "connected_portals": portal_names,
+        "wearable": wearable_name,
+        "summary": summary,
+        "quantified_overview": quantified_overview,
+        "health_axes": health_axes,
+        "vitals": vitals,
+        "lab_trends": {
+            "glucose": glucose_trend,
+            "a1c": a1c_trend,
+            "cholesterol": cholesterol_trend,
+        },
+        "care_alerts": care_alerts[:4],
+        "data_coverage": data_coverage,
+        "recent_labs": labs_out,
+        "ingestion": ingestion,
+        "translation": translation,
+    }
+
+
+@router.get("/dashboard")
+def get_dashboard(user: User = Depends(get_current_user), session: Session = Depends(get_session)):
+    patient_id = user.patient_id
+
+    version, snapshot = get_snapshot(session, patient_id)
+    cache_miss = snapshot is None
+    if cache_miss:
+        snapshot = _build_dashboard_snapshot(session, patient_id)
+
+    # The audit trail changes on every request (including this one), so it is
+    # never part of the cached snapshot.
+    audit_entries = session.exec(
+        select(AuditLog).where(AuditLog.patient_id == patient_id).order_by(AuditLog.created_at.desc()).limit(12)
+    ).all()
+    last_export = next((entry for entry in audit_entries if entry.action == "FHIR R4 data exported"), None)
     audit_out = [
         {"action": entry.action, "by": entry.performed_by, "when": _relative_time(entry.created_at), "icon": entry.icon}
         for entry in audit_entries
@@ -466,30 +464,38 @@ def get_dashboard(user: User = Depends(get_current_user), session: Session = Dep
         )
         session.commit()
     except Exception as exc:
+        session.rollback()
         logger.error("Failed to write dashboard audit log for patient %s: %s", patient_id, exc)
 
+    if cache_miss:
+        try:
+            store_snapshot(session, patient_id, version, snapshot)
+            session.commit()
+        except Exception as exc:
+            session.rollback()
+            logger.warning("Failed to cache dashboard snapshot for patient %s: %s", patient_id, exc)
+
     return {
         "patient": {
             "name": f"{user.first_name} {user.last_name}",
             "dob": user.dob,
             "patient_id": user.patient_id,
-            "connected_portals": portal_names,
-            "wearable": wearable_name,
+            "connected_portals": snapshot["connected_portals"],
+            "wearable": snapshot["wearable"],
         },
-        "summary": summary,
-        "quantified_overview": quantified_overview,
-        "health_axes": health_axes,
-        "vitals": vitals,
-        "lab_trends": {
-            "glucose": glucose_trend,
-            "a1c": a1c_trend,
-            "cholesterol": cholesterol_trend,
+        "summary": snapshot["summary"],
+        "quantified_overview": snapshot["quantified_overview"],
+        "health_axes": snapshot["health_axes"],
+        "vitals": snapshot["vitals"],
+        "lab_trends": snapshot["lab_trends"],
+        "care_alerts": snapshot["care_alerts"],
+        "data_coverage": snapshot["data_coverage"],
+        "recent_labs": snapshot["recent_labs"],
+        "ingestion": snapshot["ingestion"],
+        "translation": {
+            **snapshot["translation"],
+            "last_exported_at": _relative_time(last_export.created_at) if last_export else None,
         },
-        "care_alerts": care_alerts[:4],
-        "data_coverage": data_coverage,
-        "recent_labs": labs_out,
-        "ingestion": ingestion,
-        "translation": translation,
         "audit_log": audit_out,
     }
 
@@ -513,10 +519,12 @@ def create_manual_lab_entry(
     except ValueError as exc:
         raise HTTPException(status_code=400, detail="Collected date must be YYYY-MM-DD.") from exc
 
-    status = (request.status or "").lower() or _derive_status(request.value, request.ref_range)
+    status = (request.status or "").lower() or reference_status(request.value, request.ref_range) or "normal"
+    catalog_test = lookup_lab(test_name)
     lab = LabObservation(
         patient_id=user.patient_id,
         test_name=test_name,
+        loinc=catalog_test.loinc if catalog_test else None,
         value=request.value,
         unit=unit,
         ref_range=request.ref_range,
@@ -545,6 +553,7 @@ def create_manual_lab_entry(
             icon="download",
         )
     )
+    invalidate_dashboard(session, user.patient_id)
     session.commit()
     session.refresh(lab)
 
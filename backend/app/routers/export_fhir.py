@@ -1,85 +1,178 @@
 import json
 from datetime import datetime, timezone
-from fastapi import APIRouter, Depends
-from fastapi.responses import JSONResponse
+from typing import Iterable, Iterator, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from sqlmodel import Session, select
 from ..db import get_session
 from ..models import User, LabObservation, MedicalRecord, AuditLog
 from ..auth import get_current_user
+from ..rate_limit import rate_limit
 
 router = APIRouter(prefix="/api", tags=["export"])
 
+# Rows pulled per round trip; on Postgres this is a server-side cursor.
+EXPORT_YIELD_PER = 500
+# Serialized bytes buffered before a chunk is handed to the client.
+EXPORT_CHUNK_BYTES = 64 * 1024
+EXPORT_RESOURCE_TYPES = ("Patient", "Observation", "DocumentReference")
 
-@router.get("/export/fhir")
+
+def _patient_resource(user: User) -> dict:
+    return {
+        "resourceType": "Patient",
+        "id": user.patient_id,
+        "name": [{"family": user.last_name, "given": [user.first_name]}],
+        "birthDate": user.dob,
+        "identifier": [{"system": "urn:medbridge:patient", "value": user.patient_id}],
+    }
+
+
+def _observation_resource(lab: LabObservation, pid: str) -> dict:
+    resource = {
+        "resourceType": "Observation",
+        "status": "final",
+        "category": [{"coding": [{"system": "http://terminology.hl7.org/CodeSystem/observation-category", "code": "laboratory"}]}],
+        "code": {"coding": [{"system": "http://loinc.org", "code": lab.loinc or "", "display": lab.test_name}]},
+        "subject": {"reference": f"Patient/{pid}"},
+        "effectiveDateTime": lab.timestamp.isoformat(),
+        "valueQuantity": {"value": lab.value, "unit": lab.unit or "", "system": "http://unitsofmeasure.org"},
+    }
+    if lab.source:
+        resource["performer"] = [{"display": lab.source}]
+    return resource
+
+
+def _document_reference_resource(rec: MedicalRecord, pid: str) -> dict:
+    return {
+        "resourceType": "DocumentReference",
+        "status": "current",
+        "type": {"text": rec.record_type},
+        "subject": {"reference": f"Patient/{pid}"},
+        "date": rec.date,
+        "description": rec.title,
+        "content": [{"attachment": {"contentType": "text/plain", "data": rec.description}}],
+        "context": {"related": [{"display": rec.source}]},
+    }
+
+
+def _iter_resources(
+    session: Session,
+    patient: dict,
+    resource_types: Iterable[str] = EXPORT_RESOURCE_TYPES,
+    since: Optional[datetime] = None,
+) -> Iterator[dict]:
+    """Yield FHIR resources one at a time, reading rows in ``EXPORT_YIELD_PER`` batches."""
+    pid = patient["id"]
+    if "Patient" in resource_types:
+        yield patient
+
+    if "Observation" in resource_types:
+        lab_stmt = select(LabObservation).where(LabObservation.patient_id == pid)
+        if since:
+            lab_stmt = lab_stmt.where(LabObservation.timestamp >= since)
+        labs = session.exec(lab_stmt.order_by(LabObservation.id).execution_options(yield_per=EXPORT_YIELD_PER))
+        for lab in labs:
+            yield _observation_resource(lab, pid)
+            session.expunge(lab)
+
+    if "DocumentReference" in resource_types:
+        record_stmt = select(MedicalRecord).where(MedicalRecord.patient_id == pid)
+        if since:
+            record_stmt = record_stmt.where(MedicalRecord.created_at >= since)
+        records = session.exec(record_stmt.order_by(MedicalRecord.id).execution_options(yield_per=EXPORT_YIELD_PER))
+        for rec in records:
+            yield _document_reference_resource(rec, pid)
+            session.expunge(rec)
+
+
+def _buffered(pieces: Iterable[str]) -> Iterator[bytes]:
+    buffer: list[str] = []
+    size = 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= EXPORT_CHUNK_BYTES:
+            yield "".join(buffer).encode("utf-8")
+            buffer, size = [], 0
+    if buffer:
+        yield "".join(buffer).encode("utf-8")
+
+
+def _stream_with_own_session(session: Session, render) -> Iterator[bytes]:
+    # The request-scoped session is closed before the body is streamed, so the
+    # generator opens its own on the same bind and closes it when done.
+    with Session(bind=session.get_bind()) as stream_session:
+        yield from _buffered(render(stream_session))
+
+
+def _log_export(session: Session, pid: str) -> None:
+    session.add(AuditLog(patient_id=pid, action="FHIR R4 data exported", performed_by="You", icon="download"))
+    session.commit()
+
+
+@router.get("/export/fhir", dependencies=[Depends(rate_limit("export"))])
 def export_fhir(user: User = Depends(get_current_user), session: Session = Depends(get_session)):
     pid = user.patient_id
+    patient = _patient_resource(user)
+    exported_at = datetime.now(timezone.utc).isoformat()
 
-    # Build FHIR R4 Bundle
-    bundle = {
+    # Build FHIR R4 Bundle; "entry" is left open so resources can be written as they are read.
+    envelope = json.dumps({
         "resourceType": "Bundle",
         "type": "collection",
-        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "timestamp": exported_at,
         "meta": {
-            "lastUpdated": datetime.now(timezone.utc).isoformat(),
+            "lastUpdated": exported_at,
             "source": "MedBridge Health Platform",
         },
         "entry": [],
-    }
-
-    # Patient resource
-    bundle["entry"].append({
-        "resource": {
-            "resourceType": "Patient",
-            "id": pid,
-            "name": [{"family": user.last_name, "given": [user.first_name]}],
-            "birthDate": user.dob,
-            "identifier": [{"system": "urn:medbridge:patient", "value": pid}],
-        }
     })
+    envelope_head, envelope_tail = envelope[:-2], envelope[-2:]
 
-    # Lab Observations
-    labs = session.exec(select(LabObservation).where(LabObservation.patient_id == pid)).all()
-    for lab in labs:
-        obs = {
-            "resource": {
-                "resourceType": "Observation",
-                "status": "final",
-                "category": [{"coding": [{"system": "http://terminology.hl7.org/CodeSystem/observation-category", "code": "laboratory"}]}],
-                "code": {"coding": [{"system": "http://loinc.org", "code": lab.loinc or "", "display": lab.test_name}]},
-                "subject": {"reference": f"Patient/{pid}"},
-                "effectiveDateTime": lab.timestamp.isoformat(),
-                "valueQuantity": {"value": lab.value, "unit": lab.unit or "", "system": "http://unitsofmeasure.org"},
-            }
-        }
-        if lab.source:
-            obs["resource"]["performer"] = [{"display": lab.source}]
-        bundle["entry"].append(obs)
-
-    # Medical Records as DocumentReference
-    records = session.exec(select(MedicalRecord).where(MedicalRecord.patient_id == pid)).all()
-    for rec in records:
-        doc = {
-            "resource": {
-                "resourceType": "DocumentReference",
-                "status": "current",
-                "type": {"text": rec.record_type},
-                "subject": {"reference": f"Patient/{pid}"},
-                "date": rec.date,
-                "description": rec.title,
-                "content": [{"attachment": {"contentType": "text/plain", "data": rec.description}}],
-                "context": {"related": [{"display": rec.source}]},
-            }
-        }
-        bundle["entry"].append(doc)
-
-    # Log the export
-    session.add(AuditLog(patient_id=pid, action="FHIR R4 data exported", performed_by="You", icon="download"))
-    session.commit()
+    def render_bundle(stream_session: Session) -> Iterator[str]:
+        yield envelope_head
+        for index, resource in enumerate(_iter_resources(stream_session, patient)):
+            yield ("," if index else "") + json.dumps({"resource": resource})
+        yield envelope_tail
 
-    return JSONResponse(
-        content=bundle,
-        headers={
-            "Content-Disposition": f"attachment; filename=medbridge_{pid}_fhir_export.json",
-            "Content-Type": "application/fhir+json",
-        },
+    _log_export(session, pid)
+
+    return StreamingResponse(
+        _stream_with_own_session(session, render_bundle),
+        media_type="application/fhir+json",
+        headers={"Content-Disposition": f"attachment; filename=medbridge_{pid}_fhir_export.json"},
+    )
+
+
+@router.get("/export/fhir/ndjson", dependencies=[Depends(rate_limit("export"))])
+def export_fhir_ndjson(
+    resource_type: Optional[str] = Query(default=None, alias="_type"),
+    since: Optional[datetime] = Query(default=None, alias="_since"),
+    user: User = Depends(get_current_user),
+    session: Session = Depends(get_session),
+):
+    """FHIR Bulk Data style export: one resource per line, filtered by ``_type`` and ``_since``."""
+    pid = user.patient_id
+    patient = _patient_resource(user)
+    resource_types = EXPORT_RESOURCE_TYPES
+    if resource_type:
+        resource_types = tuple(part.strip() for part in resource_type.split(",") if part.strip())
+        unsupported = [part for part in resource_types if part not in EXPORT_RESOURCE_TYPES]
+        if unsupported:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unsupported _type: {', '.join(unsupported)}. Supported: {', '.join(EXPORT_RESOURCE_TYPES)}.",
+            )
+
+    def render_ndjson(stream_session: Session) -> Iterator[str]:
+        for resource in _iter_resources(stream_session, patient, resource_types, since):
+            yield json.dumps(resource) + "\n"
+
+    _log_export(session, pid)
+
+    return StreamingResponse(
+        _stream_with_own_session(session, render_ndjson),
+        media_type="application/fhir+ndjson",
+        headers={"Content-Disposition": f"attachment; filename=medbridge_{pid}_fhir_export.ndjson"},
     )
@@ -1,5 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlmodel import Session, select
+from app.dashboard_cache import invalidate_dashboard
 from app.db import get_session
 from app.models import User, PortalConnection, AuditLog, Notification
 from app.auth import get_current_user
@@ -29,6 +30,7 @@ def connect_portal(portal_id: int, user: User = Depends(get_current_user), sessi
     p.status = "connected"
     session.add(AuditLog(patient_id=user.patient_id, action=f"Connected {p.name}", performed_by="You", icon="sync"))
     session.add(Notification(patient_id=user.patient_id, notification_type="system", title="Portal connected", message=f"{p.name} has been connected to your account"))
+    invalidate_dashboard(session, user.patient_id)
     session.commit()
     return {"status": "ok", "message": f"{p.name} connected successfully"}
 
@@ -38,5 +40,6 @@ def disconnect_portal(portal_id: int, user: User = Depends(get_current_user), se
     p = _get_portal_or_404(portal_id, user, session)
     p.status = "available"
     session.add(AuditLog(patient_id=user.patient_id, action=f"Disconnected {p.name}", performed_by="You", icon="sync"))
+    invalidate_dashboard(session, user.patient_id)
     session.commit()
     return {"status": "ok"}
@@ -1,14 +1,21 @@
 from datetime import datetime, timezone
-from sqlalchemy import false
 from fastapi import APIRouter, Depends, Query, UploadFile, File, Form, HTTPException
-from fastapi.responses import Response
-from sqlmodel import Session, select, or_
+from fastapi.responses import Response, StreamingResponse
+from sqlmodel import Session, select
 from typing import Optional
 from pydantic import BaseModel
+from app.dashboard_cache import invalidate_dashboard
 from app.db import get_session
-from app.models import User, MedicalRecord, MedicalDocument, AuditLog, DocumentReviewItem
+from app.models import User, MedicalRecord, MedicalDocument, AuditLog, DocumentBlob, DocumentReviewItem, IngestionJob
 from app.auth import get_current_user
-from app.encryption import encrypt_bytes, decrypt_bytes
+from app.blob_store import (
+    EmptyUpload,
+    UploadTooLarge,
+    document_payload_size,
+    iter_blob_chunks,
+    load_document_payload,
+    store_upload_blob,
+)
 from app.document_intelligence import (
     build_extraction_profile,
     capability_payload,
@@ -16,9 +23,17 @@ from app.document_intelligence import (
     iter_supported_record_types,
     profile_for_source_system,
 )
-from app.document_extraction import extract_document
-from app.document_ai import build_review_draft, create_review_item, persist_review_approval
-from app.document_profile_model import classify_text, model_summary
+from app.document_ai import derived_record_counts, persist_review_approval
+from app.document_profile_model import classify_text, classify_texts, model_summary
+from app.ingestion_jobs import (
+    enqueue_document_ingestion,
+    ingestion_workers_running,
+    process_ingestion_job_inline,
+    reuse_cached_ingestion,
+    worker_pool,
+)
+from app.rate_limit import rate_limit
+from app.timeline import InvalidCursor, document_timeline_type, timeline_page
 
 router = APIRouter(prefix="/api", tags=["records"])
 
@@ -33,12 +48,18 @@ ALLOWED_DOCUMENT_TYPES = {
 }
 ALLOWED_RECORD_TYPES = set(iter_supported_record_types())
 MAX_UPLOAD_BYTES = 8 * 1024 * 1024
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+MAX_CLASSIFY_BATCH = 100
 
 
 class DocumentClassificationRequest(BaseModel):
     text: str
 
 
+class DocumentBatchClassificationRequest(BaseModel):
+    texts: list[str]
+
+
 def _review_counts(payload: dict) -> dict[str, int]:
     return {
         "labs": len(payload.get("labs", [])),
@@ -56,6 +77,15 @@ def _latest_review_items(review_items: list[DocumentReviewItem]) -> dict[int, Do
     return latest_by_document
 
 
+def _latest_review_item(session: Session, document_id: int) -> DocumentReviewItem | None:
+    return session.exec(
+        select(DocumentReviewItem)
+        .where(DocumentReviewItem.document_id == document_id)
+        .order_by(DocumentReviewItem.created_at.desc(), DocumentReviewItem.id.desc())
+        .limit(1)
+    ).first()
+
+
 def _serialize_review_item(review_item: DocumentReviewItem, document: MedicalDocument) -> dict:
     payload = review_item.get_payload()
     return {
@@ -82,156 +112,112 @@ def _serialize_review_item(review_item: DocumentReviewItem, document: MedicalDoc
     }
 
 
-def _parse_sort_date(value: str) -> datetime:
-    try:
-        return datetime.strptime(value, "%Y-%m-%d")
-    except ValueError:
-        return datetime.min
-
-
-def _document_timeline_type(record_type: str) -> str:
-    if record_type in {"lab_result", "pathology_report"}:
-        return "lab"
-    if record_type == "medication_list":
-        return "medication"
-    if record_type == "imaging_report":
-        return "imaging"
-    if record_type in {"wearable_report", "vitals_sheet"}:
-        return "wearable"
-    if record_type in {
-        "care_plan",
-        "consult_note",
-        "discharge_summary",
-        "encounter_summary",
-        "history_and_physical",
-        "operative_note",
-        "progress_note",
-        "referral_note",
-        "therapy_note",
-    }:
-        return "visit"
-    return "document"
+def _serialize_timeline_record(record: MedicalRecord) -> dict:
+    return {
+        "id": record.id,
+        "type": record.record_type,
+        "title": record.title,
+        "description": record.description,
+        "date": record.date,
+        "source": record.source,
+        "provider": record.provider,
+        "flags": record.get_flags(),
+        "classification": None,
+        "download_url": None,
+    }
+
+
+def _serialize_timeline_document(
+    document: MedicalDocument,
+    review_item: DocumentReviewItem | None,
+    derived_count: int,
+) -> dict:
+    return {
+        "id": document.id,
+        "type": document_timeline_type(document.record_type),
+        "title": document.title,
+        "description": f"Uploaded {document.file_name}",
+        "date": document.document_date,
+        "source_system": document.source_system,
+        "source": document.source,
+        "facility": document.facility,
+        "provider": document.provider,
+        "flags": [
+            "Uploaded file",
+            *(["Ready for review"] if review_item and review_item.status == "pending_review" else []),
+            *([f"Extracted {derived_count} items"] if derived_count else []),
+        ],
+        "classification": document.record_type,
+        "ocr_status": document.ocr_status,
+        "extraction_status": document.extraction_status,
+        "extraction_profile": document.extraction_profile,
+        "source_family": profile_for_source_system(document.source_system).family,
+        "extraction_targets": extraction_targets_for(document.record_type, document.source_system),
+        "derived_records_count": derived_count,
+        "review_item_id": review_item.id if review_item else None,
+        "review_status": review_item.status if review_item else None,
+        "review_summary": review_item.summary if review_item else None,
+        "review_confidence": review_item.confidence if review_item else None,
+        "review_caution_flags": review_item.get_caution_flags() if review_item else [],
+        "review_counts": _review_counts(review_item.get_payload()) if review_item else None,
+        "download_url": f"/api/records/documents/{document.id}/download",
+    }
 
 
 @router.get("/records")
 def list_records(
+    response: Response,
     type: Optional[str] = Query(default=None),
     search: Optional[str] = Query(default=None),
+    cursor: Optional[str] = Query(default=None),
     skip: int = 0,
     limit: int = 50,
     user: User = Depends(get_current_user),
     session: Session = Depends(get_session),
 ):
-    record_stmt = select(MedicalRecord).where(MedicalRecord.patient_id == user.patient_id)
-    document_stmt = select(MedicalDocument).where(MedicalDocument.patient_id == user.patient_id)
-    all_record_stmt = select(MedicalRecord).where(MedicalRecord.patient_id == user.patient_id)
-    review_stmt = select(DocumentReviewItem).where(DocumentReviewItem.patient_id == user.patient_id)
-
-    if type and type != "all":
-        if type == "document":
-            record_stmt = record_stmt.where(false())
-        else:
-            record_stmt = record_stmt.where(MedicalRecord.record_type == type)
-
-    if search:
-        search_pattern = f"%{search}%"
-        record_stmt = record_stmt.where(
-            or_(
-                MedicalRecord.title.ilike(search_pattern),
-                MedicalRecord.description.ilike(search_pattern),
-                MedicalRecord.source.ilike(search_pattern),
-                MedicalRecord.provider.ilike(search_pattern),
-                MedicalRecord.flags.ilike(search_pattern),
-            )
+    try:
+        page = timeline_page(
+            session,
+            user.patient_id,
+            type=type,
+            search=search,
+            cursor=cursor,
+            skip=skip,
+            limit=limit,
         )
-        document_stmt = document_stmt.where(
-            or_(
-                MedicalDocument.title.ilike(search_pattern),
-                MedicalDocument.source_system.ilike(search_pattern),
-                MedicalDocument.source.ilike(search_pattern),
-                MedicalDocument.facility.ilike(search_pattern),
-                MedicalDocument.provider.ilike(search_pattern),
-                MedicalDocument.file_name.ilike(search_pattern),
-                MedicalDocument.record_type.ilike(search_pattern),
-                MedicalDocument.extraction_profile.ilike(search_pattern),
-            )
+    except InvalidCursor as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    if page.next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = page.next_cursor
+
+    record_ids = [key.id for key in page.keys if key.is_record]
+    document_ids = [key.id for key in page.keys if not key.is_record]
+    records = {
+        record.id: record
+        for record in session.exec(select(MedicalRecord).where(MedicalRecord.id.in_(record_ids))).all()
+    } if record_ids else {}
+    documents = {
+        document.id: document
+        for document in session.exec(select(MedicalDocument).where(MedicalDocument.id.in_(document_ids))).all()
+    } if document_ids else {}
+    latest_review_by_document = _latest_review_items(
+        session.exec(select(DocumentReviewItem).where(DocumentReviewItem.document_id.in_(document_ids))).all()
+    ) if document_ids else {}
+    derived_counts = derived_record_counts(session, user.patient_id, document_ids)
+
+    return [
+        _serialize_timeline_record(records[key.id])
+        if key.is_record
+        else _serialize_timeline_document(
+            documents[key.id],
+            latest_review_by_document.get(key.id),
+            derived_counts.get(key.id, 0),
         )
-
-    records = session.exec(record_stmt).all()
-    documents = session.exec(document_stmt).all()
-    all_patient_records = session.exec(all_record_stmt).all()
-    review_items = session.exec(review_stmt).all()
-    latest_review_by_document = _latest_review_items(review_items)
-    derived_counts: dict[int, int] = {}
-    for record in all_patient_records:
-        for flag in record.get_flags():
-            if isinstance(flag, str) and flag.startswith("document:"):
-                try:
-                    document_id = int(flag.split(":", 1)[1])
-                except ValueError:
-                    continue
-                derived_counts[document_id] = derived_counts.get(document_id, 0) + 1
-
-    if type and type != "all":
-        documents = [document for document in documents if _document_timeline_type(document.record_type) == type]
-
-    combined = [
-        {
-            "id": record.id,
-            "type": record.record_type,
-            "title": record.title,
-            "description": record.description,
-            "date": record.date,
-            "source": record.source,
-            "provider": record.provider,
-            "flags": record.get_flags(),
-            "classification": None,
-            "download_url": None,
-        }
-        for record in records
-    ] + [
-        {
-            "id": document.id,
-            "type": _document_timeline_type(document.record_type),
-            "title": document.title,
-            "description": f"Uploaded {document.file_name}",
-            "date": document.document_date,
-            "source_system": document.source_system,
-            "source": document.source,
-            "facility": document.facility,
-            "provider": document.provider,
-            "flags": [
-                "Uploaded file",
-                *(
-                    ["Ready for review"]
-                    if latest_review_by_document.get(document.id) and latest_review_by_document[document.id].status == "pending_review"
-                    else []
-                ),
-                *( [f"Extracted {derived_counts.get(document.id, 0)} items"] if derived_counts.get(document.id, 0) else []),
-            ],
-            "classification": document.record_type,
-            "ocr_status": document.ocr_status,
-            "extraction_status": document.extraction_status,
-            "extraction_profile": document.extraction_profile,
-            "source_family": profile_for_source_system(document.source_system).family,
-            "extraction_targets": extraction_targets_for(document.record_type, document.source_system),
-            "derived_records_count": derived_counts.get(document.id, 0),
-            "review_item_id": latest_review_by_document[document.id].id if latest_review_by_document.get(document.id) else None,
-            "review_status": latest_review_by_document[document.id].status if latest_review_by_document.get(document.id) else None,
-            "review_summary": latest_review_by_document[document.id].summary if latest_review_by_document.get(document.id) else None,
-            "review_confidence": latest_review_by_document[document.id].confidence if latest_review_by_document.get(document.id) else None,
-            "review_caution_flags": latest_review_by_document[document.id].get_caution_flags() if latest_review_by_document.get(document.id) else [],
-            "review_counts": _review_counts(latest_review_by_document[document.id].get_payload()) if latest_review_by_document.get(document.id) else None,
-            "download_url": f"/api/records/documents/{document.id}/download",
-        }
-        for document in documents
+        for key in page.keys
     ]
 
-    combined.sort(key=lambda item: _parse_sort_date(item["date"]), reverse=True)
-    return combined[skip: skip + limit]
-
 
-@router.post("/records/documents")
+@router.post("/records/documents", dependencies=[Depends(rate_limit("upload"))])
 async def upload_document(
     file: UploadFile = File(...),
     source_system: str = Form(...),
@@ -263,12 +249,12 @@ async def upload_document(
     if not clean_source_system or not clean_source or not clean_provider:
         raise HTTPException(status_code=400, detail="Source system, source label, and provider are required.")
 
-    payload = await file.read()
-    if not payload:
-        raise HTTPException(status_code=400, detail="Uploaded file is empty.")
-    if len(payload) > MAX_UPLOAD_BYTES:
-        raise HTTPException(status_code=400, detail="File is too large. Max size is 8 MB.")
-
+    try:
+        blob, blob_created = await store_upload_blob(session, user.patient_id, file, MAX_UPLOAD_BYTES)
+    except EmptyUpload as exc:
+        raise HTTPException(status_code=400, detail="Uploaded file is empty.") from exc
+    except UploadTooLarge as exc:
+        raise HTTPException(status_code=400, detail="File is too large. Max size is 8 MB.") from exc
     document = MedicalDocument(
         patient_id=user.patient_id,
         title=clean_title,
@@ -281,22 +267,15 @@ async def upload_document(
         file_name=file.filename or "document",
         content_type=file.content_type or "application/octet-stream",
         extraction_profile=build_extraction_profile(clean_source_system, record_type),
-        encrypted_blob=encrypt_bytes(payload),
+        blob_id=blob.id,
     )
     session.add(document)
     session.flush()
     normalized_supplied_text = (extracted_text or "").strip() or None
-    extracted_content, ocr_status, _extraction_status, text_length = extract_document(document, payload, normalized_supplied_text)
-    document.ocr_status = ocr_status
-    derived_records_count = 0
-    review_item: DocumentReviewItem | None = None
-    if document.content_type == "application/pdf" or normalized_supplied_text or extracted_content:
-        draft_build = build_review_draft(document, payload, normalized_supplied_text or extracted_content)
-        review_item = create_review_item(document, draft_build)
-        session.add(review_item)
-        document.extraction_status = "ready_for_review"
-    else:
-        document.extraction_status = "needs_review"
+    job: IngestionJob | None = None
+    reused = None if blob_created else reuse_cached_ingestion(session, document, normalized_supplied_text)
+    if reused is None:
+        job = enqueue_document_ingestion(session, document, normalized_supplied_text)
     session.add(AuditLog(
         patient_id=user.patient_id,
         action=f"Uploaded {document.file_name}",
@@ -304,10 +283,17 @@ async def upload_document(
         icon="download",
         resource=f"document:{document.id}",
     ))
+    invalidate_dashboard(session, user.patient_id)
     session.commit()
+    if job is not None:
+        if ingestion_workers_running():
+            worker_pool.wake()
+        else:
+            process_ingestion_job_inline(session, job)
+        session.refresh(job)
     session.refresh(document)
-    if review_item:
-        session.refresh(review_item)
+    derived_records_count = 0
+    review_item = _latest_review_item(session, document.id)
 
     return {
         "id": document.id,
@@ -317,7 +303,7 @@ async def upload_document(
         "source": document.source,
         "facility": document.facility,
         "provider": document.provider,
-        "type": _document_timeline_type(document.record_type),
+        "type": document_timeline_type(document.record_type),
         "classification": document.record_type,
         "ocr_status": document.ocr_status,
         "extraction_status": document.extraction_status,
@@ -325,7 +311,9 @@ async def upload_document(
         "source_family": profile_for_source_system(document.source_system).family,
         "extraction_targets": extraction_targets_for(document.record_type, document.source_system),
         "derived_records_count": derived_records_count,
-        "extracted_text_length": text_length,
+        "extracted_text_length": (job.extracted_text_length or 0) if job else reused[1],
+        "ingestion_job_id": job.id if job else None,
+        "ingestion_status": job.status if job else "reused",
         "review_item_id": review_item.id if review_item else None,
         "review_status": review_item.status if review_item else None,
         "review_summary": review_item.summary if review_item else None,
@@ -336,6 +324,32 @@ async def upload_document(
     }
 
 
+@router.get("/records/ingestion-jobs/{job_id}")
+def get_ingestion_job(
+    job_id: int,
+    user: User = Depends(get_current_user),
+    session: Session = Depends(get_session),
+):
+    job = session.get(IngestionJob, job_id)
+    if not job or job.patient_id != user.patient_id:
+        raise HTTPException(status_code=404, detail="Ingestion job not found")
+    review_item = _latest_review_item(session, job.document_id) if job.status == "succeeded" else None
+    return {
+        "id": job.id,
+        "document_id": job.document_id,
+        "status": job.status,
+        "attempts": job.attempts,
+        "max_attempts": job.max_attempts,
+        "last_error": job.last_error,
+        "extracted_text_length": job.extracted_text_length,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+        "review_item_id": review_item.id if review_item else None,
+        "review_status": review_item.status if review_item else None,
+    }
+
+
 @router.get("/records/document-intelligence")
 def get_document_intelligence_capabilities(
     user: User = Depends(get_current_user),
@@ -360,6 +374,23 @@ def classify_document_text(
     return result
 
 
+@router.post("/records/document-intelligence/classify-batch")
+def classify_document_texts(
+    request: DocumentBatchClassificationRequest,
+    user: User = Depends(get_current_user),
+):
+    texts = [text.strip() for text in request.texts]
+    if not texts or not all(texts):
+        raise HTTPException(status_code=400, detail="Every document needs text for classification.")
+    if len(texts) > MAX_CLASSIFY_BATCH:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_CLASSIFY_BATCH} documents can be classified at once.")
+
+    results = classify_texts(texts)
+    if results is None:
+        raise HTTPException(status_code=503, detail="Document profile model is not available yet.")
+    return results
+
+
 @router.get("/records/review-queue")
 def get_review_queue(
     user: User = Depends(get_current_user),
@@ -408,6 +439,7 @@ def approve_review_item(
     document.extraction_status = "approved_review"
     session.add(review_item)
     session.add(document)
+    invalidate_dashboard(session, user.patient_id)
     session.commit()
     return {"status": "approved", "created_items": created_items}
 
@@ -443,6 +475,7 @@ def reject_review_item(
             resource=f"document:{document.id}",
         )
     )
+    invalidate_dashboard(session, user.patient_id)
     session.commit()
     return {"status": "rejected"}
 
@@ -457,8 +490,19 @@ def download_document(
     if not document or document.patient_id != user.patient_id:
         raise HTTPException(status_code=404, detail="Document not found.")
 
-    return Response(
-        content=decrypt_bytes(document.encrypted_blob),
-        media_type=document.content_type,
-        headers={"Content-Disposition": f'attachment; filename="{document.file_name}"'},
-    )
+    blob_id = document.blob_id
+    headers = {"Content-Disposition": f'attachment; filename="{document.file_name}"'}
+    size = document_payload_size(session, document)
+    if size is not None:
+        headers["Content-Length"] = str(size)
+    if blob_id is None:
+        return Response(content=load_document_payload(session, document), media_type=document.content_type, headers=headers)
+
+    def stream_chunks():
+        # The request-scoped session is closed before the body is streamed.
+        with Session(bind=session.get_bind()) as stream_session:
+            blob = stream_session.get(DocumentBlob, blob_id)
+            if blob is not None:
+                yield from iter_blob_chunks(stream_session, blob)
+
+    return StreamingResponse(stream_chunks(), media_type=document.content_type, headers=headers)
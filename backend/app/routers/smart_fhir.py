@@ -4,7 +4,8 @@ SMART on FHIR OAuth2 flow for EHR integration.
 Supports Epic, Cerner, and generic FHIR servers.  The router implements
 the full authorization-code flow: build an authorize URL, exchange the
 callback code for tokens, persist encrypted tokens in a FHIRConnection
-row, and fetch/sync patient data from the remote FHIR server.
+row, and fetch/sync patient data from the remote FHIR server (see
+``app.fhir_sync``).
 """
 
 import json
@@ -16,41 +17,29 @@ from datetime import datetime, timedelta, timezone
 from typing import Optional
 
 from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy import delete
 from sqlmodel import Session, select
 
 from ..auth import get_current_user
 from ..db import get_session
-from ..encryption import encrypt_field, decrypt_field
+from ..encryption import encrypt_field
+from ..fhir_client import SMART_CLIENT_ID, ehr_config
+from ..fhir_scheduler import FHIR_SYNC_LEASE_SECONDS, lease_connection, release_connection
+from ..fhir_sync import sync_fhir_connection
 from ..models import (
     AuditLog,
     FHIRConnection,
-    LabObservation,
-    MedicalRecord,
+    FHIRSyncedResource,
     User,
 )
+from ..rate_limit import rate_limit
 
 router = APIRouter(prefix="/api/fhir", tags=["smart-fhir"])
 
 # ---------------------------------------------------------------------------
-# EHR configuration registry
+# EHR configuration (the registry itself lives in app.fhir_client)
 # ---------------------------------------------------------------------------
 
-EHR_CONFIGS = {
-    "epic": {
-        "authorize_url": "https://fhir.epic.com/interconnect-fhir-oauth/oauth2/authorize",
-        "token_url": "https://fhir.epic.com/interconnect-fhir-oauth/oauth2/token",
-        "fhir_base": "https://fhir.epic.com/interconnect-fhir-oauth/api/FHIR/R4",
-        "scopes": "openid fhirUser patient/*.read launch/patient",
-    },
-    "cerner": {
-        "authorize_url": "https://authorization.cerner.com/tenants/ec2458f2-1e24-41c8-b71b-0e701af7583d/protocols/oauth2/profiles/smart-v1/personas/patient/authorize",
-        "token_url": "https://authorization.cerner.com/tenants/ec2458f2-1e24-41c8-b71b-0e701af7583d/protocols/oauth2/profiles/smart-v1/token",
-        "fhir_base": "https://fhir-open.cerner.com/r4/ec2458f2-1e24-41c8-b71b-0e701af7583d",
-        "scopes": "openid fhirUser patient/*.read launch/patient",
-    },
-}
-
-SMART_CLIENT_ID = os.environ.get("SMART_CLIENT_ID", "medbridge-local-dev")
 SMART_REDIRECT_URI = os.environ.get(
     "SMART_REDIRECT_URI", "http://localhost:8000/api/fhir/callback"
 )
@@ -63,49 +52,15 @@ SMART_REDIRECT_URI = os.environ.get(
 def _ehr_config(ehr: str, fhir_url: Optional[str] = None) -> dict:
     """Return the configuration dict for a known EHR or build one for a
     generic FHIR server whose base URL was supplied by the caller."""
-    if ehr in EHR_CONFIGS:
-        return EHR_CONFIGS[ehr]
-    if ehr == "generic" and fhir_url:
-        # For a generic FHIR server we derive well-known endpoints from the
-        # base URL.  The caller is expected to provide a conformant server.
-        base = fhir_url.rstrip("/")
-        return {
-            "authorize_url": f"{base}/auth/authorize",
-            "token_url": f"{base}/auth/token",
-            "fhir_base": base,
-            "scopes": "openid fhirUser patient/*.read launch/patient",
-        }
+    config = ehr_config(ehr, fhir_url)
+    if config is not None:
+        return config
     raise HTTPException(
         status_code=status.HTTP_400_BAD_REQUEST,
         detail=f"Unknown EHR '{ehr}'. Use 'epic', 'cerner', or 'generic' with a fhir_url.",
     )
 
 
-def _fhir_get(url: str, access_token: str) -> dict:
-    """Perform an authenticated GET against a FHIR endpoint and return the
-    parsed JSON response.  Uses stdlib urllib so there are no extra deps."""
-    req = urllib.request.Request(
-        url,
-        headers={
-            "Authorization": f"Bearer {access_token}",
-            "Accept": "application/fhir+json",
-        },
-    )
-    try:
-        with urllib.request.urlopen(req, timeout=30) as resp:
-            return json.loads(resp.read().decode())
-    except urllib.error.HTTPError as exc:
-        raise HTTPException(
-            status_code=status.HTTP_502_BAD_GATEWAY,
-            detail=f"FHIR server returned {exc.code}: {exc.reason}",
-        )
-    except urllib.error.URLError as exc:
-        raise HTTPException(
-            status_code=status.HTTP_502_BAD_GATEWAY,
-            detail=f"Could not reach FHIR server: {exc.reason}",
-        )
-
-
 def _exchange_code_for_token(token_url: str, code: str) -> dict:
     """Exchange an OAuth2 authorization code for an access token."""
     data = urllib.parse.urlencode(
@@ -137,111 +92,6 @@ def _exchange_code_for_token(token_url: str, code: str) -> dict:
         )
 
 
-def _sync_fhir_data(
-    connection: FHIRConnection,
-    patient_id: str,
-    session: Session,
-) -> dict:
-    """Fetch Patient + Observation resources from the FHIR server and persist
-    them as local LabObservation / MedicalRecord rows.  Returns a summary."""
-    access_token = decrypt_field(connection.access_token)
-    fhir_base = connection.fhir_base_url.rstrip("/")
-    fhir_patient_id = connection.patient_fhir_id or "self"
-    synced = {"patient": False, "observations": 0, "records": 0}
-
-    # --- Patient resource ---------------------------------------------------
-    try:
-        patient = _fhir_get(f"{fhir_base}/Patient/{fhir_patient_id}", access_token)
-        if patient.get("resourceType") == "Patient":
-            synced["patient"] = True
-            # Store as a MedicalRecord for reference
-            name_parts = patient.get("name", [{}])[0]
-            display_name = " ".join(name_parts.get("given", [])) + " " + name_parts.get("family", "")
-            session.add(
-                MedicalRecord(
-                    patient_id=patient_id,
-                    record_type="visit",
-                    title=f"FHIR Patient record ({connection.ehr_name})",
-                    description=f"Patient: {display_name.strip()}. Birth date: {patient.get('birthDate', 'N/A')}.",
-                    date=datetime.now(timezone.utc).strftime("%Y-%m-%d"),
-                    source=connection.ehr_name.capitalize(),
-                    provider=connection.ehr_name.capitalize(),
-                )
-            )
-            synced["records"] += 1
-    except HTTPException:
-        pass  # Non-fatal; continue with observations
-
-    # --- Observation resources ----------------------------------------------
-    try:
-        obs_bundle = _fhir_get(
-            f"{fhir_base}/Observation?patient={fhir_patient_id}&_count=100",
-            access_token,
-        )
-        for entry in obs_bundle.get("entry", []):
-            resource = entry.get("resource", {})
-            if resource.get("resourceType") != "Observation":
-                continue
-
-            # Extract meaningful fields
-            code_obj = resource.get("code", {})
-            codings = code_obj.get("coding", [{}])
-            coding = codings[0] if codings else {}
-            test_name = coding.get("display") or code_obj.get("text", "Unknown")
-            loinc = coding.get("code")
-
-            value_qty = resource.get("valueQuantity", {})
-            value = value_qty.get("value")
-            unit = value_qty.get("unit", "")
-
-            ref_range_list = resource.get("referenceRange", [])
-            ref_range = None
-            if ref_range_list:
-                low = ref_range_list[0].get("low", {}).get("value", "")
-                high = ref_range_list[0].get("high", {}).get("value", "")
-                if low or high:
-                    ref_range = f"{low}-{high}"
-
-            effective = resource.get("effectiveDateTime", datetime.now(timezone.utc).isoformat())
-
-            if value is not None:
-                session.add(
-                    LabObservation(
-                        patient_id=patient_id,
-                        test_name=test_name,
-                        loinc=loinc,
-                        value=float(value),
-                        unit=unit,
-                        ref_range=ref_range,
-                        status="normal",
-                        source=f"FHIR:{connection.ehr_name}",
-                        timestamp=datetime.fromisoformat(effective.replace("Z", "+00:00")),
-                    )
-                )
-                synced["observations"] += 1
-
-            # Also store as MedicalRecord
-            session.add(
-                MedicalRecord(
-                    patient_id=patient_id,
-                    record_type="lab",
-                    title=test_name,
-                    description=f"{test_name}: {value} {unit}".strip(),
-                    date=effective[:10] if effective else datetime.now(timezone.utc).strftime("%Y-%m-%d"),
-                    source=f"FHIR:{connection.ehr_name}",
-                    provider=connection.ehr_name.capitalize(),
-                )
-            )
-            synced["records"] += 1
-    except HTTPException:
-        pass  # Non-fatal; we return whatever we managed to sync
-
-    connection.last_synced_at = datetime.now(timezone.utc)
-    session.add(connection)
-    session.commit()
-    return synced
-
-
 # ---------------------------------------------------------------------------
 # Endpoints
 # ---------------------------------------------------------------------------
@@ -305,6 +155,8 @@ def callback(
         token_expires_at=datetime.now(timezone.utc) + timedelta(seconds=int(expires_in)),
         patient_fhir_id=patient_fhir_id,
         status="active",
+        # Leased from the start so the scheduler leaves it to the initial sync below.
+        sync_leased_until=datetime.now(timezone.utc) + timedelta(seconds=FHIR_SYNC_LEASE_SECONDS),
     )
     session.add(conn)
     session.commit()
@@ -322,7 +174,7 @@ def callback(
     session.commit()
 
     # Initial sync
-    sync_summary = _sync_fhir_data(conn, patient_id, session)
+    sync_summary = _sync_leased(conn, patient_id, session)
 
     return {
         "status": "connected",
@@ -333,6 +185,18 @@ def callback(
     }
 
 
+def _sync_leased(conn: FHIRConnection, patient_id: str, session: Session) -> dict:
+    """Sync a connection this request holds the lease on, releasing the lease afterwards."""
+    connection_id = conn.id
+    try:
+        return sync_fhir_connection(conn, patient_id, session)
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        release_connection(session, connection_id)
+
+
 @router.get("/connections")
 def list_connections(
     user: User = Depends(get_current_user),
@@ -352,12 +216,16 @@ def list_connections(
             "token_expires_at": c.token_expires_at.isoformat() if c.token_expires_at else None,
             "created_at": c.created_at.isoformat(),
             "last_synced_at": c.last_synced_at.isoformat() if c.last_synced_at else None,
+            "next_sync_at": c.next_sync_at.isoformat() if c.next_sync_at else None,
+            "last_sync_duration_ms": c.last_sync_duration_ms,
+            "last_sync_error": c.last_sync_error,
+            "sync_failures": c.sync_failures,
         }
         for c in conns
     ]
 
 
-@router.post("/connections/{connection_id}/sync")
+@router.post("/connections/{connection_id}/sync", dependencies=[Depends(rate_limit("fhir_sync"))])
 def sync_connection(
     connection_id: int,
     user: User = Depends(get_current_user),
@@ -378,7 +246,12 @@ def sync_connection(
             detail=f"Connection is {conn.status}; cannot sync",
         )
 
-    sync_summary = _sync_fhir_data(conn, user.patient_id, session)
+    if not lease_connection(session, conn.id):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="A sync of this connection is already running",
+        )
+    sync_summary = _sync_leased(conn, user.patient_id, session)
 
     # Audit
     session.add(
@@ -411,6 +284,8 @@ def delete_connection(
         raise HTTPException(status_code=404, detail="FHIR connection not found")
 
     ehr_name = conn.ehr_name
+    # Synced rows stay; only the bookkeeping that ties them to this connection goes.
+    session.execute(delete(FHIRSyncedResource).where(FHIRSyncedResource.connection_id == conn.id))
     session.delete(conn)
     session.commit()
 
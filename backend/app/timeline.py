@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+import base64
+import binascii
+import json
+
+from sqlalchemy import Integer, false, literal, or_, union_all
+from sqlmodel import Session, select
+
+from app.models import MedicalDocument, MedicalRecord
+
+
+DOCUMENT_TIMELINE_TYPES = {
+    "lab": ("lab_result", "pathology_report"),
+    "medication": ("medication_list",),
+    "imaging": ("imaging_report",),
+    "wearable": ("wearable_report", "vitals_sheet"),
+    "visit": (
+        "care_plan",
+        "consult_note",
+        "discharge_summary",
+        "encounter_summary",
+        "history_and_physical",
+        "operative_note",
+        "progress_note",
+        "referral_note",
+        "therapy_note",
+    ),
+}
+TIMELINE_TYPE_BY_DOCUMENT_TYPE = {
+    record_type: timeline_type
+    for timeline_type, record_types in DOCUMENT_TIMELINE_TYPES.items()
+    for record_type in record_types
+}
+
+# Same-day ties sort records ahead of uploaded documents, then newest id first.
+RECORD_RANK = 1
+DOCUMENT_RANK = 0
+
+
+class InvalidCursor(ValueError):
+    """Raised when a timeline cursor was not produced by ``encode_cursor``."""
+
+
+@dataclass(frozen=True)
+class TimelineKey:
+    sort_date: str
+    rank: int
+    id: int
+
+    @property
+    def is_record(self) -> bool:
+        return self.rank == RECORD_RANK
+
+
+@dataclass
+class TimelinePage:
+    keys: list[TimelineKey]
+    next_cursor: str | None
+
+
+def document_timeline_type(record_type: str) -> str:
+    return TIMELINE_TYPE_BY_DOCUMENT_TYPE.get(record_type, "document")
+
+
+def encode_cursor(key: TimelineKey) -> str:
+    raw = json.dumps([key.sort_date, key.rank, key.id], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> TimelineKey:
+    padded = cursor + "=" * (-len(cursor) % 4)
+    try:
+        sort_date, rank, row_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (binascii.Error, UnicodeError, ValueError, TypeError) as exc:
+        raise InvalidCursor("Malformed timeline cursor.") from exc
+    if not isinstance(sort_date, str) or rank not in {RECORD_RANK, DOCUMENT_RANK} or not isinstance(row_id, int):
+        raise InvalidCursor("Malformed timeline cursor.")
+    return TimelineKey(sort_date=sort_date, rank=rank, id=row_id)
+
+
+def _after(date_column, id_column, rank: int, cursor: TimelineKey):
+    """Rows of one branch that sort strictly after ``cursor`` in (date, rank, id) DESC order."""
+    if rank < cursor.rank:
+        return date_column <= cursor.sort_date
+    if rank > cursor.rank:
+        return date_column < cursor.sort_date
+    return or_(
+        date_column < cursor.sort_date,
+        (date_column == cursor.sort_date) & (id_column < cursor.id),
+    )
+
+
+def _record_conditions(type: str | None, search: str | None) -> list | None:
+    conditions = []
+    if type and type != "all":
+        if type == "document":
+            return None
+        conditions.append(MedicalRecord.record_type == type)
+    if search:
+        pattern = f"%{search}%"
+        conditions.append(
+            or_(
+                MedicalRecord.title.ilike(pattern),
+                MedicalRecord.description.ilike(pattern),
+                MedicalRecord.source.ilike(pattern),
+                MedicalRecord.provider.ilike(pattern),
+                MedicalRecord.flags.ilike(pattern),
+            )
+        )
+    return conditions
+
+
+def _document_conditions(type: str | None, search: str | None) -> list:
+    conditions = []
+    if type and type != "all":
+        if type in DOCUMENT_TIMELINE_TYPES:
+            conditions.append(MedicalDocument.record_type.in_(DOCUMENT_TIMELINE_TYPES[type]))
+        elif type == "document":
+            conditions.append(MedicalDocument.record_type.not_in(list(TIMELINE_TYPE_BY_DOCUMENT_TYPE)))
+        else:
+            conditions.append(false())
+    if search:
+        pattern = f"%{search}%"
+        conditions.append(
+            or_(
+                MedicalDocument.title.ilike(pattern),
+                MedicalDocument.source_system.ilike(pattern),
+                MedicalDocument.source.ilike(pattern),
+                MedicalDocument.facility.ilike(pattern),
+                MedicalDocument.provider.ilike(pattern),
+                MedicalDocument.file_name.ilike(pattern),
+                MedicalDocument.record_type.ilike(pattern),
+                MedicalDocument.extraction_profile.ilike(pattern),
+            )
+        )
+    return conditions
+
+
+def _branch(date_column, id_column, patient_column, patient_id: str, rank: int, conditions: list, cursor: TimelineKey | None, fetch: int):
+    stmt = select(
+        date_column.label("sort_date"),
+        literal(rank, Integer).label("rank"),
+        id_column.label("id"),
+    ).where(patient_column == patient_id, *conditions)
+    if cursor is not None:
+        stmt = stmt.where(_after(date_column, id_column, rank, cursor))
+    # Each branch walks its (patient_id, date, id) index and stops after ``fetch`` rows,
+    # so the outer merge never touches more than two pages worth of keys.
+    return stmt.order_by(date_column.desc(), id_column.desc()).limit(fetch).subquery()
+
+
+def timeline_page(
+    session: Session,
+    patient_id: str,
+    *,
+    type: str | None = None,
+    search: str | None = None,
+    cursor: str | None = None,
+    skip: int = 0,
+    limit: int = 50,
+) -> TimelinePage:
+    """Return one page of merged record/document keys ordered newest first.
+
+    Pass the returned ``next_cursor`` back as ``cursor`` to continue; keyset pages
+    cost the same regardless of depth. ``skip`` is kept for offset-style callers.
+    """
+    after = decode_cursor(cursor) if cursor else None
+    skip = max(skip, 0)
+    limit = max(limit, 0)
+    fetch = skip + limit + 1
+
+    branches = []
+    record_conditions = _record_conditions(type, search)
+    if record_conditions is not None:
+        branches.append(
+            _branch(MedicalRecord.date, MedicalRecord.id, MedicalRecord.patient_id, patient_id, RECORD_RANK, record_conditions, after, fetch)
+        )
+    branches.append(
+        _branch(
+            MedicalDocument.document_date,
+            MedicalDocument.id,
+            MedicalDocument.patient_id,
+            patient_id,
+            DOCUMENT_RANK,
+            _document_conditions(type, search),
+            after,
+            fetch,
+        )
+    )
+
+    merged = union_all(*(select(branch) for branch in branches)).subquery() if len(branches) > 1 else branches[0]
+    rows = session.exec(
+        select(merged.c.sort_date, merged.c.rank, merged.c.id)
+        .order_by(merged.c.sort_date.desc(), merged.c.rank.desc(), merged.c.id.desc())
+        .offset(skip)
+        .limit(limit + 1)
+    ).all()
+
+    keys = [TimelineKey(sort_date=row[0], rank=int(row[1]), id=int(row[2])) for row in rows]
+    next_cursor = encode_cursor(keys[limit - 1]) if len(keys) > limit and limit else None
+    return TimelinePage(keys=keys[:limit], next_cursor=next_cursor)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""Compare the sync read endpoints with the same queries run on the async engine.
+
+Seeds a throwaway database, then drives the notifications and audit-log
+endpoints in-process with many concurrent clients. Each endpoint is measured
+twice: as served (sync handler in Starlette's threadpool on the sync engine)
+and through an async twin that runs the same query on the async engine.
+
+The dashboard, records, notifications and audit-log handlers stay sync until
+this shows a gain against Postgres. Point DATABASE_URL at a scratch Postgres
+database to run it there; by default it uses a temporary SQLite file.
+
+    python -m scripts.benchmark_async_endpoints --concurrency 100 --requests 2000
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+
+def percentile(samples: list[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def drive(client, path: str, headers: dict, requests: int, concurrency: int) -> tuple[float, list[float]]:
+    latencies: list[float] = []
+    remaining = iter(range(requests))
+
+    async def worker() -> None:
+        for _ in remaining:
+            started = time.perf_counter()
+            response = await client.get(path, headers=headers)
+            latencies.append(time.perf_counter() - started)
+            response.raise_for_status()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - started, latencies
+
+
+def seed(session, rows: int) -> None:
+    from app.auth import hash_password
+    from app.models import AuditLog, Notification, User
+
+    user = User(
+        email="bench@example.com", first_name="Bench", last_name="User", role="patient",
+        hashed_password=hash_password("BenchPass1"), patient_id="MBR-00000042",
+    )
+    session.add(user)
+    for index in range(rows):
+        session.add(Notification(
+            patient_id=user.patient_id, notification_type="info", title=f"Note {index}", message="New result",
+        ))
+        session.add(AuditLog(patient_id=user.patient_id, action="Viewed record", performed_by="You", icon="eye"))
+    session.commit()
+
+
+def add_async_twins(app) -> dict[str, str]:
+    """Register async versions of the sync endpoints under /bench/async."""
+    from fastapi import Depends
+    from sqlmodel import select
+    from sqlmodel.ext.asyncio.session import AsyncSession
+
+    from app.auth import get_current_user_async
+    from app.db import get_async_session
+    from app.models import AuditLog, Notification, User
+
+    @app.get("/bench/async/notifications")
+    async def async_notifications(
+        user: User = Depends(get_current_user_async), session: AsyncSession = Depends(get_async_session)
+    ):
+        rows = (await session.exec(
+            select(Notification).where(Notification.patient_id == user.patient_id)
+            .order_by(Notification.created_at.desc()).limit(20)
+        )).all()
+        return [{"id": row.id, "title": row.title} for row in rows]
+
+    @app.get("/bench/async/audit-log")
+    async def async_audit_log(
+        user: User = Depends(get_current_user_async), session: AsyncSession = Depends(get_async_session)
+    ):
+        rows = (await session.exec(
+            select(AuditLog).where(AuditLog.patient_id == user.patient_id)
+            .order_by(AuditLog.created_at.desc()).limit(50)
+        )).all()
+        return [{"id": row.id, "action": row.action} for row in rows]
+
+    return {
+        "notifications": "/api/notifications",
+        "audit-log": "/api/audit-log",
+    }
+
+
+async def run(args: argparse.Namespace) -> None:
+    import httpx
+    from sqlmodel import Session, SQLModel
+
+    from app.auth import create_access_token
+    from app.db import async_engine, engine
+    from app.main import app
+    from app.rate_limit import rate_limiter
+
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        seed(session, args.rows)
+    rate_limiter.enabled = False
+    endpoints = add_async_twins(app)
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'bench@example.com', 'uid': 1})}"}
+
+    print(f"{args.requests} requests per run, {args.concurrency} concurrent clients, {args.rows} rows per table")
+    print(f"{'endpoint':<14} {'mode':<6} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for name, sync_path in endpoints.items():
+            for mode, path in (("sync", sync_path), ("async", f"/bench/async/{name}")):
+                await drive(client, path, headers, min(args.requests, 50), args.concurrency)  # warm-up
+                elapsed, latencies = await drive(client, path, headers, args.requests, args.concurrency)
+                print(
+                    f"{name:<14} {mode:<6} {args.requests / elapsed:9.1f} "
+                    f"{statistics.median(latencies) * 1000:9.1f} {percentile(latencies, 0.99) * 1000:9.1f}"
+                )
+    await async_engine.dispose()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=2000, help="requests per endpoint and mode")
+    parser.add_argument("--rows", type=int, default=200, help="notifications and audit entries to seed")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Must be set before app.db creates its engines.
+        os.environ.setdefault("DATABASE_URL", f"sqlite:///{directory}/bench.db")
+        os.environ.setdefault("FHIR_SYNC_WORKERS", "0")
+        asyncio.run(run(args))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
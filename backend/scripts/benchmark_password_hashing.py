@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""Measure bcrypt throughput at a given cost, per core and through the hashing pool.
+
+Use it to pick PASSWORD_BCRYPT_ROUNDS: each +1 doubles the time per hash.
+
+    python -m scripts.benchmark_password_hashing --rounds 10 11 12 --hashes 20
+"""
+from __future__ import annotations
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import os
+import time
+
+from app.password_hashing import PASSWORD_HASH_WORKERS, build_context
+
+
+def hashes_per_second(rounds: int, hashes: int, threads: int) -> float:
+    context = build_context(rounds)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(lambda index: context.hash(f"Benchmark-{index}"), range(hashes)))
+    return hashes / (time.perf_counter() - started)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, nargs="+", default=[12])
+    parser.add_argument("--hashes", type=int, default=20, help="hashes per measurement")
+    parser.add_argument("--threads", type=int, default=max(PASSWORD_HASH_WORKERS, 1), help="pool size to measure")
+    args = parser.parse_args()
+
+    cores = os.cpu_count() or 1
+    print(f"{cores} cores, pool of {args.threads} threads")
+    for rounds in args.rounds:
+        single = hashes_per_second(rounds, args.hashes, 1)
+        pooled = hashes_per_second(rounds, args.hashes, args.threads)
+        print(
+            f"rounds={rounds:>2}  {1000 / single:7.1f} ms/hash  {single:7.2f} hashes/s per core  "
+            f"{pooled:7.2f} hashes/s with the pool ({pooled / min(args.threads, cores):.2f} per core)"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
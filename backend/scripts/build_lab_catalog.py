@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""Build the lab catalog table from the LOINC distribution.
+
+The curated rows already in the catalog (names, synonyms and reference ranges
+maintained by hand) are kept first. Laboratory-class LOINC terms with a
+common-test rank are appended in rank order, with their component, short
+name and display name as synonyms and the example UCUM unit as the unit.
+LOINC carries no reference ranges, so appended rows have none.
+
+    python -m scripts.build_lab_catalog --loinc LoincTable/Loinc.csv --top 2000
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import os
+from pathlib import Path
+
+from app.lab_catalog import CATALOG_FIELDS, LAB_CATALOG_PATH, normalize_lab_name
+
+LAB_CLASSTYPE = "1"
+# Shorter names ("ph", "ua") match too much ordinary text to be useful as synonyms.
+MIN_SYNONYM_LENGTH = 3
+
+
+def read_catalog_rows(path: Path) -> list[dict[str, str]]:
+    if not path.exists():
+        return []
+    with path.open(newline="", encoding="utf-8") as handle:
+        return list(csv.DictReader(handle, delimiter="\t", quoting=csv.QUOTE_NONE))
+
+
+def _clean(value: str | None) -> str:
+    return " ".join((value or "").replace("\t", " ").replace("|", " ").split())
+
+
+def loinc_rows(loinc_csv: Path, top: int) -> list[dict[str, str]]:
+    ranked = []
+    with loinc_csv.open(newline="", encoding="utf-8-sig") as handle:
+        for row in csv.DictReader(handle):
+            if row.get("CLASSTYPE") != LAB_CLASSTYPE or row.get("STATUS", "ACTIVE") != "ACTIVE":
+                continue
+            rank = int(row.get("COMMON_TEST_RANK") or 0)
+            if rank > 0:
+                ranked.append((rank, row))
+    ranked.sort(key=lambda item: item[0])
+
+    rows = []
+    for _rank, row in ranked[:top]:
+        name = _clean(row.get("DisplayName") or row.get("SHORTNAME") or row.get("LONG_COMMON_NAME"))
+        synonyms = [_clean(row.get(field)) for field in ("COMPONENT", "SHORTNAME", "LONG_COMMON_NAME")]
+        rows.append(
+            {
+                "loinc": row["LOINC_NUM"],
+                "name": name,
+                "unit": _clean(row.get("EXAMPLE_UCUM_UNITS")).split(";")[0].strip(),
+                "ref_range": "",
+                "synonyms": "|".join(synonym for synonym in synonyms if len(normalize_lab_name(synonym)) >= MIN_SYNONYM_LENGTH),
+            }
+        )
+    return rows
+
+
+def merge_rows(curated: list[dict[str, str]], imported: list[dict[str, str]]) -> list[dict[str, str]]:
+    seen = {row["loinc"] for row in curated}
+    return curated + [row for row in imported if row["loinc"] not in seen and not seen.add(row["loinc"])]
+
+
+def write_catalog(path: Path, rows: list[dict[str, str]]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    partial = path.with_suffix(".partial")
+    with partial.open("w", newline="", encoding="utf-8") as handle:
+        writer = csv.DictWriter(handle, CATALOG_FIELDS, delimiter="\t", quoting=csv.QUOTE_NONE, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(partial, path)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--loinc", type=Path, required=True, help="Loinc.csv from the LOINC table distribution")
+    parser.add_argument("--top", type=int, default=2000, help="how many ranked lab terms to import")
+    parser.add_argument("--curated", type=Path, default=LAB_CATALOG_PATH, help="catalog whose rows are kept first")
+    parser.add_argument("--output", type=Path, default=LAB_CATALOG_PATH)
+    args = parser.parse_args()
+
+    curated = read_catalog_rows(args.curated)
+    rows = merge_rows(curated, loinc_rows(args.loinc, args.top))
+    write_catalog(args.output, rows)
+    print(f"Wrote {len(rows)} tests ({len(curated)} curated) to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""Import a FHIR Bulk Data export into the patients connected to a FHIR server.
+
+The access token must be a system-level (backend services) token allowed to
+run ``$export``; pass it with --token or FHIR_BULK_ACCESS_TOKEN.
+
+    python -m scripts.fhir_bulk_import --base-url https://ehr.example/fhir/r4 --group practice-42
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+from datetime import datetime
+import os
+
+from sqlmodel import Session
+
+from app.db import engine
+from app.fhir_bulk import run_bulk_import
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", required=True, help="FHIR base URL, as stored on the connections")
+    parser.add_argument("--group", help="export this Group instead of all patients")
+    parser.add_argument("--since", type=datetime.fromisoformat, help="only resources updated after this ISO timestamp")
+    parser.add_argument("--token", default=os.environ.get("FHIR_BULK_ACCESS_TOKEN"))
+    args = parser.parse_args()
+    if not args.token:
+        parser.error("an access token is required (--token or FHIR_BULK_ACCESS_TOKEN)")
+
+    with Session(engine) as session:
+        summary = asyncio.run(
+            run_bulk_import(session, args.base_url, args.token, group_id=args.group, since=args.since)
+        )
+    print(
+        f"Imported {summary['records']} records and {summary['observations']} lab results "
+        f"({summary['unchanged']} unchanged, {summary['skipped']} skipped, {summary['malformed']} malformed lines)"
+    )
+    for url in summary["failed"]:
+        print(f"Failed to download {url}")
+    if summary["busy"]:
+        print(f"Skipped FHIR connections with a sync in progress: {', '.join(map(str, summary['busy']))}")
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
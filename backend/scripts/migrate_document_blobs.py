@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""Move inline document payloads into the configured chunked blob backend.
+
+Resumable: re-running picks up wherever an interrupted run stopped.
+"""
+from __future__ import annotations
+
+import argparse
+
+from sqlmodel import Session
+
+from app.blob_backends import BLOB_STORE_BACKEND
+from app.blob_store import migrate_legacy_payloads
+from app.db import engine
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--batch-size", type=int, default=50)
+    args = parser.parse_args()
+
+    with Session(engine) as session:
+        migrated = migrate_legacy_payloads(session, batch_size=args.batch_size)
+    print(f"Migrated {migrated} inline payloads into the {BLOB_STORE_BACKEND} blob backend.")
+
+
+if __name__ == "__main__":
+    main()
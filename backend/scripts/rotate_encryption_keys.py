@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""Re-encrypt stored PHI under the current ENCRYPTION_KEY.
+
+Set the new key as ENCRYPTION_KEY and the old one(s) in ENCRYPTION_PREVIOUS_KEYS
+first. Resumable: re-running continues from the last committed batch.
+"""
+from __future__ import annotations
+
+import argparse
+
+from sqlmodel import Session
+
+from app.db import engine
+from app.encryption import rotation_pending
+from app.key_rotation import KEY_ROTATION_BATCH_SIZE, rotate_encryption_keys
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--batch-size", type=int, default=KEY_ROTATION_BATCH_SIZE)
+    args = parser.parse_args()
+
+    if not rotation_pending():
+        raise SystemExit("Set ENCRYPTION_KEY and ENCRYPTION_PREVIOUS_KEYS before rotating.")
+    with Session(engine) as session:
+        rotated = rotate_encryption_keys(session, batch_size=args.batch_size)
+    for table_name, count in sorted(rotated.items()):
+        print(f"{table_name}: {count} rows re-encrypted")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,26 +2,37 @@
 from __future__ import annotations
 
 import argparse
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, as_completed, wait
 import json
 import math
+import os
 import random
 import re
-from collections import Counter, defaultdict
-from dataclasses import dataclass
+import sys
+import time
+import zlib
+from collections import Counter
+from dataclasses import dataclass, field
 from datetime import date, timedelta
+from itertools import islice
 from pathlib import Path
-from typing import Iterable
+from typing import Callable, Iterable, Iterator
 
 from app.document_intelligence import (
     DOCUMENT_TYPE_LABELS,
     SOURCE_SYSTEMS,
     DEFAULT_TARGETS_BY_RECORD_TYPE,
 )
+from app.document_profile_model import CompiledLabelModel, binary_model_path, compile_model, write_binary_model
+from app.pdf_text import extract_pdf_text
 
 
 TOKEN_RE = re.compile(r"[a-z0-9]+")
 TRAINING_RANDOM_SEED = 1511
 DEFAULT_EXAMPLE_COUNT = 1000
+# Tokens seen fewer times than this across the whole corpus are left out of the vocabulary.
+MIN_TOKEN_FREQUENCY = 2
+LABEL_FIELDS = {"source_system_model": "source_system", "record_type_model": "record_type"}
 
 PATIENTS = [
     ("Marcus Johnson", "1985-04-19"),
@@ -255,126 +266,299 @@ def render_record_lines(source_slug: str, source_display: str, record_type: str,
     return lines
 
 
-def generate_examples(count: int, corpus_dir: Path) -> list[Example]:
+def iter_synthetic_examples(count: int, corpus_dir: Path | None) -> Iterator[Example]:
+    """Yield synthetic examples, writing each one's PDF to ``corpus_dir`` when given.
+
+    The stream is deterministic, so a second pass (evaluation) can regenerate it
+    without writing the PDFs again.
+    """
     rng = random.Random(TRAINING_RANDOM_SEED)
-    corpus_dir.mkdir(parents=True, exist_ok=True)
+    if corpus_dir is not None:
+        corpus_dir.mkdir(parents=True, exist_ok=True)
     eligible_sources = [profile for profile in SOURCE_SYSTEMS if profile.slug != "generic_scanned_record"]
-    examples: list[Example] = []
 
     for index in range(count):
         profile = rng.choice(eligible_sources)
         record_type = rng.choice(profile.likely_record_types)
         lines = render_record_lines(profile.slug, profile.display_name, record_type, rng)
-        pdf_path = corpus_dir / f"{index:04d}_{profile.slug}_{record_type}.pdf"
-        pdf_path.write_bytes(build_pdf(lines))
-        examples.append(
-            Example(
-                text="\n".join(lines),
-                source_system=profile.slug,
-                record_type=record_type,
-                pdf_path=str(pdf_path),
-            )
+        pdf_path = (corpus_dir or Path(".")) / f"{index:04d}_{profile.slug}_{record_type}.pdf"
+        if corpus_dir is not None:
+            pdf_path.write_bytes(build_pdf(lines))
+        yield Example(
+            text="\n".join(lines),
+            source_system=profile.slug,
+            record_type=record_type,
+            pdf_path=str(pdf_path),
         )
 
-    return examples
 
+def iter_corpus_examples(corpus_dir: Path) -> Iterator[Example]:
+    """Yield labelled documents listed in ``corpus_dir/manifest.jsonl``.
+
+    Each manifest line names a ``.pdf`` or ``.txt`` file (``file`` or
+    ``pdf_name``) relative to the directory plus its ``source_system`` and
+    ``record_type``. Text is read later, in the worker that counts the document.
+    """
+    with (corpus_dir / "manifest.jsonl").open() as manifest:
+        for line in manifest:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            yield Example(
+                text="",
+                source_system=entry["source_system"],
+                record_type=entry["record_type"],
+                pdf_path=str(corpus_dir / (entry.get("file") or entry["pdf_name"])),
+            )
 
-def split_examples(examples: list[Example]) -> tuple[list[Example], list[Example]]:
-    rng = random.Random(TRAINING_RANDOM_SEED)
-    shuffled = examples[:]
-    rng.shuffle(shuffled)
-    cutoff = int(len(shuffled) * 0.8)
-    return shuffled[:cutoff], shuffled[cutoff:]
+
+def iter_jsonl_examples(path: Path) -> Iterator[Example]:
+    """Yield examples from JSONL lines carrying ``text``, ``source_system`` and ``record_type``."""
+    with path.open() as handle:
+        for line in handle:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            yield Example(
+                text=entry["text"],
+                source_system=entry["source_system"],
+                record_type=entry["record_type"],
+                pdf_path="",
+            )
 
 
-def train_nb_model(examples: list[Example], label_getter) -> dict:
-    label_examples: dict[str, list[Counter[str]]] = defaultdict(list)
-    label_counts: Counter[str] = Counter()
-    vocabulary: Counter[str] = Counter()
+def example_text(example: Example) -> str:
+    if example.text or not example.pdf_path:
+        return example.text
+    path = Path(example.pdf_path)
+    if path.suffix.lower() == ".pdf":
+        return extract_pdf_text(path.read_bytes(), parallel=False).text
+    return path.read_text(errors="ignore")
+
+
+def is_validation(index: int) -> bool:
+    # Hash the stream position instead of shuffling, so the split needs no
+    # buffering and every pass over the same input agrees on it.
+    return zlib.crc32(f"{TRAINING_RANDOM_SEED}:{index}".encode()) % 5 == 0
+
+
+@dataclass
+class LabelCounts:
+    """Raw per-label document and token counts, mergeable across batches and runs."""
+
+    document_counts: Counter[str] = field(default_factory=Counter)
+    token_counts: dict[str, Counter[str]] = field(default_factory=dict)
+
+    def add(self, label: str, tokens: Counter[str]) -> None:
+        self.document_counts[label] += 1
+        self.token_counts.setdefault(label, Counter()).update(tokens)
+
+    def merge(self, other: "LabelCounts") -> None:
+        self.document_counts.update(other.document_counts)
+        for label, tokens in other.token_counts.items():
+            self.token_counts.setdefault(label, Counter()).update(tokens)
+
+    @classmethod
+    def from_model(cls, bundle: dict, train_documents: int) -> "LabelCounts":
+        """Recover counts from a trained model so new data can be merged into it.
+
+        Tokens below the vocabulary cutoff were dropped when that model was
+        built, so they start from zero. Models written before
+        ``document_counts`` was stored get them back from the priors.
+        """
+        document_counts = bundle.get("document_counts") or {
+            label: round(math.exp(prior) * train_documents) for label, prior in bundle["priors"].items()
+        }
+        return cls(
+            document_counts=Counter(document_counts),
+            token_counts={label: Counter(tokens) for label, tokens in bundle["token_counts"].items()},
+        )
+
+
+def count_batch(batch: list[tuple[int, Example]]) -> tuple[dict[str, LabelCounts], int]:
+    """Map step: count the training examples of one batch. Runs in a pool worker."""
+    counts = {name: LabelCounts() for name in LABEL_FIELDS}
+    counted = 0
+    for index, example in batch:
+        if is_validation(index):
+            continue
+        tokens = Counter(tokenize(example_text(example)))
+        for name, label_field in LABEL_FIELDS.items():
+            counts[name].add(getattr(example, label_field), tokens)
+        counted += 1
+    return counts, counted
 
-    for example in examples:
-        tokens = tokenize(example.text)
-        token_counter = Counter(tokens)
-        label = label_getter(example)
-        label_examples[label].append(token_counter)
-        label_counts[label] += 1
-        vocabulary.update(token_counter)
 
-    vocab = {token for token, freq in vocabulary.items() if freq >= 2}
+def build_nb_model(counts: LabelCounts) -> dict:
+    """Reduce step: prune rare tokens and turn merged counts into a model bundle."""
+    vocabulary: Counter[str] = Counter()
+    for tokens in counts.token_counts.values():
+        vocabulary.update(tokens)
+    vocab = {token for token, freq in vocabulary.items() if freq >= MIN_TOKEN_FREQUENCY}
+
     token_counts: dict[str, dict[str, int]] = {}
     total_tokens: dict[str, int] = {}
-    total_examples = sum(label_counts.values())
-
-    for label, counters in label_examples.items():
-        merged = Counter()
-        for counter in counters:
-            for token, count in counter.items():
-                if token in vocab:
-                    merged[token] += count
-        token_counts[label] = dict(merged)
-        total_tokens[label] = sum(merged.values())
+    for label, tokens in counts.token_counts.items():
+        kept = {token: count for token, count in tokens.items() if token in vocab}
+        token_counts[label] = kept
+        total_tokens[label] = sum(kept.values())
 
+    total_examples = sum(counts.document_counts.values())
     priors = {
         label: math.log(count / total_examples)
-        for label, count in label_counts.items()
+        for label, count in counts.document_counts.items()
     }
 
     return {
-        "labels": sorted(label_counts.keys()),
+        "labels": sorted(counts.document_counts.keys()),
         "priors": priors,
         "token_counts": token_counts,
         "total_tokens": total_tokens,
         "vocab_size": len(vocab),
+        "document_counts": dict(counts.document_counts),
     }
 
 
-def predict(model: dict, text: str) -> tuple[str, float]:
-    tokens = [token for token in tokenize(text) if token]
-    scores: dict[str, float] = {}
-
-    for label in model["labels"]:
-        score = float(model["priors"][label])
-        denominator = model["total_tokens"].get(label, 0) + model["vocab_size"]
-        label_token_counts = model["token_counts"].get(label, {})
-        for token in tokens:
-            score += math.log((label_token_counts.get(token, 0) + 1) / max(denominator, 1))
-        scores[label] = score
-
-    best_label = max(scores, key=scores.get)
-    max_score = scores[best_label]
-    denominator = sum(math.exp(score - max_score) for score in scores.values())
-    confidence = 1.0 / denominator if denominator else 0.0
-    return best_label, confidence
-
-
-def accuracy(model: dict, examples: list[Example], label_getter) -> float:
-    if not examples:
-        return 0.0
-    correct = 0
-    for example in examples:
-        predicted, _ = predict(model, example.text)
-        if predicted == label_getter(example):
-            correct += 1
-    return round(correct / len(examples), 4)
-
-
-def write_manifest(examples: list[Example], manifest_path: Path) -> None:
-    manifest_path.write_text(
-        "\n".join(
-            json.dumps(
-                {
-                    "pdf_name": Path(example.pdf_path).name,
-                    "source_system": example.source_system,
-                    "record_type": example.record_type,
-                }
-            )
-            for example in examples
+_evaluation_models: dict[str, CompiledLabelModel] = {}
+
+
+def init_evaluator(bundles: dict[str, dict]) -> None:
+    _evaluation_models.clear()
+    _evaluation_models.update({name: CompiledLabelModel.from_bundle(bundle) for name, bundle in bundles.items()})
+
+
+def evaluate_batch(batch: list[tuple[int, Example]]) -> tuple[dict[str, int], int]:
+    """Count correct predictions on the validation examples of one batch. Runs in a pool worker."""
+    examples = [example for index, example in batch if is_validation(index)]
+    token_lists = [tokenize(example_text(example)) for example in examples]
+    correct = {}
+    for name, label_field in LABEL_FIELDS.items():
+        predictions = _evaluation_models[name].predict_batch(token_lists)
+        correct[name] = sum(
+            prediction["label"] == getattr(example, label_field)
+            for prediction, example in zip(predictions, examples)
         )
-    )
+    return correct, len(examples)
+
+
+def batched(examples: Iterable[Example], size: int) -> Iterator[list[tuple[int, Example]]]:
+    numbered = enumerate(examples)
+    while batch := list(islice(numbered, size)):
+        yield batch
+
+
+def map_batches(
+    function: Callable,
+    batches: Iterable[list[tuple[int, Example]]],
+    workers: int,
+    initializer: Callable | None = None,
+    initargs: tuple = (),
+) -> Iterator:
+    """Yield ``function(batch)`` for every batch, in completion order.
+
+    At most ``2 * workers`` batches are in flight, so the input is streamed
+    rather than read up front. ``workers=0`` runs everything in this process.
+    """
+    if workers <= 0:
+        if initializer:
+            initializer(*initargs)
+        yield from map(function, batches)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as executor:
+        pending: set[Future] = set()
+        for batch in batches:
+            pending.add(executor.submit(function, batch))
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in as_completed(pending):
+            yield future.result()
+
+
+class Throughput:
+    def __init__(self, phase: str, report_every: int = 10_000):
+        self.phase = phase
+        self.report_every = report_every
+        self.documents = 0
+        self.started = time.perf_counter()
+        self._next_report = report_every
+
+    def add(self, documents: int) -> None:
+        self.documents += documents
+        if self.documents >= self._next_report:
+            print(f"{self.phase}: {self.documents} docs, {self.per_second:.0f} docs/sec", file=sys.stderr)
+            self._next_report += self.report_every
+
+    @property
+    def seconds(self) -> float:
+        return time.perf_counter() - self.started
+
+    @property
+    def per_second(self) -> float:
+        return self.documents / self.seconds if self.seconds > 0 else 0.0
+
+
+def count_examples(examples: Iterable[Example], workers: int, batch_size: int) -> tuple[dict[str, LabelCounts], int, Throughput]:
+    """Map-reduce token counting over the training split of ``examples``."""
+    counts = {name: LabelCounts() for name in LABEL_FIELDS}
+    throughput = Throughput("count")
+    documents = 0
+    for batch_counts, counted in map_batches(count_batch, batched(examples, batch_size), workers):
+        for name, label_counts in batch_counts.items():
+            counts[name].merge(label_counts)
+        documents += counted
+        throughput.add(counted)
+    return counts, documents, throughput
+
+
+def evaluate_examples(
+    examples: Iterable[Example],
+    bundles: dict[str, dict],
+    workers: int,
+    batch_size: int,
+) -> tuple[dict[str, float], int, Throughput]:
+    """Return per-model accuracy on the validation split of ``examples``."""
+    correct = Counter()
+    throughput = Throughput("evaluate")
+    documents = 0
+    for batch_correct, evaluated in map_batches(
+        evaluate_batch, batched(examples, batch_size), workers, init_evaluator, (bundles,)
+    ):
+        correct.update(batch_correct)
+        documents += evaluated
+        throughput.add(evaluated)
+    accuracy = {name: round(correct[name] / documents, 4) if documents else 0.0 for name in LABEL_FIELDS}
+    return accuracy, documents, throughput
+
+
+def write_manifest(examples: Iterable[Example], manifest_path: Path) -> Iterator[Example]:
+    """Pass ``examples`` through, recording each one in the manifest as it goes by."""
+    with manifest_path.open("w") as manifest:
+        for index, example in enumerate(examples):
+            if index:
+                manifest.write("\n")
+            manifest.write(
+                json.dumps(
+                    {
+                        "pdf_name": Path(example.pdf_path).name,
+                        "source_system": example.source_system,
+                        "record_type": example.record_type,
+                    }
+                )
+            )
+            yield example
 
 
 def main() -> None:
-    parser = argparse.ArgumentParser(description="Generate a synthetic medical PDF corpus and train a lightweight profile model.")
+    parser = argparse.ArgumentParser(description="Train the lightweight document profile model on a synthetic or labelled corpus.")
+    parser.add_argument(
+        "--input",
+        type=Path,
+        help="Labelled corpus to train on: a JSONL file of {text, source_system, record_type}, or a directory "
+        "with a manifest.jsonl of {file, source_system, record_type}. Defaults to a generated synthetic corpus.",
+    )
     parser.add_argument("--count", type=int, default=DEFAULT_EXAMPLE_COUNT, help="Number of synthetic PDFs to generate.")
     parser.add_argument(
         "--corpus-dir",
@@ -388,42 +572,84 @@ def main() -> None:
         default=Path(__file__).resolve().parents[1] / "generated",
         help="Directory where the trained model and report will be written.",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Worker processes for tokenizing and counting; 0 runs in this process.",
+    )
+    parser.add_argument("--batch-size", type=int, default=500, help="Documents per worker task.")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Merge the new counts into the existing model in --artifact-dir instead of training from scratch.",
+    )
+    parser.add_argument(
+        "--compile-only",
+        action="store_true",
+        help="Skip training and rebuild the binary model from the existing JSON export.",
+    )
     args = parser.parse_args()
 
-    examples = generate_examples(args.count, args.corpus_dir)
-    train_examples, validation_examples = split_examples(examples)
-
-    source_model = train_nb_model(train_examples, lambda example: example.source_system)
-    record_model = train_nb_model(train_examples, lambda example: example.record_type)
+    model_path = args.artifact_dir / "document_profile_model.json"
+    if args.compile_only:
+        write_binary_model(binary_model_path(model_path), compile_model(json.loads(model_path.read_text())))
+        print(f"Wrote {binary_model_path(model_path)}")
+        return
 
     args.artifact_dir.mkdir(parents=True, exist_ok=True)
     manifest_path = args.artifact_dir / "synthetic_document_manifest.jsonl"
     report_path = args.artifact_dir / "document_profile_training_report.json"
-    model_path = args.artifact_dir / "document_profile_model.json"
 
-    write_manifest(examples, manifest_path)
+    def examples(first_pass: bool) -> Iterator[Example]:
+        if args.input is None:
+            synthetic = iter_synthetic_examples(args.count, args.corpus_dir if first_pass else None)
+            return write_manifest(synthetic, manifest_path) if first_pass else synthetic
+        if args.input.is_dir():
+            return iter_corpus_examples(args.input)
+        return iter_jsonl_examples(args.input)
+
+    counts = {name: LabelCounts() for name in LABEL_FIELDS}
+    base_train_documents = 0
+    if args.incremental:
+        base = json.loads(model_path.read_text())
+        base_train_documents = base.get("summary", {}).get("train_documents", 0)
+        for name in LABEL_FIELDS:
+            counts[name].merge(LabelCounts.from_model(base[name], base_train_documents))
+
+    new_counts, train_documents, counting = count_examples(examples(True), args.workers, args.batch_size)
+    for name, label_counts in new_counts.items():
+        counts[name].merge(label_counts)
+    bundles = {name: build_nb_model(label_counts) for name, label_counts in counts.items()}
+
+    accuracy, validation_documents, evaluation = evaluate_examples(
+        examples(False), bundles, args.workers, args.batch_size
+    )
 
     report = {
-        "generated_documents": len(examples),
-        "train_documents": len(train_examples),
-        "validation_documents": len(validation_examples),
-        "source_system_accuracy": accuracy(source_model, validation_examples, lambda example: example.source_system),
-        "record_type_accuracy": accuracy(record_model, validation_examples, lambda example: example.record_type),
-        "source_system_classes": source_model["labels"],
-        "record_type_classes": record_model["labels"],
-        "corpus_dir": str(args.corpus_dir),
-        "manifest_file": manifest_path.name,
+        "generated_documents": train_documents + validation_documents,
+        "train_documents": base_train_documents + train_documents,
+        "validation_documents": validation_documents,
+        "source_system_accuracy": accuracy["source_system_model"],
+        "record_type_accuracy": accuracy["record_type_model"],
+        "source_system_classes": bundles["source_system_model"]["labels"],
+        "record_type_classes": bundles["record_type_model"]["labels"],
+        "incremental": args.incremental,
+        "base_train_documents": base_train_documents,
+        "workers": args.workers,
+        "training_docs_per_second": round(counting.per_second, 1),
+        "evaluation_docs_per_second": round(evaluation.per_second, 1),
+        "corpus_dir": str(args.input or args.corpus_dir),
+        "manifest_file": manifest_path.name if args.input is None else None,
         "note": "Synthetic training data is useful for pipeline bootstrapping, not as a substitute for de-identified real clinical corpora.",
     }
 
-    model_payload = {
-        "summary": report,
-        "source_system_model": source_model,
-        "record_type_model": record_model,
-    }
+    model_payload = {"summary": report, **bundles}
 
     report_path.write_text(json.dumps(report, indent=2))
+    # The JSON keeps raw token counts for debugging; the app loads the binary artifact.
     model_path.write_text(json.dumps(model_payload))
+    write_binary_model(binary_model_path(model_path), compile_model(model_payload))
 
     print(json.dumps(report, indent=2))
 
@@ -1,42 +1,64 @@
 import pytest
 from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
 from sqlmodel import SQLModel, Session, create_engine
-from sqlmodel.pool import StaticPool
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app.main import app
-from app.db import get_session
+from app.auth_cache import clear_auth_cache
+from app.dashboard_cache import clear_dashboard_cache
+from app.db import get_async_session, get_session
+from app.db_config import configure_engine
 from app.auth import hash_password, create_access_token
 from app.models import User
-from app.routers import auth as auth_router_module
+from app.rate_limit import rate_limiter
+
+
+@pytest.fixture(name="db_path")
+def db_path_fixture(tmp_path):
+    # A file rather than an in-memory database, so the sync and async engines share it.
+    return tmp_path / "test.db"
 
 
 @pytest.fixture(name="session")
-def session_fixture():
-    engine = create_engine(
-        "sqlite://",
-        connect_args={"check_same_thread": False},
-        poolclass=StaticPool,
-    )
+def session_fixture(db_path):
+    url = f"sqlite:///{db_path}"
+    engine = create_engine(url, connect_args={"check_same_thread": False})
+    configure_engine(engine, url)
     SQLModel.metadata.create_all(engine)
     with Session(engine) as session:
         yield session
+    engine.dispose()
 
 
 @pytest.fixture(name="client")
-def client_fixture(session: Session):
+def client_fixture(session: Session, db_path):
+    # NullPool: each TestClient request runs on its own event loop, so connections must not be reused.
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}", poolclass=NullPool)
+
     def get_session_override():
         return session
 
+    async def get_async_session_override():
+        async with AsyncSession(async_engine, expire_on_commit=False) as async_session:
+            yield async_session
+
     app.dependency_overrides[get_session] = get_session_override
+    app.dependency_overrides[get_async_session] = get_async_session_override
 
     # Disable rate limiting during tests so login calls are not throttled
-    auth_router_module.limiter.enabled = False
+    rate_limiter.enabled = False
+    clear_dashboard_cache()
+    clear_auth_cache()
 
     client = TestClient(app)
     yield client
 
     app.dependency_overrides.clear()
-    auth_router_module.limiter.enabled = True
+    clear_dashboard_cache()
+    clear_auth_cache()
+    rate_limiter.enabled = True
 
 
 @pytest.fixture(name="demo_user")
@@ -1,8 +1,19 @@
-"""Tests for authentication endpoints: signup, login, me, change-password."""
+"""Tests for authentication endpoints: signup, login, me, change-password, and the auth cache."""
+import asyncio
+import threading
+
+import httpx
 import pytest
 from fastapi.testclient import TestClient
+from jose import jwt
+from sqlalchemy import event
 from sqlmodel import Session
 
+from app import auth as auth_module, password_hashing
+from app.main import app
+from app.auth import create_access_token
+from app.models import User
+
 
 # ---------------------------------------------------------------------------
 # Signup
@@ -164,3 +175,133 @@ class TestChangePassword:
         )
         assert resp.status_code == 400, f"Expected 400, got {resp.status_code}: {resp.text}"
         assert "incorrect" in resp.json()["detail"].lower()
+
+
+# ---------------------------------------------------------------------------
+# Auth cache
+# ---------------------------------------------------------------------------
+
+class TestAuthCache:
+    """Verified tokens and user rows are cached between requests."""
+
+    def _user_selects(self, session: Session) -> list[str]:
+        statements: list[str] = []
+        event.listen(
+            session.get_bind(),
+            "before_cursor_execute",
+            lambda _conn, _cursor, statement, *_args: statements.append(statement),
+        )
+        return statements
+
+    def test_token_carries_user_id(self, client: TestClient, auth_headers: dict, demo_user):
+        token = auth_headers["Authorization"].split()[1]
+        assert jwt.get_unverified_claims(token)["uid"] == demo_user.id
+
+    def test_repeat_requests_skip_verification_and_user_query(
+        self, client: TestClient, auth_headers: dict, session: Session, monkeypatch
+    ):
+        decodes = []
+        real_decode = auth_module.jwt.decode
+        monkeypatch.setattr(auth_module.jwt, "decode", lambda *args, **kw: decodes.append(1) or real_decode(*args, **kw))
+        statements = self._user_selects(session)
+
+        for _ in range(3):
+            session.expunge_all()
+            assert client.get("/api/auth/me", headers=auth_headers).status_code == 200
+
+        assert len(decodes) == 1
+        assert len([s for s in statements if 'FROM "user"' in s or "FROM user" in s]) == 1
+
+    def test_settings_and_role_changes_are_seen_immediately(
+        self, client: TestClient, auth_headers: dict, session: Session, demo_user
+    ):
+        assert client.get("/api/auth/me", headers=auth_headers).json()["first_name"] == "Test"
+        resp = client.put("/api/settings", json={"first_name": "Renamed"}, headers=auth_headers)
+        assert resp.status_code == 200, resp.text
+        session.expunge_all()
+        assert client.get("/api/auth/me", headers=auth_headers).json()["first_name"] == "Renamed"
+
+        user = session.get(User, demo_user.id)
+        user.role = "provider"
+        session.add(user)
+        session.commit()
+        session.expunge_all()
+        assert client.get("/api/auth/me", headers=auth_headers).json()["role"] == "provider"
+
+    def test_tokens_without_user_id_still_authenticate(self, client: TestClient, demo_user):
+        token = create_access_token({"sub": demo_user.email})
+        resp = client.get("/api/auth/me", headers={"Authorization": f"Bearer {token}"})
+        assert resp.status_code == 200 and resp.json()["id"] == demo_user.id
+
+
+# ---------------------------------------------------------------------------
+# Password hashing pool
+# ---------------------------------------------------------------------------
+
+class TestPasswordHashing:
+    """bcrypt runs on a bounded pool and outdated hashes are upgraded on login."""
+
+    def test_login_rehashes_an_outdated_cost(self, client: TestClient, session: Session, demo_user, monkeypatch):
+        monkeypatch.setattr(password_hashing, "pwd_context", password_hashing.build_context(5))
+        demo_user.hashed_password = password_hashing.build_context(4).hash("TestPass1")
+        session.add(demo_user)
+        session.commit()
+
+        resp = client.post("/api/auth/login", data={"username": "test@example.com", "password": "TestPass1"})
+
+        assert resp.status_code == 200, resp.text
+        session.refresh(demo_user)
+        assert demo_user.hashed_password.startswith("$2b$05$")
+        stored = demo_user.hashed_password
+        assert client.post("/api/auth/login", data={"username": "test@example.com", "password": "TestPass1"}).status_code == 200
+        session.refresh(demo_user)
+        assert demo_user.hashed_password == stored
+
+    def test_full_queue_is_rejected_with_503(self, client: TestClient, demo_user, monkeypatch):
+        monkeypatch.setattr(password_hashing, "PASSWORD_HASH_MAX_QUEUE", 0)
+        monkeypatch.setattr(auth_module, "METRICS_TOKEN", "metrics-secret")
+        metrics = {"X-Metrics-Token": "metrics-secret"}
+        before = client.get("/api/health/password-hashing", headers=metrics).json()
+
+        resp = client.post("/api/auth/login", data={"username": "test@example.com", "password": "TestPass1"})
+
+        assert resp.status_code == 503 and resp.headers["Retry-After"] == "1"
+        stats = client.get("/api/health/password-hashing", headers=metrics).json()
+        assert stats["rejected"] == before["rejected"] + 1 and stats["queued"] == 0
+
+    def test_other_endpoints_respond_while_the_hash_queue_is_full(self, client: TestClient, demo_user, monkeypatch):
+        release = threading.Event()
+
+        class BlockedContext:
+            def verify_and_update(self, plain, hashed):
+                release.wait(10)
+                return False, None
+
+        # More waiting logins than Starlette's 40 request threads.
+        max_queue = 50
+        monkeypatch.setattr(password_hashing, "pwd_context", BlockedContext())
+        monkeypatch.setattr(password_hashing, "PASSWORD_HASH_MAX_QUEUE", max_queue)
+        workers = password_hashing.hashing_stats()["workers"]
+        form = {"username": "test@example.com", "password": "TestPass1"}
+
+        async def queue_filled():
+            while password_hashing.hashing_stats()["queued"] < max_queue:
+                await asyncio.sleep(0.01)
+
+        async def scenario():
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+                logins = [asyncio.create_task(http.post("/api/auth/login", data=form)) for _ in range(workers + max_queue)]
+                try:
+                    await asyncio.wait_for(queue_filled(), 5)
+                    rejected = await asyncio.wait_for(http.post("/api/auth/login", data=form), 5)
+                    health = await asyncio.wait_for(http.get("/api/health"), 5)
+                finally:
+                    release.set()
+                return rejected, health, await asyncio.gather(*logins)
+
+        rejected, health, logins = asyncio.run(scenario())
+
+        assert rejected.status_code == 503
+        assert health.status_code == 200
+        assert {response.status_code for response in logins} == {401}
@@ -119,6 +119,7 @@ class TestDashboard:
         labs = session.exec(select(LabObservation).where(LabObservation.patient_id == demo_user.patient_id)).all()
         assert len(labs) == 1
         assert labs[0].source == "Manual entry"
+        assert labs[0].loinc == "1558-6"
 
         records = session.exec(select(MedicalRecord).where(MedicalRecord.patient_id == demo_user.patient_id)).all()
         assert len(records) == 1
@@ -127,3 +128,68 @@ class TestDashboard:
         dashboard = client.get("/api/dashboard", headers=auth_headers)
         assert dashboard.status_code == 200
         assert dashboard.json()["summary"]["manual_lab_entries"] == 1
+
+    def test_dashboard_snapshot_is_cached_until_a_write_invalidates_it(
+        self, client: TestClient, auth_headers: dict, session: Session, demo_user
+    ):
+        portal = PortalConnection(
+            patient_id=demo_user.patient_id,
+            name="Epic MyChart",
+            doctors="300,000+",
+            status="available",
+        )
+        session.add(portal)
+        session.commit()
+        session.refresh(portal)
+
+        first = client.get("/api/dashboard", headers=auth_headers)
+        assert first.status_code == 200
+        assert first.json()["summary"]["abnormal_labs"] == 0
+
+        # Rows written outside the API do not bump the snapshot version.
+        session.add(
+            LabObservation(
+                patient_id=demo_user.patient_id,
+                test_name="Glucose",
+                value=130,
+                unit="mg/dL",
+                status="high",
+                source="Epic MyChart",
+            )
+        )
+        session.commit()
+        cached = client.get("/api/dashboard", headers=auth_headers)
+        assert cached.json()["summary"]["abnormal_labs"] == 0
+        assert cached.json()["audit_log"][0]["action"] == "Viewed dashboard"
+
+        connect = client.post(f"/api/portals/{portal.id}/connect", headers=auth_headers)
+        assert connect.status_code == 200
+        refreshed = client.get("/api/dashboard", headers=auth_headers).json()
+        assert refreshed["summary"]["abnormal_labs"] == 1
+        assert refreshed["summary"]["connected_portals"] == 1
+
+    def test_dashboard_snapshot_database_tier(
+        self, client: TestClient, auth_headers: dict, session: Session, demo_user, monkeypatch
+    ):
+        from app import dashboard_cache
+        from app.models import DashboardSnapshot
+
+        monkeypatch.setattr(dashboard_cache, "DASHBOARD_CACHE_BACKEND", "database")
+
+        assert client.get("/api/dashboard", headers=auth_headers).status_code == 200
+        row = session.get(DashboardSnapshot, demo_user.patient_id)
+        assert row is not None and row.payload and row.version == 0
+
+        # A cold worker (empty LRU) is served from the shared database tier.
+        dashboard_cache._lru.clear()
+        assert client.get("/api/dashboard", headers=auth_headers).json()["summary"]["manual_lab_entries"] == 0
+
+        response = client.post(
+            "/api/dashboard/manual-labs",
+            headers=auth_headers,
+            json={"test_name": "TSH", "value": 2.1, "unit": "mIU/L", "collected_on": "2026-03-23"},
+        )
+        assert response.status_code == 200, response.text
+        session.refresh(row)
+        assert row.version == 1 and row.payload is None
+        assert client.get("/api/dashboard", headers=auth_headers).json()["summary"]["manual_lab_entries"] == 1
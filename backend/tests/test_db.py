@@ -0,0 +1,85 @@
+"""Tests for database engine configuration."""
+import pytest
+from sqlalchemy import exc
+from sqlmodel import create_engine
+
+from app import auth
+from app.db import async_database_url
+from app.db_config import (
+    DB_MAX_OVERFLOW,
+    DB_POOL_RECYCLE_SECONDS,
+    DB_POOL_SIZE,
+    DB_SQLITE_BUSY_TIMEOUT_MS,
+    DB_SQLITE_CACHE_SIZE_KB,
+    TimedAsyncAdaptedQueuePool,
+    TimedQueuePool,
+    configure_engine,
+    engine_options,
+    pool_stats,
+)
+
+
+class TestAsyncDatabaseURL:
+    def test_sync_urls_map_to_async_drivers(self):
+        assert async_database_url("sqlite:///./medbridge.db") == "sqlite+aiosqlite:///./medbridge.db"
+        assert async_database_url("postgresql://u:p@db/medbridge") == "postgresql+asyncpg://u:p@db/medbridge"
+        assert async_database_url("postgres://u:p@db/medbridge") == "postgresql+asyncpg://u:p@db/medbridge"
+        assert async_database_url("postgresql+psycopg2://db/medbridge") == "postgresql+asyncpg://db/medbridge"
+
+
+class TestDatabaseConfig:
+    def test_sqlite_connections_use_wal_and_tuned_pragmas(self, tmp_path):
+        url = f"sqlite:///{tmp_path / 'config.db'}"
+        engine = create_engine(url, **engine_options(url))
+        configure_engine(engine, url)
+        with engine.connect() as connection:
+            pragma = lambda name: connection.exec_driver_sql(f"PRAGMA {name}").scalar()
+            assert pragma("journal_mode") == "wal"
+            assert pragma("synchronous") == 1  # NORMAL
+            assert pragma("busy_timeout") == DB_SQLITE_BUSY_TIMEOUT_MS
+            assert pragma("cache_size") == -DB_SQLITE_CACHE_SIZE_KB
+        engine.dispose()
+
+    def test_postgres_pool_is_sized_from_settings(self):
+        options = engine_options("postgresql://u:p@db/medbridge")
+        assert options["poolclass"] is TimedQueuePool
+        assert options["pool_size"] == DB_POOL_SIZE
+        assert options["max_overflow"] == DB_MAX_OVERFLOW
+        assert options["pool_recycle"] == DB_POOL_RECYCLE_SECONDS
+        assert options["pool_pre_ping"] is True
+        assert engine_options("postgresql+asyncpg://u:p@db/medbridge", is_async=True)["poolclass"] is TimedAsyncAdaptedQueuePool
+
+    def test_in_memory_sqlite_keeps_default_pool(self):
+        assert "poolclass" not in engine_options("sqlite://")
+
+    def test_pool_stats_report_checkout_waits_and_timeouts(self, tmp_path):
+        url = f"sqlite:///{tmp_path / 'pool.db'}"
+        engine = create_engine(url, **{**engine_options(url), "pool_size": 1, "max_overflow": 0, "pool_timeout": 0.05})
+        held = engine.connect()
+        with pytest.raises(exc.TimeoutError):
+            engine.connect()
+        held.close()
+        with engine.connect():
+            stats = pool_stats(engine)
+        assert stats["pool"] == "TimedQueuePool"
+        assert stats["size"] == 1 and stats["checked_out"] == 1
+        assert stats["checkouts"] == 2 and stats["timeouts"] == 1
+        assert stats["max_wait_ms"] >= 0
+        engine.dispose()
+
+    def test_health_endpoint_reports_both_engines(self, client, monkeypatch):
+        monkeypatch.setattr(auth, "METRICS_TOKEN", "metrics-secret")
+        response = client.get("/api/health/database-pool", headers={"X-Metrics-Token": "metrics-secret"})
+        assert response.status_code == 200
+        assert set(response.json()) == {"sync", "async"}
+
+    @pytest.mark.parametrize("path", ["/api/health/database-pool", "/api/health/password-hashing"])
+    def test_metrics_endpoints_require_the_metrics_token(self, client, monkeypatch, path):
+        monkeypatch.setattr(auth, "METRICS_TOKEN", None)
+        assert client.get(path, headers={"X-Metrics-Token": ""}).status_code == 404
+
+        monkeypatch.setattr(auth, "METRICS_TOKEN", "metrics-secret")
+        assert client.get(path).status_code == 401
+        assert client.get(path, headers={"X-Metrics-Token": "guess"}).status_code == 401
+        assert client.get(path, headers={"X-Metrics-Token": "metrics-secret"}).status_code == 200
+        assert client.get("/api/health").status_code == 200
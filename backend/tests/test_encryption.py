@@ -0,0 +1,164 @@
+"""Tests for the cached keyring and resumable key rotation."""
+from cryptography.fernet import Fernet
+from sqlmodel import Session, select
+
+from app import encryption, key_rotation
+from app.blob_store import load_document_payload, store_document_blob
+from app.encryption import decrypt_field, encrypt_bytes, encrypt_field
+from app.key_rotation import ROTATION_TARGETS, rotate_batch, rotate_encryption_keys
+from app.models import BlobChunk, FHIRConnection, KeyRotationProgress, MedicalDocument
+
+OLD_KEY = Fernet.generate_key().decode()
+NEW_KEY = Fernet.generate_key().decode()
+
+
+def _use_keys(monkeypatch, primary: str, previous: str = ""):
+    monkeypatch.setattr(encryption, "_key", primary)
+    monkeypatch.setattr(encryption, "_previous_keys", previous)
+
+
+def _connection(token: str) -> FHIRConnection:
+    return FHIRConnection(
+        patient_id="MBR-1",
+        ehr_name="epic",
+        fhir_base_url="https://fhir.example.test",
+        access_token=encrypt_field(token),
+        refresh_token=encrypt_field(f"refresh-{token}"),
+    )
+
+
+class TestKeyring:
+    def test_keyring_is_built_once(self, monkeypatch):
+        _use_keys(monkeypatch, NEW_KEY)
+        assert encryption._get_fernet() is encryption._get_fernet()
+
+    def test_primary_key_is_cached_with_the_keyring(self, monkeypatch):
+        _use_keys(monkeypatch, NEW_KEY, OLD_KEY)
+        assert encryption._primary_fernet() is encryption._primary_fernet()
+        assert encryption._primary_fernet() is encryption._build_keys(NEW_KEY, OLD_KEY)[0]
+
+    def test_each_key_is_tried_once_when_checking_and_rotating(self, monkeypatch):
+        _use_keys(monkeypatch, OLD_KEY)
+        stale = encrypt_field("secret")
+        _use_keys(monkeypatch, NEW_KEY, OLD_KEY)
+        fresh = encrypt_field("fresh")
+        attempts = []
+        real_decrypt = Fernet.decrypt
+
+        def counting_decrypt(self, token, ttl=None):
+            attempts.append(self)
+            return real_decrypt(self, token, ttl)
+
+        monkeypatch.setattr(Fernet, "decrypt", counting_decrypt)
+        assert encryption.needs_rotation(stale) and len(attempts) == 2
+        attempts.clear()
+        assert not encryption.needs_rotation(fresh) and len(attempts) == 1
+        attempts.clear()
+        rotated = encryption.rotated_token(stale)
+        assert len(attempts) == 2
+        assert encryption.rotated_token(rotated) is None
+        assert Fernet(NEW_KEY.encode()).extract_timestamp(rotated.encode()) == Fernet(OLD_KEY.encode()).extract_timestamp(
+            stale.encode()
+        )
+
+    def test_previous_keys_still_decrypt(self, monkeypatch):
+        _use_keys(monkeypatch, OLD_KEY)
+        token = encrypt_field("secret")
+        _use_keys(monkeypatch, NEW_KEY, OLD_KEY)
+        assert decrypt_field(token) == "secret"
+        assert encryption.needs_rotation(token)
+        assert not encryption.needs_rotation(encrypt_field("fresh"))
+        assert not encryption.needs_rotation("plain text")
+
+
+class TestKeyRotation:
+    def test_rotation_re_encrypts_every_table(self, session: Session, monkeypatch):
+        _use_keys(monkeypatch, OLD_KEY)
+        for index in range(3):
+            session.add(_connection(f"token-{index}"))
+        session.add(MedicalDocument(
+            patient_id="MBR-1", title="Legacy", source="Portal", provider="Dr. A", document_date="2026-01-01",
+            file_name="legacy.pdf", content_type="application/pdf", encrypted_blob=encrypt_bytes(b"legacy"),
+        ))
+        blob, _created = store_document_blob(session, "MBR-1", b"envelope payload")
+        session.commit()
+        chunks_before = [chunk.data for chunk in session.exec(select(BlobChunk)).all()]
+
+        _use_keys(monkeypatch, NEW_KEY, OLD_KEY)
+        rotated = rotate_encryption_keys(session, batch_size=2)
+        assert rotated["fhirconnection"] == 3
+        assert rotated["medicaldocument"] == 1
+        assert rotated["documentblob"] == 1
+
+        # Only the wrapped data key changed; payload segments were not rewritten.
+        assert [chunk.data for chunk in session.exec(select(BlobChunk)).all()] == chunks_before
+
+        _use_keys(monkeypatch, NEW_KEY)
+        new_only = Fernet(NEW_KEY.encode())
+        for connection in session.exec(select(FHIRConnection)).all():
+            assert new_only.decrypt(connection.access_token.encode()).decode().startswith("token-")
+            assert new_only.decrypt(connection.refresh_token.encode()).decode().startswith("refresh-token-")
+        document = session.exec(select(MedicalDocument)).one()
+        assert load_document_payload(session, document) == b"legacy"
+        document.blob_id, document.encrypted_blob = blob.id, None
+        assert load_document_payload(session, document) == b"envelope payload"
+
+    def test_rotation_resumes_from_last_batch(self, session: Session, monkeypatch):
+        _use_keys(monkeypatch, OLD_KEY)
+        for index in range(5):
+            session.add(_connection(f"token-{index}"))
+        session.commit()
+
+        _use_keys(monkeypatch, NEW_KEY, OLD_KEY)
+        target = next(target for target in ROTATION_TARGETS if target.model is FHIRConnection)
+        assert rotate_batch(session, target, batch_size=2) is True
+        progress = session.get(KeyRotationProgress, "fhirconnection")
+        assert progress.last_id == 2 and progress.rows_rotated == 2 and progress.finished_at is None
+
+        # A fresh run (e.g. after a restart) continues after id 2.
+        assert rotate_encryption_keys(session, batch_size=2)["fhirconnection"] == 5
+        session.refresh(progress)
+        assert progress.finished_at is not None
+        assert not any(
+            encryption.needs_rotation(connection.access_token)
+            for connection in session.exec(select(FHIRConnection)).all()
+        )
+
+    def test_new_primary_key_restarts_rotation(self, session: Session, monkeypatch):
+        _use_keys(monkeypatch, OLD_KEY)
+        session.add(_connection("token"))
+        session.commit()
+        _use_keys(monkeypatch, NEW_KEY, OLD_KEY)
+        rotate_encryption_keys(session)
+
+        newest = Fernet.generate_key().decode()
+        _use_keys(monkeypatch, newest, f"{NEW_KEY},{OLD_KEY}")
+        assert rotate_encryption_keys(session)["fhirconnection"] == 1
+        assert session.get(KeyRotationProgress, "fhirconnection").key_fingerprint == encryption.primary_key_fingerprint()
+
+    def test_value_changed_during_the_batch_is_not_overwritten(self, session: Session, monkeypatch):
+        _use_keys(monkeypatch, OLD_KEY)
+        connection = _connection("token")
+        session.add(connection)
+        session.commit()
+        _use_keys(monkeypatch, NEW_KEY, OLD_KEY)
+        real_rotate = key_rotation.rotated_token
+
+        def refresh_then_rotate(value):
+            # The sync scheduler commits a refreshed token after the batch read the row.
+            with Session(session.get_bind()) as scheduler:
+                refreshed = scheduler.get(FHIRConnection, connection.id)
+                refreshed.access_token = encrypt_field("refreshed-token")
+                scheduler.add(refreshed)
+                scheduler.commit()
+            monkeypatch.setattr(key_rotation, "rotated_token", real_rotate)
+            return real_rotate(value)
+
+        monkeypatch.setattr(key_rotation, "rotated_token", refresh_then_rotate)
+        assert rotate_encryption_keys(session)["fhirconnection"] == 1
+
+        session.refresh(connection)
+        assert decrypt_field(connection.access_token) == "refreshed-token"
+        # The row was re-read and its refresh token, which the scheduler left alone, still rotated.
+        assert not encryption.needs_rotation(connection.refresh_token)
+        assert decrypt_field(connection.refresh_token) == "refresh-token"
@@ -1,4 +1,5 @@
 """Tests for FHIR R4 export endpoint."""
+import json
 import pytest
 from datetime import datetime, timezone, timedelta
 from fastapi.testclient import TestClient
@@ -102,3 +103,45 @@ class TestFHIRExport:
         ]
         assert "1558-6" in loinc_codes, "Glucose LOINC code should be present"
         assert "4548-4" in loinc_codes, "A1c LOINC code should be present"
+
+    def test_fhir_ndjson_export_streams_one_resource_per_line(
+        self, client: TestClient, auth_headers: dict, session: Session, demo_user
+    ):
+        """The Bulk Data style NDJSON export honours _type and writes one resource per line."""
+        pid = demo_user.patient_id
+        for day in range(3):
+            session.add(
+                LabObservation(
+                    patient_id=pid,
+                    test_name="Glucose",
+                    loinc="2345-7",
+                    value=100 + day,
+                    unit="mg/dL",
+                    timestamp=datetime.now(timezone.utc) - timedelta(days=day),
+                )
+            )
+        session.add(
+            MedicalRecord(
+                patient_id=pid,
+                record_type="visit",
+                title="Annual physical",
+                description="Routine exam",
+                date="2026-02-01",
+                source="Epic MyChart",
+                provider="Dr. Chen",
+            )
+        )
+        session.commit()
+
+        resp = client.get("/api/export/fhir/ndjson", headers=auth_headers)
+        assert resp.status_code == 200, resp.text
+        assert resp.headers["content-type"].startswith("application/fhir+ndjson")
+        lines = [json.loads(line) for line in resp.text.splitlines()]
+        assert [line["resourceType"] for line in lines] == ["Patient", "Observation", "Observation", "Observation", "DocumentReference"]
+
+        filtered = client.get("/api/export/fhir/ndjson?_type=Observation", headers=auth_headers)
+        assert filtered.status_code == 200
+        assert {json.loads(line)["resourceType"] for line in filtered.text.splitlines()} == {"Observation"}
+
+        bad = client.get("/api/export/fhir/ndjson?_type=Condition", headers=auth_headers)
+        assert bad.status_code == 400
@@ -0,0 +1,520 @@
+"""Tests for SMART on FHIR sync against a local mock FHIR server."""
+import asyncio
+from datetime import datetime, timedelta, timezone
+import json
+from urllib.parse import parse_qs
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlmodel import Session, create_engine, select
+
+from app import fhir_bulk, fhir_client, fhir_scheduler, fhir_sync
+from app.encryption import decrypt_field, encrypt_field
+from app.models import FHIRConnection, FHIRSyncedResource, LabObservation, MedicalRecord
+
+FHIR_BASE = "https://fhir.example.test/r4"
+
+
+def _observation(index: int) -> dict:
+    return {
+        "resourceType": "Observation",
+        "id": f"obs-{index}",
+        "code": {"coding": [{"system": "http://loinc.org", "code": "2345-7", "display": "Glucose"}]},
+        "valueQuantity": {"value": 90 + index % 20, "unit": "mg/dL"},
+        "referenceRange": [{"low": {"value": 70}, "high": {"value": 100}}],
+        "effectiveDateTime": f"2026-01-{index % 28 + 1:02d}T08:00:00Z",
+        "meta": {"versionId": "1", "lastUpdated": "2026-02-01T00:00:00Z"},
+    }
+
+
+class MockFHIRServer:
+    """Serves a Patient, paged Observations and MedicationRequests; tracks requests in flight.
+
+    Searches honour ``_lastUpdated=gt...`` and carry it into their next links.
+    """
+
+    def __init__(self, observations: int = 250, page_size: int = 100, fail: set[str] = frozenset()):
+        self.observations = [_observation(index) for index in range(observations)]
+        self.page_size = page_size
+        self.fail = fail
+        self.access_token = "remote-token"
+        self.refresh_tokens = {"refresh-1"}
+        self.requests: list[httpx.Request] = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def _bundle(self, request: httpx.Request, resource_type: str, resources: list[dict]) -> dict:
+        offset = int(request.url.params.get("_getpagesoffset", "0"))
+        if since := request.url.params.get("_lastUpdated", "")[2:]:
+            resources = [r for r in resources if r.get("meta", {}).get("lastUpdated", "") > since]
+        page = resources[offset:offset + self.page_size]
+        bundle = {"resourceType": "Bundle", "type": "searchset", "entry": [{"resource": r} for r in page]}
+        if offset + self.page_size < len(resources):
+            params = request.url.params.set("_getpagesoffset", str(offset + self.page_size))
+            bundle["link"] = [{"relation": "next", "url": f"{FHIR_BASE}/{resource_type}?{params}"}]
+        return bundle
+
+    def _token(self, request: httpx.Request) -> httpx.Response:
+        form = {key: values[0] for key, values in parse_qs(request.content.decode()).items()}
+        if form.get("grant_type") != "refresh_token" or form.get("refresh_token") not in self.refresh_tokens:
+            return httpx.Response(400, json={"error": "invalid_grant"})
+        self.access_token = "refreshed-token"
+        self.refresh_tokens = {"refresh-2"}
+        return httpx.Response(200, json={"access_token": "refreshed-token", "refresh_token": "refresh-2", "expires_in": 3600})
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.005)
+            if request.url.path.endswith("/auth/token"):
+                return self._token(request)
+            if request.headers["Authorization"] != f"Bearer {self.access_token}":
+                return httpx.Response(401)
+            resource_type = request.url.path.rsplit("/r4/", 1)[1].split("/")[0]
+            if resource_type in self.fail:
+                return httpx.Response(500)
+            if resource_type == "Patient":
+                return httpx.Response(
+                    200, json={"resourceType": "Patient", "id": "p1", "name": [{"given": ["Ana"], "family": "Ruiz"}]}
+                )
+            if resource_type == "Observation":
+                return httpx.Response(200, json=self._bundle(request, "Observation", self.observations))
+            if resource_type == "MedicationRequest":
+                medication = {
+                    "resourceType": "MedicationRequest",
+                    "id": "med-1",
+                    "status": "active",
+                    "medicationCodeableConcept": {"text": "Metformin 500 mg"},
+                    "dosageInstruction": [{"text": "Once daily with dinner"}],
+                    "authoredOn": "2026-01-28",
+                }
+                return httpx.Response(200, json=self._bundle(request, "MedicationRequest", [medication]))
+            return httpx.Response(404)
+        finally:
+            self.in_flight -= 1
+
+
+@pytest.fixture(name="fhir_server")
+def fhir_server_fixture():
+    server = MockFHIRServer()
+    fhir_client.set_fhir_transport(httpx.MockTransport(server.handler))
+    yield server
+    fhir_client.set_fhir_transport(None)
+
+
+def _connection(session: Session, patient_id: str, **fields) -> FHIRConnection:
+    fields = {"ehr_name": "epic", "access_token": encrypt_field("remote-token"), "patient_fhir_id": "p1", **fields}
+    connection = FHIRConnection(patient_id=patient_id, fhir_base_url=FHIR_BASE, **fields)
+    session.add(connection)
+    session.commit()
+    session.refresh(connection)
+    return connection
+
+
+class TestFHIRSync:
+    def test_sync_follows_next_links_and_fetches_resource_types_concurrently(
+        self, client: TestClient, auth_headers: dict, session: Session, demo_user, fhir_server: MockFHIRServer
+    ):
+        connection = _connection(session, demo_user.patient_id)
+
+        response = client.post(f"/api/fhir/connections/{connection.id}/sync", headers=auth_headers)
+
+        assert response.status_code == 200, response.text
+        sync = response.json()["sync"]
+        assert sync == {
+            "patient": True, "observations": 250, "medications": 1, "records": 252, "unchanged": 0, "failed": [],
+        }
+        observation_requests = [r for r in fhir_server.requests if r.url.path.endswith("/Observation")]
+        assert len(observation_requests) == 3
+        assert observation_requests[0].url.params["_count"] == str(fhir_client.FHIR_PAGE_SIZE)
+        assert fhir_server.max_in_flight > 1
+
+        labs = session.exec(select(LabObservation).where(LabObservation.patient_id == demo_user.patient_id)).all()
+        assert len(labs) == 250 and labs[0].loinc == "2345-7" and labs[0].ref_range == "70-100"
+        medication = session.exec(select(MedicalRecord).where(MedicalRecord.record_type == "medication")).one()
+        assert medication.title == "Metformin 500 mg" and medication.date == "2026-01-28"
+        assert session.get(FHIRConnection, connection.id).last_synced_at is not None
+
+    def test_manual_sync_waits_for_the_lease_of_a_running_sync(
+        self, client: TestClient, auth_headers: dict, session: Session, demo_user, fhir_server: MockFHIRServer
+    ):
+        leased_until = datetime.now(timezone.utc) + timedelta(minutes=5)
+        connection = _connection(session, demo_user.patient_id, sync_leased_until=leased_until)
+
+        response = client.post(f"/api/fhir/connections/{connection.id}/sync", headers=auth_headers)
+
+        assert response.status_code == 409
+        assert not fhir_server.requests
+        # A lease taken by a manual sync keeps the scheduler away just the same.
+        assert fhir_scheduler.run_due_syncs(session, transport=httpx.MockTransport(fhir_server.handler)) == 0
+
+        connection.sync_leased_until = datetime.now(timezone.utc) - timedelta(seconds=1)
+        session.add(connection)
+        session.commit()
+        response = client.post(f"/api/fhir/connections/{connection.id}/sync", headers=auth_headers)
+
+        assert response.status_code == 200, response.text
+        session.refresh(connection)
+        assert connection.sync_leased_until is None
+
+    def test_failed_resource_type_does_not_stop_the_others(self, session: Session, demo_user, monkeypatch):
+        server = MockFHIRServer(observations=5, fail={"MedicationRequest"})
+        monkeypatch.setattr(fhir_sync, "FHIR_SYNC_BATCH_SIZE", 2)
+        connection = _connection(session, demo_user.patient_id)
+
+        sync = asyncio.run(
+            fhir_sync.sync_fhir_connection_async(connection, demo_user.patient_id, session, httpx.MockTransport(server.handler))
+        )
+
+        assert sync == {
+            "patient": True, "observations": 5, "medications": 0, "records": 6, "unchanged": 0, "failed": ["MedicationRequest"],
+        }
+        assert len(session.exec(select(LabObservation)).all()) == 5
+        # The watermark stays put, so the next sync asks for the failed window again.
+        assert connection.last_synced_at is None
+
+    def test_repeat_sync_fetches_and_writes_only_changes(self, session: Session, demo_user):
+        server = MockFHIRServer(observations=120)
+        transport = httpx.MockTransport(server.handler)
+        connection = _connection(session, demo_user.patient_id)
+        asyncio.run(fhir_sync.sync_fhir_connection_async(connection, demo_user.patient_id, session, transport))
+        assert "_lastUpdated" not in server.requests[-1].url.params
+
+        changed = server.observations[7]
+        changed["valueQuantity"]["value"] = 250
+        changed["meta"] = {"versionId": "2", "lastUpdated": "2099-01-01T00:00:00Z"}
+        server.observations.append(_observation(500) | {"meta": {"versionId": "1", "lastUpdated": "2099-01-01T00:00:00Z"}})
+        server.requests.clear()
+
+        sync = asyncio.run(fhir_sync.sync_fhir_connection_async(connection, demo_user.patient_id, session, transport))
+
+        searches = [r for r in server.requests if not r.url.path.endswith("/Patient/p1")]
+        assert all(r.url.params["_lastUpdated"].startswith("gt") for r in searches)
+        # The Patient is read again but unchanged versions are not rewritten.
+        assert sync["observations"] == 2 and sync["records"] == 3
+        labs = session.exec(select(LabObservation)).all()
+        assert len(labs) == 121 and sorted(lab.value for lab in labs)[-1] == 250
+        patient_records = session.exec(select(MedicalRecord).where(MedicalRecord.record_type == "visit")).all()
+        assert len(patient_records) == 1
+        links = session.exec(select(FHIRSyncedResource).where(FHIRSyncedResource.resource_id == "obs-7")).one()
+        assert links.version_id == "2" and session.get(LabObservation, links.lab_observation_id).value == 250
+
+    def test_observation_that_loses_its_value_drops_the_lab_row(self, db_path, demo_user, session: Session):
+        server = MockFHIRServer(observations=3)
+        transport = httpx.MockTransport(server.handler)
+        # Postgres enforces the link's foreign keys; SQLite only does with this pragma.
+        engine = create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False})
+        event.listen(engine, "connect", lambda connection, _record: connection.execute("PRAGMA foreign_keys=ON"))
+        with Session(engine) as fk_session:
+            connection = _connection(fk_session, demo_user.patient_id)
+            asyncio.run(fhir_sync.sync_fhir_connection_async(connection, demo_user.patient_id, fk_session, transport))
+
+            changed = server.observations[1]
+            del changed["valueQuantity"]
+            changed["meta"] = {"versionId": "2", "lastUpdated": "2099-01-01T00:00:00Z"}
+            sync = asyncio.run(fhir_sync.sync_fhir_connection_async(connection, demo_user.patient_id, fk_session, transport))
+
+            assert sync["observations"] == 0 and sync["records"] == 2
+            link = fk_session.exec(select(FHIRSyncedResource).where(FHIRSyncedResource.resource_id == "obs-1")).one()
+            assert link.lab_observation_id is None and link.medical_record_id is not None
+            assert len(fk_session.exec(select(LabObservation)).all()) == 2
+        engine.dispose()
+
+    @pytest.mark.parametrize("next_url", [
+        "https://elsewhere.example/Observation?page=2",
+        FHIR_BASE.replace("https://", "http://") + "/Observation?page=2",
+        FHIR_BASE + "/Observation?patient=p1",
+    ])
+    def test_next_links_that_cannot_be_followed_fail_the_search(self, next_url: str):
+        requested: list[str] = []
+
+        async def handler(request: httpx.Request) -> httpx.Response:
+            requested.append(str(request.url))
+            return httpx.Response(
+                200,
+                json={
+                    "resourceType": "Bundle",
+                    "entry": [{"resource": {"resourceType": "Observation", "id": "o1"}}],
+                    "link": [{"relation": "next", "url": next_url}],
+                },
+            )
+
+        pages: list[list[dict]] = []
+
+        async def search() -> None:
+            async with fhir_client.FHIRClient(FHIR_BASE, "token", transport=httpx.MockTransport(handler)) as fhir:
+                async for page in fhir.search_pages("Observation", {"patient": "p1"}):
+                    pages.append(page)
+
+        with pytest.raises(fhir_client.FHIRError):
+            asyncio.run(search())
+        assert pages and all(url.startswith(FHIR_BASE) for url in requested)
+
+    def test_truncated_paging_fails_the_resource_type_and_keeps_the_watermark(
+        self, session: Session, demo_user, monkeypatch
+    ):
+        server = MockFHIRServer(observations=5, page_size=2)
+        downgraded = FHIR_BASE.replace("https://", "http://")
+
+        async def handler(request: httpx.Request) -> httpx.Response:
+            response = await server.handler(request)
+            if request.url.path.endswith("/Observation") and response.status_code == 200:
+                bundle = json.loads(response.content)
+                for link in bundle.get("link", []):
+                    link["url"] = link["url"].replace(FHIR_BASE, downgraded)
+                return httpx.Response(200, json=bundle)
+            return response
+
+        connection = _connection(session, demo_user.patient_id)
+        sync = asyncio.run(
+            fhir_sync.sync_fhir_connection_async(connection, demo_user.patient_id, session, httpx.MockTransport(handler))
+        )
+
+        assert sync["failed"] == ["Observation"]
+        assert not any(request.url.scheme == "http" for request in server.requests)
+        assert connection.last_synced_at is None
+
+        monkeypatch.setattr(fhir_client, "FHIR_MAX_PAGES", 2)
+        sync = asyncio.run(
+            fhir_sync.sync_fhir_connection_async(connection, demo_user.patient_id, session, httpx.MockTransport(server.handler))
+        )
+        assert sync["failed"] == ["Observation"]
+        assert connection.last_synced_at is None
+
+
+def _utc(value: datetime) -> datetime:
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+class TestFHIRSyncScheduler:
+    def test_due_connections_are_synced_once_and_rescheduled_with_jitter(self, session: Session, demo_user):
+        server = MockFHIRServer(observations=3)
+        first = _connection(session, demo_user.patient_id)
+        _connection(session, demo_user.patient_id, status="expired")
+        recent = _connection(session, demo_user.patient_id, last_synced_at=datetime.now(timezone.utc))
+        before = datetime.now(timezone.utc)
+
+        assert fhir_scheduler.run_due_syncs(session, transport=httpx.MockTransport(server.handler)) == 1
+        assert fhir_scheduler.run_due_syncs(session, transport=httpx.MockTransport(server.handler)) == 0
+
+        session.refresh(first)
+        interval = timedelta(seconds=fhir_scheduler.FHIR_SYNC_INTERVAL_SECONDS)
+        jitter = timedelta(seconds=fhir_scheduler.FHIR_SYNC_JITTER_SECONDS)
+        assert before + interval <= _utc(first.next_sync_at) <= datetime.now(timezone.utc) + interval + jitter
+        assert first.last_sync_duration_ms is not None and first.last_sync_error is None
+        assert first.sync_failures == 0 and first.last_synced_at is not None
+        assert len(session.exec(select(LabObservation)).all()) == 3
+        assert session.get(FHIRConnection, recent.id).next_sync_at is None
+
+    def test_expiring_token_is_refreshed_before_the_sync(self, session: Session, demo_user):
+        server = MockFHIRServer(observations=2)
+        server.access_token = "old-token"
+        connection = _connection(
+            session,
+            demo_user.patient_id,
+            ehr_name="generic",
+            access_token=encrypt_field("old-token"),
+            refresh_token=encrypt_field("refresh-1"),
+            token_expires_at=datetime.now(timezone.utc) + timedelta(seconds=30),
+        )
+
+        assert fhir_scheduler.run_due_syncs(session, transport=httpx.MockTransport(server.handler)) == 1
+
+        session.refresh(connection)
+        assert decrypt_field(connection.access_token) == "refreshed-token"
+        assert decrypt_field(connection.refresh_token) == "refresh-2"
+        assert _utc(connection.token_expires_at) > datetime.now(timezone.utc) + timedelta(minutes=50)
+        assert connection.last_sync_error is None
+        assert len(session.exec(select(LabObservation)).all()) == 2
+
+    def test_rejected_refresh_marks_the_connection_expired(self, session: Session, demo_user):
+        server = MockFHIRServer()
+        connection = _connection(
+            session,
+            demo_user.patient_id,
+            ehr_name="generic",
+            refresh_token=encrypt_field("revoked"),
+            token_expires_at=datetime.now(timezone.utc) - timedelta(minutes=1),
+        )
+
+        fhir_scheduler.run_due_syncs(session, transport=httpx.MockTransport(server.handler))
+
+        session.refresh(connection)
+        assert connection.status == "expired"
+        assert connection.sync_failures == 1 and "400" in connection.last_sync_error
+        assert not [r for r in server.requests if "/auth/token" not in r.url.path]
+
+    def test_failures_back_off_and_reset_on_success(self, session: Session, demo_user, monkeypatch):
+        monkeypatch.setattr(fhir_scheduler, "FHIR_SYNC_JITTER_SECONDS", 0)
+        server = MockFHIRServer(observations=1, fail={"Observation"})
+        transport = httpx.MockTransport(server.handler)
+        connection = _connection(session, demo_user.patient_id)
+
+        for failures in (1, 2):
+            before = datetime.now(timezone.utc)
+            fhir_scheduler.run_due_syncs(session, transport=transport)
+            session.refresh(connection)
+            assert connection.sync_failures == failures
+            assert connection.last_sync_error == "Could not fetch Observation"
+            retry = timedelta(seconds=fhir_scheduler.FHIR_SYNC_RETRY_BASE_SECONDS * 2 ** (failures - 1))
+            assert before + retry <= _utc(connection.next_sync_at) <= datetime.now(timezone.utc) + retry
+            connection.next_sync_at = None
+            session.add(connection)
+            session.commit()
+
+        server.fail = set()
+        fhir_scheduler.run_due_syncs(session, transport=transport)
+        session.refresh(connection)
+        assert connection.sync_failures == 0 and connection.last_sync_error is None
+
+    def test_rate_limiter_spaces_syncs_per_ehr(self):
+        now = [100.0]
+        limiter = fhir_scheduler.EHRRateLimiter(
+            fhir_scheduler.parse_rate_limits("epic=30, cerner=0"), default_rate=60, clock=lambda: now[0]
+        )
+
+        assert [limiter.reserve("epic") for _ in range(3)] == [0.0, 2.0, 4.0]
+        assert limiter.reserve("generic") == 0.0 and limiter.reserve("generic") == 1.0
+        assert limiter.reserve("cerner") == 0.0 and limiter.reserve("cerner") == 0.0
+        now[0] += 10
+        assert limiter.reserve("epic") == 0.0
+
+
+class BulkExportServer:
+    """Local ``$export`` endpoint: accepts the kick-off, reports progress once, then serves NDJSON files.
+
+    File bodies are streamed in small chunks that split lines, like a real download.
+    """
+
+    def __init__(self, files: dict[str, list[str]]):
+        self.files = files
+        self.polls = 0
+        self.requests: list[httpx.Request] = []
+
+    async def _chunks(self, body: bytes):
+        for start in range(0, len(body), 37):
+            yield body[start:start + 37]
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        path = request.url.path
+        if path.endswith("/Group/practice-1/$export"):
+            assert request.headers["Prefer"] == "respond-async"
+            return httpx.Response(202, headers={"Content-Location": f"{FHIR_BASE}/bulk-status/1"})
+        if path.endswith("/bulk-status/1") and request.method == "DELETE":
+            return httpx.Response(202)
+        if path.endswith("/bulk-status/1"):
+            self.polls += 1
+            if self.polls == 1:
+                return httpx.Response(202, headers={"Retry-After": "0", "X-Progress": "50%"})
+            output = [{"type": name, "url": f"{FHIR_BASE}/bulk-files/{name}.ndjson"} for name in self.files]
+            return httpx.Response(200, json={"requiresAccessToken": True, "output": output, "error": []})
+        if "/bulk-files/" in path:
+            assert request.headers["Authorization"] == "Bearer system-token"
+            name = path.rsplit("/", 1)[1].removesuffix(".ndjson")
+            body = "\n".join(self.files[name]).encode() + b"\n"
+            return httpx.Response(200, content=self._chunks(body), headers={"Content-Type": "application/fhir+ndjson"})
+        return httpx.Response(404)
+
+
+class TestFHIRBulkImport:
+    def _files(self) -> dict[str, list[str]]:
+        observations = []
+        for index in range(25):
+            observation = _observation(index) | {"subject": {"reference": f"Patient/{'p1' if index % 2 else 'p2'}"}}
+            observations.append(json.dumps(observation))
+        observations.append(json.dumps(_observation(99) | {"subject": {"reference": "Patient/stranger"}}))
+        observations.append("{not json")
+        medication = {
+            "resourceType": "MedicationRequest",
+            "id": "med-1",
+            "subject": {"reference": f"{FHIR_BASE}/Patient/p2"},
+            "medicationCodeableConcept": {"text": "Lisinopril 10 mg"},
+            "authoredOn": "2026-02-01",
+        }
+        return {
+            "Patient": [json.dumps({"resourceType": "Patient", "id": "p1", "name": [{"family": "Ruiz"}]}), ""],
+            "Observation": observations,
+            "MedicationRequest": [json.dumps(medication)],
+        }
+
+    def test_export_is_polled_streamed_and_stored_in_batches(self, session: Session, demo_user, monkeypatch):
+        monkeypatch.setattr(fhir_bulk, "FHIR_BULK_BATCH_SIZE", 4)
+        stores = []
+        real_store = fhir_bulk._store_bulk_batch
+        monkeypatch.setattr(
+            fhir_bulk, "_store_bulk_batch", lambda *args: stores.append(len(args[2])) or real_store(*args)
+        )
+        first = _connection(session, demo_user.patient_id)
+        second = _connection(session, "MBR-00000002", patient_fhir_id="p2")
+        server = BulkExportServer(self._files())
+
+        summary = asyncio.run(
+            fhir_bulk.run_bulk_import(
+                session, FHIR_BASE, "system-token", group_id="practice-1", transport=httpx.MockTransport(server.handler)
+            )
+        )
+
+        assert summary == {
+            "patients": 1, "observations": 25, "medications": 1, "records": 27, "unchanged": 0,
+            "skipped": 1, "malformed": 1, "errors": 0, "failed": [], "busy": [],
+        }
+        assert server.polls == 2 and server.requests[-1].method == "DELETE"
+        assert max(stores) == 4 and sum(stores) == 27
+        first_labs = session.exec(select(LabObservation).where(LabObservation.patient_id == demo_user.patient_id)).all()
+        second_labs = session.exec(select(LabObservation).where(LabObservation.patient_id == "MBR-00000002")).all()
+        assert len(first_labs) == 12 and len(second_labs) == 13
+        medication = session.exec(select(MedicalRecord).where(MedicalRecord.record_type == "medication")).one()
+        assert medication.patient_id == "MBR-00000002" and medication.title == "Lisinopril 10 mg"
+        links = session.exec(select(FHIRSyncedResource).where(FHIRSyncedResource.connection_id == second.id)).all()
+        assert len(links) == 14 and first.id != second.id
+
+    def test_import_leases_its_connections_and_skips_ones_already_syncing(self, session: Session, demo_user):
+        first = _connection(session, demo_user.patient_id)
+        second = _connection(session, "MBR-00000002", patient_fhir_id="p2")
+        assert fhir_scheduler.lease_connection(session, second.id)
+        server = BulkExportServer(self._files())
+        leased_during_import = []
+
+        async def handler(request: httpx.Request) -> httpx.Response:
+            if "/bulk-files/" in request.url.path:
+                session.refresh(first)
+                leased_during_import.append(first.sync_leased_until is not None)
+            return await server.handler(request)
+
+        summary = asyncio.run(
+            fhir_bulk.run_bulk_import(
+                session, FHIR_BASE, "system-token", group_id="practice-1", transport=httpx.MockTransport(handler)
+            )
+        )
+
+        assert summary["busy"] == [second.id]
+        assert summary["observations"] == 12 and summary["skipped"] == 15
+        assert leased_during_import and all(leased_during_import)
+        # A sync can't start while the import runs, and the import can't take over a running sync.
+        assert not fhir_scheduler.lease_connection(session, second.id)
+        session.refresh(first)
+        session.refresh(second)
+        assert first.sync_leased_until is None and second.sync_leased_until is not None
+        assert session.exec(select(LabObservation).where(LabObservation.patient_id == "MBR-00000002")).all() == []
+
+    def test_reimporting_the_same_export_writes_nothing_new(self, session: Session, demo_user):
+        _connection(session, demo_user.patient_id)
+        _connection(session, "MBR-00000002", patient_fhir_id="p2")
+        files = self._files()
+
+        for _ in range(2):
+            server = BulkExportServer(files)
+            summary = asyncio.run(
+                fhir_bulk.run_bulk_import(
+                    session, FHIR_BASE, "system-token", group_id="practice-1",
+                    transport=httpx.MockTransport(server.handler),
+                )
+            )
+
+        assert summary["unchanged"] == 25 and summary["observations"] == 0
+        assert len(session.exec(select(LabObservation)).all()) == 25
@@ -0,0 +1,82 @@
+"""Tests for the shared token-bucket rate limiter."""
+import pytest
+from fastapi.testclient import TestClient
+
+from app.rate_limit import (
+    Budget,
+    MemoryBucketStore,
+    SQLiteBucketStore,
+    load_budgets,
+    rate_limiter,
+)
+
+
+@pytest.fixture(name="limited")
+def limited_fixture(client: TestClient, monkeypatch):
+    store = MemoryBucketStore()
+    monkeypatch.setattr(rate_limiter, "enabled", True)
+    monkeypatch.setattr(rate_limiter, "budgets", load_budgets("login=2/minute,export=2/hour"))
+    monkeypatch.setattr(rate_limiter, "_store", store)
+    return store
+
+
+class TestBudgets:
+    def test_budget_specs_and_overrides(self):
+        assert Budget.parse("30/hour") == Budget(capacity=30, per_second=30 / 3600)
+        assert Budget.parse("5 / minutes").capacity == 5
+        budgets = load_budgets("upload=50/hour")
+        assert budgets["upload"].capacity == 50 and budgets["login"] == Budget.parse("5/minute")
+        with pytest.raises(ValueError):
+            Budget.parse("5/fortnight")
+
+
+class TestBucketStores:
+    def test_memory_bucket_bursts_then_refills(self):
+        store, budget = MemoryBucketStore(), Budget.parse("2/minute")
+
+        assert [store.take(["k"], budget, 0.0) for _ in range(3)] == [0.0, 0.0, 30.0]
+        assert store.take(["other"], budget, 0.0) == 0.0
+        assert store.take(["k"], budget, 15.0) == pytest.approx(15.0)
+        assert store.take(["k"], budget, 30.0) == 0.0
+
+    def test_sqlite_buckets_are_shared_between_stores(self, tmp_path):
+        path = str(tmp_path / "ratelimit.db")
+        first, second, budget = SQLiteBucketStore(path), SQLiteBucketStore(path), Budget.parse("2/minute")
+
+        assert first.take(["k"], budget, 0.0) == 0.0
+        assert second.take(["k"], budget, 0.0) == 0.0
+        assert first.take(["k"], budget, 1.0) == pytest.approx(29.0)
+        assert second.take(["k"], budget, 31.0) == 0.0
+
+    @pytest.mark.parametrize("backend", ["memory", "sqlite"])
+    def test_spent_bucket_rejects_without_charging_the_others(self, backend, tmp_path):
+        store = MemoryBucketStore() if backend == "memory" else SQLiteBucketStore(str(tmp_path / "ratelimit.db"))
+        budget = Budget.parse("2/minute")
+        assert store.take(["user:1"], budget, 0.0) == 0.0
+        assert store.take(["user:1"], budget, 0.0) == 0.0
+
+        # The user is spent, so requests from a new address are rejected without draining it.
+        assert [store.take(["ip:a", "user:1"], budget, 1.0) for _ in range(3)] == [pytest.approx(29.0)] * 3
+        assert store.take(["ip:a"], budget, 1.0) == 0.0
+        assert store.take(["ip:a"], budget, 1.0) == 0.0
+        assert store.take(["ip:a"], budget, 1.0) == pytest.approx(30.0)
+
+
+class TestRouteBudgets:
+    def test_login_budget_answers_429_with_retry_after(self, client: TestClient, demo_user, limited):
+        form = {"username": "test@example.com", "password": "wrong"}
+        statuses = [client.post("/api/auth/login", data=form).status_code for _ in range(3)]
+
+        assert statuses == [401, 401, 429]
+        resp = client.post("/api/auth/login", data=form)
+        assert resp.status_code == 429 and 0 < int(resp.headers["Retry-After"]) <= 30
+
+    def test_export_is_charged_to_the_user_and_the_ip(self, client: TestClient, auth_headers: dict, demo_user, limited):
+        statuses = [client.get("/api/export/fhir", headers=auth_headers).status_code for _ in range(3)]
+
+        assert statuses == [200, 200, 429]
+        assert {"export:ip:testclient", f"export:user:{demo_user.id}"} <= set(limited._buckets)
+
+    def test_disabled_limiter_allows_everything(self, client: TestClient, demo_user):
+        form = {"username": "test@example.com", "password": "wrong"}
+        assert {client.post("/api/auth/login", data=form).status_code for _ in range(8)} == {401}
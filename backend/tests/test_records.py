@@ -1,11 +1,21 @@
 """Tests for medical records endpoints: list, filter, search, pagination."""
+import io
 import json
-from sqlmodel import select
+import os
+
+import numpy as np
+import pytest
+from cryptography.exceptions import InvalidTag
+from sqlmodel import create_engine, select
 from fastapi.testclient import TestClient
 from sqlmodel import Session
 
-from app.models import DocumentReviewItem, MedicalRecord, MedicalDocument, LabObservation
-from app.encryption import decrypt_bytes, encrypt_bytes
+from app import blob_backends, document_profile_model, ingestion_jobs, pdf_text
+from app.models import BlobChunk, DocumentBlob, DocumentReviewItem, IngestionJob, MedicalRecord, MedicalDocument, LabObservation, User
+from app.blob_store import load_document_payload, migrate_legacy_payloads, release_document_blob, store_document_blob
+from app.encryption import encrypt_bytes
+from app.auth import hash_password
+from app.routers import records as records_router
 
 
 def _make_record(patient_id: str, **overrides) -> MedicalRecord:
@@ -24,6 +34,36 @@ def _make_record(patient_id: str, **overrides) -> MedicalRecord:
     return MedicalRecord(**defaults)
 
 
+def _stuck_page_range(*args):
+    """Stands in for a page range that never finishes; runs in a PDF pool worker."""
+    import time
+
+    time.sleep(120)
+
+
+def _make_pdf(page_texts: list[str]) -> bytes:
+    """Build a minimal text PDF with one line per page."""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in page_texts:
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        content_id = len(objects)
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {content_id} 0 R /Resources << /Font << /F1 3 0 R >> >> >>")
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode()
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return out
+
+
 class TestListRecords:
     """GET /api/records"""
 
@@ -152,6 +192,61 @@ class TestListRecords:
         titles_page2 = {r["title"] for r in data2}
         assert titles_page1.isdisjoint(titles_page2), "Pages should not overlap"
 
+    def test_cursor_pagination_merges_records_and_documents(
+        self, client: TestClient, auth_headers: dict, session: Session, demo_user
+    ):
+        """Keyset cursors walk the merged timeline newest-first without gaps or overlap."""
+        for i in range(4):
+            session.add(_make_record(demo_user.patient_id, title=f"Record {i}", date=f"2026-01-{10 + i * 2:02d}"))
+        for i in range(3):
+            session.add(
+                MedicalDocument(
+                    patient_id=demo_user.patient_id,
+                    title=f"Document {i}",
+                    record_type="lab_result",
+                    source="VA Health",
+                    provider="Dr. House",
+                    document_date=f"2026-01-{11 + i * 2:02d}",
+                    file_name=f"lab-{i}.pdf",
+                    content_type="application/pdf",
+                    encrypted_blob=encrypt_bytes(b"lab-data"),
+                )
+            )
+        session.add(_make_record(demo_user.patient_id, title="Same day record", date="2026-01-15"))
+        session.commit()
+
+        full = client.get("/api/records?limit=50", headers=auth_headers)
+        assert full.status_code == 200
+        assert "X-Next-Cursor" not in full.headers
+        expected = [item["title"] for item in full.json()]
+        assert len(expected) == 8
+        assert [item["date"] for item in full.json()] == sorted((item["date"] for item in full.json()), reverse=True)
+        assert expected.index("Same day record") < expected.index("Document 2")
+
+        walked: list[str] = []
+        cursor = None
+        for _ in range(10):
+            query = "/api/records?limit=3" + (f"&cursor={cursor}" if cursor else "")
+            resp = client.get(query, headers=auth_headers)
+            assert resp.status_code == 200, resp.text
+            walked.extend(item["title"] for item in resp.json())
+            cursor = resp.headers.get("X-Next-Cursor")
+            if not cursor:
+                break
+        assert walked == expected
+
+        lab_page = client.get("/api/records?type=lab&limit=2", headers=auth_headers)
+        assert lab_page.status_code == 200
+        lab_next = client.get(
+            f"/api/records?type=lab&limit=50&cursor={lab_page.headers['X-Next-Cursor']}",
+            headers=auth_headers,
+        )
+        assert [item["title"] for item in lab_page.json() + lab_next.json()] == expected
+
+    def test_invalid_cursor_is_rejected(self, client: TestClient, auth_headers: dict):
+        resp = client.get("/api/records?cursor=not-a-cursor", headers=auth_headers)
+        assert resp.status_code == 400, resp.text
+
     def test_records_unauthenticated(self, client: TestClient):
         """Accessing records without a token returns 401."""
         resp = client.get("/api/records")
@@ -195,7 +290,8 @@ class TestDocumentUploads:
         assert stored.patient_id == demo_user.patient_id
         assert stored.source_system == "eClinicalWorks"
         assert stored.facility == "Downtown Cardiology"
-        assert decrypt_bytes(stored.encrypted_blob) == b"demo-pdf"
+        assert stored.encrypted_blob is None
+        assert load_document_payload(session, stored) == b"demo-pdf"
 
         list_response = client.get("/api/records", headers=auth_headers)
         assert list_response.status_code == 200
@@ -292,6 +388,32 @@ class TestDocumentUploads:
         assert payload["source_system"]["label"] == "eclinicalworks"
         assert payload["record_type"]["label"] == "progress_note"
 
+    def test_document_intelligence_batch_classifier_matches_single(
+        self, client: TestClient, auth_headers: dict
+    ):
+        texts = [
+            "eClinicalWorks\nProgress note\nAssessment: stable\nPlan: follow up",
+            "Epic (MyChart)\nLab result\nHemoglobin A1c: 6.1% High",
+            "Radiology impression: no acute findings",
+        ]
+        response = client.post(
+            "/api/records/document-intelligence/classify-batch",
+            headers=auth_headers,
+            json={"texts": texts},
+        )
+        assert response.status_code == 200, response.text
+        batch = response.json()
+        singles = [
+            client.post("/api/records/document-intelligence/classify", headers=auth_headers, json={"text": text}).json()
+            for text in texts
+        ]
+        assert batch == singles
+
+        empty = client.post(
+            "/api/records/document-intelligence/classify-batch", headers=auth_headers, json={"texts": ["ok", " "]}
+        )
+        assert empty.status_code == 400
+
     def test_upload_with_browser_ocr_text_queues_review_then_approval_creates_records(
         self, client: TestClient, auth_headers: dict, session: Session, demo_user
     ):
@@ -353,7 +475,19 @@ class TestDocumentUploads:
 
         labs = session.exec(select(LabObservation).where(LabObservation.patient_id == demo_user.patient_id)).all()
         assert len(labs) >= 2
-        assert any(lab.test_name == "Hemoglobin A1C" or lab.test_name == "Hemoglobin A1C".title() for lab in labs)
+        assert any(lab.test_name == "Hemoglobin A1c" for lab in labs)
+        assert all(lab.source_document_id == payload["id"] for lab in labs)
+
+        all_records = session.exec(
+            select(MedicalRecord).where(MedicalRecord.patient_id == demo_user.patient_id)
+        ).all()
+        assert all(record.source_document_id == payload["id"] for record in all_records)
+        document_entry = next(
+            item for item in client.get("/api/records", headers=auth_headers).json()
+            if item.get("classification") == "lab_result"
+        )
+        assert document_entry["derived_records_count"] == len(all_records)
+        assert f"Extracted {len(all_records)} items" in document_entry["flags"]
 
     def test_reject_review_item_marks_document_without_importing_records(
         self, client: TestClient, auth_headers: dict, session: Session, demo_user
@@ -391,3 +525,737 @@ class TestDocumentUploads:
             select(MedicalRecord).where(MedicalRecord.patient_id == demo_user.patient_id)
         ).all()
         assert timeline_records == []
+
+
+class TestIngestionJobs:
+    """Uploads enqueue a durable job that background workers process."""
+
+    UPLOAD_FORM = {
+        "source_system": "Epic (MyChart)",
+        "source": "Epic portal",
+        "provider": "Dr. Sarah Chen",
+        "facility": "Bayview Medical Center",
+        "document_date": "2026-03-16",
+        "record_type": "lab_result",
+        "title": "A1c screenshot",
+        "extracted_text": "Epic (MyChart)\nLab result\nHemoglobin A1c: 6.1% High\nGlucose: 112 mg/dL High",
+    }
+
+    def _upload(self, client: TestClient, auth_headers: dict):
+        return client.post(
+            "/api/records/documents",
+            headers=auth_headers,
+            data=self.UPLOAD_FORM,
+            files={"file": ("labs.png", b"fake-image", "image/png")},
+        )
+
+    def test_upload_returns_queued_job_when_workers_are_running(
+        self, client: TestClient, auth_headers: dict, session: Session, monkeypatch
+    ):
+        monkeypatch.setattr(records_router, "ingestion_workers_running", lambda: True)
+        response = self._upload(client, auth_headers)
+        assert response.status_code == 200, response.text
+        payload = response.json()
+        assert payload["ingestion_status"] == "queued"
+        assert payload["extraction_status"] == "queued"
+        assert payload["review_item_id"] is None
+
+        job_url = f"/api/records/ingestion-jobs/{payload['ingestion_job_id']}"
+        status = client.get(job_url, headers=auth_headers).json()
+        assert status["status"] == "queued"
+        assert status["attempts"] == 0
+
+        assert ingestion_jobs.drain_ingestion_jobs(session, "test-worker") == 1
+
+        status = client.get(job_url, headers=auth_headers).json()
+        assert status["status"] == "succeeded"
+        assert status["attempts"] == 1
+        assert status["review_status"] == "pending_review"
+        assert session.get(MedicalDocument, payload["id"]).extraction_status == "ready_for_review"
+        assert session.get(IngestionJob, payload["ingestion_job_id"]).supplied_text is None
+
+    def test_failed_job_is_retried_then_succeeds(
+        self, client: TestClient, auth_headers: dict, session: Session, monkeypatch
+    ):
+        monkeypatch.setattr(records_router, "ingestion_workers_running", lambda: True)
+        monkeypatch.setattr(ingestion_jobs, "INGESTION_RETRY_BASE_SECONDS", 0)
+        real_build = ingestion_jobs.build_review_draft
+        calls = {"count": 0}
+
+        def flaky_build(*args, **kwargs):
+            calls["count"] += 1
+            if calls["count"] == 1:
+                raise RuntimeError("model timeout")
+            return real_build(*args, **kwargs)
+
+        monkeypatch.setattr(ingestion_jobs, "build_review_draft", flaky_build)
+        job_id = self._upload(client, auth_headers).json()["ingestion_job_id"]
+
+        assert ingestion_jobs.drain_ingestion_jobs(session, "test-worker", limit=1) == 1
+        job = session.get(IngestionJob, job_id)
+        assert job.status == "queued"
+        assert "model timeout" in job.last_error
+
+        assert ingestion_jobs.drain_ingestion_jobs(session, "test-worker") == 1
+        session.refresh(job)
+        assert job.status == "succeeded"
+        assert job.attempts == 2
+        assert job.last_error is None
+
+    def test_job_reclaimed_mid_run_keeps_the_new_lease_and_drops_the_stale_results(
+        self, client: TestClient, auth_headers: dict, session: Session, db_path, monkeypatch
+    ):
+        monkeypatch.setattr(records_router, "ingestion_workers_running", lambda: True)
+        payload = self._upload(client, auth_headers).json()
+        job_id = payload["ingestion_job_id"]
+        real_build = ingestion_jobs.build_review_draft
+
+        def build_while_reclaimed(*args, **kwargs):
+            # Another worker reclaims the job after this worker's lease expired.
+            other_engine = create_engine(f"sqlite:///{db_path}")
+            with Session(other_engine) as other:
+                reclaimed = other.get(IngestionJob, job_id)
+                reclaimed.locked_by = "other-worker"
+                reclaimed.attempts += 1
+                other.add(reclaimed)
+                other.commit()
+            other_engine.dispose()
+            return real_build(*args, **kwargs)
+
+        monkeypatch.setattr(ingestion_jobs, "build_review_draft", build_while_reclaimed)
+        assert ingestion_jobs.drain_ingestion_jobs(session, "stale-worker", limit=1) == 1
+
+        job = session.get(IngestionJob, job_id)
+        session.refresh(job)
+        assert (job.status, job.locked_by, job.attempts) == ("running", "other-worker", 2)
+        items = session.exec(select(DocumentReviewItem).where(DocumentReviewItem.document_id == payload["id"])).all()
+        assert items == []
+        assert session.get(MedicalDocument, payload["id"]).extraction_status == "queued"
+
+    def test_inline_job_is_retried_until_it_fails_for_good(
+        self, client: TestClient, auth_headers: dict, session: Session, monkeypatch
+    ):
+        monkeypatch.setattr(records_router, "ingestion_workers_running", lambda: False)
+        calls = {"count": 0}
+
+        def broken_build(*args, **kwargs):
+            calls["count"] += 1
+            raise RuntimeError("model timeout")
+
+        monkeypatch.setattr(ingestion_jobs, "build_review_draft", broken_build)
+        payload = self._upload(client, auth_headers).json()
+
+        assert payload["ingestion_status"] == "failed"
+        assert payload["extraction_status"] == "failed"
+        job = session.get(IngestionJob, payload["ingestion_job_id"])
+        assert job.attempts == job.max_attempts == calls["count"]
+        assert "model timeout" in job.last_error
+
+    def test_inline_job_retry_can_succeed(
+        self, client: TestClient, auth_headers: dict, session: Session, monkeypatch
+    ):
+        monkeypatch.setattr(records_router, "ingestion_workers_running", lambda: False)
+        real_build = ingestion_jobs.build_review_draft
+        calls = {"count": 0}
+
+        def flaky_build(*args, **kwargs):
+            calls["count"] += 1
+            if calls["count"] == 1:
+                raise RuntimeError("model timeout")
+            return real_build(*args, **kwargs)
+
+        monkeypatch.setattr(ingestion_jobs, "build_review_draft", flaky_build)
+        payload = self._upload(client, auth_headers).json()
+
+        assert payload["ingestion_status"] == "succeeded"
+        assert payload["extraction_status"] == "ready_for_review"
+        assert session.get(IngestionJob, payload["ingestion_job_id"]).attempts == 2
+
+    def test_ingestion_job_is_scoped_to_patient(self, client: TestClient, auth_headers: dict):
+        assert client.get("/api/records/ingestion-jobs/999", headers=auth_headers).status_code == 404
+
+
+class TestPdfTextExtraction:
+    """Page-parallel PDF extraction with page and time budgets."""
+
+    PAGES = [f"Glucose {index} mg/dL" for index in range(20)]
+
+    def test_parallel_and_serial_extraction_agree(self):
+        payload = _make_pdf(self.PAGES)
+        serial = pdf_text.extract_pdf_text(payload, parallel=False)
+        parallel = pdf_text.extract_pdf_text(payload, parallel=True)
+
+        assert [page.index for page in parallel.pages] == list(range(20))
+        assert parallel.text == serial.text
+        assert "Glucose 19 mg/dL" in parallel.text
+        assert all(page.seconds >= 0 for page in parallel.pages)
+
+    def test_exhausted_budget_kills_workers_still_running_a_range(self, monkeypatch):
+        pdf_text.shutdown_pdf_pool()
+        released = []
+        real_release = pdf_text._release_pool
+
+        def release(pool, recycle=False):
+            released.append((pool, recycle))
+            real_release(pool, recycle)
+
+        monkeypatch.setattr(pdf_text, "_release_pool", release)
+        monkeypatch.setattr(pdf_text, "_extract_page_range", _stuck_page_range)
+        monkeypatch.setattr(pdf_text, "PDF_EXTRACT_TIMEOUT_SECONDS", 3)
+
+        result = pdf_text.extract_pdf_text(_make_pdf(self.PAGES), parallel=True)
+
+        assert result.timed_out and result.pages == []
+        ((pool, recycle),) = released
+        assert recycle and pool.retired and pdf_text._pool is None
+        processes = list(pool.executor._processes.values()) if pool.executor._processes else []
+        for process in processes:
+            process.join(timeout=5)
+        assert not any(process.is_alive() for process in processes)
+
+        monkeypatch.undo()
+        assert pdf_text.extract_pdf_text(_make_pdf(self.PAGES), parallel=True).text.count("Glucose") == 20
+
+    def test_page_limit_truncates_long_documents(self, monkeypatch):
+        monkeypatch.setattr(pdf_text, "PDF_EXTRACT_MAX_PAGES", 3)
+        result = pdf_text.extract_pdf_text(_make_pdf(self.PAGES))
+        assert len(result.pages) == 3
+        assert result.page_count == 20
+        assert result.truncated
+
+    def test_time_budget_stops_extraction(self, monkeypatch):
+        monkeypatch.setattr(pdf_text, "PDF_EXTRACT_TIMEOUT_SECONDS", 0)
+        result = pdf_text.extract_pdf_text(_make_pdf(self.PAGES), parallel=False)
+        assert result.pages == []
+        assert result.timed_out
+
+    def test_uploaded_pdf_text_is_extracted(self, client: TestClient, auth_headers: dict):
+        response = client.post(
+            "/api/records/documents",
+            headers=auth_headers,
+            data={
+                "source_system": "Epic (MyChart)",
+                "source": "Epic portal",
+                "provider": "Dr. Sarah Chen",
+                "facility": "Bayview Medical Center",
+                "document_date": "2026-03-16",
+                "record_type": "lab_result",
+                "title": "Lab packet",
+            },
+            files={"file": ("labs.pdf", _make_pdf(["Glucose: 112 mg/dL High"]), "application/pdf")},
+        )
+        assert response.status_code == 200, response.text
+        assert response.json()["ocr_status"] == "completed_pdf_text"
+        assert response.json()["extracted_text_length"] > 0
+
+
+class TestDocumentDeduplication:
+    """Identical uploads share one stored blob and reuse earlier extraction results."""
+
+    def _upload(self, client: TestClient, auth_headers: dict, payload: bytes, **overrides):
+        data = {
+            "source_system": "Epic (MyChart)",
+            "source": "Epic portal",
+            "provider": "Dr. Sarah Chen",
+            "facility": "Bayview Medical Center",
+            "document_date": "2026-03-16",
+            "record_type": "lab_result",
+            "title": "Lab packet",
+        }
+        data.update(overrides)
+        return client.post(
+            "/api/records/documents",
+            headers=auth_headers,
+            data=data,
+            files={"file": ("labs.pdf", payload, "application/pdf")},
+        )
+
+    def test_duplicate_upload_reuses_blob_and_review_draft(
+        self, client: TestClient, auth_headers: dict, session: Session, monkeypatch
+    ):
+        payload = _make_pdf(["Hemoglobin A1c: 6.1% High", "Glucose: 112 mg/dL High"])
+        first = self._upload(client, auth_headers, payload)
+        assert first.status_code == 200, first.text
+        assert "deduplicated" not in first.json()
+
+        def fail(*args, **kwargs):
+            raise AssertionError("duplicate upload should not be re-extracted")
+
+        monkeypatch.setattr(ingestion_jobs, "extract_document", fail)
+        monkeypatch.setattr(ingestion_jobs, "build_review_draft", fail)
+        second = self._upload(client, auth_headers, payload, title="Same packet again")
+        assert second.status_code == 200, second.text
+        body = second.json()
+        assert body["ingestion_status"] == "reused"
+        assert body["ocr_status"] == "completed_pdf_text"
+        assert body["extracted_text_length"] == first.json()["extracted_text_length"]
+        assert body["review_status"] == "pending_review"
+        assert body["review_item_id"] != first.json()["review_item_id"]
+        assert body["review_counts"] == first.json()["review_counts"]
+
+        blobs = session.exec(select(DocumentBlob)).all()
+        assert len(blobs) == 1
+        assert blobs[0].ref_count == 2
+        download = client.get(body["download_url"], headers=auth_headers)
+        assert download.content == payload
+
+    def test_duplicate_with_different_metadata_skips_extraction_but_redrafts(
+        self, client: TestClient, auth_headers: dict, session: Session, monkeypatch
+    ):
+        payload = _make_pdf(["Glucose: 112 mg/dL High"])
+        assert self._upload(client, auth_headers, payload).status_code == 200
+
+        def fail(*args, **kwargs):
+            raise AssertionError("cached text should be reused")
+
+        monkeypatch.setattr(ingestion_jobs, "extract_document", fail)
+        response = self._upload(client, auth_headers, payload, record_type="encounter_summary")
+        assert response.status_code == 200, response.text
+        assert response.json()["ingestion_status"] == "succeeded"
+        assert response.json()["ocr_status"] == "completed_pdf_text"
+        assert response.json()["review_status"] == "pending_review"
+
+    def test_identical_uploads_from_different_patients_do_not_share_a_blob(
+        self, client: TestClient, auth_headers: dict, session: Session
+    ):
+        other = User(
+            email="other@example.com",
+            first_name="Other",
+            last_name="Patient",
+            role="patient",
+            hashed_password=hash_password("OtherPass1"),
+            patient_id="MBR-99990002",
+            dob="1985-05-05",
+        )
+        session.add(other)
+        session.commit()
+        login = client.post("/api/auth/login", data={"username": "other@example.com", "password": "OtherPass1"})
+        other_headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+        payload = _make_pdf(["Glucose: 112 mg/dL High"])
+        first = self._upload(client, auth_headers, payload)
+        second = self._upload(client, other_headers, payload)
+        assert first.status_code == second.status_code == 200
+        # The second patient's upload is processed as new, so the response can't reveal the first one.
+        assert second.json()["ingestion_status"] == first.json()["ingestion_status"] == "succeeded"
+
+        blobs = session.exec(select(DocumentBlob)).all()
+        assert len(blobs) == 2
+        assert [blob.ref_count for blob in blobs] == [1, 1]
+
+    def test_release_deletes_unreferenced_blob(self, session: Session):
+        blob, created = store_document_blob(session, "MBR-1", b"same-bytes")
+        again, created_again = store_document_blob(session, "MBR-1", b"same-bytes")
+        session.commit()
+        assert created and not created_again
+        assert again.id == blob.id and again.ref_count == 2
+
+        blob_id = blob.id
+        release_document_blob(session, blob_id)
+        session.commit()
+        assert session.get(DocumentBlob, blob_id).ref_count == 1
+        release_document_blob(session, blob_id)
+        session.commit()
+        assert session.get(DocumentBlob, blob_id) is None
+
+
+class _InMemoryS3:
+    """Local stand-in for the subset of the S3 API the blob backend uses."""
+
+    def __init__(self):
+        self.objects: dict[tuple[str, str], bytes] = {}
+
+    def put_object(self, Bucket: str, Key: str, Body: bytes):
+        self.objects[(Bucket, Key)] = Body
+
+    def get_object(self, Bucket: str, Key: str):
+        return {"Body": io.BytesIO(self.objects[(Bucket, Key)])}
+
+    def delete_object(self, Bucket: str, Key: str):
+        self.objects.pop((Bucket, Key), None)
+
+
+class TestChunkedBlobStore:
+    """Document payloads are stored as encrypted fixed-size chunks in a pluggable backend."""
+
+    PAYLOAD = bytes(range(256)) * 40  # 10 KB
+
+    def test_database_backend_chunks_and_streams_download(
+        self, client: TestClient, auth_headers: dict, session: Session, monkeypatch
+    ):
+        monkeypatch.setattr(blob_backends, "BLOB_STORE_BACKEND", "database")
+        monkeypatch.setattr("app.blob_store.BLOB_CHUNK_BYTES", 4096)
+        response = client.post(
+            "/api/records/documents",
+            headers=auth_headers,
+            data={
+                "source_system": "Epic (MyChart)",
+                "source": "Epic portal",
+                "provider": "Dr. Sarah Chen",
+                "document_date": "2026-03-16",
+                "record_type": "imaging_report",
+                "title": "Scan",
+            },
+            files={"file": ("scan.png", self.PAYLOAD, "image/png")},
+        )
+        assert response.status_code == 200, response.text
+
+        blob = session.exec(select(DocumentBlob)).one()
+        assert blob.storage_backend == "database"
+        assert blob.chunk_count == 3
+        assert blob.encrypted_blob is None
+        chunks = session.exec(select(BlobChunk).where(BlobChunk.blob_key == blob.storage_key)).all()
+        assert len(chunks) == 3
+
+        download = client.get(response.json()["download_url"], headers=auth_headers)
+        assert download.status_code == 200
+        assert download.content == self.PAYLOAD
+        assert download.headers["content-length"] == str(len(self.PAYLOAD))
+
+    def test_filesystem_backend_round_trip_and_delete(self, session: Session, monkeypatch, tmp_path):
+        blob_backends.register_blob_backend(blob_backends.FilesystemBlobBackend(tmp_path))
+        monkeypatch.setattr(blob_backends, "BLOB_STORE_BACKEND", "filesystem")
+        monkeypatch.setattr("app.blob_store.BLOB_CHUNK_BYTES", 4096)
+        try:
+            blob, _created = store_document_blob(session, "MBR-1", self.PAYLOAD)
+            session.commit()
+            assert len(list((tmp_path / blob.storage_key[:2] / blob.storage_key).iterdir())) == 3
+            document = MedicalDocument(
+                patient_id="MBR-1", title="Scan", source="Portal", provider="Dr. A", document_date="2026-01-01",
+                file_name="scan.png", content_type="image/png", blob_id=blob.id,
+            )
+            assert load_document_payload(session, document) == self.PAYLOAD
+
+            release_document_blob(session, blob.id)
+            session.commit()
+            assert not (tmp_path / blob.storage_key[:2] / blob.storage_key).exists()
+        finally:
+            blob_backends._backends.pop("filesystem", None)
+
+    def test_s3_backend_with_local_stand_in(self, session: Session, monkeypatch):
+        fake = _InMemoryS3()
+        blob_backends.register_blob_backend(blob_backends.S3BlobBackend(fake, "medbridge", "docs/"))
+        monkeypatch.setattr(blob_backends, "BLOB_STORE_BACKEND", "s3")
+        monkeypatch.setattr("app.blob_store.BLOB_CHUNK_BYTES", 4096)
+        try:
+            blob, _created = store_document_blob(session, "MBR-1", self.PAYLOAD)
+            session.commit()
+            assert blob.storage_backend == "s3"
+            assert len(fake.objects) == 3
+            assert all(key.startswith("docs/") for _bucket, key in fake.objects)
+            assert b"".join(fake.objects[("medbridge", f"docs/{blob.storage_key}/{index:06d}")] for index in range(3)) == self.PAYLOAD
+        finally:
+            blob_backends._backends.pop("s3", None)
+
+    def test_chunks_are_encrypted_at_rest(self, session: Session, monkeypatch):
+        from cryptography.fernet import Fernet
+
+        monkeypatch.setattr("app.encryption._key", Fernet.generate_key().decode())
+        monkeypatch.setattr("app.blob_store.BLOB_CHUNK_BYTES", 4096)
+        blob, _created = store_document_blob(session, "MBR-1", self.PAYLOAD)
+        session.commit()
+        assert blob.wrapped_data_key and blob.nonce_prefix
+        chunks = session.exec(select(BlobChunk).order_by(BlobChunk.chunk_index)).all()
+        assert self.PAYLOAD[:4096] not in b"".join(chunk.data for chunk in chunks)
+        document = MedicalDocument(
+            patient_id="MBR-1", title="Scan", source="Portal", provider="Dr. A", document_date="2026-01-01",
+            file_name="scan.png", content_type="image/png", blob_id=blob.id,
+        )
+        assert load_document_payload(session, document) == self.PAYLOAD
+
+        # Segments are bound to their position: swapping or dropping one fails authentication.
+        chunks[0].data, chunks[1].data = chunks[1].data, chunks[0].data
+        session.add_all(chunks)
+        session.commit()
+        with pytest.raises(InvalidTag):
+            load_document_payload(session, document)
+        blob.chunk_count = 2
+        session.add(blob)
+        session.commit()
+        with pytest.raises(InvalidTag):
+            load_document_payload(session, document)
+
+    def test_oversized_upload_is_rejected_without_storing_chunks(
+        self, client: TestClient, auth_headers: dict, session: Session, monkeypatch
+    ):
+        monkeypatch.setattr(records_router, "MAX_UPLOAD_BYTES", 5000)
+        monkeypatch.setattr("app.blob_store.BLOB_CHUNK_BYTES", 4096)
+        response = client.post(
+            "/api/records/documents",
+            headers=auth_headers,
+            data={
+                "source_system": "Epic (MyChart)",
+                "source": "Epic portal",
+                "provider": "Dr. Sarah Chen",
+                "document_date": "2026-03-16",
+                "record_type": "imaging_report",
+                "title": "Scan",
+            },
+            files={"file": ("scan.png", self.PAYLOAD, "image/png")},
+        )
+        assert response.status_code == 400
+        assert session.exec(select(BlobChunk)).all() == []
+        assert session.exec(select(DocumentBlob)).all() == []
+
+    def test_legacy_inline_payloads_are_migrated_in_batches(self, session: Session):
+        for index in range(3):
+            session.add(MedicalDocument(
+                patient_id="MBR-1", title=f"Legacy {index}", source="Portal", provider="Dr. A",
+                document_date="2026-01-01", file_name="legacy.pdf", content_type="application/pdf",
+                encrypted_blob=encrypt_bytes(b"legacy-%d" % index),
+            ))
+        session.commit()
+
+        assert migrate_legacy_payloads(session, batch_size=2) == 3
+        documents = session.exec(select(MedicalDocument)).all()
+        assert all(document.encrypted_blob is None and document.blob_id for document in documents)
+        assert sorted(load_document_payload(session, document) for document in documents) == [
+            b"legacy-0", b"legacy-1", b"legacy-2",
+        ]
+        assert migrate_legacy_payloads(session) == 0
+
+
+class TestDocumentProfileModel:
+    """The compiled classifier is memoized and recompiled when the artifact changes."""
+
+    def test_model_is_compiled_once_and_reloaded_on_change(self, monkeypatch, tmp_path):
+        artifact = tmp_path / "document_profile_model.json"
+        payload = json.loads(document_profile_model.MODEL_PATH.read_text())
+        artifact.write_text(json.dumps(payload))
+        monkeypatch.setattr(document_profile_model, "MODEL_PATH", artifact)
+
+        first = document_profile_model._load_model()
+        assert document_profile_model._load_model() is first
+
+        payload["summary"]["generated_documents"] = 42
+        artifact.write_text(json.dumps(payload))
+        stat = artifact.stat()
+        os.utime(artifact, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+        reloaded = document_profile_model._load_model()
+        assert reloaded is not first
+        assert document_profile_model.model_summary()["generated_documents"] == 42
+
+    def test_missing_artifact_disables_classification(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(document_profile_model, "MODEL_PATH", tmp_path / "missing.json")
+        assert document_profile_model.classify_texts(["anything"]) is None
+        assert document_profile_model.classify_text("anything") is None
+
+    def test_batch_handles_documents_without_known_tokens(self):
+        texts = ["", "Lab result hemoglobin glucose", "zzqx", "Progress note assessment plan"]
+        batch = document_profile_model.classify_texts(texts)
+        assert batch == [document_profile_model.classify_text(text) for text in texts]
+
+    def test_binary_artifact_is_preferred_and_matches_json(self, monkeypatch, tmp_path):
+        artifact = tmp_path / "document_profile_model.json"
+        artifact.write_text(document_profile_model.MODEL_PATH.read_text())
+        monkeypatch.setattr(document_profile_model, "MODEL_PATH", artifact)
+        texts = [
+            "Epic MyChart lab result hemoglobin A1c glucose reference range",
+            "Progress note assessment and plan follow up in clinic",
+            "Immunization record influenza vaccine lot number",
+            "",
+        ]
+        from_json = document_profile_model.classify_texts(texts)
+
+        binary = document_profile_model.binary_model_path(artifact)
+        document_profile_model.write_binary_model(
+            binary, document_profile_model.compile_model(json.loads(artifact.read_text()))
+        )
+        model = document_profile_model._load_model()
+        assert model.record_type_model.log_probs.dtype == np.float32
+        assert not model.record_type_model.log_probs.flags.writeable
+        assert document_profile_model.classify_texts(texts) == from_json
+
+    def test_unreadable_binary_artifact_falls_back_to_json(self, monkeypatch, tmp_path):
+        artifact = tmp_path / "document_profile_model.json"
+        artifact.write_text(document_profile_model.MODEL_PATH.read_text())
+        document_profile_model.binary_model_path(artifact).write_bytes(b"not a model")
+        monkeypatch.setattr(document_profile_model, "MODEL_PATH", artifact)
+
+        assert document_profile_model.model_summary()["generated_documents"] == 1000
+
+
+class TestSourceHintMatcher:
+    """Vendor hints and profile aliases are found in one pass over whole words."""
+
+    def test_matcher_reports_overlapping_patterns(self):
+        from app.hint_matcher import HintMatcher
+
+        matcher = HintMatcher([("epic", "a"), ("epic mychart", "b"), ("mychart", "c"), ("mychart portal", "d")])
+        matches = matcher.find_all("Exported from Epic MyChart portal today")
+        assert [(match.start, match.end, match.value) for match in matches] == [
+            (2, 3, "a"), (2, 4, "b"), (3, 4, "c"), (3, 5, "d"),
+        ]
+        assert matcher.find_all("nothing relevant") == []
+
+    def test_document_hints_keep_their_priority(self):
+        from app.document_intelligence import hint_tokens, source_system_from_tokens
+
+        # "cerner" is listed before "kareo" in SOURCE_SYSTEM_HINTS.
+        assert source_system_from_tokens(hint_tokens("Kareo billing copy of a Cerner record")) == "oracle_cerner"
+        assert source_system_from_tokens(hint_tokens("My HealtheVet download")) == "va_health"
+        assert source_system_from_tokens(hint_tokens("Nova Health clinic letter")) is None
+
+    def test_normalize_source_system_matches_aliases_exactly(self):
+        from app.document_intelligence import normalize_source_system
+
+        assert normalize_source_system("Epic (MyChart)") == "epic_mychart"
+        assert normalize_source_system("Quest Diagnostics via Epic") == "quest_diagnostics_via_epic"
+        assert normalize_source_system("Epic portal export") == "epic_portal_export"
+        assert normalize_source_system("Quest Diagnostics") == "quest_diagnostics"
+        assert normalize_source_system("") == "generic_scanned_record"
+
+
+class TestClinicalScanner:
+    """One trigger pass finds what the per-kind regexes found separately."""
+
+    TEXT = (
+        "Metformin 500 mg, BP 120/80 daily then Lisinopril 10mg twice daily. Pulse: 72\n"
+        "A1c / Glucose 5.8 % high; Hemoglobin A1c 6.1; fasting glucose 99 mg/dL TSH 9.1\n"
+        "HR 88 blood pressure 140/90 weight: 77KG metformin 500 mg daily overweight 300"
+    )
+
+    def test_findings_match_separate_regex_passes(self):
+        from app import clinical_scanner
+        from app.lab_catalog import lookup_lab
+
+        findings = clinical_scanner.scan_clinical_text(self.TEXT)
+        assert [lab.test_name for lab in findings.labs] == [
+            lookup_lab(match.group(1)).name for match in clinical_scanner.LAB_LINE_PATTERN.finditer(self.TEXT)
+        ]
+        assert [(med.name, med.dose, med.frequency) for med in findings.medications] == [
+            ("Metformin", "500 mg", "daily"), ("Lisinopril", "10mg", "twice daily"),
+        ]
+        # The blood pressure inside the medication line is still found.
+        assert [(vital.metric, vital.value, vital.unit) for vital in findings.vitals] == [
+            ("blood_pressure", "120/80", None), ("heart_rate", "72", "bpm"), ("weight", "77", "kg"),
+        ]
+
+    def test_lab_status_is_explicit_or_derived_from_reference_range(self):
+        from app.clinical_scanner import scan_clinical_text
+
+        labs = scan_clinical_text(self.TEXT).labs
+        assert [(lab.test_name, lab.value_text, lab.status) for lab in labs] == [
+            ("Hemoglobin A1c", "5.8", "high"),
+            ("Hemoglobin A1c", "6.1", "high"),
+            ("Glucose (fasting)", "99", "normal"),
+            ("TSH", "9.1", "high"),
+        ]
+        assert labs[2].loinc == "1558-6"
+        assert scan_clinical_text("nothing clinical here").labs == ()
+
+    def test_medication_doses_are_not_labs(self):
+        from app.clinical_scanner import scan_clinical_text
+
+        findings = scan_clinical_text(
+            "Medications:\n"
+            "Calcium 600 mg twice daily\n"
+            "Vitamin D 2000 IU daily\n"
+            "Iron 325 mg daily\n"
+            "Vitamin B12 1000 mcg\n"
+            "Sodium chloride tablet 1 g\n"
+            "Potassium 20 mEq daily\n"
+        )
+        assert findings.labs == ()
+
+    def test_lab_unit_in_text_is_kept(self):
+        from app.clinical_scanner import scan_clinical_text
+
+        (lab,) = scan_clinical_text("Hemoglobin A1c 42 mmol/mol").labs
+        assert (lab.test_name, lab.value_text, lab.unit, lab.status) == ("Hemoglobin A1c", "42", "mmol/mol", None)
+        (lab,) = scan_clinical_text("Calcium 9.1 mg/dL").labs
+        assert (lab.unit, lab.status) == ("mg/dL", "normal")
+
+
+class TestLabCatalog:
+    """Lab names resolve through the catalog index, and reference ranges are parsed once."""
+
+    def test_reference_ranges_parse_bounds_and_intervals(self):
+        from app.lab_catalog import parse_reference_range, reference_status
+
+        assert reference_status(104, "70-100") == "high"
+        assert reference_status(0.5, "0.6 - 1.3 mg/dL") == "low"
+        assert reference_status(200, "<200") == "high" and reference_status(199, "<200") == "normal"
+        assert reference_status(60, ">=60") == "normal" and reference_status(40, ">40") == "low"
+        assert reference_status(5, "see note") is None and reference_status(5, None) is None
+        assert parse_reference_range("70-100") is parse_reference_range("70-100")
+
+    def test_lookup_normalizes_names_and_synonyms(self):
+        from app.lab_catalog import get_lab_catalog, lookup_lab
+
+        assert lookup_lab("Glucose (fasting)").loinc == "1558-6"
+        assert lookup_lab("HbA1c").loinc == lookup_lab("hemoglobin  A1C").loinc == "4548-4"
+        assert lookup_lab("hs-CRP").loinc == "30522-7"
+        assert lookup_lab("Unobtainium") is None
+        assert get_lab_catalog().by_loinc("2823-3").name == "Potassium"
+
+    def test_scanner_uses_catalog_names_and_whole_words(self):
+        from app.clinical_scanner import scan_clinical_text
+
+        labs = scan_clinical_text("HDL-C 38 mg/dL; Potassium 5.9 mmol/L; seen in the past 3 months").labs
+        assert [(lab.loinc, lab.status) for lab in labs] == [("2085-9", "low"), ("2823-3", "high")]
+
+    def test_build_script_appends_ranked_loinc_terms(self, tmp_path):
+        from app.lab_catalog import get_lab_catalog, load_lab_catalog
+        from scripts.build_lab_catalog import LAB_CATALOG_PATH, loinc_rows, merge_rows, read_catalog_rows, write_catalog
+
+        loinc_csv = tmp_path / "Loinc.csv"
+        loinc_csv.write_text(
+            "LOINC_NUM,COMPONENT,SHORTNAME,LONG_COMMON_NAME,EXAMPLE_UCUM_UNITS,CLASSTYPE,STATUS,COMMON_TEST_RANK\n"
+            "2345-7,Glucose,Glucose SerPl-mCnc,Glucose [Mass/volume] in Serum or Plasma,mg/dL,1,ACTIVE,1\n"
+            "2601-3,Magnesium,Magnesium SerPl-sCnc,Magnesium [Moles/volume] in Serum or Plasma,mmol/L,1,ACTIVE,40\n"
+            "8867-4,Heart rate,Heart rate,Heart rate,/min,2,ACTIVE,3\n"
+            "1234-5,Old test,Old test,Old test,mg/dL,1,DEPRECATED,2\n"
+        )
+        output = tmp_path / "lab_catalog.tsv"
+        curated = read_catalog_rows(LAB_CATALOG_PATH)
+        write_catalog(output, merge_rows(curated, loinc_rows(loinc_csv, top=10)))
+
+        catalog = load_lab_catalog(output)
+        assert len(catalog) == len(get_lab_catalog()) + 1
+        assert catalog.lookup("glucose").ref_range == "70-100"
+        assert catalog.lookup("Magnesium SerPl-sCnc").loinc == "2601-3"
+        assert catalog.by_loinc("8867-4") is None and catalog.by_loinc("1234-5") is None
+
+
+class TestProfileModelTraining:
+    """The streaming trainer's map-reduce counts match a single pass and merge incrementally."""
+
+    @staticmethod
+    def _examples(count: int, offset: int = 0):
+        from scripts.train_document_profile_model import Example
+
+        kinds = [
+            ("Epic MyChart lab result hemoglobin glucose", "epic_mychart", "lab_result"),
+            ("Cerner PowerChart progress note assessment plan", "oracle_cerner", "progress_note"),
+            ("athenaOne medication list metformin daily", "athenahealth", "medication_list"),
+        ]
+        examples = []
+        for index in range(offset, offset + count):
+            text, source, record_type = kinds[index % len(kinds)]
+            examples.append(Example(text=f"{text} visit {index % 4}", source_system=source, record_type=record_type, pdf_path=""))
+        return examples
+
+    def test_pool_counts_match_in_process_counts(self):
+        from scripts import train_document_profile_model as trainer
+
+        serial, serial_docs, _ = trainer.count_examples(self._examples(60), workers=0, batch_size=7)
+        pooled, pooled_docs, throughput = trainer.count_examples(self._examples(60), workers=2, batch_size=7)
+        assert serial_docs == pooled_docs == throughput.documents
+        for name in trainer.LABEL_FIELDS:
+            assert trainer.build_nb_model(serial[name]) == trainer.build_nb_model(pooled[name])
+
+    def test_incremental_training_matches_training_from_scratch(self):
+        from scripts import train_document_profile_model as trainer
+
+        first, first_docs, _ = trainer.count_examples(self._examples(60), workers=0, batch_size=16)
+        second, _, _ = trainer.count_examples(self._examples(30, offset=60), workers=0, batch_size=16)
+
+        for name in trainer.LABEL_FIELDS:
+            saved = json.loads(json.dumps(trainer.build_nb_model(first[name])))
+            resumed = trainer.LabelCounts.from_model(saved, first_docs)
+            resumed.merge(second[name])
+            combined = trainer.LabelCounts()
+            combined.merge(first[name])
+            combined.merge(second[name])
+            assert trainer.build_nb_model(resumed) == trainer.build_nb_model(combined)